@@ -0,0 +1,245 @@
+'''Cost of each logging call through the LoggerProxy for every backend
+
+Run with "python -m benchmarks.bench_backends". The default backend logs to
+a stream that only counts bytes, the Carbon backend sends to a local
+CarbonSink and the Datadog backend to a FakeDatadogServer. For each call,
+the suite reports calls/second and the caller's p50 and p99 latency, and
+for each backend the bytes it wrote or sent. Use --output to save the
+results as JSON and --compare to flag calls that got slower than in an
+earlier run.
+'''
+
+import argparse
+import json
+import logging
+import platform
+import sys
+import time
+
+import rh_logger.api
+from rh_logger.api import ExitCode, LoggerProxy, TimeSeries
+from rh_logger.discovery import register_backend
+from rh_logger.testing import CarbonSink, FakeDatadogServer
+
+try:
+    from time import perf_counter as clock
+except ImportError:
+    from timeit import default_timer as clock
+
+BACKENDS = {
+    "default": "rh_logger.backends.backend_python_logging:get_logger",
+    "carbon": "rh_logger.backends.backend_carbon_logging:get_logger",
+    "datadog": "rh_logger.backends.backend_datadog_logging:get_logger"}
+
+OPERATIONS = ["report_metric", "report_metrics", "report_event",
+              "report_exception"]
+
+'''Flag a call whose p50 latency grew by more than this fraction'''
+DEFAULT_TOLERANCE = .2
+
+
+class CountingStream(object):
+    '''A stream that counts the bytes written to it'''
+
+    def __init__(self):
+        self.n_bytes = 0
+
+    def write(self, s):
+        self.n_bytes += len(s)
+
+    def flush(self):
+        pass
+
+
+def percentile(latencies, fraction):
+    return latencies[min(int(len(latencies) * fraction),
+                         len(latencies) - 1)]
+
+
+def measure(fn, n):
+    '''Call fn(i) n times
+
+    :returns: calls/second and the p50 and p99 latency in microseconds
+    '''
+    latencies = [0.0] * n
+    t0 = clock()
+    for i in range(n):
+        start = clock()
+        fn(i)
+        latencies[i] = clock() - start
+    elapsed = clock() - t0
+    latencies.sort()
+    return dict(calls_per_sec=n / elapsed,
+                p50_us=percentile(latencies, .5) * 1e6,
+                p99_us=percentile(latencies, .99) * 1e6)
+
+
+def make_calls(logger, points_per_series):
+    series = TimeSeries()
+    series.report_metrics(list(range(points_per_series)))
+    exception = ValueError("benchmark")
+
+    def report_exception(i):
+        try:
+            raise exception
+        except ValueError as e:
+            logger.report_exception(e)
+
+    return dict(
+        report_metric=lambda i: logger.report_metric(
+            "metric", i, ["tile", i % 10]),
+        report_metrics=lambda i: logger.report_metrics(
+            "series", series, ["tile", i % 10]),
+        report_event=lambda i: logger.report_event(
+            "event", ["tile", i % 10]),
+        report_exception=report_exception)
+
+
+def run_backend(backend, config, n, points_per_series, wire_bytes,
+                wait=None):
+    '''Drive every call through a LoggerProxy using one backend
+
+    :param backend: the backend's name
+    :param config: its configuration section
+    :param n: the number of times to make each call
+    :param points_per_series: the size of the TimeSeries for report_metrics
+    :param wire_bytes: a function returning the bytes written or sent
+    :param wait: a function that waits for delivery after end_process
+    '''
+    old_root = rh_logger.api.logging_config_root
+    rh_logger.api.logging_config_root = {
+        "logging-backend": backend, backend: config}
+    rh_logger.api.set_logging_backend(backend)
+    try:
+        logger = LoggerProxy()
+        result = {}
+        start = clock()
+        logger.start_process("bench", "Benchmarking %s" % backend)
+        result["start_process_us"] = (clock() - start) * 1e6
+        calls = make_calls(logger, points_per_series)
+        for operation in OPERATIONS:
+            result[operation] = measure(calls[operation], n)
+        start = clock()
+        logger.end_process("done", ExitCode.success)
+        result["end_process_us"] = (clock() - start) * 1e6
+        if wait is not None:
+            wait()
+        result["delivered_sec"] = clock() - start
+        result["bytes"] = wire_bytes()
+        return result
+    finally:
+        rh_logger.api.logging_config_root = old_root
+        rh_logger.api.set_logging_backend(None)
+
+
+def settle(get_bytes, quiet=.2, timeout=30):
+    '''Wait until the byte count stops changing'''
+    deadline = time.time() + timeout
+    n_bytes = get_bytes()
+    while time.time() < deadline:
+        time.sleep(quiet)
+        if get_bytes() == n_bytes:
+            break
+        n_bytes = get_bytes()
+
+
+def run_default(n, points_per_series, stream):
+    stream.n_bytes = 0
+    return run_backend("default", {}, n, points_per_series,
+                       lambda: stream.n_bytes)
+
+
+def run_carbon(n, points_per_series, stream):
+    with CarbonSink() as sink:
+        host, port = sink.address
+        return run_backend(
+            "carbon", dict(host=host, port=port, overflow="block"),
+            n, points_per_series, lambda: sink.n_bytes,
+            wait=lambda: settle(lambda: sink.n_bytes))
+
+
+def run_datadog(n, points_per_series, stream):
+    with FakeDatadogServer() as server:
+        return run_backend(
+            "datadog", {"api-key": "api-key", "api-host": server.url,
+                        "bench": {"app-key": "app-key"}},
+            n, points_per_series, lambda: server.n_bytes)
+
+RUNNERS = dict(default=run_default, carbon=run_carbon, datadog=run_datadog)
+
+
+def compare(results, baseline, tolerance):
+    '''Print the calls whose p50 latency grew by more than the tolerance
+
+    :returns: the number of regressions
+    '''
+    n_regressions = 0
+    for backend, result in sorted(results.items()):
+        for operation in OPERATIONS:
+            try:
+                old = baseline["results"][backend][operation]["p50_us"]
+            except (KeyError, TypeError):
+                continue
+            new = result[operation]["p50_us"]
+            if new > old * (1 + tolerance):
+                n_regressions += 1
+                print("REGRESSION %s %s: p50 %.2f us, was %.2f us" %
+                      (backend, operation, new, old))
+    return n_regressions
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--backend", action="append", choices=sorted(RUNNERS),
+                        help="Benchmark only this backend (repeatable)")
+    parser.add_argument("-n", type=int, default=10000,
+                        help="The number of times to make each call")
+    parser.add_argument("--points", type=int, default=100,
+                        help="The number of points in each TimeSeries")
+    parser.add_argument("--output", help="Save the results to this JSON file")
+    parser.add_argument("--compare",
+                        help="Compare with the results in this JSON file")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE,
+                        help="The fraction by which p50 latency may grow "
+                        "before --compare reports a regression")
+    args = parser.parse_args(args)
+    for backend, value in BACKENDS.items():
+        register_backend(backend, value)
+    stream = CountingStream()
+    handler = logging.StreamHandler(stream)
+    saved_handlers = logging.root.handlers[:]
+    logging.root.handlers = [handler]
+    logging.root.setLevel(logging.INFO)
+    results = {}
+    try:
+        for backend in args.backend or sorted(RUNNERS):
+            try:
+                results[backend] = RUNNERS[backend](args.n, args.points, stream)
+            except ImportError as e:
+                print("%s: skipped (%s)" % (backend, e))
+                continue
+            result = results[backend]
+            print("%s: %d bytes, end_process %.0f us" %
+                  (backend, result["bytes"], result["end_process_us"]))
+            for operation in OPERATIONS:
+                print("    %-17s %10.0f calls/sec  p50 %8.2f us  "
+                      "p99 %8.2f us" % (
+                          operation, result[operation]["calls_per_sec"],
+                          result[operation]["p50_us"],
+                          result[operation]["p99_us"]))
+    finally:
+        logging.root.handlers = saved_handlers
+    document = dict(time=time.time(), python=sys.version,
+                    platform=platform.platform(), n=args.n,
+                    points=args.points, results=results)
+    if args.output is not None:
+        with open(args.output, "w") as fd:
+            json.dump(document, fd, indent=2, sort_keys=True)
+    if args.compare is not None:
+        with open(args.compare) as fd:
+            baseline = json.load(fd)
+        if compare(results, baseline, args.tolerance) > 0:
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+'''Cost of reporting through a bound logger against passing context=
+
+Run with "python -m benchmarks.bench_bind". For each backend, the suite
+reports calls/second and the caller's p50 latency for report_metric,
+report_metrics and report_event, once with the context passed on every
+call and once through logger.bind(context).
+'''
+
+import argparse
+import logging
+
+import rh_logger.api
+from rh_logger.api import ExitCode, LoggerProxy, TimeSeries
+from rh_logger.discovery import register_backend
+from rh_logger.testing import CarbonSink, FakeDatadogServer
+from benchmarks.bench_backends import BACKENDS, CountingStream, measure
+
+CONTEXT = ["section", 12, "mfov", 5, "tile", 3]
+
+
+def make_calls(logger, bound, points_per_series):
+    series = TimeSeries()
+    series.report_metrics(list(range(points_per_series)))
+    return [
+        ("report_metric",
+         lambda i: logger.report_metric("metric", i, CONTEXT),
+         lambda i: bound.report_metric("metric", i)),
+        ("report_metrics",
+         lambda i: logger.report_metrics("series", series, CONTEXT),
+         lambda i: bound.report_metrics("series", series)),
+        ("report_event",
+         lambda i: logger.report_event("event", CONTEXT),
+         lambda i: bound.report_event("event"))]
+
+
+def run_backend(backend, config, n, points_per_series):
+    old_root = rh_logger.api.logging_config_root
+    rh_logger.api.logging_config_root = {
+        "logging-backend": backend, backend: config}
+    rh_logger.api.set_logging_backend(backend)
+    try:
+        logger = LoggerProxy()
+        logger.start_process("bench", "Benchmarking bind on %s" % backend)
+        bound = logger.bind(CONTEXT)
+        result = {}
+        for operation, unbound_fn, bound_fn in make_calls(
+                logger, bound, points_per_series):
+            result[operation] = (measure(unbound_fn, n),
+                                 measure(bound_fn, n))
+        logger.end_process("done", ExitCode.success)
+        return result
+    finally:
+        rh_logger.api.logging_config_root = old_root
+        rh_logger.api.set_logging_backend(None)
+
+
+def run_default(n, points_per_series):
+    return run_backend("default", {}, n, points_per_series)
+
+
+def run_carbon(n, points_per_series):
+    with CarbonSink() as sink:
+        host, port = sink.address
+        return run_backend("carbon", dict(host=host, port=port),
+                           n, points_per_series)
+
+
+def run_datadog(n, points_per_series):
+    with FakeDatadogServer() as server:
+        return run_backend(
+            "datadog", {"api-key": "api-key", "api-host": server.url,
+                        "bench": {"app-key": "app-key"}},
+            n, points_per_series)
+
+RUNNERS = dict(default=run_default, carbon=run_carbon, datadog=run_datadog)
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--backend", action="append", choices=sorted(RUNNERS),
+                        help="Benchmark only this backend (repeatable)")
+    parser.add_argument("-n", type=int, default=10000,
+                        help="The number of times to make each call")
+    parser.add_argument("--points", type=int, default=10,
+                        help="The number of points in each TimeSeries")
+    args = parser.parse_args(args)
+    for backend, value in BACKENDS.items():
+        register_backend(backend, value)
+    saved_handlers = logging.root.handlers[:]
+    logging.root.handlers = [logging.StreamHandler(CountingStream())]
+    logging.root.setLevel(logging.INFO)
+    try:
+        for backend in args.backend or sorted(RUNNERS):
+            try:
+                result = RUNNERS[backend](args.n, args.points)
+            except ImportError as e:
+                print("%s: skipped (%s)" % (backend, e))
+                continue
+            print(backend)
+            for operation in sorted(result):
+                unbound, bound = result[operation]
+                print("    %-15s context= %9.0f calls/sec p50 %7.2f us   "
+                      "bind %9.0f calls/sec p50 %7.2f us" % (
+                          operation, unbound["calls_per_sec"],
+                          unbound["p50_us"], bound["calls_per_sec"],
+                          bound["p50_us"]))
+    finally:
+        logging.root.handlers = saved_handlers
+
+if __name__ == "__main__":
+    main()
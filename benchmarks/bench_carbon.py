@@ -0,0 +1,86 @@
+'''Caller-side and end-to-end throughput of the Carbon backend
+
+Run with "python -m benchmarks.bench_carbon". Compares formatting each
+point on the caller's thread, as the backend used to, with enqueueing raw
+tuples for the sender thread to format as plaintext or pickles, then
+shards the points across one, two and four Carbon destinations.
+'''
+
+from rh_logger import ExitCode
+from rh_logger.backends.backend_carbon_logging import CarbonLogger
+from rh_logger.testing import CarbonSink
+import logging
+import time
+
+
+def preformatted(logger, name, value):
+    '''The old caller-side path: format the line, then enqueue it'''
+    full_name = logger.make_name(name)
+    logger.sender.put("%s %f %f\n" % (full_name, value, time.time()))
+
+
+def raw(logger, name, value):
+    logger.report_metric(name, value)
+
+
+def run(protocol, report, n_points, n_names):
+    with CarbonSink(protocol=protocol) as sink:
+        host, port = sink.address
+        logger = CarbonLogger("bench", {
+            "host": host, "port": port, "protocol": protocol,
+            "max-queue": n_points * 2})
+        names = ["metric %d" % i for i in range(n_names)]
+        t0 = time.time()
+        for i in range(n_points):
+            report(logger, names[i % n_names], i)
+        t_caller = time.time() - t0
+        logger.end_process("done", ExitCode.success)
+        sink.wait_for(lambda metrics: len(metrics) >= n_points, 60)
+        t_total = time.time() - t0
+        return t_caller, t_total, sink.n_bytes
+
+
+def run_sharded(n_destinations, n_points, n_names):
+    sinks = [CarbonSink().start() for _ in range(n_destinations)]
+    try:
+        logger = CarbonLogger("bench", {
+            "destinations": ["%s:%d:%d" % (sink.address + (i, ))
+                             for i, sink in enumerate(sinks)],
+            "max-queue": n_points * 2})
+        names = ["metric %d" % i for i in range(n_names)]
+        t0 = time.time()
+        for i in range(n_points):
+            logger.report_metric(names[i % n_names], i)
+        t_caller = time.time() - t0
+        logger.end_process("done", ExitCode.success)
+        deadline = time.time() + 60
+        while sum([len(_.metrics) for _ in sinks]) < n_points and \
+                time.time() < deadline:
+            time.sleep(.01)
+        t_total = time.time() - t0
+        return t_caller, t_total, [len(_.metrics) for _ in sinks]
+    finally:
+        for sink in sinks:
+            sink.stop()
+
+
+def main(n_points=200000, n_names=100):
+    logging.disable(logging.INFO)
+    for label, protocol, report in (
+            ("plaintext, formatted by caller", "plaintext", preformatted),
+            ("plaintext, formatted by sender", "plaintext", raw),
+            ("pickle, formatted by sender", "pickle", raw)):
+        t_caller, t_total, n_bytes = run(protocol, report, n_points, n_names)
+        print("%s: %.0f points/sec on the caller, %.0f points/sec "
+              "delivered, %d bytes" % (
+                  label, n_points / t_caller, n_points / t_total, n_bytes))
+    for n_destinations in (1, 2, 4):
+        t_caller, t_total, counts = run_sharded(
+            n_destinations, n_points, n_names)
+        print("%d destinations: %.0f points/sec on the caller, %.0f "
+              "points/sec delivered, points per destination: %s" % (
+                  n_destinations, n_points / t_caller, n_points / t_total,
+                  ", ".join([str(_) for _ in counts])))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,31 @@
+'''Throughput of the batching Datadog transport against a local stand-in
+
+Run with "python -m benchmarks.bench_datadog_transport"
+'''
+
+from rh_logger.backends.datadog_transport import DatadogTransport
+from rh_logger.testing import FakeDatadogServer
+import time
+
+
+def main(n_points=100000, n_metrics=10):
+    with FakeDatadogServer() as server:
+        transport = DatadogTransport("api-key", api_host=server.url,
+                                     flush_interval=1)
+        t0 = time.time()
+        for i in range(n_points):
+            transport.send_metric("metric%d" % (i % n_metrics),
+                                  [(t0, i)], "host", ["tag"])
+        t_caller = time.time() - t0
+        transport.close()
+        t_total = time.time() - t0
+        print("%d points from the caller in %.3f sec: %.0f points/sec" %
+              (n_points, t_caller, n_points / t_caller))
+        print("%d points delivered in %.3f sec: %.0f points/sec, "
+              "%d requests, %d bytes" %
+              (transport.n_points_sent, t_total,
+               transport.n_points_sent / t_total,
+               server.n_requests, server.n_bytes))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+'''Cost of reporting the same exception over and over
+
+Run with "python -m benchmarks.bench_exceptions". The same exception is
+raised from the same place and reported through the logger proxy, with the
+default backend writing to an in-memory stream and with the Datadog backend
+posting to a local stand-in. Each is timed with "exception-window" at 60
+seconds, so repeats are only counted, and at 0, so every exception is
+reported in full with its formatted traceback.
+'''
+
+import argparse
+import io
+import logging
+import time
+
+from rh_logger.api import ExitCode, LoggerProxy
+from rh_logger.backends.backend_python_logging import BLPLogger
+from rh_logger.testing import FakeDatadogServer
+
+try:
+    from rh_logger.backends.backend_datadog_logging import DatadogLogger
+except ImportError:
+    DatadogLogger = None
+
+
+def parse(value):
+    return int(value)
+
+
+def work(values):
+    for value in values:
+        parse(value)
+
+
+def run(backend, window, number):
+    '''Report number exceptions, returning the microseconds for each'''
+    proxy = LoggerProxy()
+    proxy.logger = backend
+    proxy.aggregator.target = proxy
+    proxy.fingerprinter.window = window
+    t0 = time.time()
+    for _ in range(number):
+        try:
+            work(["bad"])
+        except ValueError:
+            proxy.report_exception()
+    elapsed = time.time() - t0
+    proxy.aggregator.flush()
+    backend.end_process("done", ExitCode.success)
+    return elapsed * 1e6 / number
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--number", type=int, default=10000,
+                        help="The number of exceptions in each timing")
+    args = parser.parse_args(args)
+    stream = io.StringIO() if str is not bytes else io.BytesIO()
+    handler = logging.StreamHandler(stream)
+    logging.getLogger("bench").addHandler(handler)
+    logging.getLogger("bench").propagate = False
+    try:
+        for window in (60, 0):
+            print("Default backend, exception-window = %d: %.1f usec per "
+                  "exception" % (window, run(BLPLogger("bench", {}), window,
+                                             args.number)))
+    finally:
+        logging.getLogger("bench").removeHandler(handler)
+    if DatadogLogger is None:
+        return
+    for window in (60, 0):
+        with FakeDatadogServer() as server:
+            logger = DatadogLogger("bench", {
+                "api-key": "key", "api-host": server.url,
+                "bench": {"app-key": "app"}})
+            usec = run(logger, window, args.number)
+            print("Datadog, exception-window = %d: %.1f usec per exception, "
+                  "%d events sent" % (window, usec, len(server.events)))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,45 @@
+'''Time to import rh_logger and its backends in a fresh interpreter
+
+Run with "python -m benchmarks.bench_import". Each import is timed in a
+new process, so this includes everything done at import time.
+'''
+
+import os
+import subprocess
+import sys
+
+MODULES = ["rh_logger",
+           "rh_logger.backends.backend_python_logging",
+           "rh_logger.backends.backend_carbon_logging"]
+
+SCRIPT = """
+import sys, time
+t0 = time.time()
+import %s
+sys.stdout.write("%%f %%d" %% (time.time() - t0, "mpi4py.MPI" in sys.modules))
+"""
+
+
+def time_import(module, repeat):
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(
+        [root] + [_ for _ in [env.get("PYTHONPATH")] if _])
+    times = []
+    for _ in range(repeat):
+        output = subprocess.check_output(
+            [sys.executable, "-c", SCRIPT % module], env=env)
+        t, mpi = output.decode().split()
+        times.append(float(t))
+    return min(times), sum(times) / len(times), mpi == "1"
+
+
+def main(repeat=10):
+    for module in MODULES:
+        best, mean, mpi = time_import(module, repeat)
+        print("import %s: best %.1f ms, mean %.1f ms%s" % (
+            module, best * 1000, mean * 1000,
+            ", initializes MPI" if mpi else ""))
+
+if __name__ == "__main__":
+    main()
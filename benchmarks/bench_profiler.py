@@ -0,0 +1,56 @@
+'''Slowdown of a CPU-bound workload under the sampling profiler
+
+Run with "python -m benchmarks.bench_profiler". The workload is timed
+without the profiler and then with it at several sampling intervals. For
+each, the suite prints the slowdown, the overhead the profiler measured
+itself and the interval it settled on.
+'''
+
+import argparse
+
+from rh_logger.profiler import SamplingProfiler
+
+try:
+    from time import perf_counter as clock
+except ImportError:
+    from timeit import default_timer as clock
+
+
+def fib(n):
+    return n if n < 2 else fib(n - 1) + fib(n - 2)
+
+
+def workload(repeat):
+    for _ in range(repeat):
+        fib(20)
+
+
+def best_time(repeat, n=5):
+    times = []
+    for _ in range(n):
+        start = clock()
+        workload(repeat)
+        times.append(clock() - start)
+    return min(times)
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--repeat", type=int, default=100,
+                        help="The number of times to run the workload")
+    args = parser.parse_args(args)
+    baseline = best_time(args.repeat)
+    print("No profiler: %.3f sec" % baseline)
+    for interval in (.1, .01, .001):
+        profiler = SamplingProfiler(interval=interval)
+        profiler.start()
+        elapsed = best_time(args.repeat)
+        profiler.stop()
+        print("Interval %5.3f sec: %.3f sec, slowdown %5.2f%%, measured "
+              "overhead %5.2f%%, %d samples, final interval %.3f sec" % (
+                  interval, elapsed, 100 * (elapsed / baseline - 1),
+                  100 * profiler.overhead, profiler.n_samples,
+                  profiler.interval))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+'''Events per second through the default backend with a slow log file
+
+The file handler sleeps on every write to stand in for a log file on
+network storage. Run with "python -m benchmarks.bench_python_logging"
+'''
+
+from rh_logger.backends.backend_python_logging import BLPLogger
+from rh_logger.api import ExitCode
+import logging
+import os
+import tempfile
+import time
+
+
+class SlowFileHandler(logging.FileHandler):
+    '''A file handler that takes "latency" seconds for each record'''
+
+    def __init__(self, filename, latency):
+        logging.FileHandler.__init__(self, filename)
+        self.latency = latency
+
+    def emit(self, record):
+        time.sleep(self.latency)
+        logging.FileHandler.emit(self, record)
+
+
+def run(asynchronous, n_events, latency, log_level=logging.INFO):
+    '''Report n_events events and return the caller's and total events/sec'''
+    fd, path = tempfile.mkstemp(suffix=".log")
+    os.close(fd)
+    handler = SlowFileHandler(path, latency)
+    saved_handlers = logging.root.handlers[:]
+    logging.root.handlers = [handler]
+    logging.root.setLevel(logging.INFO)
+    try:
+        logger = BLPLogger("bench", {"asynchronous": asynchronous})
+        start = time.time()
+        for i in range(n_events):
+            logger.report_event("event", context=["tile", i],
+                                log_level=log_level)
+        reported = time.time()
+        logger.end_process("done", ExitCode.success)
+        finished = time.time()
+    finally:
+        logging.root.handlers = saved_handlers
+        handler.close()
+        os.remove(path)
+    return n_events / (reported - start), n_events / (finished - start)
+
+
+def main(n_events=2000, latency=.0005):
+    print("File latency %.1f ms per record, %d events" %
+          (latency * 1000, n_events))
+    for asynchronous in (False, True):
+        caller, total = run(asynchronous, n_events, latency)
+        print("%-12s %10.0f events/sec reported, %8.0f events/sec written" %
+              ("asynchronous" if asynchronous else "synchronous",
+               caller, total))
+    for asynchronous in (False, True):
+        caller, total = run(asynchronous, n_events * 50, latency,
+                            log_level=logging.DEBUG)
+        print("%-12s %10.0f filtered events/sec" %
+              ("asynchronous" if asynchronous else "synchronous", caller))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+'''Cost of sampling the process's resource use from /proc
+
+Run with "python -m benchmarks.bench_resources". The suite times the
+sampler's sample() call and prints the mean and p99 time per sample, and
+the fraction of one CPU that sampling at 10 Hz and 100 Hz would take.
+'''
+
+import argparse
+
+from rh_logger.resources import ResourceSampler
+
+try:
+    from time import perf_counter as clock
+except ImportError:
+    from timeit import default_timer as clock
+
+
+class NullLogger(object):
+
+    def report_metrics(self, name, time_series, context=None):
+        pass
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--samples", type=int, default=10000,
+                        help="The number of samples to time")
+    args = parser.parse_args(args)
+    sampler = ResourceSampler(NullLogger())
+    if not sampler.open():
+        print("/proc/self/stat can't be read")
+        return
+    times = []
+    for i in range(args.samples):
+        start = clock()
+        sampler.sample()
+        times.append(clock() - start)
+        if i % 1000 == 999:
+            sampler.flush()
+    sampler.close()
+    times.sort()
+    mean = sum(times) / len(times)
+    print("%d samples: mean %.1f usec, p99 %.1f usec" % (
+        len(times), mean * 1e6, times[int(len(times) * .99)] * 1e6))
+    for rate in (10, 100):
+        print("At %3d Hz: %.4f%% of one CPU" % (rate, 100 * mean * rate))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+'''Overhead of logger.span per span
+
+Run with "python -m benchmarks.bench_spans". The suite reports the cost of
+a span around an empty block, of a span nested three deep, of a decorated
+call, and of a span when the spans are also written to a trace file,
+alongside logger.timer for comparison. Exporting the batches is included.
+'''
+
+import argparse
+import os
+import shutil
+import tempfile
+import timeit
+
+from rh_logger.api import LoggerProxy
+
+
+class NullLogger(object):
+
+    def report_metrics(self, name, time_series, context=None):
+        pass
+
+    def report_spans(self, spans):
+        pass
+
+
+def ns_per_call(stmt, setup, number):
+    best = min(timeit.Timer(stmt, setup).repeat(5, number))
+    return best * 1e9 / number
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--number", type=int, default=100000,
+                        help="The number of spans in each timing")
+    args = parser.parse_args(args)
+    directory = tempfile.mkdtemp()
+    try:
+        setup = """
+from benchmarks.bench_spans import make_proxy
+proxy = make_proxy(%r)
+span = proxy.span
+timer = proxy.timer
+@proxy.span("fn")
+def spanned():
+    pass
+def plain():
+    pass
+"""
+        plain_setup = setup % None
+        trace_setup = setup % os.path.join(directory, "trace.json")
+        baseline = ns_per_call("pass", plain_setup, args.number)
+        timer = ns_per_call("with timer('block'):\n    pass", plain_setup,
+                            args.number) - baseline
+        flat = ns_per_call("with span('block'):\n    pass", plain_setup,
+                           args.number) - baseline
+        nested = ns_per_call(
+            "with span('a'):\n with span('b'):\n  with span('c'):\n   pass",
+            plain_setup, args.number) - baseline
+        decorated = ns_per_call("spanned()", plain_setup, args.number) - \
+            ns_per_call("plain()", plain_setup, args.number)
+        traced = ns_per_call("with span('block'):\n    pass", trace_setup,
+                             args.number) - baseline
+    finally:
+        shutil.rmtree(directory)
+    print("Timer: %.0f ns per block" % timer)
+    print("Span: %.0f ns per block" % flat)
+    print("Nested spans: %.0f ns per span" % (nested / 3))
+    print("Decorated call: %.0f ns per span" % decorated)
+    print("Span with a trace file: %.0f ns per block" % traced)
+
+
+def make_proxy(trace_file):
+    proxy = LoggerProxy()
+    proxy.aggregator.target = NullLogger()
+    proxy.spans.target = NullLogger()
+    proxy.spans.configure(trace_file=trace_file)
+    return proxy
+
+if __name__ == "__main__":
+    main()
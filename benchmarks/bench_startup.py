@@ -0,0 +1,51 @@
+'''Startup cost: importing rh_logger and logging the first event
+
+Run with "python -m benchmarks.bench_startup". Each run is a fresh
+interpreter using the backend configured in .rh-config.yaml. The first run
+uses an empty entry point cache and the rest use the cache that it wrote.
+'''
+
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+SCRIPT = """
+import sys, time
+t0 = time.time()
+import rh_logger
+t1 = time.time()
+rh_logger.logger.start_process("bench_startup", "starting")
+rh_logger.logger.report_event("first event")
+t2 = time.time()
+sys.stdout.write("%f %f" % (t1 - t0, t2 - t1))
+"""
+
+
+def run(env):
+    output = subprocess.check_output([sys.executable, "-c", SCRIPT], env=env)
+    t_import, t_first_log = [float(_) for _ in output.decode().split()[-2:]]
+    return t_import, t_first_log
+
+
+def main(repeat=10):
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    directory = tempfile.mkdtemp()
+    try:
+        env = dict(os.environ)
+        env["PYTHONPATH"] = os.pathsep.join(
+            [root] + [_ for _ in [env.get("PYTHONPATH")] if _])
+        env["RH_LOGGER_CACHE"] = os.path.join(directory, "entry_points.json")
+        t_import, t_first_log = run(env)
+        print("Cold cache: import %.1f ms, first log %.1f ms" %
+              (t_import * 1000, t_first_log * 1000))
+        results = [run(env) for _ in range(repeat)]
+        print("Warm cache: import %.1f ms, first log %.1f ms (best of %d)" %
+              (min([_[0] for _ in results]) * 1000,
+               min([_[1] for _ in results]) * 1000, repeat))
+    finally:
+        shutil.rmtree(directory)
+
+if __name__ == "__main__":
+    main()
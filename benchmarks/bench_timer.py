@@ -0,0 +1,50 @@
+'''Overhead of logger.timer per timed block
+
+Run with "python -m benchmarks.bench_timer"
+'''
+
+from rh_logger.api import LoggerProxy
+import timeit
+
+
+class NullLogger(object):
+    def report_metrics(self, name, time_series, context=None):
+        pass
+
+
+def ns_per_call(stmt, setup, number):
+    best = min(timeit.Timer(stmt, setup).repeat(5, number))
+    return best * 1e9 / number
+
+
+def main(number=200000):
+    setup = """
+from benchmarks.bench_timer import make_proxy
+proxy = make_proxy(%s)
+timer = proxy.timer
+@proxy.timer("fn")
+def timed():
+    pass
+def untimed():
+    pass
+"""
+    for enabled in (True, False):
+        baseline = ns_per_call("pass", setup % enabled, number)
+        block = ns_per_call(
+            "with timer('block'):\n    pass", setup % enabled, number)
+        untimed = ns_per_call("untimed()", setup % enabled, number)
+        timed = ns_per_call("timed()", setup % enabled, number)
+        print("Timers %s: %.0f ns per timed block, "
+              "%.0f ns per decorated call" % (
+                  "enabled" if enabled else "disabled",
+                  block - baseline, timed - untimed))
+
+
+def make_proxy(enabled):
+    proxy = LoggerProxy()
+    proxy.aggregator.target = NullLogger()
+    proxy.enable_timers(enabled)
+    return proxy
+
+if __name__ == "__main__":
+    main()
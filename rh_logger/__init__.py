@@ -1,5 +1,5 @@
 from .api import get_logging_backend, set_logging_backend
-from .api import ExitCode, TimeSeries, logger
+from .api import ExitCode, TimeSeries, AggregateTimeSeries, logger
 
 all = [get_logging_backend, set_logging_backend,
-       ExitCode, TimeSeries, logger]
+       ExitCode, TimeSeries, AggregateTimeSeries, logger]
@@ -0,0 +1,204 @@
+'''aggregator.py - in-process aggregation of metrics
+
+The aggregator collects values per metric name and context and reports them
+to a logger periodically, so that a metric recorded in a tight loop costs
+one backend call per flush interval rather than one per value.
+
+There are three kinds of metric. A counter is the sum of its increments and
+is reported with report_count. A gauge is the last value set and is
+reported as a TimeSeries of one point with report_metrics. A histogram is
+the distribution of its values and is reported as an AggregateTimeSeries
+with report_metrics. Flush windows are aligned to multiples of the flush
+interval in wall-clock time, so processes with the same interval report for
+the same windows. With an interval of 0, every value is reported at once.
+A value is added after any due flush, so it always counts toward the window
+it arrived in, and each point is timestamped with the end of its window,
+even when the flush happens later.
+'''
+
+import array
+import rh_logger.api
+import threading
+import time
+
+'''The default number of seconds between reports'''
+DEFAULT_FLUSH_INTERVAL = 60.0
+
+'''Fold pending values into the statistics after this many'''
+FOLD_SIZE = 4096
+
+try:
+    perf_counter_ns = time.perf_counter_ns
+except AttributeError:
+    from timeit import default_timer as _default_timer
+
+    def perf_counter_ns():
+        '''Fallback for Pythons without time.perf_counter_ns'''
+        return int(_default_timer() * 1e9)
+
+
+def context_key(context):
+    '''Convert a context into something that can be used as a dictionary key
+    '''
+    if isinstance(context, list):
+        return tuple(context)
+    return context
+
+
+class _Histogram(object):
+    '''The values of one metric name and context
+
+    Values are appended to a flat array and folded into an
+    AggregateTimeSeries in bulk, which keeps the per-value cost low.
+    '''
+
+    __slots__ = ["pending", "series", "context"]
+
+    def __init__(self, context):
+        self.pending = array.array("d")
+        self.series = rh_logger.api.AggregateTimeSeries()
+        self.context = context
+
+    def fold(self):
+        if len(self.pending) > 0:
+            self.series.report_metrics(self.pending)
+            self.pending = array.array("d")
+
+
+class MetricAggregator(object):
+    '''Accumulates metrics and reports them through a logger periodically
+
+    The "target" attribute is the logger that receives the reports. Metrics
+    are kept until a target is set.
+    '''
+
+    def __init__(self, flush_interval=DEFAULT_FLUSH_INTERVAL):
+        self.lock = threading.Lock()
+        self.enabled = True
+        self.target = None
+        self.histograms = {}
+        self.counters = {}
+        self.gauges = {}
+        self.set_flush_interval(flush_interval)
+
+    def set_flush_interval(self, flush_interval):
+        '''Set the number of seconds between reports'''
+        self.flush_interval = flush_interval
+        self.next_flush, self.window_end = self.get_next_flush()
+
+    def get_next_flush(self):
+        '''The end of the current window
+
+        :returns: the end as a perf_counter_ns time and as a wall-clock time
+        '''
+        now = time.time()
+        if self.flush_interval <= 0:
+            return perf_counter_ns(), now
+        remaining = self.flush_interval - now % self.flush_interval
+        return perf_counter_ns() + int(remaining * 1e9), now + remaining
+
+    def increment(self, name, value=1, context=None):
+        '''Add to a counter
+
+        :param name: the name of the counter
+        :param value: the amount to add
+        :param context: the context to report with the counter
+        '''
+        self.maybe_flush()
+        key = (name, context_key(context) if context is not None else None)
+        self.lock.acquire()
+        try:
+            counter = self.counters.get(key)
+            if counter is None:
+                self.counters[key] = [value, context]
+            else:
+                counter[0] += value
+        finally:
+            self.lock.release()
+        if self.flush_interval <= 0:
+            self.flush()
+
+    def gauge(self, name, value, context=None):
+        '''Set a gauge, replacing the value set earlier in the window
+
+        :param name: the name of the gauge
+        :param value: the value
+        :param context: the context to report with the gauge
+        '''
+        self.maybe_flush()
+        key = (name, context_key(context) if context is not None else None)
+        self.lock.acquire()
+        try:
+            self.gauges[key] = (value, context)
+        finally:
+            self.lock.release()
+        if self.flush_interval <= 0:
+            self.flush()
+
+    def histogram(self, name, value, context=None, now=None):
+        '''Add a value to the distribution of a metric
+
+        :param name: the name of the metric
+        :param value: the value to add
+        :param context: the context to report with the metric
+        :param now: the current time from perf_counter_ns, if the caller
+        already has it
+        '''
+        #
+        # This is on the caller's path for every timed block, so the flush
+        # check is inlined and the lock is taken by hand, which is cheaper
+        # than "with".
+        #
+        if (perf_counter_ns() if now is None else now) >= self.next_flush:
+            self.flush()
+        key = (name, context_key(context) if context is not None else None)
+        self.lock.acquire()
+        try:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = _Histogram(context)
+            histogram.pending.append(value)
+            if len(histogram.pending) >= FOLD_SIZE:
+                histogram.fold()
+        finally:
+            self.lock.release()
+        if self.flush_interval <= 0:
+            self.flush()
+
+    def maybe_flush(self, now=None):
+        '''Flush if the flush interval has elapsed
+
+        :param now: the current time from perf_counter_ns, if the caller
+        already has it
+        '''
+        if (perf_counter_ns() if now is None else now) >= self.next_flush:
+            self.flush()
+
+    def flush(self):
+        '''Report everything aggregated so far to the target
+
+        The points are timestamped with the end of their window or, if the
+        window hasn't ended, with the current time.
+        '''
+        target = self.target
+        with self.lock:
+            timestamp = min(self.window_end, time.time())
+            self.next_flush, self.window_end = self.get_next_flush()
+            if target is None:
+                return
+            histograms, self.histograms = self.histograms, {}
+            counters, self.counters = self.counters, {}
+            gauges, self.gauges = self.gauges, {}
+        for (name, _), (value, context) in counters.items():
+            target.report_count(name, value, context, timestamp)
+        for (name, _), (value, context) in gauges.items():
+            series = rh_logger.api.TimeSeries()
+            series.timestamps.append(timestamp)
+            series.values.append(value)
+            target.report_metrics(name, series, context)
+        for (name, _), histogram in histograms.items():
+            histogram.fold()
+            series = histogram.series
+            series.end = min(series.end, timestamp)
+            series.start = min(series.start, series.end)
+            target.report_metrics(name, series, histogram.context)
@@ -0,0 +1,691 @@
+'''aio.py - logging from asyncio applications
+
+The LoggerProxy's backends do their network I/O either on the caller's
+thread, which blocks the event loop, or on a helper thread. The loggers
+here use transports that run on the event loop instead: the calls buffer
+on the loop and a task sends the buffer in batches, with no helper
+threads. This module needs Python 3.7 or later.
+
+async def main():
+    logger = rh_logger.aio.get_logger("tile-fetcher")
+    await logger.start_process("tile-fetcher", "Starting")
+    logger.report_metric_nowait("Tiles fetched", 1)
+    await logger.report_metric("Fetch time", .25, ["tile", 3])
+    await logger.end_process("Done", ExitCode.success)
+
+Each report method has two forms. The "_nowait" form only buffers and
+can be called anywhere on the loop, even in a callback. The awaitable form
+also waits for the buffer to be sent when the buffer is full, which slows
+down a producer that outruns the network. Create the logger and make the
+calls on the loop's thread. end_process sends everything buffered.
+
+get_logger uses the logging-backend and its section of the rh-logger
+config, like the LoggerProxy. The "carbon" and "datadog" backends have
+asyncio transports, AsyncCarbonTransport and AsyncDatadogTransport, and
+take the same config entries as the thread-based backends, apart from
+"overflow" (the oldest buffered point is dropped) and "asynchronous".
+Events go to Python logging with Carbon and to Datadog's event API with
+Datadog. Any other backend, or a list of backends, is called from a
+single worker thread.
+'''
+
+import asyncio
+import collections
+import concurrent.futures
+import json
+import logging
+import sys
+import time
+import traceback
+from urllib.parse import urlparse, urlencode
+
+import rh_logger.api
+from rh_logger.api import AggregateTimeSeries, get_logging_backend, \
+     get_logging_config_root, make_backend, make_fanout_backend
+from rh_logger.backends.carbon_transport import SERIALIZERS, PLAINTEXT, \
+     DEFAULT_PORTS, DEFAULT_MAX_QUEUE, DEFAULT_RECONNECT_MIN, \
+     DEFAULT_RECONNECT_MAX
+from rh_logger.backends.datadog_transport import DEFAULT_API_HOST, \
+     DEFAULT_FLUSH_INTERVAL, DEFAULT_FLUSH_SIZE
+
+log = logging.getLogger("rh_logger.aio")
+
+'''Seconds that end_process waits for the transport to send its buffer'''
+DEFAULT_CLOSE_TIMEOUT = 10.0
+
+
+class AsyncCarbonTransport(object):
+    '''Send metrics to Carbon from a task on the event loop
+
+    Messages are the (name, value, timestamp) and (name, values,
+    timestamps) tuples of rh_logger.backends.carbon_transport. The task
+    sends everything buffered in one write and waits for the stream to
+    drain. If the connection fails, it reconnects with exponential backoff
+    while the buffer keeps up to max_queue messages, dropping the oldest.
+    '''
+
+    def __init__(self, host, port, protocol=PLAINTEXT,
+                 max_queue=DEFAULT_MAX_QUEUE,
+                 reconnect_min=DEFAULT_RECONNECT_MIN,
+                 reconnect_max=DEFAULT_RECONNECT_MAX):
+        self.host = host
+        self.port = port
+        self.serializer = SERIALIZERS[protocol]
+        self.max_queue = max_queue
+        self.reconnect_min = reconnect_min
+        self.reconnect_max = reconnect_max
+        self.queue = collections.deque()
+        self.writer = None
+        self.n_dropped = 0
+        self.n_reconnects = 0
+        self.n_sent = 0
+        self.wakeup = asyncio.Event()
+        self.idle = asyncio.Event()
+        self.idle.set()
+        self.closing = False
+        self.task = asyncio.ensure_future(self.run())
+
+    def put(self, message):
+        '''Buffer a message'''
+        if len(self.queue) >= self.max_queue:
+            self.queue.popleft()
+            self.n_dropped += 1
+        self.queue.append(message)
+        self.idle.clear()
+        self.wakeup.set()
+
+    def is_full(self):
+        '''True if the buffer is full and Carbon is connected
+
+        While Carbon is unreachable, the oldest messages are dropped rather
+        than making the callers wait.
+        '''
+        return len(self.queue) >= self.max_queue and self.writer is not None
+
+    async def run(self):
+        '''Task that sends the buffer whenever there is something in it'''
+        backoff = self.reconnect_min
+        while True:
+            await self.wakeup.wait()
+            self.wakeup.clear()
+            while len(self.queue) > 0:
+                messages = list(self.queue)
+                self.queue.clear()
+                try:
+                    await self.send(self.serializer(messages))
+                    self.n_sent += len(messages)
+                    backoff = self.reconnect_min
+                except (OSError, asyncio.IncompleteReadError):
+                    self.disconnect()
+                    #
+                    # Put the messages back in front of any new ones,
+                    # keeping the newest if there are too many.
+                    #
+                    self.queue.extendleft(reversed(messages))
+                    while len(self.queue) > self.max_queue:
+                        self.queue.popleft()
+                        self.n_dropped += 1
+                    if self.closing:
+                        break
+                    log.warning("Failed to send to Carbon at %s:%d, "
+                                "retrying in %.1f sec",
+                                self.host, self.port, backoff)
+                    await asyncio.sleep(backoff)
+                    backoff = min(backoff * 2, self.reconnect_max)
+            if len(self.queue) == 0:
+                self.idle.set()
+            if self.closing:
+                break
+
+    async def send(self, data):
+        if self.writer is None:
+            _, self.writer = await asyncio.open_connection(
+                self.host, self.port)
+            self.n_reconnects += 1
+        self.writer.write(data)
+        await self.writer.drain()
+
+    def disconnect(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+
+    async def flush(self, timeout=DEFAULT_CLOSE_TIMEOUT):
+        '''Wait until the buffer is sent
+
+        :param timeout: seconds to wait. While Carbon is unreachable the
+        buffer is never sent, so the wait gives up after this long.
+        :returns: True if the buffer was sent, False if the wait timed out
+        '''
+        self.wakeup.set()
+        try:
+            await asyncio.wait_for(self.idle.wait(), timeout)
+        except asyncio.TimeoutError:
+            return False
+        return True
+
+    async def close(self, timeout=DEFAULT_CLOSE_TIMEOUT):
+        '''Send the buffer and close the connection
+
+        :param timeout: seconds to wait for the buffer to be sent. What is
+        left after that is dropped.
+        '''
+        if not await self.flush(timeout):
+            log.warning("Dropped %d messages that could not be sent to "
+                        "Carbon at %s:%d", len(self.queue), self.host,
+                        self.port)
+        self.closing = True
+        self.wakeup.set()
+        self.task.cancel()
+        try:
+            await self.task
+        except asyncio.CancelledError:
+            pass
+        self.disconnect()
+
+
+class AsyncDatadogTransport(object):
+    '''Buffer metrics and events and post them to Datadog from a task
+
+    Points that share a metric name, host, type and tag set are merged
+    into one series, as in DatadogTransport. The buffer is posted when it
+    holds flush_size points and events, every flush_interval seconds and
+    at close, over a keep-alive HTTP/1.1 connection made with asyncio
+    streams.
+    '''
+
+    def __init__(self, api_key, app_key=None, api_host=DEFAULT_API_HOST,
+                 flush_interval=DEFAULT_FLUSH_INTERVAL,
+                 flush_size=DEFAULT_FLUSH_SIZE, timeout=30):
+        url = urlparse(api_host)
+        self.ssl = (url.scheme or "https") == "https"
+        netloc = url.netloc or url.path
+        self.base_path = url.path.rstrip("/") if url.netloc else ""
+        if ":" in netloc:
+            self.host, port = netloc.rsplit(":", 1)
+            self.port = int(port)
+        else:
+            self.host, self.port = netloc, 443 if self.ssl else 80
+        self.netloc = netloc
+        query = dict(api_key=api_key)
+        if app_key is not None:
+            query["application_key"] = app_key
+        self.query = urlencode(query)
+        self.flush_interval = flush_interval
+        self.flush_size = flush_size
+        self.timeout = timeout
+        self.reader = self.writer = None
+        self.series = collections.OrderedDict()
+        self.events = []
+        self.n_pending = 0
+        self.n_requests = 0
+        self.n_points_sent = 0
+        self.n_events_sent = 0
+        self.n_dropped = 0
+        self.closing = False
+        self.lock = asyncio.Lock()
+        self.wakeup = asyncio.Event()
+        self.task = asyncio.ensure_future(self.run())
+
+    def send_metric(self, metric, points, host=None, tags=None,
+                    metric_type="gauge"):
+        '''Buffer metric points
+
+        :param metric: the name of the metric
+        :param points: an iterable of (timestamp, value) pairs
+        :param host: the host name to report
+        :param tags: a sequence of tags for the series
+        :param metric_type: "gauge", "rate" or "count"
+        '''
+        points = list(points)
+        key = (metric, host, tuple(tags or ()), metric_type)
+        series = self.series.get(key)
+        if series is None:
+            self.series[key] = points
+        else:
+            series.extend(points)
+        self.n_pending += len(points)
+        if self.n_pending >= self.flush_size:
+            self.wakeup.set()
+
+    def send_event(self, title, text, alert_type="info", tags=None):
+        '''Buffer an event'''
+        self.events.append(dict(
+            title=title, text=text, alert_type=alert_type,
+            date_happened=int(time.time()), tags=list(tags or ())))
+        self.n_pending += 1
+        if self.n_pending >= self.flush_size:
+            self.wakeup.set()
+
+    def is_full(self):
+        return self.n_pending >= self.flush_size
+
+    async def run(self):
+        '''Task that posts the buffer until close is called'''
+        while not self.closing:
+            try:
+                await asyncio.wait_for(self.wakeup.wait(),
+                                       self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self.wakeup.clear()
+            try:
+                await self.flush()
+            except Exception:
+                log.exception("Datadog transport flush failed")
+
+    async def flush(self):
+        '''Post everything buffered so far
+
+        If the flush is cancelled, what it took from the buffer and hadn't
+        sent is counted as dropped.
+        '''
+        async with self.lock:
+            series, self.series = self.series, collections.OrderedDict()
+            events, self.events = self.events, []
+            self.n_pending = 0
+            n_points = sum([len(_) for _ in series.values()])
+            n_events = len(events)
+            try:
+                if len(series) > 0:
+                    payload = [
+                        dict(metric=metric,
+                             points=[[t, v] for t, v in points],
+                             type=metric_type, host=host, tags=list(tags))
+                        for (metric, host, tags, metric_type), points
+                        in series.items()]
+                    if await self.post("/api/v1/series",
+                                       dict(series=payload)):
+                        self.n_points_sent += n_points
+                    else:
+                        self.n_dropped += n_points
+                    n_points = 0
+                for event in events:
+                    if await self.post("/api/v1/events", event):
+                        self.n_events_sent += 1
+                    else:
+                        self.n_dropped += 1
+                    n_events -= 1
+            except asyncio.CancelledError:
+                self.n_dropped += n_points + n_events
+                raise
+
+    async def post(self, path, body):
+        '''Post a JSON body, reconnecting once on failure
+
+        :returns: True if the post succeeded
+        '''
+        data = json.dumps(body).encode("utf-8")
+        request = (
+            "POST %s%s?%s HTTP/1.1\r\nHost: %s\r\n"
+            "Content-Type: application/json\r\nContent-Length: %d\r\n"
+            "Connection: keep-alive\r\n\r\n" % (
+                self.base_path, path, self.query, self.netloc,
+                len(data))).encode("ascii") + data
+        for attempt in range(2):
+            try:
+                status, reason = await asyncio.wait_for(
+                    self.request(request), self.timeout)
+                self.n_requests += 1
+                if status >= 400:
+                    log.warning("Datadog rejected %s: HTTP %d %s",
+                                path, status, reason)
+                    return False
+                return True
+            except (OSError, ValueError, asyncio.TimeoutError,
+                    asyncio.IncompleteReadError):
+                self.disconnect()
+                if attempt == 1:
+                    log.warning("Failed to send to Datadog at %s",
+                                self.netloc, exc_info=1)
+            except asyncio.CancelledError:
+                #
+                # The request may be half written or its response half
+                # read, so the connection can't be reused.
+                #
+                self.disconnect()
+                raise
+        return False
+
+    async def request(self, data):
+        '''Send a request and read the response
+
+        :returns: the status and reason
+        '''
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection(
+                self.host, self.port, ssl=self.ssl or None)
+        self.writer.write(data)
+        await self.writer.drain()
+        status_line = await self.reader.readuntil(b"\r\n")
+        _, status, reason = status_line.decode("latin-1").split(" ", 2)
+        headers = {}
+        while True:
+            line = await self.reader.readuntil(b"\r\n")
+            if line == b"\r\n":
+                break
+            key, value = line.decode("latin-1").split(":", 1)
+            headers[key.strip().lower()] = value.strip()
+        if headers.get("transfer-encoding", "").lower() == "chunked":
+            while True:
+                size = int((await self.reader.readuntil(b"\r\n")).split(
+                    b";")[0], 16)
+                await self.reader.readexactly(size + 2)
+                if size == 0:
+                    break
+        elif "content-length" in headers:
+            await self.reader.readexactly(int(headers["content-length"]))
+        else:
+            await self.reader.read()
+            self.disconnect()
+        if headers.get("connection", "").lower() == "close":
+            self.disconnect()
+        return int(status), reason.strip()
+
+    def disconnect(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.reader = self.writer = None
+
+    async def close(self, timeout=DEFAULT_CLOSE_TIMEOUT):
+        '''Post the buffer and stop the task
+
+        The task finishes the flush it is in the middle of before the last
+        flush. Whatever is unsent after timeout seconds is dropped.
+        '''
+        self.closing = True
+        self.wakeup.set()
+        try:
+            await asyncio.wait_for(self.finish(), timeout)
+        except asyncio.TimeoutError:
+            log.warning("Timed out sending the last metrics to Datadog")
+        self.disconnect()
+
+    async def finish(self):
+        '''Wait for the task to stop, then post what is left'''
+        await self.task
+        await self.flush()
+
+
+def _exception_text(exception, msg):
+    '''The message and traceback for report_exception'''
+    if exception is None:
+        exc_type, exception, tb = sys.exc_info()
+    else:
+        exc_type, tb = type(exception), exception.__traceback__
+    if msg is None:
+        msg = str(exception)
+    if tb is not None:
+        msg += "\n" + "".join(traceback.format_exception(
+            exc_type, exception, tb))
+    return exc_type, msg
+
+
+class AsyncLogger(object):
+    '''The interface of the asyncio loggers
+
+    Subclasses implement the "_nowait" methods, which only buffer, and
+    the transport's flush and close.
+    '''
+
+    transport = None
+
+    async def start_process(self, name, msg, args=None):
+        self.start_process_nowait(name, msg, args)
+
+    async def end_process(self, msg, exit_code):
+        '''Report the end of the process and send everything buffered'''
+        self.end_process_nowait(msg, exit_code)
+        await self.transport.close()
+
+    async def report_metric(self, name, metric, context=None):
+        self.report_metric_nowait(name, metric, context)
+        await self.backpressure()
+
+    async def report_metrics(self, name, time_series, context=None):
+        self.report_metrics_nowait(name, time_series, context)
+        await self.backpressure()
+
+    async def report_event(self, event, context=None, log_level=None):
+        self.report_event_nowait(event, context, log_level)
+        await self.backpressure()
+
+    async def report_exception(self, exception=None, msg=None):
+        self.report_exception_nowait(exception, msg)
+        await self.backpressure()
+
+    async def backpressure(self):
+        '''Wait for the buffer to be sent if it is full'''
+        if self.transport.is_full():
+            await self.transport.flush()
+
+    async def flush(self):
+        '''Send everything buffered so far'''
+        await self.transport.flush()
+
+    def start_process_nowait(self, name, msg, args=None):
+        pass
+
+    def end_process_nowait(self, msg, exit_code):
+        pass
+
+
+class AsyncCarbonLogger(AsyncLogger):
+    '''Metrics to Carbon and events to Python logging'''
+
+    def __init__(self, name, config):
+        protocol = config.get("protocol", PLAINTEXT)
+        self.name = name
+        self.full_names = {}
+        self.logger = logging.getLogger(name)
+        self.transport = AsyncCarbonTransport(
+            config.get("host", "127.0.0.1"),
+            config.get("port", DEFAULT_PORTS.get(protocol, 2003)),
+            protocol=protocol,
+            max_queue=config.get("max-queue", DEFAULT_MAX_QUEUE),
+            reconnect_min=config.get("reconnect-min", DEFAULT_RECONNECT_MIN),
+            reconnect_max=config.get("reconnect-max", DEFAULT_RECONNECT_MAX))
+
+    def get_full_name(self, name):
+        full_name = self.full_names.get(name)
+        if full_name is None:
+            full_name = self.full_names[name] = "%s.%s" % (
+                self.name, name.replace(" ", "_"))
+        return full_name
+
+    def start_process_nowait(self, name, msg, args=None):
+        if args is not None:
+            self.logger.info("Starting process: %s (%r)", msg, args)
+        else:
+            self.logger.info("Starting process: %s", msg)
+
+    def end_process_nowait(self, msg, exit_code):
+        self.logger.info("Ending process: %s, exit code = %s",
+                         msg, exit_code.name)
+
+    def report_metric_nowait(self, name, metric, context=None):
+        self.transport.put((self.get_full_name(name), metric, time.time()))
+
+    def report_metrics_nowait(self, name, time_series, context=None):
+        full_name = self.get_full_name(name)
+        if isinstance(time_series, AggregateTimeSeries):
+            if len(time_series) == 0:
+                return
+            summary = time_series.summary()
+            for suffix, v in summary.metrics():
+                self.transport.put(
+                    ("%s.%s" % (full_name, suffix), v, summary.end))
+        else:
+            self.transport.put((full_name, time_series.values[:],
+                                time_series.timestamps[:]))
+
+    def report_event_nowait(self, event, context=None, log_level=None):
+        if log_level is None:
+            log_level = logging.INFO
+        if context is None:
+            self.logger.log(log_level, event)
+        else:
+            self.logger.log(log_level, "%s (%r)", event, context)
+
+    def report_exception_nowait(self, exception=None, msg=None):
+        self.logger.error(_exception_text(exception, msg)[1])
+
+
+class AsyncDatadogLogger(AsyncLogger):
+    '''Metrics and events to the Datadog API'''
+
+    def __init__(self, name, config):
+        if "api-key" not in config:
+            raise IndexError(
+                "The api-key is missing from the datadog configuration "
+                "subsection in the rh-logger section. See README.md for "
+                "a configuration example.")
+        app_key = config.get(name, {}).get("app-key")
+        self.name = name
+        self.transport = AsyncDatadogTransport(
+            config["api-key"], app_key,
+            api_host=config.get("api-host", DEFAULT_API_HOST),
+            flush_interval=config.get(
+                "flush-interval", DEFAULT_FLUSH_INTERVAL),
+            flush_size=config.get("flush-size", DEFAULT_FLUSH_SIZE))
+
+    def get_tags(self, context):
+        if isinstance(context, (list, tuple)):
+            return [self.name] + list(context)
+        elif context is not None:
+            return [self.name, context]
+        return [self.name]
+
+    def start_process_nowait(self, name, msg, args=None):
+        if args is None:
+            context = []
+        elif isinstance(args, (list, tuple)):
+            context = list(args)
+        else:
+            context = [str(args)]
+        self.transport.send_event("%s starting" % self.name, msg, "info",
+                                  [self.name, "startup"] + context)
+
+    def end_process_nowait(self, msg, exit_code):
+        if exit_code == rh_logger.api.ExitCode.success:
+            self.transport.send_event("%s exiting" % self.name, msg,
+                                      "success", [self.name, "success"])
+        else:
+            self.transport.send_event(
+                "%s exiting with error" % self.name, msg, "error",
+                [self.name, "error", exit_code.name])
+
+    def report_metric_nowait(self, name, metric, context=None):
+        self.transport.send_metric(name, [(time.time(), metric)], self.name,
+                                   self.get_tags(context))
+
+    def report_metrics_nowait(self, name, time_series, context=None):
+        tags = self.get_tags(context)
+        if isinstance(time_series, AggregateTimeSeries):
+            if len(time_series) == 0:
+                return
+            summary = time_series.summary()
+            for suffix, value in summary.metrics():
+                self.transport.send_metric("%s.%s" % (name, suffix),
+                                           [(summary.end, value)],
+                                           self.name, tags)
+        else:
+            self.transport.send_metric(
+                name, list(zip(time_series.timestamps, time_series.values)),
+                self.name, tags)
+
+    def report_event_nowait(self, event, context=None, log_level=None):
+        if log_level is None or log_level <= logging.INFO:
+            alert_type = "info"
+        elif log_level <= logging.WARNING:
+            alert_type = "warning"
+        else:
+            alert_type = "error"
+        self.transport.send_event(event, event, alert_type,
+                                  self.get_tags(context))
+
+    def report_exception_nowait(self, exception=None, msg=None):
+        exc_type, text = _exception_text(exception, msg)
+        tags = [self.name, "exception", exc_type.__name__]
+        self.transport.send_event("Exception report", text, "error", tags)
+        self.transport.send_metric("exception", [(time.time(), 1)],
+                                   self.name, tags, "count")
+
+
+class _ExecutorTransport(object):
+    '''Calls a thread-based backend from one worker thread'''
+
+    def __init__(self, logger):
+        self.logger = logger
+        self.executor = concurrent.futures.ThreadPoolExecutor(1)
+        self.pending = collections.deque()
+
+    def call(self, method, *args):
+        future = asyncio.get_running_loop().run_in_executor(
+            self.executor, getattr(self.logger, method), *args)
+        self.pending.append(future)
+        while len(self.pending) > 0 and self.pending[0].done():
+            self.pending.popleft()
+
+    def is_full(self):
+        return False
+
+    async def flush(self):
+        if len(self.pending) > 0:
+            await asyncio.gather(*self.pending, return_exceptions=True)
+            self.pending.clear()
+
+    async def close(self, timeout=DEFAULT_CLOSE_TIMEOUT):
+        await self.flush()
+        self.executor.shutdown()
+
+
+class AsyncBackendLogger(AsyncLogger):
+    '''Any backend, called in order from a worker thread'''
+
+    def __init__(self, logger):
+        self.transport = _ExecutorTransport(logger)
+
+    def start_process_nowait(self, name, msg, args=None):
+        self.transport.call("start_process", name, msg, args)
+
+    def end_process_nowait(self, msg, exit_code):
+        self.transport.call("end_process", msg, exit_code)
+
+    def report_metric_nowait(self, name, metric, context=None):
+        self.transport.call("report_metric", name, metric, context)
+
+    def report_metrics_nowait(self, name, time_series, context=None):
+        self.transport.call("report_metrics", name, time_series.copy(),
+                            context)
+
+    def report_event_nowait(self, event, context=None, log_level=None):
+        self.transport.call("report_event", event, context, log_level)
+
+    def report_exception_nowait(self, exception=None, msg=None):
+        if exception is None:
+            exception = sys.exc_info()[1]
+        self.transport.call("report_exception", exception, msg)
+
+
+'''The backends with asyncio transports'''
+ASYNC_BACKENDS = dict(carbon=AsyncCarbonLogger, datadog=AsyncDatadogLogger)
+
+
+def get_logger(name, backend=None):
+    '''Make the asyncio logger for a backend
+
+    Call this from a coroutine or callback running on the event loop.
+
+    :param name: the name to use for reporting
+    :param backend: the backend's name or a list of names to send to all
+    of them. Default is the logging-backend.
+    '''
+    if backend is None:
+        backend = get_logging_backend()
+    if isinstance(backend, (list, tuple)):
+        return AsyncBackendLogger(make_fanout_backend(backend, name))
+    if backend in ASYNC_BACKENDS:
+        return ASYNC_BACKENDS[backend](
+            name, get_logging_config_root().get(backend, {}))
+    return AsyncBackendLogger(make_backend(backend, name))
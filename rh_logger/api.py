@@ -1,16 +1,27 @@
 '''api.py - API for the Rhoana logger'''
 
+import array
 import enum
 import os
-import pkg_resources
-import rh_config
 import time
 
+from rh_logger.stats import QuantileSketch, RunningStats, Summary
+from rh_logger.aggregator import MetricAggregator, DEFAULT_FLUSH_INTERVAL, \
+     context_key
+from rh_logger.timer import Timer, NULL_TIMER
+from rh_logger.spans import Span, SpanRecorder, DEFAULT_FLUSH_SIZE as \
+     DEFAULT_SPAN_FLUSH_SIZE, DEFAULT_FLUSH_INTERVAL as \
+     DEFAULT_SPAN_FLUSH_INTERVAL
+from rh_logger.discovery import find_backends
+from rh_logger.fingerprint import ExceptionFingerprinter, \
+     get_exception_info, DEFAULT_WINDOW as DEFAULT_EXCEPTION_WINDOW
+
 
 def set_logging_backend(name):
     '''Set the name of the logging backend
 
-    :param name: name of the logger (see below)
+    :param name: name of the logger (see below) or a list of names to send
+    everything to several backends
 
     The logger will use a backend with the registered entry point from the
     group, "rh_logger.backend", and the given name.
@@ -21,9 +32,57 @@ def set_logging_backend(name):
 
 def get_logging_backend():
     '''Return the name of the current logging backend'''
+    if __logging_backend is None:
+        return get_logging_config_root().get("logging-backend", "default")
     return __logging_backend
 
 
+def get_logging_config_root():
+    '''Return the rh-logger section of the rh_config configuration
+
+    The configuration is read the first time this is called rather than
+    when rh_logger is imported.
+    '''
+    global logging_config_root
+    if logging_config_root is None:
+        import rh_config
+        logging_config_root = rh_config.config.get(
+            "rh-logger",
+            {"logging-backend": "default"})
+    return logging_config_root
+
+
+def make_backend(backend, name):
+    '''Create a logger using the named backend
+
+    :param backend: the name of the backend's entry point
+    :param name: the name to use for reporting
+    '''
+    for fn in find_backends(backend):
+        logging_config = get_logging_config_root().get(backend, {})
+        logger = fn(name, logging_config)
+        if logger is not None:
+            return logger
+    raise ValueError("Unable to find an appropriate logging backend. "
+                     "Check your .rh_config.yaml file.")
+
+
+def make_fanout_backend(backends, name):
+    '''Create a logger that sends everything to several backends
+
+    :param backends: the names of the backends' entry points
+    :param name: the name to use for reporting
+    '''
+    from rh_logger.fanout import FanoutLogger, DEFAULT_MAX_QUEUE, \
+         DEFAULT_CLOSE_TIMEOUT
+    config = get_logging_config_root()
+    return FanoutLogger(
+        [(_, make_backend(_, name)) for _ in backends],
+        max_queue=config.get("fanout-max-queue", DEFAULT_MAX_QUEUE),
+        close_timeout=config.get(
+            "fanout-close-timeout", DEFAULT_CLOSE_TIMEOUT))
+
+
 class ExitCode(enum.Enum):
     '''Process completed successfully'''
     success = 0
@@ -40,13 +99,192 @@ class TimeSeries(object):
 
     The use case is a rapid process which is being done repeatedly - this
     aggregates the metrics on that process into one API round-trip.
+
+    The timestamps and values are kept in two contiguous arrays of doubles.
+    Backends should read them through the "timestamps" and "values"
+    attributes or :py:meth: `as_numpy` rather than building lists of tuples.
     '''
 
+    __slots__ = ["timestamps", "values"]
+
     def __init__(self):
-        self.timestamps_and_metrics = []
+        self.timestamps = array.array("d")
+        self.values = array.array("d")
+
+    def report_metric(self, metric):
+        self.timestamps.append(time.time())
+        self.values.append(metric)
+
+    def report_metrics(self, values, timestamps=None):
+        '''Add many metrics at once
+
+        :param values: a sequence of metric values. A NumPy array of float64
+        or a double array.array is copied in bulk without touching
+        individual elements.
+        :param timestamps: a sequence of timestamps, one per value. Default
+        is to use the current time for all of them.
+        '''
+        n_before = len(self.values)
+        _extend(self.values, values)
+        n_added = len(self.values) - n_before
+        if timestamps is None:
+            self.timestamps.extend(
+                array.array("d", [time.time()]) * n_added)
+        else:
+            _extend(self.timestamps, timestamps)
+            if len(self.timestamps) != len(self.values):
+                del self.timestamps[n_before:]
+                del self.values[n_before:]
+                raise ValueError(
+                    "The number of timestamps does not match the number "
+                    "of values")
+
+    def copy(self):
+        '''Return a copy that doesn't change when this series does'''
+        result = TimeSeries()
+        result.timestamps = array.array("d", self.timestamps)
+        result.values = array.array("d", self.values)
+        return result
+
+    @property
+    def timestamps_and_metrics(self):
+        '''A list of (timestamp, metric) tuples'''
+        return list(zip(self.timestamps, self.values))
+
+    def as_numpy(self):
+        '''Return copies of the timestamps and values as NumPy arrays
+
+        The arrays are copies, made in bulk. A view on the time series'
+        buffers would keep them from growing, so that reporting more
+        metrics raised BufferError while the view was alive.
+        '''
+        import numpy as np
+        return (np.frombuffer(self.timestamps, np.float64).copy(),
+                np.frombuffer(self.values, np.float64).copy())
+
+    def summary(self):
+        '''Return a :py:class: `rh_logger.stats.Summary` of the series'''
+        stats = RunningStats()
+        for value in self.values:
+            stats.add(value)
+        ordered = sorted(self.values)
+
+        def percentile(q):
+            if len(ordered) == 0:
+                return None
+            return ordered[int(round(q * (len(ordered) - 1)))]
+
+        if len(ordered) == 0:
+            start = end = None
+        else:
+            start, end = self.timestamps[0], self.timestamps[-1]
+        return Summary(stats.count, stats.total,
+                       stats.min if stats.count else None,
+                       stats.max if stats.count else None,
+                       stats.mean, stats.variance, percentile(.5),
+                       percentile(.95), percentile(.99), start, end)
+
+    def __len__(self):
+        return len(self.values)
+
+
+class AggregateTimeSeries(object):
+    '''A time series that keeps only summary statistics
+
+    This has the same reporting methods as :py:class: `TimeSeries` but, instead
+    of recording every point, it keeps running statistics and a quantile
+    sketch, so its memory stays constant no matter how many metrics are
+    reported. Backends report its :py:meth: `summary` instead of the points.
+    '''
+
+    __slots__ = ["stats", "sketch", "start", "end"]
+
+    def __init__(self, relative_accuracy=0.01):
+        '''Initialize the time series
+
+        :param relative_accuracy: the relative accuracy of the p50, p95 and
+        p99 estimates.
+        '''
+        self.stats = RunningStats()
+        self.sketch = QuantileSketch(relative_accuracy)
+        self.start = None
+        self.end = None
 
     def report_metric(self, metric):
-        self.timestamps_and_metrics.append((time.time(), metric))
+        self._touch(time.time())
+        self.stats.add(metric)
+        self.sketch.add(metric)
+
+    def report_metrics(self, values, timestamps=None):
+        '''Add many metrics at once
+
+        :param values: a sequence of metric values
+        :param timestamps: the timestamps of the values. Only the first and
+        last are kept. Default is the current time.
+        '''
+        if hasattr(values, "tolist"):
+            values = values.tolist()
+        if len(values) == 0:
+            return
+        if timestamps is None:
+            self._touch(time.time())
+        else:
+            if len(timestamps) != len(values):
+                raise ValueError(
+                    "The number of timestamps does not match the number "
+                    "of values")
+            self._touch(min(timestamps))
+            self._touch(max(timestamps))
+        self.stats.add_many(values)
+        self.sketch.add_many(values)
+
+    def _touch(self, timestamp):
+        if self.start is None or timestamp < self.start:
+            self.start = timestamp
+        if self.end is None or timestamp > self.end:
+            self.end = timestamp
+
+    def copy(self):
+        '''Return a copy that doesn't change when this series does'''
+        result = AggregateTimeSeries(self.sketch.relative_accuracy)
+        result.merge(self)
+        return result
+
+    def merge(self, other):
+        '''Combine another AggregateTimeSeries into this one'''
+        if other.start is not None:
+            self._touch(other.start)
+            self._touch(other.end)
+        self.stats.merge(other.stats)
+        self.sketch.merge(other.sketch)
+
+    def summary(self):
+        '''Return a :py:class: `rh_logger.stats.Summary` of the series'''
+        stats = self.stats
+        quantile = self.sketch.quantile
+        return Summary(stats.count, stats.total,
+                       stats.min if stats.count else None,
+                       stats.max if stats.count else None,
+                       stats.mean, stats.variance,
+                       quantile(.5), quantile(.95), quantile(.99),
+                       self.start, self.end)
+
+    def __len__(self):
+        return self.stats.count
+
+
+def _extend(a, values):
+    '''Extend a double array.array as cheaply as the values allow'''
+    if isinstance(values, array.array) and values.typecode == "d":
+        a.extend(values)
+    elif hasattr(values, "dtype") and hasattr(values, "tobytes"):
+        data = values.astype("=f8", copy=False).ravel().tobytes()
+        if hasattr(a, "frombytes"):
+            a.frombytes(data)
+        else:
+            a.fromstring(data)
+    else:
+        a.extend(values)
 
 
 class Logger(object):
@@ -70,6 +308,18 @@ class Logger(object):
         '''
         raise NotImplementedError()
 
+    def flush(self):
+        '''Send everything reported so far
+
+        Backends that buffer calls or send them from another thread wait
+        here until what they hold has been sent. The default has nothing
+        to wait for.
+
+        :returns: True if everything was sent, False if some of it was
+        dropped or is still waiting
+        '''
+        return True
+
     def report_metric(self, name, metric, context=None):
         '''Report a metric such as accuracy or execution time
 
@@ -84,6 +334,50 @@ class Logger(object):
         '''Report a number of metrics simultaneously'''
         raise NotImplementedError()
 
+    def report_count(self, name, count, context=None, timestamp=None):
+        '''Report the number of times something happened in a flush window
+
+        Backends that distinguish counts from other metrics override this.
+        The default reports the count with report_metric or, if there is a
+        timestamp, as a TimeSeries of one point with report_metrics.
+
+        :param name: the name of the counter
+        :param count: the number of times
+        :param context: an optional context for the counter
+        :param timestamp: the time of the count, the end of its flush
+        window. Default is now.
+        '''
+        if timestamp is None:
+            self.report_metric(name, count, context)
+        else:
+            series = TimeSeries()
+            series.report_metrics([count], [timestamp])
+            self.report_metrics(name, series, context)
+
+    def increment(self, name, value=1, context=None):
+        '''Add to a counter
+
+        The LoggerProxy sums increments in process and reports one count per
+        name, context and flush window. This default reports each increment.
+        '''
+        self.report_count(name, value, context)
+
+    def gauge(self, name, value, context=None):
+        '''Set a gauge
+
+        The LoggerProxy reports the last value set in each flush window.
+        This default reports each value.
+        '''
+        self.report_metric(name, value, context)
+
+    def histogram(self, name, value, context=None):
+        '''Add a value to a distribution
+
+        The LoggerProxy reports an :py:class: `AggregateTimeSeries` of the
+        values in each flush window. This default reports each value.
+        '''
+        self.report_metric(name, value, context)
+
     def report_event(self, event, context=None, log_level=None):
         '''Report an event
 
@@ -94,6 +388,24 @@ class Logger(object):
         '''
         raise NotImplementedError()
 
+    def report_events(self, events, context=None, log_level=None,
+                      title=None):
+        '''Report several events at once
+
+        Backends override this to send the events as one record or one
+        request. The default reports the title and then each event with
+        report_event.
+
+        :param events: a sequence of event texts
+        :param context: a subcontext for all of the events
+        :param log_level: an optional log level for all of the events
+        :param title: an optional heading for the events
+        '''
+        if title is not None:
+            self.report_event(title, context, log_level)
+        for event in events:
+            self.report_event(event, context, log_level)
+
     def report_exception(self, exception=None, msg=None):
         '''Report an exception
 
@@ -103,6 +415,90 @@ class Logger(object):
         '''
         raise NotImplementedError()
 
+    def report_spans(self, spans):
+        '''Report a batch of finished spans
+
+        The default reports the durations of the spans with each name and
+        context as a TimeSeries named "span.<name>", timestamped with the
+        end of each span.
+
+        :param spans: a sequence of :py:class: `rh_logger.spans.SpanRecord`
+        '''
+        series = {}
+        for span in spans:
+            key = (span.name, context_key(span.context)
+                   if span.context is not None else None)
+            try:
+                entry = series.get(key)
+            except TypeError:
+                key = (span.name, repr(span.context))
+                entry = series.get(key)
+            if entry is None:
+                entry = series[key] = (span.name, TimeSeries(), span.context)
+            entry[1].timestamps.append(span.start + span.duration)
+            entry[1].values.append(span.duration)
+        for name, time_series, context in series.values():
+            self.report_metrics("span." + name, time_series, context)
+
+    def bind(self, context):
+        '''Return a :py:class: `BoundLogger` that reports with a context'''
+        return BoundLogger(self, context)
+
+    def bind_context(self, context):
+        '''Normalize a context once for a :py:class: `BoundLogger`
+
+        Backends override this to return whatever they derive from a context
+        on every call, for instance tag lists or formatted text, and
+        override the report_bound methods to use it. The default returns
+        the context unchanged.
+        '''
+        return context
+
+    def report_bound_metric(self, name, metric, bound):
+        '''Report a metric with a context normalized by bind_context'''
+        self.report_metric(name, metric, bound)
+
+    def report_bound_metrics(self, name, time_series, bound):
+        '''Report metrics with a context normalized by bind_context'''
+        self.report_metrics(name, time_series, bound)
+
+    def report_bound_event(self, event, bound, log_level=None):
+        '''Report an event with a context normalized by bind_context'''
+        self.report_event(event, bound, log_level)
+
+
+class BoundLogger(object):
+    '''A context bound to a logger
+
+    The backend normalizes the context once, when the context is bound,
+    so reporting through the bound logger skips the per-call work of
+    turning the context into tags, paths or text:
+
+    tile_logger = logger.bind(["tile", 5])
+    tile_logger.report_metric("Rand score", .95)
+    '''
+
+    __slots__ = ["logger", "context", "bound"]
+
+    def __init__(self, logger, context):
+        '''Bind a context
+
+        :param logger: the backend :py:class: `Logger`
+        :param context: the context to report with every call
+        '''
+        self.logger = logger
+        self.context = context
+        self.bound = logger.bind_context(context)
+
+    def report_metric(self, name, metric):
+        self.logger.report_bound_metric(name, metric, self.bound)
+
+    def report_metrics(self, name, time_series):
+        self.logger.report_bound_metrics(name, time_series, self.bound)
+
+    def report_event(self, event, log_level=None):
+        self.logger.report_bound_event(event, self.bound, log_level)
+
 
 class LoggerProxy(Logger):
     '''This is a proxy for whatever logger is chosen
@@ -114,6 +510,13 @@ class LoggerProxy(Logger):
     because what you will get is the logger proxy.
     '''
 
+    def __init__(self):
+        self.aggregator = MetricAggregator()
+        self.spans = SpanRecorder()
+        self.fingerprinter = ExceptionFingerprinter()
+        self.profiler = None
+        self.resource_sampler = None
+
     def __initialize(self, name):
         '''Pick the actual logger to be served to everyone.
 
@@ -121,32 +524,77 @@ class LoggerProxy(Logger):
         '''
         assert not hasattr(self, "logger"), "Can't call start_process twice"
         backend = get_logging_backend()
-        for entry_point in pkg_resources.WorkingSet().iter_entry_points(
-                'rh_logger.backend', backend):
-            fn = entry_point.load()
-            logging_config = logging_config_root.get(backend, {})
-            self.logger = fn(name, logging_config)
-            if self.logger is not None:
-                return
-        raise ValueError("Unable to find an appropriate logging backend. "
-                         "Check your .rh_config.yaml file.")
-
-    def start_process(self, name, msg, args=None, log_env=False):
+        if isinstance(backend, (list, tuple)):
+            self.logger = make_fanout_backend(backend, name)
+        else:
+            self.logger = make_backend(backend, name)
+        config = get_logging_config_root()
+        if config.get("fork-collector", False):
+            from rh_logger.collector import ForkCollector, DEFAULT_CAPACITY, \
+                 DEFAULT_RECORD_SIZE, DEFAULT_INTERVAL, DEFAULT_LOCK_TIMEOUT
+            self.logger = ForkCollector(
+                self.logger,
+                capacity=config.get(
+                    "fork-collector-capacity", DEFAULT_CAPACITY),
+                record_size=config.get(
+                    "fork-collector-record-size", DEFAULT_RECORD_SIZE),
+                interval=config.get(
+                    "fork-collector-interval", DEFAULT_INTERVAL),
+                lock_timeout=config.get(
+                    "fork-collector-lock-timeout", DEFAULT_LOCK_TIMEOUT))
+
+    def start_process(self, name, msg, args=None, log_env=False,
+                      profile=None, resources=None):
         '''Report the start of a process
 
         :param msg: an introductory message for the process
+        :param log_env: True to report the PID and the environment, as one
+        batch of events titled "Environment"
+        :param profile: True to run the sampling profiler (see
+        rh_logger.profiler). Default is the "profile" config entry.
+        :param resources: True to report the process's resource use (see
+        rh_logger.resources). Default is the "resources" config entry.
         '''
         self.__initialize(name)
+        config = get_logging_config_root()
+        if "timers" in config:
+            self.aggregator.enabled = config["timers"]
+        self.aggregator.set_flush_interval(config.get(
+            "timer-flush-interval", DEFAULT_FLUSH_INTERVAL))
+        self.aggregator.target = self
+        self.fingerprinter.window = config.get(
+            "exception-window", DEFAULT_EXCEPTION_WINDOW)
+        spans = config.get("spans", {})
+        self.spans.configure(
+            flush_size=spans.get("flush-size", DEFAULT_SPAN_FLUSH_SIZE),
+            flush_interval=spans.get(
+                "flush-interval", DEFAULT_SPAN_FLUSH_INTERVAL),
+            trace_file=spans.get("trace-file"))
+        self.spans.target = self
         self.logger.start_process(name, msg, args)
+        self.spans.start_root(name)
         if log_env:
             #
-            # Adding some automatic capture of running state here
+            # Adding some automatic capture of running state here, as one
+            # record
             #
-            self.logger.report_event("PID: %d" % os.getpid())
-            self.logger.report_event("--------- Environment ---------")
-            for k, v in os.environ.items():
-                self.logger.report_event("    %s: %s" % (k, v))
-            self.logger.report_event("-------------------------------")
+            self.logger.report_events(
+                ["PID: %d" % os.getpid()] +
+                ["%s: %s" % (k, v) for k, v in sorted(os.environ.items())],
+                title="Environment")
+        if profile is None:
+            profile = config.get("profile", False)
+        if profile:
+            from rh_logger.profiler import make_profiler
+            self.profiler = make_profiler(self, name, config.get("profile"))
+            self.profiler.start()
+        if resources is None:
+            resources = config.get("resources", False)
+        if resources:
+            from rh_logger.resources import make_resource_sampler
+            sampler = make_resource_sampler(self, config.get("resources"))
+            if sampler.start():
+                self.resource_sampler = sampler
 
     def end_process(self, msg, exit_code):
         '''Report the end of a process
@@ -154,8 +602,24 @@ class LoggerProxy(Logger):
         :param msg: an informative message about why the process ended
         :param exit_code: one of the :py:class: `ExitCode` enumerations
         '''
+        if self.profiler is not None:
+            self.profiler.stop()
+            self.profiler = None
+        if self.resource_sampler is not None:
+            self.resource_sampler.stop()
+            self.resource_sampler = None
+        self.spans.end_root()
+        self.aggregator.flush()
         self.logger.end_process(msg, exit_code)
 
+    def flush(self):
+        '''Report the aggregated counters and send everything reported
+
+        :returns: True if the backend sent everything
+        '''
+        self.aggregator.flush()
+        return self.logger.flush()
+
     def report_metric(self, name, metric, context=None):
         '''Report a metric such as accuracy or execution time
 
@@ -170,6 +634,47 @@ class LoggerProxy(Logger):
         '''Report a number of metrics simultaneously'''
         self.logger.report_metrics(name, time_series, context)
 
+    def report_count(self, name, count, context=None, timestamp=None):
+        '''Report the number of times something happened in a flush window'''
+        self.logger.report_count(name, count, context, timestamp)
+
+    def increment(self, name, value=1, context=None):
+        '''Add to a counter
+
+        Increments are summed in process and reported through report_count
+        once per name, context and flush window ("timer-flush-interval").
+
+        :param name: the name of the counter, e.g. "Tiles aligned"
+        :param value: the amount to add
+        :param context: an optional context for the counter
+        '''
+        self.aggregator.increment(name, value, context)
+
+    def gauge(self, name, value, context=None):
+        '''Set a gauge
+
+        The last value set in each flush window is reported through
+        report_metrics as a :py:class: `TimeSeries` of one point,
+        timestamped with the end of the window.
+
+        :param name: the name of the gauge, e.g. "Queue depth"
+        :param value: the value
+        :param context: an optional context for the gauge
+        '''
+        self.aggregator.gauge(name, value, context)
+
+    def histogram(self, name, value, context=None):
+        '''Add a value to a distribution
+
+        The values in each flush window are reported through report_metrics
+        as an :py:class: `AggregateTimeSeries`.
+
+        :param name: the name of the metric, e.g. "Tile size"
+        :param value: the value
+        :param context: an optional context for the metric
+        '''
+        self.aggregator.histogram(name, value, context)
+
     def report_event(self, event, context=None, log_level=None):
         '''Report an event
 
@@ -180,22 +685,96 @@ class LoggerProxy(Logger):
         '''
         self.logger.report_event(event, context, log_level)
 
+    def report_events(self, events, context=None, log_level=None,
+                      title=None):
+        '''Report several events at once
+
+        The backend sends them as one record where it can, for instance
+        one Datadog event or one multi-line log record.
+
+        :param events: a sequence of event texts
+        :param context: a subcontext for all of the events
+        :param log_level: an optional log level for all of the events
+        :param title: an optional heading for the events
+        '''
+        self.logger.report_events(events, context, log_level, title)
+
     def report_exception(self, exception=None, msg=None):
         '''Report an exception
 
+        The exception is reported in full the first time its fingerprint is
+        seen in each "exception-window". Repeats are counted and reported
+        as "exception.repeats.<fingerprint>" counts (see
+        rh_logger.fingerprint).
+
         :param exception: the :py:class: `Exception` that was thrown. Default
         is the one reported by sys.exc_info()
         :param msg: an informative message
         '''
+        exc_type, value, tb = get_exception_info(exception)
+        if exc_type is not None:
+            fingerprint, first = self.fingerprinter.check(
+                exc_type, tb, value)
+            if not first:
+                self.aggregator.increment(
+                    "exception.repeats." + fingerprint, 1, exc_type.__name__)
+                return
         self.logger.report_exception(exception, msg)
 
-logging_config_root = rh_config.config.get(
-    "rh-logger",
-    {"logging-backend": "default"})
+    def report_spans(self, spans):
+        '''Report a batch of finished spans'''
+        self.logger.report_spans(spans)
+
+    def bind(self, context):
+        '''Return a :py:class: `BoundLogger` for a context
+
+        The handle reports straight to the backend, which prepares the
+        context once. Call this after start_process.
+
+        :param context: the context to report with every call
+        '''
+        return self.logger.bind(context)
+
+    def timer(self, name, context=None):
+        '''Time a block of code or a function
+
+        Use as a context manager ("with logger.timer(name):") or a decorator
+        ("@logger.timer(name)"). The durations in seconds are aggregated
+        in process and reported periodically as an
+        :py:class: `AggregateTimeSeries` through report_metrics.
+
+        :param name: the name of the metric, e.g. "Align tile"
+        :param context: an optional context for the metric
+        '''
+        if not self.aggregator.enabled:
+            return NULL_TIMER
+        return Timer(self.aggregator, name, context)
+
+    def span(self, name, context=None):
+        '''Time a block of code or a function as a nested span
+
+        Use as a context manager ("with logger.span(name):") or a decorator
+        ("@logger.span(name)"). Each span records its id, its parent's id,
+        its start and its duration. Finished spans are exported in batches
+        through report_spans (see rh_logger.spans).
+
+        :param name: the name of the span, e.g. "Align tile"
+        :param context: an optional context for the span
+        '''
+        return Span(self.spans, name, context)
+
+    def enable_timers(self, enabled=True):
+        '''Turn timing on or off
+
+        When timing is off, logger.timer returns a timer that does nothing.
+        '''
+        self.aggregator.enabled = enabled
+
+'''The rh-logger config section, loaded by get_logging_config_root'''
+logging_config_root = None
 
-__logging_backend = logging_config_root.get(
-    "logging-backend", "default"
-)
+'''The backend name set by set_logging_backend or None to use the config'''
+__logging_backend = None
 
 logging_config = None
 logger = LoggerProxy()
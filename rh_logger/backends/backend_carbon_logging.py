@@ -8,75 +8,135 @@ Configuration:
 rh-logger:
     carbon:
         host: 127.0.0.1
+        # The default port is 2003 for plaintext and 2004 for pickle
         port: 2003
+        # plaintext or pickle
+        protocol: plaintext
+        # The maximum number of messages buffered while Carbon is slow or
+        # unreachable
+        max-queue: 100000
+        # What to do when the buffer is full: block, drop-oldest or
+        # drop-newest
+        overflow: drop-oldest
+        # Reconnection backoff in seconds
+        reconnect-min: 0.1
+        reconnect-max: 60
+
+To spread metrics over several Carbon relays or caches, list them as
+destinations instead of giving host and port. Each metric name goes to one
+destination, picked by the consistent-hash ring that carbon-relay uses, and
+to the next one on the ring while that destination is down. As with
+carbon-relay, destinations on the same host need different instances.
+
+rh-logger:
+    carbon:
+        # host:port:instance, as in carbon-relay's DESTINATIONS
+        destinations:
+            - 10.0.0.1:2003:a
+            - 10.0.0.2:2003:a
+            - 10.0.0.2:2103:b
+        # The number of positions of each destination on the hash ring
+        replica-count: 100
 '''
 
 import rh_logger
-import backend_python_logging
-import Queue
-import socket
-import threading
+import rh_logger.api
+from rh_logger.backends import backend_python_logging
+from rh_logger.backends.carbon_transport import CarbonSender, \
+     ShardedCarbonSender, parse_destination, DEFAULT_MAX_QUEUE, \
+     DEFAULT_PORTS, DEFAULT_RECONNECT_MIN, DEFAULT_RECONNECT_MAX, \
+     DEFAULT_REPLICA_COUNT, DROP_OLDEST, PLAINTEXT
 import time
 
 class CarbonLogger(backend_python_logging.BLPLogger):
     '''Log metrics to Carbon/Graphite'''
 
+    reduces_metrics = False
+
     def __init__(self, name, config):
-        super(CarbonLogger, self).__init__(name)
+        super(CarbonLogger, self).__init__(name, config)
         if "host" not in config:
             host = "127.0.0.1"
         else:
             host = config["host"]
+        protocol = config.get("protocol", PLAINTEXT)
         if "port" not in config:
-            port = 2003
+            port = DEFAULT_PORTS.get(protocol, 2003)
         else:
             port = config["port"]
-        s = socket.socket()
-        s.connect((host, port))
-        self.queue = Queue.Queue()
-        self.thread = threading.Thread(
-            target = lambda :self.run(s),
-            name = "CarbonLoggerThread")
-        self.thread.start()
-    
-    def run(self, s):
-        '''Thread for running the logger'''
-        
-        done = False
-        while not done:
-            msg = self.queue.get()
-            if msg is None:
-                break
-            while True:
-                try:
-                    another_msg = self.queue.get_nowait()
-                    if another_msg is None:
-                        done = True
-                        break
-                    msg += another_msg
-                except Queue.Empty:
-                    break
-            s.sendall(msg)
-        s.close()
+        self.name = name
+        self.full_names = {}
+        kwargs = dict(
+            prefix=name,
+            protocol=protocol,
+            max_queue=config.get("max-queue", DEFAULT_MAX_QUEUE),
+            overflow=config.get("overflow", DROP_OLDEST),
+            reconnect_min=config.get("reconnect-min", DEFAULT_RECONNECT_MIN),
+            reconnect_max=config.get("reconnect-max", DEFAULT_RECONNECT_MAX))
+        destinations = [
+            parse_destination(_, DEFAULT_PORTS.get(protocol, 2003))
+            for _ in config.get("destinations", [])]
+        if len(destinations) > 1:
+            self.sender = ShardedCarbonSender(
+                destinations,
+                replica_count=config.get(
+                    "replica-count", DEFAULT_REPLICA_COUNT),
+                **kwargs)
+        else:
+            if len(destinations) == 1:
+                host, port = destinations[0][:2]
+            self.sender = CarbonSender(host, port, **kwargs)
     
     def make_name(self, name):
         name = name.replace(" ", "_")
         return "%s.%s" % (self.name, name)
+
+    def get_full_name(self, name):
+        '''The Carbon path for a metric name, computed once per name'''
+        full_name = self.full_names.get(name)
+        if full_name is None:
+            full_name = self.full_names[name] = self.make_name(name)
+        return full_name
     
+    def report_spans(self, spans):
+        '''Send the durations of spans as span.<name> metrics'''
+        rh_logger.api.Logger.report_spans(self, spans)
+
     def report_metrics(self, name, time_series, context=None):
         '''Report a series of metrics'''
-        full_name = self.make_name(name)
-        msg = "".join(["%s %f %f\n" % (full_name, v, t) 
-                       for t, v in time_series.timestamps_and_metrics])
-        self.queue.put(msg)
+        full_name = self.get_full_name(name)
+        if isinstance(time_series, rh_logger.api.AggregateTimeSeries):
+            if len(time_series) == 0:
+                return
+            summary = time_series.summary()
+            for suffix, v in summary.metrics():
+                self.sender.put(
+                    ("%s.%s" % (full_name, suffix), v, summary.end))
+        else:
+            #
+            # The arrays are copied so that the caller can keep adding
+            # to the time series.
+            #
+            self.sender.put((full_name, time_series.values[:],
+                             time_series.timestamps[:]))
     
     def report_metric(self, name, metric, subcontext=None):
-        full_name = self.make_name(name)
-        self.queue.put("%s %f %f\n" % (full_name, metric, time.time()))
+        self.sender.put((self.get_full_name(name), metric, time.time()))
+
+    def report_bound_metric(self, name, metric, bound):
+        # Carbon paths don't include the context
+        self.sender.put((self.get_full_name(name), metric, time.time()))
+
+    def report_bound_metrics(self, name, time_series, bound):
+        self.report_metrics(name, time_series)
     
     def end_process(self, msg, exit_code):
         super(CarbonLogger, self).end_process(msg, exit_code)
-        self.queue.put(None)
+        self.sender.close()
+
+    def flush(self):
+        '''Wait for the buffered metrics to be sent'''
+        return self.sender.flush()
 
 
 def get_logger(name, config):
@@ -0,0 +1,93 @@
+'''backend_columnar_logging.py - logging backend that writes columnar files
+
+This logger writes numeric metrics to a columnar file (see
+rh_logger.columnar) for analysis after the run. Every point keeps its
+timestamp. Events and other logging go to the Python logger.
+
+Read the file with rh_logger.columnar.ColumnarReader:
+
+    with ColumnarReader(path) as reader:
+        timestamps, values = reader.read("Align tile", context=["mfov", 5])
+
+Configuration:
+
+rh-logger:
+    logging-backend: columnar
+    columnar:
+        # the directory for the files. Each process writes
+        # <name>-<host>-<pid>.rhcol
+        directory: metrics
+        # the number of points buffered before they are written
+        chunk-size: 65536
+'''
+
+import numbers
+import os
+import re
+import socket
+import time
+
+import rh_logger.api
+from rh_logger.backends import backend_python_logging
+from rh_logger.columnar import ColumnarWriter, DEFAULT_CHUNK_SIZE, SUFFIX
+
+
+class ColumnarLogger(backend_python_logging.BLPLogger):
+    '''Log metrics to a columnar file'''
+
+    reduces_metrics = False
+
+    def __init__(self, name, config):
+        super(ColumnarLogger, self).__init__(name, config)
+        directory = config.get("directory", ".")
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        path = os.path.join(directory, "%s-%s-%d%s" % (
+            re.sub(r"[^\w.]", "_", name), socket.gethostname(), os.getpid(),
+            SUFFIX))
+        self.columnar = ColumnarWriter(
+            path, chunk_size=config.get("chunk-size", DEFAULT_CHUNK_SIZE))
+
+    def end_process(self, msg, exit_code):
+        self.columnar.close()
+        super(ColumnarLogger, self).end_process(msg, exit_code)
+
+    def flush(self):
+        '''Write the buffered points'''
+        self.columnar.flush()
+        return True
+
+    def report_metric(self, name, metric, subcontext=None):
+        if isinstance(metric, numbers.Real):
+            self.columnar.add(name, metric, time.time(), subcontext)
+        else:
+            super(ColumnarLogger, self).report_metric(
+                name, metric, subcontext)
+
+    def report_bound_metric(self, name, metric, bound):
+        self.report_metric(name, metric, None if bound is None
+                           else bound.context)
+
+    def report_bound_metrics(self, name, time_series, bound):
+        self.report_metrics(name, time_series, None if bound is None
+                            else bound.context)
+
+    def report_spans(self, spans):
+        '''Write the durations of spans as span.<name> metrics'''
+        rh_logger.api.Logger.report_spans(self, spans)
+
+    def report_metrics(self, name, time_series, context=None):
+        if isinstance(time_series, rh_logger.api.AggregateTimeSeries):
+            if len(time_series) == 0:
+                return
+            summary = time_series.summary()
+            for suffix, v in summary.metrics():
+                self.columnar.add("%s.%s" % (name, suffix), v, summary.end,
+                                  context)
+        else:
+            self.columnar.add_many(name, time_series.values,
+                                   time_series.timestamps, context)
+
+
+def get_logger(name, config):
+    return ColumnarLogger(name, config)
@@ -1,20 +1,122 @@
-'''logger.py - the Datadog logger'''
+'''logger.py - the Datadog logger
+
+Configuration:
+
+rh-logger:
+    datadog:
+        api-key: 0000000000000000000
+        # Send metrics and events from a background thread (default: true)
+        asynchronous: true
+        # Maximum seconds a metric or event is buffered (default: 10)
+        flush-interval: 10
+        # Flush as soon as this many points and events are buffered
+        flush-size: 1000
+        # The Datadog API endpoint
+        api-host: https://api.datadoghq.com
+        # "http" to post to the Datadog API (the default) or "dogstatsd"
+        # to send over UDP to a Datadog agent. With "dogstatsd", api-key
+        # and app-key aren't needed.
+        transport: http
+        dogstatsd-host: 127.0.0.1
+        dogstatsd-port: 8125
+        # How the points of a time series are sent to DogStatsD:
+        # "distribution" (the default) or "histogram". A DogStatsD gauge
+        # keeps only the last point of each flush, so gauges aren't used.
+        dogstatsd-series-type: distribution
+        # Limit and coalesce repeated events (see rh_logger.ratelimit)
+        event-rate-limit:
+            rate: 1
+            burst: 10
+            window: 60
+        my-application:
+            app-key: 000000000000000000000
+'''
 
-import collections
 import datadog
-import datetime
 import os
 import logging
 import rh_logger
 import rh_logger.api
 import sys
+import time
 import traceback
 
+try:
+    from collections.abc import Sequence
+except ImportError:
+    from collections import Sequence
+
+try:
+    string_types = basestring
+except NameError:
+    string_types = str
+
+from rh_logger.fingerprint import fingerprint
+from rh_logger.ratelimit import make_event_limiter
+from rh_logger.backends.datadog_transport import DatadogTransport, \
+     DEFAULT_API_HOST, DEFAULT_FLUSH_INTERVAL, DEFAULT_FLUSH_SIZE
+from rh_logger.backends import dogstatsd_transport
+
+'''The most characters Datadog accepts in the body of an event'''
+MAX_EVENT_TEXT = 4000
+
+
+def format_event_lines(lines, max_length=MAX_EVENT_TEXT):
+    '''Format lines as a preformatted markdown block for an event body
+
+    Lines that don't fit in max_length are left out and counted on the last
+    line.
+    '''
+    prefix, suffix = "%%% \n```\n", "\n```\n %%%"
+    budget = max_length - len(prefix) - len(suffix) - 32
+    kept = []
+    for line in lines:
+        # so that a line can't end the block
+        line = line.replace("```", "'''")
+        budget -= len(line) + 1
+        if budget < 0:
+            break
+        kept.append(line)
+    if len(kept) < len(lines):
+        kept.append("... %d more" % (len(lines) - len(kept)))
+    return prefix + "\n".join(kept) + suffix
+
+
+class BoundTags(object):
+    '''The tags for a context, built once by DatadogLogger.bind_context'''
+
+    __slots__ = ["context", "metric_tags", "event_tags"]
+
+    def __init__(self, context, metric_tags, event_tags):
+        self.context = context
+        self.metric_tags = metric_tags
+        self.event_tags = event_tags
+
+
 class DatadogLogger(rh_logger.api.Logger):
     '''Logger for datadog'''
 
     def __init__(self, name, config):
         self.name = name
+        self.event_limiter = make_event_limiter(
+            config, self.report_coalesced_events)
+        self.series_type = "gauge"
+        transport = config.get("transport", "http")
+        if transport == "dogstatsd":
+            self.series_type = config.get(
+                "dogstatsd-series-type", "distribution")
+            if self.series_type not in ("distribution", "histogram"):
+                raise ValueError(
+                    "Unknown dogstatsd-series-type, \"%s\". Use "
+                    "\"distribution\" or \"histogram\"." % self.series_type)
+            self.transport = dogstatsd_transport.DogStatsdTransport(
+                config.get("dogstatsd-host", dogstatsd_transport.DEFAULT_HOST),
+                config.get("dogstatsd-port", dogstatsd_transport.DEFAULT_PORT))
+            return
+        elif transport != "http":
+            raise ValueError(
+                "Unknown datadog transport, \"%s\". Use \"http\" or "
+                "\"dogstatsd\"." % transport)
         if "api-key" not in config:
             raise IndexError(
                 "The api-key is missing from the datadog configuration "
@@ -34,6 +136,37 @@ class DatadogLogger(rh_logger.api.Logger):
                  "example.")
         app_key = config[name]['app-key']
         datadog.initialize(api_key=api_key, app_key=app_key)
+        if config.get("asynchronous", True):
+            self.transport = DatadogTransport(
+                api_key, app_key,
+                api_host=config.get("api-host", DEFAULT_API_HOST),
+                flush_interval=config.get(
+                    "flush-interval", DEFAULT_FLUSH_INTERVAL),
+                flush_size=config.get("flush-size", DEFAULT_FLUSH_SIZE))
+        else:
+            self.transport = None
+
+    def create_event(self, title, text, alert_type, tags):
+        '''Send an event, through the transport if there is one'''
+        if self.transport is not None:
+            self.transport.send_event(title, text, alert_type, tags)
+        else:
+            datadog.api.Event.create(title=title,
+                                     text=text,
+                                     alert_type=alert_type,
+                                     tags=tags)
+
+    def send_metric(self, name, points, tags, metric_type="gauge"):
+        '''Send (timestamp, value) points, through the transport if any'''
+        if self.transport is not None:
+            self.transport.send_metric(name, points, self.name, tags,
+                                       metric_type)
+        else:
+            datadog.api.Metric.send(metric=name,
+                                    points=points,
+                                    type=metric_type,
+                                    host=self.name,
+                                    tags=tags)
 
     def start_process(self, name, msg, args=None):
         '''Report the start of a process
@@ -42,16 +175,14 @@ class DatadogLogger(rh_logger.api.Logger):
         '''
         if args is None:
             context = []
-        elif isinstance(args, basestring):
+        elif isinstance(args, string_types):
             context = [ args ]
-        elif isinstance(args, collections.Sequence):
+        elif isinstance(args, Sequence):
             context = args
         else:
             context = [ str(args) ]
-        datadog.api.Event.create(title="%s starting" % self.name,
-                                 text=msg,
-                                 alert_type="info",
-                                 tags=[self.name, "startup"] + context)
+        self.create_event("%s starting" % self.name, msg, "info",
+                          [self.name, "startup"] + list(context))
 
     def end_process(self, msg, exit_code):
         '''Report the end of a process
@@ -59,16 +190,23 @@ class DatadogLogger(rh_logger.api.Logger):
         :param msg: an informative message about why the process ended
         :param exit_code: one of the :py:class: `ExitCode` enumerations
         '''
+        if self.event_limiter is not None:
+            self.event_limiter.close()
+            self.report_coalesced_events(self.event_limiter.pop_due(True))
         if exit_code == rh_logger.ExitCode.success:
-            datadog.api.Event.create(title="%s exiting" % self.name,
-                                     text=msg,
-                                     alert_type="success",
-                                     tags=[self.name, "success"])
+            self.create_event("%s exiting" % self.name, msg, "success",
+                              [self.name, "success"])
         else:
-            datadog.api.Event.create(title="%s exiting with error" % self.name,
-                                     text=msg,
-                                     alert_type="error",
-                                     tags=[self.name, "error", exit_code.name])
+            self.create_event("%s exiting with error" % self.name, msg,
+                              "error", [self.name, "error", exit_code.name])
+        if self.transport is not None:
+            self.transport.close()
+
+    def flush(self):
+        '''Send the points and events the transport is holding'''
+        if self.transport is None:
+            return True
+        return self.transport.flush()
 
     def report_metric(self, name, metric, subcontext=None):
         '''Report a metric such as accuracy or execution time
@@ -78,30 +216,39 @@ class DatadogLogger(rh_logger.api.Logger):
         :param subcontext: an optional sequence of objects identifying a
         subcontext for the metric such as a tile of the MFOV being processed.
         '''
-        if isinstance(subcontext, collections.Sequence)\
-           and not isinstance(subcontext, basestring):
-            tags = [self.name] + subcontext
-        elif subcontext is not None:
-            tags = [self.name, subcontext]
-        else:
-            tags = [self.name]
-        datadog.api.Metric.send(metric=name,
-                                points=[metric],
-                                host=self.name,
-                                tags=tags)
-        
-    def report_metrics(self, name, time_series, context=None):
-        if isinstance(context, collections.Sequence)\
-           and not isinstance(context, basestring):
-            tags = [self.name] + context
+        self.send_metric(name, [(time.time(), metric)],
+                         self.get_metric_tags(subcontext))
+
+    def report_count(self, name, count, context=None, timestamp=None):
+        '''Report the number of times something happened as a count'''
+        self.send_metric(name, [(time.time() if timestamp is None
+                                 else timestamp, count)],
+                         self.get_metric_tags(context), metric_type="count")
+
+    def get_metric_tags(self, context):
+        if isinstance(context, Sequence)\
+           and not isinstance(context, string_types):
+            return [self.name] + list(context)
         elif context is not None:
-            tags = [self.name, context]
+            return [self.name, context]
+        return [self.name]
+
+    def report_metrics(self, name, time_series, context=None):
+        self.send_series(name, time_series, self.get_metric_tags(context))
+
+    def send_series(self, name, time_series, tags):
+        if isinstance(time_series, rh_logger.api.AggregateTimeSeries):
+            if len(time_series) == 0:
+                return
+            summary = time_series.summary()
+            for suffix, value in summary.metrics():
+                self.send_metric("%s.%s" % (name, suffix),
+                                 [(summary.end, value)], tags)
         else:
-            tags = [self.name]
-        datadog.api.Metric.send(metric=name,
-                                points=time_series.timestamps_and_metrics,
-                                host=self.name,
-                                tags=tags)
+            self.send_metric(name,
+                             list(zip(time_series.timestamps,
+                                      time_series.values)),
+                             tags, self.series_type)
 
     def report_event(self, event, context=None, log_level=None):
         '''Report an event
@@ -109,24 +256,102 @@ class DatadogLogger(rh_logger.api.Logger):
         :param event: the name of the event, for instance, "Frobbing complete"
         :param context: a subcontext such as "MFOV: 5, Tile: 3"
         '''
-        if isinstance(context, collections.Sequence)\
-           and not isinstance(context, basestring):
-            tags = [self.name] + context
-        else:
-            tags = [self.name, context]
+        if self.event_limiter is not None:
+            self.report_coalesced_events(self.event_limiter.pop_due())
+            if not self.event_limiter.allow(event, context, log_level):
+                return
+        self.create_event(event, event, self.get_alert_type(log_level),
+                          self.get_event_tags(context))
+
+    def report_events(self, events, context=None, log_level=None,
+                      title=None):
+        '''Send several events as one Datadog event
+
+        The events are the lines of a preformatted block in the body. The
+        title is the event's title, or the number of events if there is
+        none. The rate limit applies to the batch as a whole.
+        '''
+        events = list(events)
+        if title is None:
+            title = "%d events" % len(events)
+        if self.event_limiter is not None:
+            self.report_coalesced_events(self.event_limiter.pop_due())
+            if not self.event_limiter.allow(title, context, log_level):
+                return
+        self.create_event(title, format_event_lines(events),
+                          self.get_alert_type(log_level),
+                          self.get_event_tags(context))
+
+    def report_spans(self, spans):
+        '''Send a batch of spans as one event
+
+        Each span is a line of the event's body. The spans' durations are
+        also sent as span.<name> metrics.
+        '''
+        lines = []
+        for span in spans:
+            line = "%s: id = %d, parent = %d, start = %s, duration = %f" % (
+                span.name, span.span_id, span.parent_id,
+                time.strftime("%Y-%m-%d %H:%M:%S",
+                              time.localtime(span.start)),
+                span.duration)
+            if span.context is not None:
+                line += " (%s)" % (span.context, )
+            lines.append(line)
+        self.create_event("%d spans" % len(lines), format_event_lines(lines),
+                          "info", [self.name, "spans"])
+        rh_logger.api.Logger.report_spans(self, spans)
+
+    def bind_context(self, context):
+        return BoundTags(context, tuple(self.get_metric_tags(context)),
+                         self.get_event_tags(context))
+
+    def report_bound_metric(self, name, metric, bound):
+        self.send_metric(name, [(time.time(), metric)], bound.metric_tags)
+
+    def report_bound_metrics(self, name, time_series, bound):
+        self.send_series(name, time_series, bound.metric_tags)
+
+    def report_bound_event(self, event, bound, log_level=None):
+        if self.event_limiter is not None:
+            self.report_coalesced_events(self.event_limiter.pop_due())
+            if not self.event_limiter.allow(event, bound.context, log_level):
+                return
+        self.create_event(event, event, self.get_alert_type(log_level),
+                          bound.event_tags)
+
+    def get_event_tags(self, context):
+        if isinstance(context, Sequence)\
+           and not isinstance(context, string_types):
+            return [self.name] + list(context)
+        return [self.name, context]
+
+    def get_alert_type(self, log_level):
         if log_level is None or log_level in (logging.DEBUG, logging.INFO):
-            alert_type="info"
+            return "info"
         elif log_level == logging.WARNING:
-            alert_type="warning"
+            return "warning"
         elif log_level in (logging.ERROR, logging.CRITICAL):
-            alert_type="error"
-        else:
-            alert_type="info"
-            
-        datadog.api.Event.create(title=event,
-                                 text=event,
-                                 alert_type=alert_type,
-                                 tags=tags)
+            return "error"
+        return "info"
+
+    def report_coalesced_events(self, coalesced_events):
+        '''Send one event for each summary of rate-limited repeats
+
+        :param coalesced_events: a sequence of
+        :py:class: `rh_logger.ratelimit.CoalescedEvent`
+        '''
+        for coalesced in coalesced_events:
+            text = "%d more occurrences from %s to %s" % (
+                coalesced.count,
+                time.strftime("%Y-%m-%d %H:%M:%S",
+                              time.localtime(coalesced.first)),
+                time.strftime("%Y-%m-%d %H:%M:%S",
+                              time.localtime(coalesced.last)))
+            self.create_event(
+                coalesced.event, text,
+                self.get_alert_type(coalesced.log_level),
+                self.get_event_tags(coalesced.context) + ["coalesced"])
 
     def report_exception(self, exception=None, msg=None):
         '''Report an exception
@@ -139,25 +364,16 @@ class DatadogLogger(rh_logger.api.Logger):
             exc_type, exception, tb = sys.exc_info()
         else:
             exc_type = type(exception)
-            tb = None
+            tb = getattr(exception, "__traceback__", None)
         if msg is None:
             msg = str(exception)
-        tags = [self.name, "exception", exc_type.__name__]
+        tags = [self.name, "exception", exc_type.__name__,
+                "fingerprint:" + fingerprint(exc_type, tb, exception)]
         if tb is not None:
-            # TODO: add stack breadcrumbs to the tags
-            #       Consider using Sentry for logging exceptions
+            # TODO: Consider using Sentry for logging exceptions
             msg += "\n" + "".join(traceback.format_exception(
                 exc_type, exception, tb))
-        datadog.api.Event.create(title="Exception report",
-                                 text=msg,
-                                 alert_type="error",
-                                 tags=tags)
-        datadog.api.Metric.send(metric="exception",
-                                points=[(datetime.datetime.now(),
-                                         1)],
-                                type="counter",
-                                host=self.name,
-                                tags=tags)
+        self.create_event("Exception report", msg, "error", tags)
 
 
 def get_logger(name, config):
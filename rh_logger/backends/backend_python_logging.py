@@ -1,22 +1,90 @@
 '''backend_python_logging.py - logging backend using Python logging
 
 Note: this is intended only for informal debugging.
+
+When there is more than one MPI rank, numeric metrics from all ranks are
+combined and rank 0 logs the count, total, minimum, maximum, mean and
+standard deviation of each, along with the ranks whose mean is an outlier.
+A metric reported with a context is combined separately for each context,
+as "<name> (<context>)". This happens at end_process and, optionally,
+periodically:
+
+rh-logger:
+    default:
+        # seconds between combining metrics across ranks (default: only
+        # at end_process)
+        mpi-reduce-interval: 60
+        # report ranks whose mean is this many standard deviations from
+        # the mean of all ranks
+        mpi-outlier-sigma: 3
+
+Messages are formatted lazily, so nothing is formatted for a level that is
+filtered out. Set "asynchronous" to have the root logger's handlers write
+from a background thread (see rh_logger.queue_logging). This keeps slow
+handlers, such as log files on network storage, from stalling the process.
+end_process writes everything that is queued:
+
+rh-logger:
+    default:
+        asynchronous: true
+        # the maximum number of records waiting to be written. More are
+        # dropped.
+        queue-size: 100000
+
+Repeated events can be rate limited and coalesced into summaries, as
+described in rh_logger.ratelimit:
+
+rh-logger:
+    default:
+        event-rate-limit:
+            rate: 1
+            burst: 10
+            window: 60
 '''
 
 import logging
 import logging.config
+import numbers
 import rh_logger
 import rh_logger.api
 import sys
+import time
+
+from rh_logger.mpi import MetricReducer, DEFAULT_OUTLIER_SIGMA, \
+     get_comm, get_rank_and_size
+from rh_logger.fingerprint import fingerprint, get_exception_info
+from rh_logger.queue_logging import BackgroundLogWriter, DEFAULT_QUEUE_SIZE
+from rh_logger.ratelimit import make_event_limiter
+
+
+def format_time(timestamp):
+    return time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(timestamp))
+
+
+def reduced_name(name, context):
+    '''The name a metric is combined across ranks under'''
+    if context is None:
+        return name
+    return "%s (%s)" % (name, context)
+
 
-from mpi4py import MPI
-comm = MPI.COMM_WORLD
-rank = comm.Get_rank()
-numranks = comm.Get_size()
+class BoundContext(object):
+    '''A context and its text, formatted once by BLPLogger.bind_context'''
+
+    __slots__ = ["context", "str", "repr"]
+
+    def __init__(self, context):
+        self.context = context
+        self.str = str(context)
+        self.repr = repr(context)
 
 
 class BLPLogger(rh_logger.api.Logger):
 
+    '''False for subclasses that send metrics somewhere else rather than
+    combining them across ranks'''
+    reduces_metrics = True
+
     def __init__(self, name, config):
         if "version" not in config or config["version"] != 1:
             # If no config supplied, use basic config
@@ -24,9 +92,36 @@ class BLPLogger(rh_logger.api.Logger):
             logging.root.setLevel(logging.INFO)
         else:
             logging.config.dictConfig(config)
+        self.rank, self.numranks = get_rank_and_size()
         self.logger = None
-        if rank==0:
+        if self.rank==0:
             self.logger = logging.getLogger(name)
+        self.reducing = self.reduces_metrics and self.numranks > 1
+        self.reduce_interval = config.get("mpi-reduce-interval")
+        self.outlier_sigma = config.get(
+            "mpi-outlier-sigma", DEFAULT_OUTLIER_SIGMA)
+        self.reducer = None
+        if self.reducing and self.reduce_interval is not None:
+            #
+            # Periodic reduction has to start on every rank at once
+            #
+            self.get_reducer()
+        self.event_limiter = make_event_limiter(
+            config, self.report_coalesced_events)
+        if config.get("asynchronous", False):
+            self.writer = BackgroundLogWriter(
+                queue_size=config.get("queue-size", DEFAULT_QUEUE_SIZE))
+        else:
+            self.writer = None
+
+    def get_reducer(self):
+        '''The MetricReducer, made on first use, or None if not reducing'''
+        if self.reducing and self.reducer is None:
+            self.reducer = MetricReducer(
+                get_comm(), self.report_reduced_metrics,
+                interval=self.reduce_interval,
+                outlier_sigma=self.outlier_sigma)
+        return self.reducer
 
     def start_process(self, name, msg, args=None):
         '''Report the start of a process
@@ -34,10 +129,10 @@ class BLPLogger(rh_logger.api.Logger):
         :param msg: an introductory message for the process
         '''
         if args is not None:
-            if self.logger: self.logger.info("Starting process: %s (%s)" %
-                             (msg, repr(args)))
+            if self.logger: self.logger.info("Starting process: %s (%r)",
+                                             msg, args)
         else:
-            if self.logger: self.logger.info("Starting process: %s")
+            if self.logger: self.logger.info("Starting process: %s", msg)
 
     def end_process(self, msg, exit_code):
         '''Report the end of a process
@@ -45,8 +140,24 @@ class BLPLogger(rh_logger.api.Logger):
         :param msg: an informative message about why the process ended
         :param exit_code: one of the :py:class: `ExitCode` enumerations
         '''
-        if self.logger: self.logger.info("Ending process: %s, exit code = %s" %
-                         (msg, exit_code.name))
+        if self.reducing:
+            #
+            # This is collective, so ranks that reported no metrics
+            # take part too.
+            #
+            self.get_reducer().close()
+            self.reducer = None
+            self.reducing = False
+        if self.event_limiter is not None:
+            self.event_limiter.close()
+            if self.logger:
+                self.report_coalesced_events(
+                    self.event_limiter.pop_due(True))
+        if self.logger: self.logger.info("Ending process: %s, exit code = %s",
+                                         msg, exit_code.name)
+        if self.writer is not None:
+            self.writer.stop()
+            self.writer = None
 
     def report_metric(self, name, metric, subcontext=None):
         '''Report a metric such as accuracy or execution time
@@ -56,25 +167,92 @@ class BLPLogger(rh_logger.api.Logger):
         :param subcontext: an optional sequence of objects identifying a
         subcontext for the metric such as a tile of the MFOV being processed.
         '''
+        if self.reducing and isinstance(metric, numbers.Real):
+            self.get_reducer().add(reduced_name(name, subcontext), metric)
+            return
         if subcontext is None:
-            if self.logger: self.logger.info("Metric %s=%s" %
-                             (name, str(metric)))
+            if self.logger: self.logger.info("Metric %s=%s", name, metric)
         else:
-            if self.logger: self.logger.info("Metric %s=%s (%s)" %
-                             (name, str(metric), subcontext))
+            if self.logger: self.logger.info("Metric %s=%s (%s)",
+                                             name, metric, subcontext)
+
+    def bind_context(self, context):
+        return None if context is None else BoundContext(context)
+
+    def report_bound_metric(self, name, metric, bound):
+        self.report_metric(name, metric, None if bound is None else bound.str)
+
+    def report_bound_metrics(self, name, time_series, bound):
+        self.report_metrics(name, time_series,
+                            None if bound is None else bound.str)
 
     def report_metrics(self, name, time_series, context=None):
-        times = [_[0] for _ in time_series.timestamps_and_metrics]
-        metrics = [_[1] for _ in time_series.timestamps_and_metrics]
-        delta = times[-1] - times[0]
-        total = sum(metrics)
-        avg = float(total) / len(metrics)
-        msg = "Metric %s: Running time = %0.4f, avg = %f, total = %f" % (
-            name, delta, avg, total)
-        if context is None:
-            if self.logger: self.logger.info(msg)
+        if self.reducing:
+            reducer = self.get_reducer()
+            name = reduced_name(name, context)
+            if isinstance(time_series, rh_logger.api.AggregateTimeSeries):
+                reducer.merge(name, time_series.stats)
+            else:
+                reducer.add_many(name, time_series.values)
+            return
+        if self.logger is None or not self.logger.isEnabledFor(logging.INFO):
+            return
+        if isinstance(time_series, rh_logger.api.AggregateTimeSeries):
+            if len(time_series) == 0:
+                return
+            summary = time_series.summary()
+            msg = ("Metric %s: Running time = %0.4f, count = %d, avg = %f, "
+                   "total = %f, min = %f, max = %f, std = %f, p50 = %f, "
+                   "p95 = %f, p99 = %f")
+            args = (name, summary.end - summary.start, summary.count,
+                    summary.mean, summary.total, summary.min, summary.max,
+                    summary.std, summary.p50, summary.p95, summary.p99)
         else:
-            if self.logger: self.logger.info(msg + " (%s)" % str(context))
+            times = time_series.timestamps
+            delta = times[-1] - times[0]
+            total = sum(time_series.values)
+            avg = total / len(time_series.values)
+            msg = "Metric %s: Running time = %0.4f, avg = %f, total = %f"
+            args = (name, delta, avg, total)
+        if context is not None:
+            msg += " (%s)"
+            args += (context, )
+        self.logger.info(msg, *args)
+
+    def report_spans(self, spans):
+        '''Log a line for each span'''
+        if self.logger is None or not self.logger.isEnabledFor(logging.INFO):
+            return
+        for span in spans:
+            msg = ("Span %s: id = %d, parent = %d, start = %s, "
+                   "duration = %f, thread = %d")
+            args = (span.name, span.span_id, span.parent_id,
+                    format_time(span.start), span.duration, span.thread)
+            if span.context is not None:
+                msg += " (%s)"
+                args += (span.context, )
+            self.logger.info(msg, *args)
+
+    def report_reduced_metrics(self, merged, outliers):
+        '''Log the metrics combined across ranks on rank 0
+
+        :param merged: a dictionary of metric name to RunningStats
+        :param outliers: a dictionary of metric name to a list of
+        (rank, mean) for the ranks whose mean is an outlier
+        '''
+        if self.logger is None:
+            return
+        for name in sorted(merged):
+            stats = merged[name]
+            self.logger.info(
+                "Metric %s (%d ranks): count = %d, total = %f, min = %f, "
+                "max = %f, avg = %f, std = %f",
+                name, self.numranks, stats.count, stats.total, stats.min,
+                stats.max, stats.mean, stats.variance ** .5)
+            for outlier_rank, mean in outliers.get(name, []):
+                self.logger.warning(
+                    "Metric %s: rank %d is an outlier, avg = %f",
+                    name, outlier_rank, mean)
 
     def report_event(self, event, context=None, log_level=None):
         '''Report an event
@@ -82,31 +260,79 @@ class BLPLogger(rh_logger.api.Logger):
         :param event: the name of the event, for instance, "Frobbing complete"
         :param context: a subcontext such as "MFOV: 5, Tile: 3"
         '''
+        if context is None:
+            self.log_event(event, None, log_level, "%s", event)
+        else:
+            self.log_event(event, context, log_level, "%s (%r)",
+                           event, context)
+
+    def report_bound_event(self, event, bound, log_level=None):
+        if bound is None:
+            self.log_event(event, None, log_level, "%s", event)
+        else:
+            self.log_event(event, bound.context, log_level, "%s (%s)",
+                           event, bound.repr)
+
+    def report_events(self, events, context=None, log_level=None,
+                      title=None):
+        '''Log several events as one multi-line record
+
+        The first line is the title, or the number of events, and the
+        context. Each event follows on its own indented line. The rate
+        limit applies to the record as a whole.
+        '''
+        if self.logger is None:
+            return
+        events = list(events)
+        if title is None:
+            title = "%d events" % len(events)
+        body = "".join(["\n    %s" % _ for _ in events])
+        if context is None:
+            self.log_event(title, None, log_level, "%s%s", title, body)
+        else:
+            self.log_event(title, context, log_level, "%s (%r)%s",
+                           title, context, body)
+
+    def log_event(self, event, context, log_level, fmt, *args):
+        '''Log an event as fmt % args, if the rate limit allows it'''
         if self.logger is None:
             return
-        log_from_all_ranks = False
+        log_fn, log_from_all_ranks = self.get_log_fn(log_level)
+        if log_from_all_ranks or self.rank==0:
+          if self.event_limiter is not None:
+              self.report_coalesced_events(self.event_limiter.pop_due())
+              if not self.event_limiter.allow(event, context, log_level):
+                  return
+          log_fn(fmt, *args)
+
+    def get_log_fn(self, log_level):
+        '''Return the logging function for a level and whether every rank
+        should log at that level'''
         if log_level is None:
-            log_fn = self.logger.info
+            return self.logger.info, False
         elif log_level <= logging.DEBUG:
-            log_fn = self.logger.debug
+            return self.logger.debug, False
         elif log_level <= logging.INFO:
-            log_fn = self.logger.info
+            return self.logger.info, False
         elif log_level <= logging.WARNING:
-            log_fn = self.logger.warning
+            return self.logger.warning, False
         elif log_level <= logging.ERROR:
-            log_fn = self.logger.error
-            log_from_all_ranks = True
-        elif log_level <= logging.CRITICAL:
-            log_fn = self.logger.critical
-            log_from_all_ranks = True
-        else:
-            log_fn = self.logger.critical
-            log_from_all_ranks = True
-        if log_from_all_ranks or rank==0:
-          if context is None:
-              log_fn(event)
-          else:
-              log_fn("%s (%s)" % (event, repr(context)))
+            return self.logger.error, True
+        return self.logger.critical, True
+
+    def report_coalesced_events(self, coalesced_events):
+        '''Log summaries of events suppressed by the rate limit
+
+        :param coalesced_events: a sequence of
+        :py:class: `rh_logger.ratelimit.CoalescedEvent`
+        '''
+        for coalesced in coalesced_events:
+            log_fn = self.get_log_fn(coalesced.log_level)[0]
+            log_fn("%s (%d more occurrences from %s to %s)%s",
+                   coalesced.event, coalesced.count,
+                   format_time(coalesced.first), format_time(coalesced.last),
+                   "" if coalesced.context is None
+                   else " (%r)" % (coalesced.context, ))
 
     def report_exception(self, exception=None, msg=None):
         '''Report an exception
@@ -115,14 +341,22 @@ class BLPLogger(rh_logger.api.Logger):
         is the one reported by sys.exc_info()
         :param msg: an informative message
         '''
+        exc_type, value, tb = get_exception_info(exception)
         if exception is None:
             if msg is None:
-                msg = str(sys.exc_value)
-            if self.logger: self.logger.exception(msg, exc_info=1)
+                msg = str(value)
+            if self.logger:
+                self.logger.exception("%s (fingerprint %s)", msg,
+                                      fingerprint(exc_type, tb, value),
+                                      exc_info=1)
         else:
             if msg is None:
                 msg = str(exception)
-            if self.logger: self.logger.error(msg)
+            if self.logger:
+                self.logger.error("%s (fingerprint %s)", msg,
+                                  fingerprint(exc_type, tb, value),
+                                  exc_info=None if tb is None
+                                  else (exc_type, value, tb))
 
 
 def get_logger(name, config):
@@ -0,0 +1,75 @@
+'''backend_spool_logging.py - logging backend that spools to local files
+
+Every call is appended to memory-mapped segment files on local disk (see
+rh_logger.spool), which costs a few microseconds and never touches the
+network. Run rh-logger-ship to replay the spool into another backend, while
+the process runs or afterwards.
+
+Configuration:
+
+rh-logger:
+    logging-backend: spool
+    spool:
+        # the directory for the segment files, relative to the working
+        # directory unless it is an absolute path
+        directory: rh_logger_spool
+        # the size of each segment file in bytes
+        segment-size: 67108864
+'''
+
+import os
+import re
+import socket
+import sys
+import traceback
+
+import rh_logger.api
+from rh_logger.spool import SpoolWriter, DEFAULT_SEGMENT_SIZE
+
+DEFAULT_DIRECTORY = "rh_logger_spool"
+
+
+class SpoolLogger(rh_logger.api.Logger):
+    '''Append logging calls to a local spool'''
+
+    def __init__(self, name, config):
+        prefix = "%s-%s-%d" % (
+            re.sub(r"[^\w.]", "_", name), socket.gethostname(), os.getpid())
+        self.writer = SpoolWriter(
+            config.get("directory", DEFAULT_DIRECTORY), prefix,
+            segment_size=config.get("segment-size", DEFAULT_SEGMENT_SIZE))
+
+    def start_process(self, name, msg, args=None):
+        self.writer.write_start(name, msg, args)
+
+    def end_process(self, msg, exit_code):
+        self.writer.write_end(msg, exit_code.value)
+        self.writer.close()
+
+    def flush(self):
+        self.writer.flush()
+        return True
+
+    def report_metric(self, name, metric, subcontext=None):
+        self.writer.write_metric(name, metric, subcontext)
+
+    def report_metrics(self, name, time_series, context=None):
+        self.writer.write_metrics(name, time_series, context)
+
+    def report_event(self, event, context=None, log_level=None):
+        self.writer.write_event(event, context, log_level)
+
+    def report_events(self, events, context=None, log_level=None,
+                      title=None):
+        self.writer.write_events(events, context, log_level, title)
+
+    def report_exception(self, exception=None, msg=None):
+        if exception is None:
+            text = "".join(traceback.format_exception(*sys.exc_info()))
+        else:
+            text = "%s: %s" % (type(exception).__name__, exception)
+        self.writer.write_exception(text, msg)
+
+
+def get_logger(name, config):
+    return SpoolLogger(name, config)
@@ -0,0 +1,542 @@
+'''carbon_transport.py - sending to Carbon from a background thread
+
+CarbonSender keeps a bounded buffer of messages for one Carbon destination.
+A sender thread takes everything in the buffer, joins it in one pass and
+sends it. If the connection fails, the thread reconnects with exponential
+backoff while the buffer keeps accepting messages up to its limit. When the
+buffer is full, the overflow policy decides what happens:
+
+* "block": the caller waits until there is room
+* "drop-oldest": the oldest buffered message is discarded
+* "drop-newest": the new message is discarded
+
+Dropped messages and reconnections are counted and sent to Carbon as the
+metrics <prefix>.carbon.dropped and <prefix>.carbon.reconnects.
+
+A message is a (name, value, timestamp) tuple, a (name, values, timestamps)
+tuple of two double arrays for a whole time series, or a line of
+plaintext. Messages are formatted by the sender thread, so the caller only
+pays for building the tuple. The sender speaks either Carbon's plaintext
+protocol (port 2003) or its pickle protocol (port 2004), which sends
+batches of points as length-prefixed pickles.
+
+ShardedCarbonSender spreads metrics over several destinations, such as a
+pool of carbon-relays, with one CarbonSender, and so one connection, for
+each. Each metric name is placed on the same consistent-hash ring that
+carbon-relay uses, so a name always goes to the same destination, the one
+carbon-relay would pick. While a destination's sender can't connect, new
+messages for it go to the next destination on the ring. Messages already
+in its buffer wait for it to come back, subject to the overflow policy.
+'''
+
+import array
+import bisect
+import collections
+import hashlib
+import logging
+import re
+import pickle
+import socket
+import struct
+import threading
+import time
+
+BLOCK = "block"
+DROP_OLDEST = "drop-oldest"
+DROP_NEWEST = "drop-newest"
+OVERFLOW_POLICIES = (BLOCK, DROP_OLDEST, DROP_NEWEST)
+
+PLAINTEXT = "plaintext"
+PICKLE = "pickle"
+PROTOCOLS = (PLAINTEXT, PICKLE)
+DEFAULT_PORTS = {PLAINTEXT: 2003, PICKLE: 2004}
+
+DEFAULT_MAX_QUEUE = 100000
+DEFAULT_RECONNECT_MIN = 0.1
+DEFAULT_RECONNECT_MAX = 60.0
+
+'''The number of positions of each destination on the hash ring'''
+DEFAULT_REPLICA_COUNT = 100
+
+'''The number of points in each pickle, as in carbon-relay'''
+PICKLE_BATCH_SIZE = 500
+
+try:
+    string_types = basestring
+except NameError:
+    string_types = str
+
+log = logging.getLogger("rh_logger.carbon")
+
+
+def _points(message):
+    '''The (name, value, timestamp) points in a message'''
+    if isinstance(message, string_types):
+        name, value, timestamp = message.split()
+        return [(name, float(value), float(timestamp))]
+    name, value, timestamp = message
+    if isinstance(value, array.array):
+        return [(name, v, t) for v, t in zip(value, timestamp)]
+    return [(name, float(value), float(timestamp))]
+
+
+def _format_plaintext(message):
+    '''A message as lines of Carbon's plaintext protocol'''
+    if isinstance(message, string_types):
+        return message
+    name, value, timestamp = message
+    if isinstance(value, array.array):
+        return "".join(["%s %f %f\n" % (name, v, t)
+                        for v, t in zip(value, timestamp)])
+    return "%s %f %f\n" % message
+
+
+def _checked(fn, messages):
+    '''Apply fn to each message, dropping and logging any it can't handle'''
+    try:
+        return [fn(message) for message in messages]
+    except (TypeError, ValueError):
+        result = []
+        for message in messages:
+            try:
+                result.append(fn(message))
+            except (TypeError, ValueError):
+                log.warning("Can't send %r to Carbon" % (message, ))
+        return result
+
+
+def serialize_plaintext(messages):
+    '''Serialize messages using Carbon's plaintext protocol'''
+    data = "".join(_checked(_format_plaintext, messages))
+    if not isinstance(data, bytes):
+        data = data.encode("utf-8")
+    return data
+
+
+def serialize_pickle(messages):
+    '''Serialize messages using Carbon's pickle protocol'''
+    points = [(name, (timestamp, value))
+              for message_points in _checked(_points, messages)
+              for name, value, timestamp in message_points]
+    chunks = []
+    for start in range(0, len(points), PICKLE_BATCH_SIZE):
+        payload = pickle.dumps(points[start:start + PICKLE_BATCH_SIZE], 2)
+        chunks.append(struct.pack("!L", len(payload)))
+        chunks.append(payload)
+    return b"".join(chunks)
+
+SERIALIZERS = {PLAINTEXT: serialize_plaintext, PICKLE: serialize_pickle}
+
+
+def parse_destination(destination, default_port=DEFAULT_PORTS[PLAINTEXT]):
+    '''Parse a destination as written in carbon-relay's DESTINATIONS
+
+    :param destination: "host", "host:port" or "host:port:instance", or a
+    dictionary with "host" and optionally "port" and "instance"
+    :param default_port: the port if none is given
+    :returns: a (host, port, instance) tuple. instance is None if not given.
+    '''
+    if isinstance(destination, dict):
+        return (destination["host"],
+                int(destination.get("port", default_port)),
+                destination.get("instance"))
+    parts = str(destination).split(":")
+    if len(parts) > 3:
+        raise ValueError("Can't parse Carbon destination, \"%s\". Use "
+                         "host:port:instance." % destination)
+    port = int(parts[1]) if len(parts) > 1 and parts[1] else default_port
+    instance = parts[2] if len(parts) > 2 and parts[2] else None
+    return parts[0], port, instance
+
+
+class ConsistentHashRing(object):
+    '''The consistent-hash ring of carbon-relay
+
+    A node is a (server, instance) tuple. Each node is placed on the ring
+    at replica_count positions, the first four hex digits of the MD5 of
+    "<str(node)>:<i>". A key belongs to the first node at or after the
+    position of its own hash. This matches carbon's carbon_ch hashing, so
+    metrics go to the same destinations as through carbon-relay.
+    '''
+
+    def __init__(self, nodes=(), replica_count=DEFAULT_REPLICA_COUNT):
+        self.ring = []
+        self.nodes = set()
+        self.replica_count = replica_count
+        for node in nodes:
+            self.add_node(node)
+
+    @staticmethod
+    def compute_ring_position(key):
+        return int(hashlib.md5(key.encode("utf-8")).hexdigest()[:4], 16)
+
+    def add_node(self, node):
+        self.nodes.add(node)
+        positions = set([_[0] for _ in self.ring])
+        for i in range(self.replica_count):
+            position = self.compute_ring_position("%s:%d" % (str(node), i))
+            while position in positions:
+                position += 1
+            positions.add(position)
+            bisect.insort(self.ring, (position, node))
+
+    def remove_node(self, node):
+        self.nodes.discard(node)
+        self.ring = [_ for _ in self.ring if _[1] != node]
+
+    def get_node(self, key):
+        '''The node that a key belongs to'''
+        position = self.compute_ring_position(key)
+        index = bisect.bisect_left(self.ring, (position, ())) % len(self.ring)
+        return self.ring[index][1]
+
+    def get_nodes(self, key):
+        '''Every node, in the order of preference for a key'''
+        if len(self.nodes) <= 1:
+            return list(self.nodes)
+        position = self.compute_ring_position(key)
+        index = bisect.bisect_left(self.ring, (position, ())) % len(self.ring)
+        nodes = []
+        for i in range(len(self.ring)):
+            node = self.ring[(index + i) % len(self.ring)][1]
+            if node not in nodes:
+                nodes.append(node)
+                if len(nodes) == len(self.nodes):
+                    break
+        return nodes
+
+
+class CarbonSender(object):
+    '''A bounded buffer and a sender thread for one Carbon destination'''
+
+    def __init__(self, host, port, prefix=None, protocol=PLAINTEXT,
+                 max_queue=DEFAULT_MAX_QUEUE, overflow=DROP_OLDEST,
+                 reconnect_min=DEFAULT_RECONNECT_MIN,
+                 reconnect_max=DEFAULT_RECONNECT_MAX,
+                 timeout=30.0, close_timeout=10.0, counter_prefix=None):
+        '''Initialize the sender and start its thread
+
+        :param host: the Carbon host
+        :param port: the Carbon port
+        :param prefix: the prefix for the sender's own metrics or None
+        to not report them
+        :param protocol: PLAINTEXT or PICKLE
+        :param max_queue: the maximum number of messages to buffer
+        :param overflow: the overflow policy, one of OVERFLOW_POLICIES
+        :param reconnect_min: seconds to wait before the first reconnection
+        attempt
+        :param reconnect_max: the maximum number of seconds between
+        reconnection attempts
+        :param timeout: the socket timeout in seconds
+        :param close_timeout: how long close() keeps trying to send what is
+        left in the buffer
+        :param counter_prefix: the prefix of the names of the sender's own
+        metrics. Default is "<prefix>.carbon".
+        '''
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError(
+                "Unknown carbon overflow policy, \"%s\". Use one of %s." %
+                (overflow, ", ".join(OVERFLOW_POLICIES)))
+        if protocol not in PROTOCOLS:
+            raise ValueError(
+                "Unknown carbon protocol, \"%s\". Use one of %s." %
+                (protocol, ", ".join(PROTOCOLS)))
+        self.address = (host, port)
+        self.protocol = protocol
+        self.serializer = SERIALIZERS[protocol]
+        self.prefix = prefix
+        if counter_prefix is None and prefix is not None:
+            counter_prefix = prefix + ".carbon"
+        self.counter_prefix = counter_prefix
+        self.max_queue = max_queue
+        self.overflow = overflow
+        self.reconnect_min = reconnect_min
+        self.reconnect_max = reconnect_max
+        self.timeout = timeout
+        self.close_timeout = close_timeout
+        self.buffer = collections.deque()
+        self.n_sending = 0
+        self.condition = threading.Condition()
+        self.closing = False
+        self.stopping = threading.Event()
+        self.socket = None
+        self.failed = False
+        self.n_dropped = 0
+        self.n_reconnects = 0
+        self.n_bytes_sent = 0
+        self.reported = (0, 0)
+        self.thread = threading.Thread(
+            target=self.run,
+            name="CarbonSenderThread-%s:%d" % self.address)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def put(self, msg):
+        '''Add a message to the buffer, applying the overflow policy'''
+        with self.condition:
+            if len(self.buffer) >= self.max_queue:
+                if self.overflow == DROP_NEWEST:
+                    self.n_dropped += 1
+                    return
+                elif self.overflow == DROP_OLDEST:
+                    self.buffer.popleft()
+                    self.n_dropped += 1
+                else:
+                    while len(self.buffer) >= self.max_queue and \
+                          not self.closing:
+                        self.condition.wait()
+            self.buffer.append(msg)
+            if len(self.buffer) == 1:
+                # The sender thread only waits when the buffer is empty
+                self.condition.notify_all()
+
+    def take(self):
+        '''Wait for messages and take all of them from the buffer
+
+        :returns: the messages or None if the sender is closing and the
+        buffer is empty
+        '''
+        with self.condition:
+            while len(self.buffer) == 0 and not self.closing:
+                self.condition.wait()
+            if len(self.buffer) == 0:
+                return None
+            messages = list(self.buffer)
+            self.buffer.clear()
+            self.n_sending = len(messages)
+            self.condition.notify_all()
+        return messages
+
+    def sent(self):
+        '''Note that the messages from take() are sent or dropped'''
+        with self.condition:
+            self.n_sending = 0
+            self.condition.notify_all()
+
+    def flush(self, timeout=None):
+        '''Wait until the messages put so far are sent
+
+        :param timeout: the most seconds to wait. Default is close_timeout.
+        :returns: True if they were sent, False if some were dropped or
+        are still waiting
+        '''
+        if timeout is None:
+            timeout = self.close_timeout
+        deadline = time.time() + timeout
+        with self.condition:
+            n_dropped = self.n_dropped
+            while len(self.buffer) > 0 or self.n_sending > 0:
+                remaining = deadline - time.time()
+                if remaining <= 0 or not self.thread.is_alive():
+                    return False
+                self.condition.wait(remaining)
+            return self.n_dropped == n_dropped
+
+    def serialize(self, messages):
+        '''Turn a list of messages into the bytes to send'''
+        return self.serializer(messages + self.counter_messages())
+
+    def counter_messages(self):
+        '''Messages reporting the sender's counters, if they changed'''
+        counters = (self.n_dropped, self.n_reconnects)
+        if self.counter_prefix is None or counters == self.reported:
+            return []
+        self.reported = counters
+        now = time.time()
+        return [(self.counter_prefix + ".dropped", counters[0], now),
+                (self.counter_prefix + ".reconnects", counters[1], now)]
+
+    def connect(self, deadline=None):
+        '''Connect, retrying with exponential backoff
+
+        :param deadline: give up at this time.time() if not None
+        :returns: True if connected
+        '''
+        delay = self.reconnect_min
+        while self.socket is None:
+            try:
+                self.socket = socket.create_connection(
+                    self.address, self.timeout)
+                self.failed = False
+            except (socket.error, IOError, OSError):
+                self.failed = True
+                if deadline is not None:
+                    if time.time() + delay > deadline:
+                        return False
+                    time.sleep(delay)
+                elif self.stopping.wait(delay):
+                    return False
+                delay = min(delay * 2, self.reconnect_max)
+        return True
+
+    def disconnect(self):
+        if self.socket is not None:
+            try:
+                self.socket.close()
+            except (socket.error, IOError, OSError):
+                pass
+            self.socket = None
+
+    def send(self, data, deadline=None):
+        '''Send data, reconnecting as needed
+
+        :returns: True if the data was sent
+        '''
+        while True:
+            if self.socket is None and not self.connect(deadline):
+                if deadline is None and self.closing:
+                    deadline = time.time() + self.close_timeout
+                    continue
+                return False
+            try:
+                self.socket.sendall(data)
+                self.n_bytes_sent += len(data)
+                return True
+            except (socket.error, IOError, OSError):
+                log.warning("Lost connection to Carbon at %s:%d" %
+                            self.address)
+                self.failed = True
+                self.disconnect()
+                self.n_reconnects += 1
+
+    def run(self):
+        '''Thread for sending the buffer'''
+        deadline = None
+        while True:
+            if self.socket is None and not self.connect():
+                # Closing while disconnected: try until close_timeout
+                deadline = time.time() + self.close_timeout
+            messages = self.take()
+            if messages is None:
+                break
+            if deadline is None and self.closing:
+                deadline = time.time() + self.close_timeout
+            try:
+                data = self.serialize(messages)
+            except Exception:
+                log.exception("Failed to serialize metrics for Carbon")
+                with self.condition:
+                    self.n_dropped += len(messages)
+                self.sent()
+                continue
+            if not self.send(data, deadline):
+                with self.condition:
+                    self.n_dropped += len(messages) + len(self.buffer)
+                    self.buffer.clear()
+                self.sent()
+                log.warning("Gave up sending to Carbon at %s:%d: "
+                            "%d messages dropped" %
+                            (self.address + (self.n_dropped, )))
+                break
+            self.sent()
+        self.disconnect()
+
+    def close(self):
+        '''Send what is left in the buffer and stop the thread'''
+        self.request_close()
+        self.thread.join()
+
+    def request_close(self):
+        '''Tell the thread to send what is left and stop, without waiting'''
+        with self.condition:
+            self.closing = True
+            self.condition.notify_all()
+        self.stopping.set()
+
+
+class ShardedCarbonSender(object):
+    '''Route messages to several Carbon destinations by metric name'''
+
+    def __init__(self, destinations, prefix=None,
+                 replica_count=DEFAULT_REPLICA_COUNT, **kwargs):
+        '''Start a sender for each destination
+
+        :param destinations: a sequence of (host, port, instance) tuples.
+        As in carbon-relay, destinations on the same host need different
+        instances.
+        :param prefix: the prefix for the senders' own metrics or None to
+        not report them. Each sender's are named
+        "<prefix>.carbon.<host>_<port>_<instance>".
+        :param replica_count: the number of positions of each destination
+        on the hash ring
+        :param kwargs: the other arguments of :py:class: `CarbonSender`
+        '''
+        self.ring = ConsistentHashRing(replica_count=replica_count)
+        self.senders = collections.OrderedDict()
+        self.routes = {}
+        try:
+            for host, port, instance in destinations:
+                node = (host, instance)
+                if node in self.senders:
+                    raise ValueError(
+                        "The Carbon destination (%s, %s) is configured "
+                        "twice. Give destinations on the same host "
+                        "different instances." % node)
+                counter_prefix = None
+                if prefix is not None:
+                    counter_prefix = "%s.carbon.%s" % (prefix, re.sub(
+                        r"[^\w-]", "_", "%s_%d_%s" % (host, port, instance)))
+                self.senders[node] = CarbonSender(
+                    host, port, prefix=prefix, counter_prefix=counter_prefix,
+                    **kwargs)
+                self.ring.add_node(node)
+        except Exception:
+            self.close()
+            raise
+        if len(self.senders) == 0:
+            raise ValueError("There are no Carbon destinations")
+
+    def get_senders(self, name):
+        '''The senders for a metric name, in order of preference'''
+        senders = self.routes.get(name)
+        if senders is None:
+            senders = self.routes[name] = [
+                self.senders[node] for node in self.ring.get_nodes(name)]
+        return senders
+
+    def put(self, msg):
+        '''Add a message to the buffer of the first sender that is up'''
+        if isinstance(msg, string_types):
+            name = msg.split(" ", 1)[0]
+        else:
+            name = msg[0]
+        senders = self.get_senders(name)
+        for sender in senders:
+            if not sender.failed:
+                sender.put(msg)
+                return
+        senders[0].put(msg)
+
+    @property
+    def n_dropped(self):
+        return sum([_.n_dropped for _ in self.senders.values()])
+
+    @property
+    def n_reconnects(self):
+        return sum([_.n_reconnects for _ in self.senders.values()])
+
+    @property
+    def n_bytes_sent(self):
+        return sum([_.n_bytes_sent for _ in self.senders.values()])
+
+    def flush(self, timeout=None):
+        '''Wait until every sender has sent the messages put so far
+
+        :param timeout: the most seconds to wait for all of them. Default
+        is each sender's close_timeout.
+        :returns: True if every sender sent its messages
+        '''
+        deadline = None if timeout is None else time.time() + timeout
+        flushed = True
+        for sender in self.senders.values():
+            if deadline is not None:
+                timeout = max(deadline - time.time(), 0)
+            flushed = sender.flush(timeout) and flushed
+        return flushed
+
+    def close(self):
+        '''Close every sender, all at the same time'''
+        for sender in self.senders.values():
+            sender.request_close()
+        for sender in self.senders.values():
+            sender.thread.join()
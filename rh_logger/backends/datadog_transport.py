@@ -0,0 +1,211 @@
+'''datadog_transport.py - background batching transport for Datadog
+
+The transport buffers metrics and events on the caller's thread and posts
+them to the Datadog HTTP API from a daemon thread, so that network round
+trips never land on the caller. Metric points that share a metric name,
+host, type and tag set are merged into a single multi-point series before
+they are sent.
+
+The buffer is flushed when it holds flush_size points or events, when
+flush_interval seconds have passed since the last flush, or when
+the transport is closed.
+'''
+
+import collections
+import json
+import logging
+import threading
+import time
+
+try:
+    import httplib
+    from urlparse import urlparse
+    from urllib import urlencode
+except ImportError:
+    import http.client as httplib
+    from urllib.parse import urlparse, urlencode
+
+DEFAULT_API_HOST = "https://api.datadoghq.com"
+DEFAULT_FLUSH_INTERVAL = 10.0
+DEFAULT_FLUSH_SIZE = 1000
+
+log = logging.getLogger("rh_logger.datadog")
+
+
+class DatadogTransport(object):
+    '''Buffer metrics and events and send them to Datadog in batches'''
+
+    def __init__(self, api_key, app_key=None, api_host=DEFAULT_API_HOST,
+                 flush_interval=DEFAULT_FLUSH_INTERVAL,
+                 flush_size=DEFAULT_FLUSH_SIZE, timeout=30):
+        '''Initialize the transport and start the flusher thread
+
+        :param api_key: the Datadog API key
+        :param app_key: the Datadog application key
+        :param api_host: the base URL of the Datadog API, e.g.
+        "https://api.datadoghq.com" or "http://127.0.0.1:8080" for a
+        local stand-in
+        :param flush_interval: maximum time in seconds that a point or event
+        waits in the buffer
+        :param flush_size: flush as soon as this many points and events are
+        buffered
+        :param timeout: socket timeout for the HTTP connection
+        '''
+        url = urlparse(api_host)
+        self.scheme = url.scheme or "https"
+        self.netloc = url.netloc or url.path
+        self.base_path = url.path.rstrip("/") if url.netloc else ""
+        query = dict(api_key=api_key)
+        if app_key is not None:
+            query["application_key"] = app_key
+        self.query = urlencode(query)
+        self.flush_interval = flush_interval
+        self.flush_size = flush_size
+        self.timeout = timeout
+        self.connection = None
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+        self.series = collections.OrderedDict()
+        self.events = []
+        self.n_pending = 0
+        #
+        # Counters, for diagnostics
+        #
+        self.n_requests = 0
+        self.n_points_sent = 0
+        self.n_events_sent = 0
+        self.n_dropped = 0
+        self.wakeup = threading.Event()
+        self.closing = False
+        self.thread = threading.Thread(
+            target=self.run,
+            name="DatadogTransportThread")
+        self.thread.daemon = True
+        self.thread.start()
+
+    def send_metric(self, metric, points, host=None, tags=None,
+                    metric_type="gauge"):
+        '''Buffer metric points for sending
+
+        :param metric: the name of the metric
+        :param points: an iterable of (timestamp, value) pairs
+        :param host: the host name to report
+        :param tags: a sequence of tags for the series
+        :param metric_type: "gauge", "rate" or "count"
+        '''
+        points = list(points)
+        key = (metric, host, tuple(tags or ()), metric_type)
+        with self.lock:
+            series = self.series.get(key)
+            if series is None:
+                self.series[key] = points
+            else:
+                series.extend(points)
+            self.n_pending += len(points)
+            if self.n_pending >= self.flush_size:
+                self.wakeup.set()
+
+    def send_event(self, title, text, alert_type="info", tags=None):
+        '''Buffer an event for sending
+
+        :param title: the event's title
+        :param text: the event's body
+        :param alert_type: "info", "warning", "error" or "success"
+        :param tags: a sequence of tags for the event
+        '''
+        event = dict(title=title, text=text, alert_type=alert_type,
+                     date_happened=int(time.time()), tags=list(tags or ()))
+        with self.lock:
+            self.events.append(event)
+            self.n_pending += 1
+            if self.n_pending >= self.flush_size:
+                self.wakeup.set()
+
+    def flush(self):
+        '''Send everything buffered so far
+
+        This waits for a flush that the flusher thread has started, so
+        everything buffered before the call has been sent when it returns.
+
+        :returns: True if nothing was dropped
+        '''
+        with self.flush_lock:
+            with self.lock:
+                series, self.series = self.series, collections.OrderedDict()
+                events, self.events = self.events, []
+                self.n_pending = 0
+            sent = True
+            if len(series) > 0:
+                payload = [
+                    dict(metric=metric, points=[[t, v] for t, v in points],
+                         type=metric_type, host=host, tags=list(tags))
+                    for (metric, host, tags, metric_type), points
+                    in series.items()]
+                n_points = sum([len(_) for _ in series.values()])
+                if self.post("/api/v1/series", dict(series=payload)):
+                    self.n_points_sent += n_points
+                else:
+                    self.n_dropped += n_points
+                    sent = False
+            for event in events:
+                if self.post("/api/v1/events", event):
+                    self.n_events_sent += 1
+                else:
+                    self.n_dropped += 1
+                    sent = False
+            return sent
+
+    def post(self, path, body):
+        '''Post a JSON body to the API, reconnecting once on failure
+
+        :returns: True if the post succeeded
+        '''
+        data = json.dumps(body)
+        url = "%s%s?%s" % (self.base_path, path, self.query)
+        headers = {"Content-Type": "application/json"}
+        for attempt in range(2):
+            try:
+                if self.connection is None:
+                    self.connection = self.connect()
+                self.connection.request("POST", url, data, headers)
+                response = self.connection.getresponse()
+                response.read()
+                self.n_requests += 1
+                if response.status >= 400:
+                    log.warning("Datadog rejected %s: HTTP %d %s",
+                                path, response.status, response.reason)
+                    return False
+                return True
+            except (httplib.HTTPException, IOError, OSError):
+                if self.connection is not None:
+                    self.connection.close()
+                    self.connection = None
+                if attempt == 1:
+                    log.warning("Failed to send to Datadog at %s",
+                                self.netloc, exc_info=1)
+        return False
+
+    def connect(self):
+        if self.scheme == "https":
+            return httplib.HTTPSConnection(self.netloc, timeout=self.timeout)
+        return httplib.HTTPConnection(self.netloc, timeout=self.timeout)
+
+    def run(self):
+        '''Thread for flushing the buffer'''
+        while not self.closing:
+            self.wakeup.wait(self.flush_interval)
+            self.wakeup.clear()
+            try:
+                self.flush()
+            except Exception:
+                log.exception("Datadog transport flush failed")
+
+    def close(self):
+        '''Drain the buffer and stop the flusher thread'''
+        self.closing = True
+        self.wakeup.set()
+        self.thread.join()
+        self.flush()
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
@@ -0,0 +1,161 @@
+'''dogstatsd_transport.py - send metrics and events to a DogStatsD agent
+
+DogStatsD is the UDP listener of the Datadog agent. Sending to it costs one
+sendto per packet and never waits for the network, and the agent does the
+batching and talks to the Datadog API. The transport has the same
+send_metric and send_event methods as DatadogTransport, so the Datadog
+backend can use either.
+
+Each point is a line "name:value|type|#tag,tag". Lines are packed into
+datagrams of at most max_packet_size bytes. DogStatsD gives a point the
+time it arrives, so the timestamps of the points are not sent. Events are
+sent as "_e{title length,text length}:title|text|d:time|t:alert type|#tags".
+'''
+
+import logging
+import re
+import socket
+import time
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8125
+
+'''The largest datagram that fits in an Ethernet frame without fragmenting'''
+DEFAULT_MAX_PACKET_SIZE = 1432
+
+METRIC_TYPES = dict(gauge="g", count="c", rate="g", histogram="h",
+                    distribution="d")
+
+log = logging.getLogger("rh_logger.dogstatsd")
+
+_name_re = re.compile(r"[:|@\s]")
+_tag_re = re.compile(r"[|,#\s]")
+
+
+def format_name(name):
+    '''Replace the characters that DogStatsD uses as separators in a name'''
+    return _name_re.sub("_", str(name))
+
+
+def format_tags(tags):
+    '''The "|#tag,tag" suffix for a sequence of tags'''
+    if not tags:
+        return ""
+    return "|#" + ",".join([_tag_re.sub("_", str(_)) for _ in tags])
+
+
+def format_value(value):
+    if isinstance(value, float) and value == int(value) and \
+       abs(value) < 1e15:
+        return str(int(value))
+    return repr(value)
+
+
+class DogStatsdTransport(object):
+    '''Send metrics and events to a DogStatsD agent over UDP'''
+
+    def __init__(self, host=DEFAULT_HOST, port=DEFAULT_PORT,
+                 max_packet_size=DEFAULT_MAX_PACKET_SIZE):
+        '''Initialize the transport
+
+        :param host: the host of the DogStatsD agent
+        :param port: the agent's UDP port
+        :param max_packet_size: the maximum number of bytes in a datagram
+        '''
+        self.address = (host, port)
+        self.max_packet_size = max_packet_size
+        family = socket.getaddrinfo(host, port, 0, socket.SOCK_DGRAM)[0][0]
+        self.socket = socket.socket(family, socket.SOCK_DGRAM)
+        self.socket.setblocking(False)
+        #
+        # Counters, for diagnostics
+        #
+        self.n_packets = 0
+        self.n_points_sent = 0
+        self.n_events_sent = 0
+        self.n_dropped = 0
+
+    def send_metric(self, metric, points, host=None, tags=None,
+                    metric_type="gauge"):
+        '''Send metric points
+
+        :param metric: the name of the metric
+        :param points: a sequence of (timestamp, value) pairs
+        :param host: the host name to report, sent as a "host:" tag
+        :param tags: a sequence of tags for the series
+        :param metric_type: "gauge", "rate", "count", "histogram" or
+        "distribution"
+        '''
+        tags = list(tags or ())
+        if host is not None:
+            tags.append("host:%s" % host)
+        suffix = "|%s%s" % (METRIC_TYPES.get(metric_type, "g"),
+                            format_tags(tags))
+        prefix = format_name(metric) + ":"
+        lines = [prefix + format_value(value) + suffix
+                 for _, value in points]
+        n_sent = self.send_lines(lines)
+        self.n_points_sent += n_sent
+        self.n_dropped += len(lines) - n_sent
+
+    def send_event(self, title, text, alert_type="info", tags=None):
+        '''Send an event
+
+        :param title: the event's title
+        :param text: the event's body
+        :param alert_type: "info", "warning", "error" or "success"
+        :param tags: a sequence of tags for the event
+        '''
+        title = str(title).replace("\n", "\\n").encode("utf-8")
+        text = str(text).replace("\n", "\\n").encode("utf-8")
+        line = b"_e{" + str(len(title)).encode("ascii") + b"," + \
+            str(len(text)).encode("ascii") + b"}:" + title + b"|" + text + \
+            ("|d:%d|t:%s%s" % (time.time(), alert_type,
+                               format_tags(tags))).encode("utf-8")
+        if self.send_packet(line):
+            self.n_events_sent += 1
+        else:
+            self.n_dropped += 1
+
+    def send_lines(self, lines):
+        '''Pack lines into datagrams and send them
+
+        :returns: the number of lines sent
+        '''
+        n_sent = 0
+        packet = []
+        size = 0
+        for line in lines:
+            line = line.encode("utf-8")
+            if size > 0 and size + 1 + len(line) > self.max_packet_size:
+                if self.send_packet(b"\n".join(packet)):
+                    n_sent += len(packet)
+                packet = []
+                size = 0
+            packet.append(line)
+            size += len(line) + (1 if size > 0 else 0)
+        if len(packet) > 0 and self.send_packet(b"\n".join(packet)):
+            n_sent += len(packet)
+        return n_sent
+
+    def send_packet(self, data):
+        '''Send one datagram
+
+        :returns: True if it was sent. A datagram that can't be sent right
+        away is dropped rather than making the caller wait.
+        '''
+        try:
+            self.socket.sendto(data, self.address)
+        except (socket.error, IOError, OSError):
+            log.debug("Failed to send to DogStatsD at %s:%d",
+                      self.address[0], self.address[1], exc_info=1)
+            return False
+        self.n_packets += 1
+        return True
+
+    def flush(self):
+        '''Nothing is buffered, so there is nothing to flush'''
+        return True
+
+    def close(self):
+        self.socket.close()
@@ -0,0 +1,488 @@
+'''collector.py - collecting the logging of forked child processes
+
+A process forked after start_process inherits the backend, but not its
+threads: the Carbon sender and the Datadog flusher don't exist in the
+child, and a socket shared with the parent interleaves both processes'
+writes. With "fork-collector" set in the rh-logger section, the proxy wraps
+the backend in a ForkCollector before start_process:
+
+rh-logger:
+    fork-collector: true
+    # the number of records the ring buffer holds. Records written when it
+    # is full are dropped.
+    fork-collector-capacity: 65536
+    # the size of each record in bytes. Longer names, contexts and
+    # exception texts are truncated.
+    fork-collector-record-size: 256
+    # seconds between drains of the ring buffer
+    fork-collector-interval: 0.5
+    # seconds to wait for the ring buffer's lock. A child that waits
+    # longer drops its record. The drain thread takes the holder to have
+    # died holding the lock and releases it.
+    fork-collector-lock-timeout: 5
+
+In the parent, the collector passes every call to the backend. A child
+writes each call as a fixed-size record into a ring buffer in shared memory
+that was mapped before the fork, and a drain thread in the parent reads the
+records and forwards them to the backend. Points of the same metric and
+context read in one drain are forwarded as one TimeSeries, and the events
+of a report_events call are written as adjacent records and forwarded as one
+batch. Children need no sockets or clients of their own.
+
+Children report an AggregateTimeSeries as the points of its summary, named
+"<name>.<statistic>", and an exception as its formatted text, since the
+objects themselves can't be rebuilt in the parent. Calls still waiting in a
+child's aggregator when it exits are lost, so children that use timers or
+counters should call logger.aggregator.flush() before exiting.
+
+A child that is killed while it holds the ring's lock would otherwise block
+every other writer and the drain thread forever. A writer advances the
+ring's head only after its record is complete, so the ring is consistent
+whenever the lock is held, and the drain thread can release a lock that has
+been held for longer than the lock timeout and carry on.
+'''
+
+import collections
+import json
+import logging
+import mmap
+import multiprocessing
+import numbers
+import os
+import struct
+import sys
+import threading
+import time
+import traceback
+
+import rh_logger.api
+
+DEFAULT_CAPACITY = 65536
+DEFAULT_RECORD_SIZE = 256
+DEFAULT_INTERVAL = 0.5
+DEFAULT_LOCK_TIMEOUT = 5.0
+
+log = logging.getLogger("rh_logger.collector")
+
+'''The ring's header: the number of records written and read and dropped'''
+RING_HEADER = struct.Struct("<QQQ")
+RING_HEADER_SIZE = 64
+
+'''A record: kind, log level, payload length, pid, timestamp and value'''
+RECORD = struct.Struct("<BbHIdd")
+
+METRIC = 1
+METRIC_TEXT = 2
+COUNT = 3
+EVENT = 4
+EXCEPTION = 5
+EVENTS = 6
+
+if hasattr(os, "register_at_fork"):
+    _forks = [0]
+
+    def _after_fork_in_child():
+        _forks[0] += 1
+
+    os.register_at_fork(after_in_child=_after_fork_in_child)
+
+    def _fork_id():
+        '''A number that is different in each forked child'''
+        return _forks[0]
+else:
+    _fork_id = os.getpid
+
+
+def encode_context(context):
+    if context is None:
+        return b""
+    try:
+        return json.dumps(context).encode("utf-8")
+    except (TypeError, ValueError):
+        return json.dumps(repr(context)).encode("utf-8")
+
+
+def decode_context(encoded):
+    if len(encoded) == 0:
+        return None
+    try:
+        return json.loads(encoded.decode("utf-8"))
+    except ValueError:
+        # truncated
+        return encoded.decode("utf-8", "replace")
+
+
+def _encode(s):
+    if not isinstance(s, bytes):
+        s = (s if isinstance(s, type(u"")) else str(s)).encode("utf-8")
+    return s
+
+
+'''A record read from the ring'''
+Record = collections.namedtuple(
+    "Record", ["kind", "log_level", "pid", "timestamp", "value", "fields"])
+
+
+class SharedRing(object):
+    '''A ring buffer of fixed-size records in shared anonymous memory
+
+    Create it before forking. Any process may write and one process reads.
+    '''
+
+    def __init__(self, capacity=DEFAULT_CAPACITY,
+                 record_size=DEFAULT_RECORD_SIZE,
+                 lock_timeout=DEFAULT_LOCK_TIMEOUT):
+        '''Map the ring
+
+        :param capacity: the number of records the ring holds
+        :param record_size: the size of a record in bytes
+        :param lock_timeout: seconds to wait for the lock. Writers drop
+        their records after that and the reader breaks the lock.
+        '''
+        if record_size <= RECORD.size:
+            raise ValueError("record_size must be more than %d bytes" %
+                             RECORD.size)
+        self.capacity = capacity
+        self.record_size = record_size
+        self.max_payload = record_size - RECORD.size
+        self.mm = mmap.mmap(-1, RING_HEADER_SIZE + capacity * record_size)
+        #
+        # The lock is a semaphore in shared memory, so a child forked while
+        # the parent's drain thread holds it waits for the parent to
+        # release it.
+        #
+        self.lock = multiprocessing.Lock()
+        self.lock_timeout = lock_timeout
+        self.n_lock_timeouts = 0
+
+    def acquire(self):
+        '''Take the lock, waiting at most lock_timeout seconds
+
+        :returns: False if the lock wasn't taken in time
+        '''
+        if self.lock.acquire(True, self.lock_timeout):
+            return True
+        self.n_lock_timeouts += 1
+        return False
+
+    def break_lock(self):
+        '''Take the lock from a process that died holding it'''
+        log.warning("The fork collector's lock was held for more than "
+                    "%.1f sec. Releasing it.", self.lock_timeout)
+        try:
+            self.lock.release()
+        except ValueError:
+            # it was released in the meantime
+            pass
+        return self.acquire()
+
+    def write(self, kind, log_level, timestamp, value, fields):
+        '''Write a record
+
+        :param fields: a sequence of byte strings, joined with NUL and
+        truncated to fit the record
+        :returns: False if the ring was full and the record was dropped
+        '''
+        payload = b"\0".join(fields)[:self.max_payload]
+        if not self.acquire():
+            return False
+        try:
+            head, tail, dropped = RING_HEADER.unpack_from(self.mm, 0)
+            if head - tail >= self.capacity:
+                RING_HEADER.pack_into(self.mm, 0, head, tail, dropped + 1)
+                return False
+            offset = RING_HEADER_SIZE + \
+                (head % self.capacity) * self.record_size
+            RECORD.pack_into(self.mm, offset, kind,
+                             -1 if log_level is None else log_level,
+                             len(payload), os.getpid(), timestamp, value)
+            start = offset + RECORD.size
+            self.mm[start:start + len(payload)] = payload
+            RING_HEADER.pack_into(self.mm, 0, head + 1, tail, dropped)
+        finally:
+            self.lock.release()
+        return True
+
+    def write_many(self, kind, log_level, records):
+        '''Write records next to each other, or none of them
+
+        :param records: a sequence of (timestamp, value, fields)
+        :returns: False if the ring didn't have room and the records were
+        dropped
+        '''
+        payloads = [(timestamp, value, b"\0".join(fields)[:self.max_payload])
+                    for timestamp, value, fields in records]
+        level = -1 if log_level is None else log_level
+        pid = os.getpid()
+        if not self.acquire():
+            return False
+        try:
+            head, tail, dropped = RING_HEADER.unpack_from(self.mm, 0)
+            if head - tail + len(payloads) > self.capacity:
+                RING_HEADER.pack_into(self.mm, 0, head, tail,
+                                      dropped + len(payloads))
+                return False
+            for i, (timestamp, value, payload) in enumerate(payloads):
+                offset = RING_HEADER_SIZE + \
+                    ((head + i) % self.capacity) * self.record_size
+                RECORD.pack_into(self.mm, offset, kind, level, len(payload),
+                                 pid, timestamp, value)
+                start = offset + RECORD.size
+                self.mm[start:start + len(payload)] = payload
+            RING_HEADER.pack_into(self.mm, 0, head + len(payloads), tail,
+                                  dropped)
+        finally:
+            self.lock.release()
+        return True
+
+    def read(self):
+        '''Read every record written since the last read
+
+        :returns: a list of :py:class: `Record`
+        '''
+        if not self.acquire() and not self.break_lock():
+            return []
+        try:
+            head, tail, dropped = RING_HEADER.unpack_from(self.mm, 0)
+            #
+            # Copy the records out so that writers can reuse their slots.
+            #
+            records = []
+            for i in range(tail, head):
+                offset = RING_HEADER_SIZE + \
+                    (i % self.capacity) * self.record_size
+                records.append(self.mm[offset:offset + self.record_size])
+            RING_HEADER.pack_into(self.mm, 0, head, head, dropped)
+        finally:
+            self.lock.release()
+        result = []
+        for data in records:
+            kind, log_level, length, pid, timestamp, value = \
+                RECORD.unpack_from(data, 0)
+            fields = data[RECORD.size:RECORD.size + length].split(b"\0")
+            fields += [b""] * (3 - len(fields))
+            result.append(Record(kind, None if log_level == -1 else log_level,
+                                 pid, timestamp, value, fields))
+        return result
+
+    @property
+    def n_dropped(self):
+        return RING_HEADER.unpack_from(self.mm, 0)[2]
+
+    def close(self):
+        self.mm.close()
+
+
+class ChildException(Exception):
+    '''An exception reported by a child, rebuilt from its text'''
+
+
+class ForkCollector(rh_logger.api.Logger):
+    '''A logger that collects the calls of forked children for a backend'''
+
+    def __init__(self, logger, capacity=DEFAULT_CAPACITY,
+                 record_size=DEFAULT_RECORD_SIZE, interval=DEFAULT_INTERVAL,
+                 lock_timeout=DEFAULT_LOCK_TIMEOUT):
+        '''Map the ring buffer and start the drain thread
+
+        :param logger: the backend :py:class: `Logger`
+        :param capacity: the number of records the ring holds
+        :param record_size: the size of a record in bytes
+        :param interval: seconds between drains
+        :param lock_timeout: seconds to wait for the ring's lock
+        '''
+        self.logger = logger
+        self.ring = SharedRing(capacity, record_size, lock_timeout)
+        self.interval = interval
+        self.fork_id = _fork_id()
+        self.n_records = 0
+        self.stopping = threading.Event()
+        self.thread = threading.Thread(
+            target=self.run, name="ForkCollectorThread")
+        self.thread.daemon = True
+        self.thread.start()
+
+    def in_parent(self):
+        return _fork_id() == self.fork_id
+
+    def run(self):
+        '''Thread for draining the ring'''
+        while not self.stopping.wait(self.interval):
+            try:
+                self.drain()
+            except Exception:
+                log.exception("Failed to forward the calls of child processes")
+
+    def drain(self):
+        '''Forward the records in the ring to the backend
+
+        :returns: the number of records forwarded
+        '''
+        records = self.ring.read()
+        series = collections.OrderedDict()
+        events = []
+        for record in records:
+            if record.kind == METRIC:
+                key = (record.fields[0], record.fields[1])
+                series.setdefault(key, []).append(record)
+            elif record.kind == METRIC_TEXT:
+                self.logger.report_metric(
+                    record.fields[0].decode("utf-8"),
+                    record.fields[2].decode("utf-8", "replace"),
+                    decode_context(record.fields[1]))
+            elif record.kind == COUNT:
+                self.logger.report_count(
+                    record.fields[0].decode("utf-8"), record.value,
+                    decode_context(record.fields[1]), record.timestamp)
+            elif record.kind == EVENT:
+                self.logger.report_event(
+                    record.fields[0].decode("utf-8", "replace"),
+                    decode_context(record.fields[1]), record.log_level)
+            elif record.kind == EVENTS:
+                #
+                # A batch is written in one go, so its records are next to
+                # each other. The value counts the records still to come.
+                #
+                events.append(record.fields[2].decode("utf-8", "replace"))
+                if record.value == 0:
+                    self.logger.report_events(
+                        events, decode_context(record.fields[1]),
+                        record.log_level,
+                        record.fields[0].decode("utf-8", "replace") or None)
+                    events = []
+            elif record.kind == EXCEPTION:
+                msg = record.fields[0].decode("utf-8", "replace")
+                self.logger.report_exception(
+                    ChildException(
+                        record.fields[1].decode("utf-8", "replace")),
+                    msg or None)
+        for (name, context), points in series.items():
+            name = name.decode("utf-8")
+            context = decode_context(context)
+            if len(points) == 1:
+                self.logger.report_metric(name, points[0].value, context)
+            else:
+                time_series = rh_logger.api.TimeSeries()
+                time_series.report_metrics(
+                    [_.value for _ in points], [_.timestamp for _ in points])
+                self.logger.report_metrics(name, time_series, context)
+        self.n_records += len(records)
+        return len(records)
+
+    def start_process(self, name, msg, args=None):
+        self.logger.start_process(name, msg, args)
+
+    def end_process(self, msg, exit_code):
+        '''Forward what the children wrote and end the backend's process
+
+        In a child, this does nothing: the parent ends the process.
+        '''
+        if not self.in_parent():
+            return
+        self.stopping.set()
+        self.thread.join()
+        self.drain()
+        if self.ring.n_dropped > 0:
+            log.warning("Dropped %d calls from child processes because the "
+                        "ring buffer was full", self.ring.n_dropped)
+        self.logger.end_process(msg, exit_code)
+
+    def report_metric(self, name, metric, context=None):
+        if self.in_parent():
+            self.logger.report_metric(name, metric, context)
+        elif isinstance(metric, numbers.Real):
+            self.ring.write(METRIC, None, time.time(), metric,
+                            (_encode(name), encode_context(context)))
+        else:
+            self.ring.write(METRIC_TEXT, None, time.time(), 0,
+                            (_encode(name), encode_context(context),
+                             _encode(metric)))
+
+    def report_metrics(self, name, time_series, context=None):
+        if self.in_parent():
+            self.logger.report_metrics(name, time_series, context)
+            return
+        fields = (_encode(name), encode_context(context))
+        if isinstance(time_series, rh_logger.api.AggregateTimeSeries):
+            if len(time_series) == 0:
+                return
+            summary = time_series.summary()
+            for suffix, value in summary.metrics():
+                self.ring.write(METRIC, None, summary.end, value,
+                                (_encode("%s.%s" % (name, suffix)),
+                                 fields[1]))
+        else:
+            for timestamp, value in zip(time_series.timestamps,
+                                        time_series.values):
+                self.ring.write(METRIC, None, timestamp, value, fields)
+
+    def report_count(self, name, count, context=None, timestamp=None):
+        if self.in_parent():
+            self.logger.report_count(name, count, context, timestamp)
+        else:
+            self.ring.write(COUNT, None,
+                            time.time() if timestamp is None else timestamp,
+                            count,
+                            (_encode(name), encode_context(context)))
+
+    def report_event(self, event, context=None, log_level=None):
+        if self.in_parent():
+            self.logger.report_event(event, context, log_level)
+        else:
+            self.ring.write(EVENT, log_level, time.time(), 0,
+                            (_encode(event), encode_context(context)))
+
+    def report_events(self, events, context=None, log_level=None,
+                      title=None):
+        if self.in_parent():
+            self.logger.report_events(events, context, log_level, title)
+            return
+        events = list(events)
+        if len(events) == 0:
+            if title is not None:
+                self.report_event(title, context, log_level)
+            return
+        now = time.time()
+        head = (_encode(title or ""), encode_context(context))
+        self.ring.write_many(
+            EVENTS, log_level,
+            [(now, len(events) - i - 1, head + (_encode(event), ))
+             for i, event in enumerate(events)])
+
+    def report_exception(self, exception=None, msg=None):
+        if self.in_parent():
+            self.logger.report_exception(exception, msg)
+            return
+        if exception is None:
+            text = "".join(traceback.format_exception(*sys.exc_info()))
+        else:
+            text = "%s: %s" % (type(exception).__name__, exception)
+        self.ring.write(EXCEPTION, None, time.time(), 0,
+                        (_encode(msg or ""), _encode(text)))
+
+    def report_spans(self, spans):
+        if self.in_parent():
+            self.logger.report_spans(spans)
+        else:
+            rh_logger.api.Logger.report_spans(self, spans)
+
+    def bind_context(self, context):
+        return context, self.logger.bind_context(context)
+
+    def report_bound_metric(self, name, metric, bound):
+        if self.in_parent():
+            self.logger.report_bound_metric(name, metric, bound[1])
+        else:
+            self.report_metric(name, metric, bound[0])
+
+    def report_bound_metrics(self, name, time_series, bound):
+        if self.in_parent():
+            self.logger.report_bound_metrics(name, time_series, bound[1])
+        else:
+            self.report_metrics(name, time_series, bound[0])
+
+    def report_bound_event(self, event, bound, log_level=None):
+        if self.in_parent():
+            self.logger.report_bound_event(event, bound[1], log_level)
+        else:
+            self.report_event(event, bound[0], log_level)
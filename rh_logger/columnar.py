@@ -0,0 +1,399 @@
+'''columnar.py - a columnar file format for metrics
+
+ColumnarWriter buffers points per metric and writes them in chunks. For
+each metric with points in a chunk, the chunk holds three columns: the
+timestamps and values as little-endian doubles and the context of each
+point as a little-endian uint32 number. The contexts are dictionary
+encoded: each distinct context is stored, as JSON, and numbered. The writer
+remembers the numbers of at most MAX_CONTEXT_NUMBERS contexts. Past that it
+starts over, so a context seen again gets another number and the same
+context can have several numbers in a file.
+
+The file layout is:
+
+* the magic number, MAGIC
+* chunks, each made of
+  - CHUNK_MAGIC, the length of the chunk header and the chunk header: JSON
+    with the contexts first used in the chunk and, for each metric, the
+    number of points, the time range, the context numbers used and the
+    offsets of its columns relative to the start of the chunk
+  - the columns, each starting on an 8-byte boundary
+* the footer: JSON with every context and every column of every chunk,
+  with absolute offsets
+* the trailer: the offset of the footer and END_MAGIC
+
+A reader only needs the trailer and footer to find any column, and can
+then map just those columns. If the writer didn't finish, the footer is
+missing and the index is rebuilt from the chunk headers.
+'''
+
+import array
+import json
+import mmap
+import os
+import struct
+import sys
+import threading
+
+from rh_logger.aggregator import context_key
+
+MAGIC = b"RHCOLUM1"
+CHUNK_MAGIC = b"RHCK"
+END_MAGIC = b"RHCOLEND"
+SUFFIX = ".rhcol"
+
+DEFAULT_CHUNK_SIZE = 65536
+
+'''The most contexts whose numbers the writer remembers'''
+MAX_CONTEXT_NUMBERS = 65536
+
+CHUNK_HEADER = struct.Struct("<4sI")
+TRAILER = struct.Struct("<Q8s")
+
+
+def _padding(n):
+    return b"\0" * (-n % 8)
+
+
+def _array_bytes(a):
+    if sys.byteorder != "little":
+        a = array.array(a.typecode, a)
+        a.byteswap()
+    if hasattr(a, "tobytes"):
+        return a.tobytes()
+    return a.tostring()
+
+
+def _uint32_array():
+    '''An empty array of 4-byte unsigned integers'''
+    for typecode in ("I", "L"):
+        if array.array(typecode).itemsize == 4:
+            return array.array(typecode)
+    raise ValueError("No 4-byte unsigned integer array type")
+
+
+def encode_context(context):
+    '''JSON for a context, or for its repr if it isn't JSON serializable'''
+    try:
+        return json.dumps(context)
+    except (TypeError, ValueError):
+        return json.dumps(repr(context))
+
+
+def decode_context(encoded):
+    return json.loads(encoded)
+
+
+class _Column(object):
+    '''The points of one metric waiting to be written'''
+
+    __slots__ = ["timestamps", "values", "contexts"]
+
+    def __init__(self):
+        self.timestamps = array.array("d")
+        self.values = array.array("d")
+        self.contexts = _uint32_array()
+
+
+class ColumnarWriter(object):
+    '''Write metrics to a columnar file'''
+
+    def __init__(self, path, chunk_size=DEFAULT_CHUNK_SIZE):
+        '''Create the file
+
+        :param path: the path to the file
+        :param chunk_size: write a chunk when this many points are buffered
+        '''
+        self.path = path
+        self.chunk_size = chunk_size
+        self.fd = open(path, "wb")
+        self.fd.write(MAGIC)
+        self.offset = len(MAGIC)
+        self.lock = threading.Lock()
+        self.columns = {}
+        self.n_buffered = 0
+        self.context_numbers = {}
+        self.n_contexts = 0
+        self.new_contexts = {}
+        self.index = []
+
+    def context_number(self, context):
+        '''The number of a context, adding it to the dictionary if new'''
+        try:
+            key = context_key(context)
+            number = self.context_numbers.get(key)
+        except TypeError:
+            key = encode_context(context)
+            number = self.context_numbers.get(key)
+        if number is None:
+            if len(self.context_numbers) >= MAX_CONTEXT_NUMBERS:
+                self.context_numbers.clear()
+            number = self.context_numbers[key] = self.n_contexts
+            self.n_contexts += 1
+            self.new_contexts[number] = encode_context(context)
+        return number
+
+    def column(self, name):
+        column = self.columns.get(name)
+        if column is None:
+            column = self.columns[name] = _Column()
+        return column
+
+    def add(self, name, value, timestamp, context=None):
+        '''Add one point'''
+        with self.lock:
+            column = self.column(name)
+            column.timestamps.append(timestamp)
+            column.values.append(value)
+            column.contexts.append(self.context_number(context))
+            self.n_buffered += 1
+            if self.n_buffered >= self.chunk_size:
+                self.write_chunk()
+
+    def add_many(self, name, values, timestamps, context=None):
+        '''Add a sequence of points with the same context'''
+        with self.lock:
+            column = self.column(name)
+            column.timestamps.extend(timestamps)
+            column.values.extend(values)
+            number = self.context_number(context)
+            column.contexts.extend([number] * len(values))
+            self.n_buffered += len(values)
+            if self.n_buffered >= self.chunk_size:
+                self.write_chunk()
+
+    def write_chunk(self):
+        '''Write the buffered points as a chunk. The caller holds the lock.'''
+        if self.n_buffered == 0:
+            return
+        entries = []
+        data = []
+        position = 0
+        for name in sorted(self.columns):
+            column = self.columns[name]
+            entry = dict(metric=name, count=len(column.values),
+                         min_time=min(column.timestamps),
+                         max_time=max(column.timestamps),
+                         context_numbers=sorted(set(column.contexts)))
+            for key in ("timestamps", "values", "contexts"):
+                b = _array_bytes(getattr(column, key))
+                entry[key] = position
+                data.append(b)
+                data.append(_padding(len(b)))
+                position += len(b) + len(data[-1])
+            entries.append(entry)
+        header = json.dumps(dict(
+            contexts=dict([(str(k), v) for k, v in self.new_contexts.items()]),
+            columns=entries)).encode("utf-8")
+        header += b" " * (-(CHUNK_HEADER.size + len(header)) % 8)
+        self.fd.write(CHUNK_HEADER.pack(CHUNK_MAGIC, len(header)))
+        self.fd.write(header)
+        for b in data:
+            self.fd.write(b)
+        self.fd.flush()
+        start = self.offset + CHUNK_HEADER.size + len(header)
+        for entry in entries:
+            for key in ("timestamps", "values", "contexts"):
+                entry[key] += start
+        self.index.extend(entries)
+        self.offset = start + position
+        self.columns = {}
+        self.n_buffered = 0
+        self.new_contexts = {}
+
+    def flush(self):
+        '''Write the buffered points'''
+        with self.lock:
+            self.write_chunk()
+
+    def read_contexts(self):
+        '''Read every context back from the chunk headers, for the footer'''
+        with open(self.path, "rb") as fd:
+            mm = mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            return _read_chunks(mm)["contexts"]
+        finally:
+            mm.close()
+
+    def close(self):
+        '''Write the buffered points and the footer and close the file'''
+        with self.lock:
+            if self.fd is None:
+                return
+            self.write_chunk()
+            self.fd.flush()
+            footer = json.dumps(dict(
+                contexts=self.read_contexts(),
+                columns=self.index)).encode("utf-8")
+            self.fd.write(footer)
+            self.fd.write(TRAILER.pack(self.offset, END_MAGIC))
+            self.fd.close()
+            self.fd = None
+
+
+def _read_chunks(data):
+    '''Rebuild the footer by scanning the chunk headers
+
+    :param data: the file's contents or a map of them
+    '''
+    contexts = {}
+    columns = []
+    offset = len(MAGIC)
+    while offset + CHUNK_HEADER.size <= len(data):
+        magic, length = CHUNK_HEADER.unpack_from(data, offset)
+        start = offset + CHUNK_HEADER.size + length
+        if magic != CHUNK_MAGIC or start > len(data):
+            break
+        header = json.loads(
+            data[offset + CHUNK_HEADER.size:start].decode("utf-8"))
+        end = start
+        for entry in header["columns"]:
+            for key in ("timestamps", "values", "contexts"):
+                entry[key] += start
+            end = max(end, entry["contexts"] + 4 * entry["count"])
+        if end > len(data):
+            break
+        for number, encoded in header["contexts"].items():
+            contexts[int(number)] = encoded
+        columns.extend(header["columns"])
+        offset = end + (-end % 8)
+    return dict(contexts=[contexts[_] for _ in sorted(contexts)],
+                columns=columns)
+
+
+class ColumnarReader(object):
+    '''Read metrics from a columnar file as NumPy arrays
+
+    The file is memory mapped and only the columns asked for are read.
+    '''
+
+    def __init__(self, path):
+        import numpy
+        self.np = numpy
+        self.path = path
+        with open(path, "rb") as fd:
+            self.mm = mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.mm[:len(MAGIC)] != MAGIC:
+            raise ValueError("%s is not a columnar metrics file" % path)
+        footer = None
+        if len(self.mm) >= len(MAGIC) + TRAILER.size:
+            footer_offset, end_magic = TRAILER.unpack_from(
+                self.mm, len(self.mm) - TRAILER.size)
+            if end_magic == END_MAGIC:
+                footer = json.loads(self.mm[
+                    footer_offset:len(self.mm) - TRAILER.size].decode("utf-8"))
+        self.complete = footer is not None
+        if footer is None:
+            footer = _read_chunks(self.mm)
+        self.contexts = [decode_context(_) for _ in footer["contexts"]]
+        self.columns = {}
+        for entry in footer["columns"]:
+            self.columns.setdefault(entry["metric"], []).append(entry)
+
+    def metrics(self):
+        '''The names of the metrics in the file'''
+        return sorted(self.columns)
+
+    def context_numbers(self, context):
+        '''The numbers of the contexts equal to the given one'''
+        key = context_key(context)
+        return [number for number, c in enumerate(self.contexts)
+                if context_key(c) == key]
+
+    def metric_contexts(self, metric):
+        '''The contexts that a metric was reported with'''
+        numbers = set()
+        for entry in self.columns.get(metric, []):
+            numbers.update(entry["context_numbers"])
+        contexts = []
+        for number in sorted(numbers):
+            # a context may have been numbered more than once
+            if self.contexts[number] not in contexts:
+                contexts.append(self.contexts[number])
+        return contexts
+
+    def column(self, entry, key, dtype):
+        '''A read-only view of one column'''
+        return self.np.frombuffer(self.mm, dtype=dtype, count=entry["count"],
+                                  offset=entry[key])
+
+    def read(self, metric, context=None, any_context=True,
+             start=None, end=None):
+        '''Read the points of a metric
+
+        :param metric: the metric's name
+        :param context: only read points with this context
+        :param any_context: if True and context is None, read the points of
+        every context. Set to False to read only points without a context.
+        :param start: only read points at or after this time
+        :param end: only read points before this time
+        :returns: arrays of the timestamps and values
+        '''
+        np = self.np
+        numbers = None
+        if context is not None or not any_context:
+            numbers = self.context_numbers(context)
+        timestamps = []
+        values = []
+        for entry in self.columns.get(metric, []):
+            if start is not None and entry["max_time"] < start:
+                continue
+            if end is not None and entry["min_time"] >= end:
+                continue
+            if numbers is not None and \
+               not set(numbers).intersection(entry["context_numbers"]):
+                continue
+            t = self.column(entry, "timestamps", "<f8")
+            v = self.column(entry, "values", "<f8")
+            mask = None
+            if numbers is not None and \
+               len(entry["context_numbers"]) > 1:
+                mask = np.isin(self.column(entry, "contexts", "<u4"),
+                               numbers)
+            if start is not None and entry["min_time"] < start:
+                mask = (t >= start) if mask is None else mask & (t >= start)
+            if end is not None and entry["max_time"] >= end:
+                mask = (t < end) if mask is None else mask & (t < end)
+            if mask is not None:
+                t = t[mask]
+                v = v[mask]
+            timestamps.append(t)
+            values.append(v)
+        if len(timestamps) == 0:
+            return np.zeros(0), np.zeros(0)
+        if len(timestamps) == 1:
+            return timestamps[0], values[0]
+        return np.concatenate(timestamps), np.concatenate(values)
+
+    def read_by_context(self, metric):
+        '''Read a metric's points grouped by context
+
+        :returns: a list of (context, timestamps, values)
+        '''
+        return [(context, ) + self.read(metric, context, any_context=False)
+                for context in self.metric_contexts(metric)]
+
+    def close(self):
+        '''Release the map
+
+        Arrays returned by read may still refer to it, in which case it is
+        unmapped once they are freed.
+        '''
+        try:
+            self.mm.close()
+        except BufferError:
+            pass
+        self.mm = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def list_files(directory):
+    '''The paths of the columnar files in a directory'''
+    return [os.path.join(directory, filename)
+            for filename in sorted(os.listdir(directory))
+            if filename.endswith(SUFFIX)]
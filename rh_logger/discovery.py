@@ -0,0 +1,165 @@
+'''discovery.py - finding logging backends without scanning every distribution
+
+Backends are registered as entry points in the "rh_logger.backend" group.
+Scanning the installed distributions for them is slow, so the map of
+entry point name to "module:attribute" is cached on disk. The cache is keyed
+by the interpreter and the modification times of the directories on
+sys.path, which change whenever a distribution is installed or removed.
+
+Set the RH_LOGGER_CACHE environment variable to the path of the cache file
+to put it somewhere other than ~/.cache/rh_logger, or to an empty string to
+turn the cache off.
+'''
+
+import importlib
+import json
+import os
+import sys
+import tempfile
+
+ENTRY_POINT_GROUP = "rh_logger.backend"
+
+_entry_point_map = None
+_registered_backends = {}
+
+
+def get_cache_path():
+    '''The path to the entry point cache file or None if it is turned off'''
+    path = os.environ.get("RH_LOGGER_CACHE")
+    if path is None:
+        path = os.path.join(
+            os.environ.get("XDG_CACHE_HOME",
+                           os.path.join(os.path.expanduser("~"), ".cache")),
+            "rh_logger", "entry_points.json")
+    return path or None
+
+
+def get_environment_key():
+    '''A key that changes when distributions are installed or removed'''
+    mtimes = []
+    for path in sys.path:
+        path = os.path.abspath(path or os.curdir)
+        try:
+            mtimes.append([path, os.stat(path).st_mtime])
+        except OSError:
+            pass
+    return [sys.executable, sys.version, mtimes]
+
+
+def scan_entry_points():
+    '''Scan the installed distributions for backends
+
+    :returns: a dictionary of entry point name to a list of
+    "module:attribute" strings
+    '''
+    result = {}
+    try:
+        try:
+            from importlib import metadata
+        except ImportError:
+            import importlib_metadata as metadata
+        entry_points = metadata.entry_points()
+        if hasattr(entry_points, "select"):
+            entry_points = entry_points.select(group=ENTRY_POINT_GROUP)
+        else:
+            entry_points = entry_points.get(ENTRY_POINT_GROUP, [])
+        for entry_point in entry_points:
+            result.setdefault(entry_point.name, []).append(entry_point.value)
+    except ImportError:
+        import pkg_resources
+        for entry_point in pkg_resources.iter_entry_points(ENTRY_POINT_GROUP):
+            result.setdefault(entry_point.name, []).append(
+                "%s:%s" % (entry_point.module_name,
+                           ".".join(entry_point.attrs)))
+    return result
+
+
+def _read_cache(path, key):
+    try:
+        with open(path) as fd:
+            cache = json.load(fd)
+    except (IOError, OSError, ValueError):
+        return None
+    if not isinstance(cache, dict) or cache.get("key") != key:
+        return None
+    return cache.get("entry_points")
+
+
+def _write_cache(path, key, entry_points):
+    '''Write the cache atomically, ignoring failure'''
+    directory = os.path.dirname(path)
+    try:
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        with os.fdopen(fd, "w") as fd:
+            json.dump(dict(key=key, entry_points=entry_points), fd)
+        os.rename(tmp_path, path)
+    except (IOError, OSError):
+        pass
+
+
+def get_entry_point_map(use_cache=True):
+    '''Return the entry point map, from the cache if it is up to date
+
+    :returns: a dictionary of backend name to a list of "module:attribute"
+    strings
+    '''
+    global _entry_point_map
+    if _entry_point_map is not None and use_cache:
+        return _entry_point_map
+    path = get_cache_path() if use_cache else None
+    if path is not None:
+        key = get_environment_key()
+        entry_points = _read_cache(path, key)
+        if entry_points is None:
+            entry_points = scan_entry_points()
+            _write_cache(path, key, entry_points)
+    else:
+        entry_points = scan_entry_points()
+    _entry_point_map = entry_points
+    return entry_points
+
+
+def register_backend(name, value):
+    '''Add a backend to the entry point map without installing it
+
+    This is for backends that aren't in an installed distribution, such as
+    those of a source checkout run by tests and benchmarks. The
+    registration only lasts for the process.
+
+    :param name: the backend's name
+    :param value: a "module:attribute" string for its get_logger function
+    '''
+    values = _registered_backends.setdefault(name, [])
+    if value not in values:
+        values.append(value)
+
+
+def load_entry_point(value):
+    '''Load the object named by a "module:attribute" string'''
+    module_name, _, attrs = value.partition(":")
+    obj = importlib.import_module(module_name.strip())
+    for attr in attrs.strip().split("."):
+        if attr:
+            obj = getattr(obj, attr)
+    return obj
+
+
+def find_backends(name):
+    '''Return the get_logger functions registered under a backend name
+
+    If the cached map doesn't have the name, the distributions are scanned
+    again in case the cache is stale. Backends added by register_backend
+    take precedence over installed ones.
+    '''
+    if name in _registered_backends:
+        return [load_entry_point(value)
+                for value in _registered_backends[name]]
+    values = get_entry_point_map().get(name)
+    if not values:
+        values = get_entry_point_map(use_cache=False).get(name, [])
+        path = get_cache_path()
+        if path is not None:
+            _write_cache(path, get_environment_key(), _entry_point_map)
+    return [load_entry_point(value) for value in values]
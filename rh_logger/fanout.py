@@ -0,0 +1,279 @@
+'''fanout.py - sending every call to several backends at once
+
+When "logging-backend" is a list, the proxy serves a FanoutLogger. Each
+backend gets a BackendWorker with its own bounded queue and thread, so the
+caller only pays for putting the call on each queue. A slow or failing
+backend fills its own queue and then drops calls without holding up the
+caller or the other backends. start_process, end_process and flush are
+never dropped. Time series are copied before they are queued, so the caller can
+keep adding to or reusing its series.
+
+Each worker counts the calls it made, the calls it dropped because its
+queue was full and the calls that raised, and times each batch of calls
+it takes from the queue. FanoutLogger.get_backend_stats returns these.
+'''
+
+import collections
+import logging
+import sys
+import threading
+import time
+
+import rh_logger.api
+
+DEFAULT_MAX_QUEUE = 10000
+DEFAULT_CLOSE_TIMEOUT = 10.0
+
+log = logging.getLogger("rh_logger.fanout")
+
+'''A snapshot of a BackendWorker's counters
+
+depth: the number of calls waiting in the queue
+calls: the number of calls made to the backend
+dropped: the number of calls dropped because the queue was full
+errors: the number of calls that raised an exception
+last_flush_latency: seconds taken by the last batch of calls
+max_flush_latency: the most seconds taken by any batch of calls
+'''
+BackendStats = collections.namedtuple(
+    "BackendStats", ["depth", "calls", "dropped", "errors",
+                     "last_flush_latency", "max_flush_latency"])
+
+
+class BackendWorker(object):
+    '''A bounded queue of calls and a thread that makes them on a backend'''
+
+    def __init__(self, name, logger, max_queue=DEFAULT_MAX_QUEUE):
+        '''Initialize the worker and start its thread
+
+        :param name: the backend's name, for the thread and stats
+        :param logger: the backend's :py:class: `Logger`
+        :param max_queue: the maximum number of calls to queue. Calls made
+        when the queue is full are dropped.
+        '''
+        self.name = name
+        self.logger = logger
+        self.max_queue = max_queue
+        self.queue = collections.deque()
+        self.condition = threading.Condition()
+        self.closing = False
+        self.n_calls = 0
+        self.n_dropped = 0
+        self.n_errors = 0
+        self.last_flush_latency = 0.0
+        self.max_flush_latency = 0.0
+        self.thread = threading.Thread(
+            target=self.run, name="BackendWorkerThread-%s" % name)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def put(self, method, args, force=False):
+        '''Queue a call of one of the backend's methods
+
+        :param method: the name of the method
+        :param args: a tuple of the arguments
+        :param force: queue the call even if the queue is full
+        '''
+        with self.condition:
+            if len(self.queue) >= self.max_queue and not force:
+                self.n_dropped += 1
+                return
+            self.queue.append((method, args))
+            if len(self.queue) == 1:
+                self.condition.notify()
+
+    def take(self):
+        '''Wait for calls and take all of them from the queue
+
+        :returns: the calls or None if the worker is closing and the queue
+        is empty
+        '''
+        with self.condition:
+            while len(self.queue) == 0 and not self.closing:
+                self.condition.wait()
+            if len(self.queue) == 0:
+                return None
+            calls = list(self.queue)
+            self.queue.clear()
+        return calls
+
+    def run(self):
+        '''Thread for making the calls'''
+        while True:
+            calls = self.take()
+            if calls is None:
+                break
+            start = time.time()
+            for method, args in calls:
+                try:
+                    if method == "flush":
+                        self.flush_backend(*args)
+                    else:
+                        getattr(self.logger, method)(*args)
+                except Exception:
+                    self.n_errors += 1
+                    log.exception("%s backend failed in %s" %
+                                  (self.name, method))
+            self.n_calls += len(calls)
+            self.last_flush_latency = time.time() - start
+            self.max_flush_latency = max(self.max_flush_latency,
+                                         self.last_flush_latency)
+
+    def flush_backend(self, done, result):
+        '''Flush the backend on the worker's thread and say how it went'''
+        try:
+            result.append(self.logger.flush())
+        finally:
+            done.set()
+
+    def request_flush(self):
+        '''Queue a flush of the backend after the calls already queued
+
+        :returns: an Event that is set once the flush is done and a list
+        that then holds what the backend's flush returned
+        '''
+        done = threading.Event()
+        result = []
+        self.put("flush", (done, result), force=True)
+        return done, result
+
+    def get_stats(self):
+        '''Return a :py:class: `BackendStats` of the worker's counters'''
+        with self.condition:
+            depth = len(self.queue)
+        return BackendStats(depth, self.n_calls, self.n_dropped,
+                            self.n_errors, self.last_flush_latency,
+                            self.max_flush_latency)
+
+    def close(self):
+        '''Tell the thread to stop once the queue is empty'''
+        with self.condition:
+            self.closing = True
+            self.condition.notify()
+
+    def join(self, timeout=None):
+        '''Wait for the thread to stop
+
+        :returns: True if it stopped
+        '''
+        self.thread.join(timeout)
+        return not self.thread.is_alive()
+
+
+class FanoutLogger(rh_logger.api.Logger):
+    '''A logger that sends every call to several backends'''
+
+    def __init__(self, loggers, max_queue=DEFAULT_MAX_QUEUE,
+                 close_timeout=DEFAULT_CLOSE_TIMEOUT):
+        '''Initialize the fan-out
+
+        :param loggers: a sequence of (backend name, logger) pairs
+        :param max_queue: the maximum number of calls to queue per backend
+        :param close_timeout: how long end_process waits for the backends
+        to finish
+        '''
+        self.workers = [BackendWorker(name, logger, max_queue)
+                        for name, logger in loggers]
+        self.close_timeout = close_timeout
+
+    def dispatch(self, method, *args):
+        for worker in self.workers:
+            worker.put(method, args)
+
+    def dispatch_always(self, method, *args):
+        '''Dispatch a call that is never dropped'''
+        for worker in self.workers:
+            worker.put(method, args, force=True)
+
+    def start_process(self, name, msg, args=None):
+        self.dispatch_always("start_process", name, msg, args)
+
+    def end_process(self, msg, exit_code):
+        '''Send end_process to every backend and wait for them to finish
+
+        Every backend gets up to close_timeout seconds, all at the same
+        time, so a stuck backend delays the others' shutdown by at most
+        that long.
+        '''
+        self.dispatch_always("end_process", msg, exit_code)
+        for worker in self.workers:
+            worker.close()
+        deadline = time.time() + self.close_timeout
+        for worker in self.workers:
+            if not worker.join(max(deadline - time.time(), 0)):
+                log.warning("%s backend did not finish within %.1f sec" %
+                            (worker.name, self.close_timeout))
+
+    def flush(self):
+        '''Wait up to close_timeout for every backend to flush'''
+        deadline = time.time() + self.close_timeout
+        requests = [(worker, ) + worker.request_flush()
+                    for worker in self.workers]
+        flushed = True
+        for worker, done, result in requests:
+            if not done.wait(max(deadline - time.time(), 0)):
+                log.warning("%s backend did not flush within %.1f sec" %
+                            (worker.name, self.close_timeout))
+            flushed = flushed and result == [True]
+        return flushed
+
+    def report_metric(self, name, metric, subcontext=None):
+        self.dispatch("report_metric", name, metric, subcontext)
+
+    def report_metrics(self, name, time_series, context=None):
+        self.dispatch("report_metrics", name, time_series.copy(), context)
+
+    def report_count(self, name, count, context=None, timestamp=None):
+        self.dispatch("report_count", name, count, context, timestamp)
+
+    def report_event(self, event, context=None, log_level=None):
+        self.dispatch("report_event", event, context, log_level)
+
+    def report_events(self, events, context=None, log_level=None,
+                      title=None):
+        self.dispatch("report_events", list(events), context, log_level,
+                      title)
+
+    def report_spans(self, spans):
+        self.dispatch("report_spans", spans)
+
+    def bind_context(self, context):
+        '''Let every backend normalize the context'''
+        return [worker.logger.bind_context(context)
+                for worker in self.workers]
+
+    def report_bound_metric(self, name, metric, bound):
+        for worker, b in zip(self.workers, bound):
+            worker.put("report_bound_metric", (name, metric, b))
+
+    def report_bound_metrics(self, name, time_series, bound):
+        time_series = time_series.copy()
+        for worker, b in zip(self.workers, bound):
+            worker.put("report_bound_metrics", (name, time_series, b))
+
+    def report_bound_event(self, event, bound, log_level=None):
+        for worker, b in zip(self.workers, bound):
+            worker.put("report_bound_event", (event, b, log_level))
+
+    def report_exception(self, exception=None, msg=None):
+        '''Report an exception
+
+        The backends run on other threads, so the exception is taken from
+        sys.exc_info() here if it isn't given. Its traceback goes with it
+        as its __traceback__, which Python 3 sets and which is set here on
+        Python 2.
+        '''
+        if exception is None:
+            exc_type, exception, tb = sys.exc_info()
+            if exception is not None and \
+               getattr(exception, "__traceback__", None) is None:
+                try:
+                    exception.__traceback__ = tb
+                except (AttributeError, TypeError):
+                    pass
+        self.dispatch("report_exception", exception, msg)
+
+    def get_backend_stats(self):
+        '''Return a dictionary of backend name to :py:class: `BackendStats`'''
+        return dict([(worker.name, worker.get_stats())
+                     for worker in self.workers])
@@ -0,0 +1,139 @@
+'''fingerprint.py - grouping repeated exceptions
+
+An exception's fingerprint is its type and the chain of code locations in
+its traceback, the (filename, function, line number) of each frame. This
+is read straight from the traceback objects, without formatting the trace
+or reading source lines, so it is cheap enough to compute for every
+exception. The same exception thrown from the same place has the same
+fingerprint in every process. An exception that was never raised has no
+traceback, so its message is part of its fingerprint instead.
+
+logger.report_exception sends the full report, with the formatted
+traceback, only the first time a fingerprint is seen in each window. The
+repeats inside the window are counted in process and reported through
+report_count, as "exception.repeats.<fingerprint>" with the exception's
+type name as the context, once per "timer-flush-interval". The Datadog and
+default backends tag each full report with its fingerprint, so that the
+counts can be matched to a traceback.
+
+rh-logger:
+    # seconds from a fingerprint's full report until the next one. 0 to
+    # report every exception in full.
+    exception-window: 60
+'''
+
+import hashlib
+import sys
+import threading
+import time
+
+'''The default number of seconds between full reports of a fingerprint'''
+DEFAULT_WINDOW = 60.0
+
+'''The maximum number of fingerprints to keep before forgetting old ones'''
+MAX_FINGERPRINTS = 10000
+
+
+def exception_key(exc_type, tb, exception=None):
+    '''The type and code location chain of an exception
+
+    :param exc_type: the exception's class
+    :param tb: the exception's traceback or None
+    :param exception: the exception. Its message is used if there is no
+    traceback, so that exceptions that were never raised, such as the
+    ones rh-logger-ship replays, aren't all taken for repeats.
+    :returns: a hashable (exc_type, ((filename, name, lineno), ...),
+    message) tuple. message is None if there is a traceback.
+    '''
+    frames = []
+    while tb is not None:
+        code = tb.tb_frame.f_code
+        frames.append((code.co_filename, code.co_name, tb.tb_lineno))
+        tb = tb.tb_next
+    message = None
+    if len(frames) == 0:
+        message = "" if exception is None else str(exception)
+    return exc_type, tuple(frames), message
+
+
+def fingerprint_key(key):
+    '''The fingerprint of a key from exception_key as 12 hex digits'''
+    exc_type, frames, message = key
+    lines = ["%s.%s" % (exc_type.__module__, exc_type.__name__)] + \
+        ["%s:%s:%d" % frame for frame in frames]
+    if message is not None:
+        lines.append(message)
+    text = "\n".join(lines)
+    if not isinstance(text, bytes):
+        text = text.encode("utf-8")
+    return hashlib.md5(text).hexdigest()[:12]
+
+
+def fingerprint(exc_type, tb, exception=None):
+    '''The fingerprint of an exception's type and traceback'''
+    return fingerprint_key(exception_key(exc_type, tb, exception))
+
+
+def get_exception_info(exception=None):
+    '''The type, the exception and the traceback of an exception
+
+    :param exception: the exception or None for the one in sys.exc_info()
+    :returns: (exc_type, exception, tb) like sys.exc_info(). All are None
+    if there is no exception.
+    '''
+    if exception is None:
+        return sys.exc_info()
+    return (type(exception), exception,
+            getattr(exception, "__traceback__", None))
+
+
+class ExceptionFingerprinter(object):
+    '''Decides which exceptions are reported in full
+
+    An exception is reported in full if its fingerprint hasn't been
+    reported in the last "window" seconds. Otherwise it is a repeat.
+    '''
+
+    def __init__(self, window=DEFAULT_WINDOW, clock=time.time):
+        '''Initialize the fingerprinter
+
+        :param window: seconds from a fingerprint's full report until the
+        next one
+        :param clock: the function giving the current time
+        '''
+        self.window = window
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.reported = {}
+
+    def check(self, exc_type, tb, exception=None):
+        '''Fingerprint an exception and decide whether to report it in full
+
+        :param exc_type: the exception's class
+        :param tb: the exception's traceback or None
+        :param exception: the exception, whose message is used if there is
+        no traceback
+        :returns: a (fingerprint, first) tuple where first is True if the
+        exception should be reported in full
+        '''
+        key = exception_key(exc_type, tb, exception)
+        now = self.clock()
+        with self.lock:
+            entry = self.reported.get(key)
+            if entry is not None and now - entry[1] < self.window:
+                return entry[0], False
+            if entry is None:
+                if len(self.reported) >= MAX_FINGERPRINTS:
+                    self.prune(now)
+                entry = self.reported[key] = [fingerprint_key(key), now]
+            else:
+                entry[1] = now
+            return entry[0], True
+
+    def prune(self, now):
+        '''Forget fingerprints whose window has passed'''
+        for key, (_, reported) in list(self.reported.items()):
+            if now - reported >= self.window:
+                del self.reported[key]
+        if len(self.reported) >= MAX_FINGERPRINTS:
+            self.reported.clear()
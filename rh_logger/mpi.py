@@ -0,0 +1,283 @@
+'''mpi.py - MPI rank discovery and combining metrics across ranks
+
+The rank and number of ranks are found without initializing MPI where
+possible: get_rank_and_size tries each registered rank detector in turn.
+The default detectors read the environment variables set by the common
+MPI launchers and SLURM, then ask mpi4py, but only if the application has
+already imported it. A serial process never imports mpi4py. SLURM and PMI
+set their variables for every task of "srun -n N", MPI or not, so they are
+only used when the job is known to be MPI: an MPI launcher's own variables
+are set, mpi4py has been imported or RH_LOGGER_MPI is set to 1.
+get_comm imports mpi4py and is only called when a collective is needed.
+
+Each rank accumulates its metrics locally in a MetricReducer. The reducer
+gathers the per-name count, sum, minimum, maximum, mean and variance from
+every rank to rank 0 in one collective, merges them and hands rank 0 the
+global statistics together with the ranks whose mean is an outlier.
+
+The reduction runs at end_process and, if an interval is given and MPI
+supports calls from multiple threads, periodically from a background
+thread. Reductions use their own duplicate of the communicator so that they
+never interfere with the application's communication. Without an interval,
+the communicator is only duplicated at end_process, so a reducer can be
+made on any rank at any time without waiting for the others. The caller's
+thread never waits on the collective except at end_process, which must be
+called by every rank.
+'''
+
+import logging
+import math
+import os
+import sys
+import threading
+
+from rh_logger.stats import RunningStats
+
+log = logging.getLogger("rh_logger.mpi")
+
+'''Ranks whose mean is more than this many standard deviations from the
+mean of all ranks are reported as outliers.'''
+DEFAULT_OUTLIER_SIGMA = 3.0
+
+
+'''Pairs of environment variables that hold the rank and number of ranks,
+in the order they are checked. Only MPI launchers set these.'''
+RANK_ENVIRONMENT_VARIABLES = [
+    ("OMPI_COMM_WORLD_RANK", "OMPI_COMM_WORLD_SIZE"),
+    ("PMIX_RANK", "PMIX_SIZE"),
+    ("MV2_COMM_WORLD_RANK", "MV2_COMM_WORLD_SIZE")]
+
+'''Pairs of environment variables set for every task a process manager
+starts, whether or not it is an MPI rank'''
+TASK_ENVIRONMENT_VARIABLES = [
+    ("PMI_RANK", "PMI_SIZE"),
+    ("SLURM_PROCID", "SLURM_NTASKS")]
+
+'''Set this environment variable to 1 to say that the process is an MPI
+rank when only the TASK_ENVIRONMENT_VARIABLES are set'''
+MPI_ENVIRONMENT_VARIABLE = "RH_LOGGER_MPI"
+
+
+def is_mpi_job():
+    '''True if something other than the process manager says this is MPI'''
+    if os.environ.get(MPI_ENVIRONMENT_VARIABLE, "0") not in ("", "0"):
+        return True
+    return "mpi4py" in sys.modules
+
+
+def environment_rank_detector():
+    '''Find the rank and size from the launcher's environment variables'''
+    variables = RANK_ENVIRONMENT_VARIABLES
+    if is_mpi_job():
+        variables = variables + TASK_ENVIRONMENT_VARIABLES
+    for rank_variable, size_variable in variables:
+        if rank_variable in os.environ:
+            return (int(os.environ[rank_variable]),
+                    int(os.environ.get(size_variable, 1)))
+    return None
+
+
+def mpi4py_rank_detector():
+    '''Ask mpi4py for the rank and size if the application imported it'''
+    if "mpi4py.MPI" not in sys.modules:
+        return None
+    comm = sys.modules["mpi4py.MPI"].COMM_WORLD
+    return comm.Get_rank(), comm.Get_size()
+
+_rank_detectors = [environment_rank_detector, mpi4py_rank_detector]
+_rank_and_size = None
+
+
+def register_rank_detector(detector):
+    '''Add a function that finds the rank and number of ranks
+
+    :param detector: a function that takes no arguments and returns a
+    tuple of the rank and number of ranks or None if it can't tell.
+    Detectors are tried most recently registered first.
+    '''
+    global _rank_and_size
+    _rank_detectors.insert(0, detector)
+    _rank_and_size = None
+
+
+def get_rank_and_size():
+    '''Return the rank of this process and the number of ranks
+
+    A process that no detector recognizes is rank 0 of 1.
+    '''
+    global _rank_and_size
+    if _rank_and_size is None:
+        for detector in _rank_detectors:
+            result = detector()
+            if result is not None:
+                break
+        else:
+            result = (0, 1)
+        _rank_and_size = result
+    return _rank_and_size
+
+
+def get_comm():
+    '''Return MPI.COMM_WORLD, initializing MPI if need be'''
+    from mpi4py import MPI
+    return MPI.COMM_WORLD
+
+
+def pack_stats(stats):
+    '''Convert a RunningStats to a tuple for sending'''
+    return (stats.count, stats.total, stats.min, stats.max, stats.mean,
+            stats.m2)
+
+
+def unpack_stats(packed):
+    '''Convert a tuple made by pack_stats back into a RunningStats'''
+    stats = RunningStats()
+    stats.count, stats.total, stats.min, stats.max, stats.mean, stats.m2 = \
+        packed
+    return stats
+
+
+def reduce_payloads(payloads, outlier_sigma=DEFAULT_OUTLIER_SIGMA):
+    '''Merge the metrics of all ranks
+
+    :param payloads: a sequence, indexed by rank, of dictionaries of metric
+    name to packed statistics
+    :param outlier_sigma: report ranks whose mean is more than this many
+    standard deviations from the mean of the per-rank means.
+    :returns: a dictionary of metric name to merged RunningStats and a
+    dictionary of metric name to a list of (rank, rank's mean) outliers.
+    '''
+    merged = {}
+    rank_means = {}
+    for rank, payload in enumerate(payloads):
+        for name, packed in payload.items():
+            stats = unpack_stats(packed)
+            if name not in merged:
+                merged[name] = RunningStats()
+                rank_means[name] = []
+            merged[name].merge(stats)
+            rank_means[name].append((rank, stats.mean))
+    outliers = {}
+    for name, means in rank_means.items():
+        if len(means) < 3:
+            continue
+        across = RunningStats()
+        for rank, mean in means:
+            across.add(mean)
+        sigma = math.sqrt(across.variance)
+        if sigma == 0:
+            continue
+        outliers[name] = [
+            (rank, mean) for rank, mean in means
+            if abs(mean - across.mean) > outlier_sigma * sigma]
+        if len(outliers[name]) == 0:
+            del outliers[name]
+    return merged, outliers
+
+
+class MetricReducer(object):
+    '''Accumulate metrics on every rank and report the totals on rank 0'''
+
+    def __init__(self, comm, report, interval=None,
+                 outlier_sigma=DEFAULT_OUTLIER_SIGMA):
+        '''Initialize the reducer
+
+        :param comm: the MPI communicator for the ranks
+        :param report: a function that is called on rank 0 with the
+        merged statistics and outliers returned by :py:func: `reduce_payloads`
+        :param interval: seconds between reductions or None to reduce only
+        at :py:meth: `close`. With an interval, the communicator is
+        duplicated here, which every rank must do at the same point.
+        :param outlier_sigma: see :py:func: `reduce_payloads`
+        '''
+        self.parent_comm = comm
+        self.comm = None
+        self.rank = comm.Get_rank()
+        self.report = report
+        self.outlier_sigma = outlier_sigma
+        self.lock = threading.Lock()
+        self.local = {}
+        self.stopping = threading.Event()
+        self.thread = None
+        if interval is not None:
+            from mpi4py import MPI
+            if MPI.Query_thread() == MPI.THREAD_MULTIPLE:
+                self.comm = comm.Dup()
+                self.thread = threading.Thread(
+                    target=self.run, args=(interval, ),
+                    name="MetricReducerThread")
+                self.thread.daemon = True
+                self.thread.start()
+            else:
+                log.warning("MPI does not support MPI_THREAD_MULTIPLE: "
+                            "metrics will only be combined at end_process")
+
+    def add(self, name, value):
+        '''Add a value to the local statistics for a metric'''
+        with self.lock:
+            stats = self.local.get(name)
+            if stats is None:
+                stats = self.local[name] = RunningStats()
+            stats.add(value)
+
+    def add_many(self, name, values):
+        '''Add a sequence of values to the local statistics for a metric'''
+        self.merge(name, None, values)
+
+    def merge(self, name, stats, values=None):
+        '''Merge a RunningStats or a sequence of values into a metric'''
+        if stats is None:
+            stats = RunningStats()
+            stats.add_many(values)
+        with self.lock:
+            local = self.local.get(name)
+            if local is None:
+                local = self.local[name] = RunningStats()
+            local.merge(stats)
+
+    def reduce(self, final):
+        '''Combine every rank's metrics and report them on rank 0
+
+        This is collective: every rank must call it.
+
+        :param final: True if this rank has no more metrics to report
+        :returns: True if every rank has no more metrics to report
+        '''
+        if self.comm is None:
+            self.comm = self.parent_comm.Dup()
+        with self.lock:
+            local, self.local = self.local, {}
+        payload = dict([(name, pack_stats(stats))
+                        for name, stats in local.items()])
+        gathered = self.comm.gather((final, payload), root=0)
+        if self.rank == 0:
+            all_final = all([_[0] for _ in gathered])
+            merged, outliers = reduce_payloads(
+                [_[1] for _ in gathered], self.outlier_sigma)
+            if len(merged) > 0:
+                try:
+                    self.report(merged, outliers)
+                except Exception:
+                    log.exception("Failed to report combined metrics")
+        else:
+            all_final = None
+        return self.comm.bcast(all_final, root=0)
+
+    def run(self, interval):
+        '''Thread for periodic reduction'''
+        final = False
+        while True:
+            if not final:
+                final = self.stopping.wait(interval)
+            if self.reduce(final):
+                break
+
+    def close(self):
+        '''Do the last reduction. Every rank must call this.'''
+        if self.thread is not None:
+            self.stopping.set()
+            self.thread.join()
+        else:
+            self.reduce(True)
+        self.comm.Free()
+        self.comm = None
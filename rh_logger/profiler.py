@@ -0,0 +1,250 @@
+'''profiler.py - a sampling profiler that reports hot functions as metrics
+
+The profiler runs a thread that looks at the stacks of the profiled
+threads every "interval" seconds with sys._current_frames. For each
+function, it counts the samples in which the function was running (self)
+and the samples in which it was anywhere on the stack (cumulative). Every
+"report-interval" seconds, it reports the top functions as the percentage
+of samples through report_metrics, as a TimeSeries named
+"profile.self.<module>.<function>" or "profile.cumulative.<module>.<function>".
+At end_process it writes every stack it saw, in the collapsed format read by
+flamegraph.pl and speedscope, one "frame;frame;frame count" line per stack.
+
+The profiler times its own sampling. When sampling takes more than
+"max-overhead" of the wall-clock time, it doubles the interval, and halves
+it again when the overhead falls well below the limit. The overhead, the
+number of samples and the current interval are reported with the hot
+functions as profile.overhead (percent), profile.samples and
+profile.interval.
+
+Start it with logger.start_process(..., profile=True) or in the config:
+
+rh-logger:
+    profile:
+        # seconds between samples
+        interval: 0.01
+        # seconds between reports
+        report-interval: 60
+        # the number of functions to report
+        top: 10
+        # the largest fraction of wall-clock time to spend sampling
+        max-overhead: 0.01
+        # "main" samples the thread that called start_process, "all"
+        # samples every thread
+        threads: main
+        # the collapsed-stack file. Default is <name>-<pid>.collapsed
+        output: profile.collapsed
+'''
+
+import collections
+import os
+import re
+import sys
+import threading
+import time
+
+import rh_logger.api
+
+DEFAULT_INTERVAL = 0.01
+DEFAULT_REPORT_INTERVAL = 60.0
+DEFAULT_TOP = 10
+DEFAULT_MAX_OVERHEAD = 0.01
+MAX_INTERVAL = 1.0
+MAX_DEPTH = 256
+
+MAIN = "main"
+ALL = "all"
+
+try:
+    from time import perf_counter as clock
+except ImportError:
+    from timeit import default_timer as clock
+
+
+class _Function(object):
+    '''What the profiler knows about a code object'''
+
+    __slots__ = ["label", "frame"]
+
+    def __init__(self, code):
+        module = os.path.splitext(os.path.basename(code.co_filename))[0]
+        self.label = re.sub(r"[^\w.]", "_", "%s.%s" % (module, code.co_name))
+        self.frame = "%s (%s:%d)" % (
+            code.co_name, code.co_filename, code.co_firstlineno)
+
+
+class SamplingProfiler(object):
+    '''Sample the stacks of threads and count the functions on them'''
+
+    def __init__(self, logger=None, interval=DEFAULT_INTERVAL,
+                 report_interval=DEFAULT_REPORT_INTERVAL, top=DEFAULT_TOP,
+                 max_overhead=DEFAULT_MAX_OVERHEAD, threads=MAIN,
+                 output=None):
+        '''Initialize the profiler
+
+        :param logger: the :py:class: `Logger` that gets the reports or None
+        to only collect
+        :param interval: seconds between samples
+        :param report_interval: seconds between reports
+        :param top: the number of functions to report
+        :param max_overhead: the largest fraction of time to spend sampling
+        :param threads: "main" to sample the thread that calls start() or
+        "all" to sample every thread but the profiler's
+        :param output: the path of the collapsed-stack file written by stop()
+        '''
+        if threads not in (MAIN, ALL):
+            raise ValueError("threads must be \"main\" or \"all\"")
+        self.logger = logger
+        self.base_interval = self.interval = interval
+        self.report_interval = report_interval
+        self.top = top
+        self.max_overhead = max_overhead
+        self.threads = threads
+        self.output = output
+        self.functions = {}
+        self.stacks = collections.Counter()
+        self.self_counts = collections.Counter()
+        self.cumulative_counts = collections.Counter()
+        self.n_samples = 0
+        self.window_samples = 0
+        self.sampling_time = 0.0
+        self.elapsed = 0.0
+        self.thread = None
+        self.stopping = threading.Event()
+
+    def start(self):
+        '''Start sampling from a background thread'''
+        self.target_ident = threading.current_thread().ident
+        self.thread = threading.Thread(target=self.run,
+                                       name="SamplingProfilerThread")
+        self.thread.daemon = True
+        self.thread.start()
+
+    def function(self, code):
+        function = self.functions.get(code)
+        if function is None:
+            function = self.functions[code] = _Function(code)
+        return function
+
+    def sample(self):
+        '''Take one sample of every profiled thread'''
+        own = threading.current_thread().ident
+        frames = sys._current_frames()
+        if self.threads == MAIN:
+            frame = frames.get(self.target_ident)
+            frames = {} if frame is None else {self.target_ident: frame}
+        for ident, frame in frames.items():
+            if ident == own:
+                continue
+            stack = []
+            depth = 0
+            while frame is not None and depth < MAX_DEPTH:
+                stack.append(self.function(frame.f_code))
+                frame = frame.f_back
+                depth += 1
+            if len(stack) == 0:
+                continue
+            self.self_counts[stack[0].label] += 1
+            for label in set([_.label for _ in stack]):
+                self.cumulative_counts[label] += 1
+            self.stacks[";".join([_.frame for _ in reversed(stack)])] += 1
+            self.n_samples += 1
+            self.window_samples += 1
+
+    def run(self):
+        '''Thread for sampling and reporting'''
+        start = last = clock()
+        next_report = start + self.report_interval
+        while not self.stopping.wait(self.interval):
+            t0 = clock()
+            self.sample()
+            t1 = clock()
+            self.sampling_time += t1 - t0
+            self.elapsed = t1 - start
+            self.adjust_interval()
+            if t1 >= next_report:
+                self.report()
+                next_report = t1 + self.report_interval
+
+    def adjust_interval(self):
+        '''Keep the time spent sampling under max_overhead'''
+        overhead = self.overhead
+        if overhead > self.max_overhead and self.interval < MAX_INTERVAL:
+            self.interval = min(self.interval * 2, MAX_INTERVAL)
+        elif overhead < self.max_overhead / 4 and \
+                self.interval > self.base_interval:
+            self.interval = max(self.interval / 2, self.base_interval)
+
+    @property
+    def overhead(self):
+        '''The fraction of wall-clock time spent sampling'''
+        if self.elapsed <= 0:
+            return 0.0
+        return self.sampling_time / self.elapsed
+
+    def top_functions(self, counts, n=None):
+        '''The n functions with the most samples
+
+        :param counts: self_counts or cumulative_counts
+        :returns: a list of (label, percentage of samples)
+        '''
+        if self.window_samples == 0:
+            return []
+        return [(label, 100.0 * count / self.window_samples)
+                for label, count in counts.most_common(n or self.top)]
+
+    def report(self):
+        '''Report the top functions since the last report and reset them'''
+        if self.logger is None or self.window_samples == 0:
+            return
+        now = time.time()
+        for kind, counts in (("self", self.self_counts),
+                             ("cumulative", self.cumulative_counts)):
+            for label, percentage in self.top_functions(counts):
+                series = rh_logger.api.TimeSeries()
+                series.report_metrics([percentage], [now])
+                self.logger.report_metrics(
+                    "profile.%s.%s" % (kind, label), series)
+        self.logger.report_metric("profile.overhead", 100 * self.overhead)
+        self.logger.report_metric("profile.samples", self.window_samples)
+        self.logger.report_metric("profile.interval", self.interval)
+        self.self_counts.clear()
+        self.cumulative_counts.clear()
+        self.window_samples = 0
+
+    def write_collapsed(self, path):
+        '''Write the stacks seen so far in the collapsed-stack format'''
+        with open(path, "w") as fd:
+            for stack, count in sorted(self.stacks.items()):
+                fd.write("%s %d\n" % (stack, count))
+
+    def stop(self):
+        '''Stop sampling, report and write the collapsed-stack file'''
+        if self.thread is None:
+            return
+        self.stopping.set()
+        self.thread.join()
+        self.thread = None
+        self.report()
+        if self.output is not None:
+            self.write_collapsed(self.output)
+
+
+def make_profiler(logger, name, config):
+    '''Make a profiler from the "profile" section of the config
+
+    :param logger: the logger that gets the reports
+    :param name: the process name, for the default output file
+    :param config: the section or True for the defaults
+    '''
+    if not isinstance(config, dict):
+        config = {}
+    return SamplingProfiler(
+        logger,
+        interval=config.get("interval", DEFAULT_INTERVAL),
+        report_interval=config.get("report-interval", DEFAULT_REPORT_INTERVAL),
+        top=config.get("top", DEFAULT_TOP),
+        max_overhead=config.get("max-overhead", DEFAULT_MAX_OVERHEAD),
+        threads=config.get("threads", MAIN),
+        output=config.get("output", "%s-%d.collapsed" % (
+            re.sub(r"[^\w.]", "_", name), os.getpid())))
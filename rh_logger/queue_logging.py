@@ -0,0 +1,88 @@
+'''queue_logging.py - writing log records from a background thread
+
+BackgroundLogWriter takes the handlers off a logger and gives them to a
+writer thread. The logger gets a DeferredQueueHandler in their place, which
+puts each record on a bounded queue without formatting it, so the caller
+neither formats the message nor waits for slow handlers such as files on
+network storage. The writer thread formats and emits the records.
+
+This is the same arrangement as logging.handlers.QueueHandler and
+QueueListener, except that the record is not formatted on the caller's
+thread, a full queue drops the record and counts it rather than raising,
+and it works on Pythons that don't have those classes. Because formatting is
+deferred, arguments that are changed after the logging call may show their
+new values.
+'''
+
+import logging
+import threading
+
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+
+DEFAULT_QUEUE_SIZE = 100000
+
+
+class DeferredQueueHandler(logging.Handler):
+    '''Put records on a queue as they are, for a BackgroundLogWriter'''
+
+    def __init__(self, record_queue):
+        logging.Handler.__init__(self)
+        self.queue = record_queue
+        self.n_dropped = 0
+
+    def emit(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.n_dropped += 1
+
+
+class BackgroundLogWriter(object):
+    '''Emit a logger's records through its handlers on a writer thread'''
+
+    def __init__(self, logger=None, queue_size=DEFAULT_QUEUE_SIZE):
+        '''Move the logger's handlers to the writer thread and start it
+
+        :param logger: the logger whose handlers should be moved. Default is
+        the root logger.
+        :param queue_size: the maximum number of records waiting to be
+        written. Records logged when the queue is full are dropped.
+        '''
+        self.logger = logging.getLogger() if logger is None else logger
+        self.queue = queue.Queue(queue_size)
+        self.handlers = list(self.logger.handlers)
+        self.handler = DeferredQueueHandler(self.queue)
+        for handler in self.handlers:
+            self.logger.removeHandler(handler)
+        self.logger.addHandler(self.handler)
+        self.thread = threading.Thread(target=self.run,
+                                       name="BackgroundLogWriterThread")
+        self.thread.daemon = True
+        self.thread.start()
+
+    @property
+    def n_dropped(self):
+        '''The number of records dropped because the queue was full'''
+        return self.handler.n_dropped
+
+    def run(self):
+        '''Thread for writing records'''
+        while True:
+            record = self.queue.get()
+            if record is None:
+                break
+            for handler in self.handlers:
+                if record.levelno >= handler.level:
+                    handler.handle(record)
+
+    def stop(self):
+        '''Write every queued record and give the handlers back'''
+        self.logger.removeHandler(self.handler)
+        self.queue.put(None)
+        self.thread.join()
+        for handler in self.handlers:
+            handler.flush()
+            self.logger.addHandler(handler)
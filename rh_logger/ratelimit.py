@@ -0,0 +1,235 @@
+'''ratelimit.py - limiting and coalescing repeated events
+
+EventLimiter keeps a token bucket per (event, log level). An event is
+reported while its bucket has tokens. After that, repeats are suppressed
+and counted, and once the coalescing window has passed since the first
+suppressed repeat, the backend reports a single CoalescedEvent with the
+number of repeats and the times of the first and last. Due summaries are
+handed out by pop_due, which backends call as events arrive and, with
+force=True, at end_process. A limiter made with a report function also
+runs a timer for the next summary that is due, so that a summary is
+reported when its window passes even if no more events arrive.
+
+Backends make a limiter from the "event-rate-limit" entry of their config
+section:
+
+rh-logger:
+    default:
+        event-rate-limit:
+            # events per second allowed for each event and level
+            rate: 1
+            # events allowed in a burst before limiting starts
+            burst: 10
+            # seconds of repeats to coalesce into one summary
+            window: 60
+'''
+
+import collections
+import logging
+import threading
+import time
+
+DEFAULT_RATE = 1.0
+DEFAULT_BURST = 10
+DEFAULT_WINDOW = 60.0
+
+'''The maximum number of buckets to keep before forgetting idle ones'''
+MAX_BUCKETS = 10000
+
+log = logging.getLogger("rh_logger.ratelimit")
+
+'''A summary of suppressed repeats of an event
+
+event: the event
+context: the context of the first suppressed repeat
+log_level: the log level
+count: the number of suppressed repeats
+first: the time of the first suppressed repeat
+last: the time of the last suppressed repeat
+'''
+CoalescedEvent = collections.namedtuple(
+    "CoalescedEvent",
+    ["event", "context", "log_level", "count", "first", "last"])
+
+
+class _Bucket(object):
+    __slots__ = ["tokens", "updated", "count", "context", "first", "last"]
+
+    def __init__(self, tokens, now):
+        self.tokens = tokens
+        self.updated = now
+        self.count = 0
+        self.context = None
+        self.first = None
+        self.last = None
+
+
+class EventLimiter(object):
+    '''A token bucket and coalescing window per (event, log level)'''
+
+    def __init__(self, rate=DEFAULT_RATE, burst=DEFAULT_BURST,
+                 window=DEFAULT_WINDOW, clock=time.time, report=None):
+        '''Initialize the limiter
+
+        :param rate: the number of events per second allowed for each
+        event and level
+        :param burst: the number of events allowed at once
+        :param window: seconds from the first suppressed repeat until its
+        summary is due
+        :param clock: the function giving the current time
+        :param report: a function that is called, on a timer thread, with
+        the list of summaries that became due, or None to only hand them
+        out through pop_due
+        '''
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self.window = window
+        self.clock = clock
+        self.report = report
+        self.lock = threading.Lock()
+        self.buckets = {}
+        self.next_due = None
+        self.timer = None
+        self.timer_due = None
+        self.reporting = None
+
+    def allow(self, event, context=None, log_level=None):
+        '''Decide whether to report an event
+
+        :returns: True to report it now, False if it is suppressed and will
+        be counted in a summary
+        '''
+        now = self.clock()
+        key = (event, log_level)
+        with self.lock:
+            bucket = self.buckets.get(key)
+            if bucket is None:
+                if len(self.buckets) >= MAX_BUCKETS:
+                    self.prune(now)
+                bucket = self.buckets[key] = _Bucket(self.burst, now)
+            else:
+                bucket.tokens = min(
+                    self.burst,
+                    bucket.tokens + (now - bucket.updated) * self.rate)
+                bucket.updated = now
+            if bucket.tokens >= 1:
+                bucket.tokens -= 1
+                return True
+            if bucket.count == 0:
+                bucket.context = context
+                bucket.first = now
+                due = now + self.window
+                if self.next_due is None or due < self.next_due:
+                    self.next_due = due
+                    self.schedule()
+            bucket.count += 1
+            bucket.last = now
+            return False
+
+    def prune(self, now):
+        '''Forget buckets that are full and have nothing suppressed'''
+        for key, bucket in list(self.buckets.items()):
+            if bucket.count == 0 and bucket.tokens + \
+               (now - bucket.updated) * self.rate >= self.burst:
+                del self.buckets[key]
+
+    def pop_due(self, force=False):
+        '''Return the summaries whose window has passed
+
+        :param force: return every summary, due or not
+        :returns: a list of :py:class: `CoalescedEvent`
+        '''
+        if self.next_due is None or \
+           (not force and self.clock() < self.next_due):
+            return []
+        with self.lock:
+            result = self.take_due(force)
+            self.schedule()
+        return result
+
+    def take_due(self, force):
+        '''Remove the due summaries. The caller holds the lock.'''
+        now = self.clock()
+        result = []
+        self.next_due = None
+        for (event, log_level), bucket in self.buckets.items():
+            if bucket.count == 0:
+                continue
+            due = bucket.first + self.window
+            if force or due <= now:
+                result.append(CoalescedEvent(
+                    event, bucket.context, log_level, bucket.count,
+                    bucket.first, bucket.last))
+                bucket.count = 0
+                bucket.context = None
+            elif self.next_due is None or due < self.next_due:
+                self.next_due = due
+        result.sort(key=lambda _: _.first)
+        return result
+
+    def schedule(self):
+        '''Set the timer for next_due. The caller holds the lock.'''
+        if self.report is None or \
+           (self.timer is not None and self.timer_due == self.next_due):
+            return
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        if self.next_due is None:
+            return
+        self.timer_due = self.next_due
+        self.timer = threading.Timer(max(self.next_due - self.clock(), 0),
+                                     self.on_timer)
+        self.timer.daemon = True
+        self.timer.start()
+
+    def on_timer(self):
+        '''Report the summaries that are due and set the next timer
+
+        Once close has been called, the summaries are left for the final
+        pop_due.
+        '''
+        with self.lock:
+            if self.timer is threading.current_thread():
+                self.timer = None
+            report = self.report
+            if report is None:
+                return
+            summaries = self.take_due(False)
+            self.reporting = threading.current_thread()
+        try:
+            if len(summaries) > 0:
+                report(summaries)
+        except Exception:
+            log.exception("Failed to report coalesced events")
+        with self.lock:
+            self.reporting = None
+            self.schedule()
+
+    def close(self):
+        '''Stop the timer, waiting for a report in progress to finish'''
+        with self.lock:
+            self.report = None
+            timer, self.timer = self.timer, None
+            reporting = self.reporting
+        if timer is not None:
+            timer.cancel()
+        for thread in (timer, reporting):
+            if thread is not None and thread is not threading.current_thread():
+                thread.join()
+
+
+def make_event_limiter(config, report=None):
+    '''Make an EventLimiter from a backend's config section
+
+    :param report: the function that reports summaries when they are due.
+    See :py:class: `EventLimiter`.
+    :returns: the limiter or None if the section has no "event-rate-limit"
+    '''
+    limit = config.get("event-rate-limit")
+    if limit is None:
+        return None
+    return EventLimiter(rate=limit.get("rate", DEFAULT_RATE),
+                        burst=limit.get("burst", DEFAULT_BURST),
+                        window=limit.get("window", DEFAULT_WINDOW),
+                        report=report)
@@ -0,0 +1,263 @@
+'''resources.py - sampling the process's resource use from /proc
+
+ResourceSampler runs a thread that reads /proc/self/stat, /proc/self/status
+and /proc/self/io every "interval" seconds. It adds each reading to a
+TimeSeries per metric and reports the series through report_metrics every
+"flush-interval" seconds and when it stops. The files are opened once and
+reread from the start, and only the fields below are parsed, so a sample
+costs a few tens of microseconds.
+
+Gauges, reported as read:
+
+resources.rss: resident memory in bytes
+resources.rss_peak: the peak resident memory in bytes
+resources.vsize: virtual memory in bytes
+resources.threads: the number of threads
+
+Rates over the interval before each sample:
+
+resources.cpu_user, resources.cpu_system: percent of one CPU
+resources.minor_faults, resources.major_faults: page faults per second
+resources.ctx_switches_voluntary, resources.ctx_switches_involuntary:
+context switches per second
+resources.read_bytes, resources.write_bytes: bytes per second read from
+and written to storage
+resources.rchar, resources.wchar: bytes per second passed to read and
+write calls, including those served by the page cache
+
+/proc/self/io is left out if it can't be read. On systems without /proc,
+the sampler logs a warning and doesn't start.
+
+Start it with logger.start_process(..., resources=True) or in the config:
+
+rh-logger:
+    resources:
+        # seconds between samples
+        interval: 1
+        # seconds between reports
+        flush-interval: 60
+'''
+
+import logging
+import os
+import threading
+import time
+
+import rh_logger.api
+
+DEFAULT_INTERVAL = 1.0
+DEFAULT_FLUSH_INTERVAL = 60.0
+
+log = logging.getLogger("rh_logger.resources")
+
+'''Indices in /proc/self/stat of the fields after the command name'''
+STAT_MINFLT = 7
+STAT_MAJFLT = 9
+STAT_UTIME = 11
+STAT_STIME = 12
+STAT_THREADS = 17
+STAT_VSIZE = 20
+STAT_RSS = 21
+
+STATUS_FIELDS = {
+    b"VmHWM": "rss_peak",
+    b"voluntary_ctxt_switches": "ctx_switches_voluntary",
+    b"nonvoluntary_ctxt_switches": "ctx_switches_involuntary"}
+
+IO_FIELDS = {
+    b"rchar": "rchar",
+    b"wchar": "wchar",
+    b"read_bytes": "read_bytes",
+    b"write_bytes": "write_bytes"}
+
+'''Readings reported as a rate per second'''
+RATES = ("minor_faults", "major_faults", "ctx_switches_voluntary",
+         "ctx_switches_involuntary", "rchar", "wchar", "read_bytes",
+         "write_bytes")
+
+
+def _open(path):
+    try:
+        return os.open(path, os.O_RDONLY)
+    except (IOError, OSError):
+        return None
+
+
+def _read(fd):
+    os.lseek(fd, 0, os.SEEK_SET)
+    return os.read(fd, 8192)
+
+
+class ResourceSampler(object):
+    '''Sample the process's resource use into TimeSeries'''
+
+    def __init__(self, logger, interval=DEFAULT_INTERVAL,
+                 flush_interval=DEFAULT_FLUSH_INTERVAL, proc="/proc/self"):
+        '''Initialize the sampler
+
+        :param logger: the :py:class: `Logger` that gets the reports
+        :param interval: seconds between samples
+        :param flush_interval: seconds between reports
+        :param proc: the /proc directory of the process
+        '''
+        self.logger = logger
+        self.interval = interval
+        self.flush_interval = flush_interval
+        self.proc = proc
+        self.clock_ticks = float(os.sysconf("SC_CLK_TCK")) \
+            if hasattr(os, "sysconf") else 100.0
+        self.page_size = os.sysconf("SC_PAGE_SIZE") \
+            if hasattr(os, "sysconf") else 4096
+        self.stat_fd = self.status_fd = self.io_fd = None
+        self.series = {}
+        self.last = None
+        self.last_time = None
+        self.n_samples = 0
+        self.lock = threading.Lock()
+        self.stopping = threading.Event()
+        self.thread = None
+
+    def open(self):
+        '''Open the /proc files
+
+        :returns: False if /proc/self/stat can't be read
+        '''
+        self.stat_fd = _open(os.path.join(self.proc, "stat"))
+        if self.stat_fd is None:
+            return False
+        self.status_fd = _open(os.path.join(self.proc, "status"))
+        self.io_fd = _open(os.path.join(self.proc, "io"))
+        if self.io_fd is not None:
+            try:
+                _read(self.io_fd)
+            except (IOError, OSError):
+                os.close(self.io_fd)
+                self.io_fd = None
+        return True
+
+    def close(self):
+        for fd in (self.stat_fd, self.status_fd, self.io_fd):
+            if fd is not None:
+                os.close(fd)
+        self.stat_fd = self.status_fd = self.io_fd = None
+
+    def read(self):
+        '''Read the counters and gauges
+
+        :returns: a dictionary of reading name to value. CPU times are in
+        seconds and memory in bytes.
+        '''
+        data = _read(self.stat_fd)
+        fields = data[data.rindex(b")") + 2:].split()
+        reading = dict(
+            minor_faults=int(fields[STAT_MINFLT]),
+            major_faults=int(fields[STAT_MAJFLT]),
+            cpu_user=int(fields[STAT_UTIME]) / self.clock_ticks,
+            cpu_system=int(fields[STAT_STIME]) / self.clock_ticks,
+            threads=int(fields[STAT_THREADS]),
+            vsize=int(fields[STAT_VSIZE]),
+            rss=int(fields[STAT_RSS]) * self.page_size)
+        if self.status_fd is not None:
+            for line in _read(self.status_fd).split(b"\n"):
+                key, _, value = line.partition(b":")
+                name = STATUS_FIELDS.get(key)
+                if name is not None:
+                    value = value.split()
+                    reading[name] = int(value[0]) * \
+                        (1024 if len(value) > 1 else 1)
+        if self.io_fd is not None:
+            for line in _read(self.io_fd).split(b"\n"):
+                key, _, value = line.partition(b":")
+                name = IO_FIELDS.get(key)
+                if name is not None:
+                    reading[name] = int(value)
+        return reading
+
+    def sample(self):
+        '''Read /proc and add the readings to the time series'''
+        now = time.time()
+        reading = self.read()
+        last, last_time = self.last, self.last_time
+        self.last, self.last_time = reading, now
+        with self.lock:
+            for name in ("rss", "rss_peak", "vsize", "threads"):
+                if name in reading:
+                    self.add(name, reading[name], now)
+            if last is None or now <= last_time:
+                return
+            elapsed = now - last_time
+            for name in ("cpu_user", "cpu_system"):
+                self.add(name, 100 * (reading[name] - last[name]) / elapsed,
+                         now)
+            for name in RATES:
+                if name in reading and name in last:
+                    self.add(name, (reading[name] - last[name]) / elapsed,
+                             now)
+        self.n_samples += 1
+
+    def add(self, name, value, timestamp):
+        series = self.series.get(name)
+        if series is None:
+            series = self.series[name] = rh_logger.api.TimeSeries()
+        series.timestamps.append(timestamp)
+        series.values.append(value)
+
+    def flush(self):
+        '''Report the time series and start new ones'''
+        with self.lock:
+            series, self.series = self.series, {}
+        for name in sorted(series):
+            self.logger.report_metrics("resources." + name, series[name])
+
+    def start(self):
+        '''Start sampling from a background thread
+
+        :returns: False if /proc can't be read
+        '''
+        if not self.open():
+            log.warning("Can't read %s/stat, so resource use won't be "
+                        "reported", self.proc)
+            return False
+        self.sample()
+        self.thread = threading.Thread(target=self.run,
+                                       name="ResourceSamplerThread")
+        self.thread.daemon = True
+        self.thread.start()
+        return True
+
+    def run(self):
+        '''Thread for sampling and reporting'''
+        next_flush = time.time() + self.flush_interval
+        while not self.stopping.wait(self.interval):
+            try:
+                self.sample()
+            except (IOError, OSError, ValueError, IndexError):
+                log.exception("Failed to sample resource use")
+            if time.time() >= next_flush:
+                self.flush()
+                next_flush = time.time() + self.flush_interval
+
+    def stop(self):
+        '''Take a last sample, report and stop'''
+        if self.thread is None:
+            return
+        self.stopping.set()
+        self.thread.join()
+        self.thread = None
+        self.sample()
+        self.flush()
+        self.close()
+
+
+def make_resource_sampler(logger, config):
+    '''Make a sampler from the "resources" section of the config
+
+    :param logger: the logger that gets the reports
+    :param config: the section or True for the defaults
+    '''
+    if not isinstance(config, dict):
+        config = {}
+    return ResourceSampler(
+        logger,
+        interval=config.get("interval", DEFAULT_INTERVAL),
+        flush_interval=config.get("flush-interval", DEFAULT_FLUSH_INTERVAL))
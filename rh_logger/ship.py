@@ -0,0 +1,238 @@
+'''ship.py - replay a spool into a logging backend
+
+rh-logger-ship reads the segment files written by the spool backend and
+replays the calls into any registered backend. Consecutive numeric metrics
+are sent in bulk as one TimeSeries per name and context, with their
+original timestamps. The replayed processes' starts and ends are reported
+as events, since the shipper itself is the process that the backend sees.
+
+The offset reached in each segment is saved in a checkpoint file in the
+spool directory after every batch, so a restarted shipper carries on where
+it left off. The backend is flushed before each save, and if it can't send
+everything, the offset isn't saved and the batch is shipped again on the
+next pass. Each call is sent at least once. Finished segments are deleted
+unless --keep is given. A segment is finished when its writer has closed it
+and every record has been sent.
+'''
+
+import argparse
+import json
+import logging
+import numbers
+import os
+import tempfile
+import time
+
+import rh_logger.api
+from rh_logger.aggregator import context_key
+from rh_logger.spool import CLOSED, list_segments, read_segment, read_state
+
+CHECKPOINT_FILENAME = "checkpoint.json"
+DEFAULT_BATCH_SIZE = 100000
+
+log = logging.getLogger("rh_logger.ship")
+
+
+class Shipper(object):
+    '''Replay the segments in a spool directory into a logger'''
+
+    def __init__(self, directory, logger, keep=False, stale=None,
+                 batch_size=DEFAULT_BATCH_SIZE):
+        '''Initialize the shipper
+
+        :param directory: the spool directory
+        :param logger: the :py:class: `Logger` to replay into
+        :param keep: True to keep segments after they are shipped
+        :param stale: treat segments that are still open but haven't been
+        written for this many seconds as finished, or None to wait for
+        their writers to close them
+        :param batch_size: save the checkpoint after at most this many calls
+        '''
+        self.directory = directory
+        self.logger = logger
+        self.keep = keep
+        self.stale = stale
+        self.batch_size = batch_size
+        self.checkpoint_path = os.path.join(directory, CHECKPOINT_FILENAME)
+        self.checkpoint = self.read_checkpoint()
+        self.n_shipped = 0
+
+    def read_checkpoint(self):
+        try:
+            with open(self.checkpoint_path) as fd:
+                return json.load(fd)
+        except (IOError, OSError, ValueError):
+            return {}
+
+    def write_checkpoint(self):
+        '''Write the checkpoint atomically'''
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        with os.fdopen(fd, "w") as fd:
+            json.dump(self.checkpoint, fd)
+        os.rename(tmp_path, self.checkpoint_path)
+
+    def is_finished(self, path):
+        '''True if nothing more will be written to a segment'''
+        if read_state(path) == CLOSED:
+            return True
+        return self.stale is not None and \
+            time.time() - os.stat(path).st_mtime > self.stale
+
+    def ship_segment(self, path):
+        '''Ship the unsent records of a segment
+
+        :returns: True if the segment is finished and completely shipped
+        '''
+        filename = os.path.basename(path)
+        start = self.checkpoint.get(filename, 0)
+        # Check before reading so that records added in between aren't lost
+        finished = self.is_finished(path)
+        series = {}
+        n_pending = 0
+        offset = start
+        for record in read_segment(path, start):
+            if record.kind == "metric" and \
+               isinstance(record.args[1], numbers.Real):
+                name, value, context = record.args
+                key = (name, context_key(context))
+                try:
+                    entry = series.get(key)
+                except TypeError:
+                    key = (name, repr(context))
+                    entry = series.get(key)
+                if entry is None:
+                    entry = series[key] = \
+                        (name, rh_logger.api.TimeSeries(), context)
+                entry[1].timestamps.append(record.timestamp)
+                entry[1].values.append(value)
+            else:
+                self.send_series(series)
+                self.replay(record)
+            n_pending += 1
+            offset = record.offset
+            if n_pending >= self.batch_size:
+                self.send_series(series)
+                if not self.save_offset(filename, offset, n_pending):
+                    return False
+                n_pending = 0
+        self.send_series(series)
+        return self.save_offset(filename, offset, n_pending) and finished
+
+    def send_series(self, series):
+        for name, time_series, context in series.values():
+            self.logger.report_metrics(name, time_series, context)
+        series.clear()
+
+    def replay(self, record):
+        '''Make a logging call read from the spool'''
+        if record.kind == "metric":
+            self.logger.report_metric(*record.args)
+        elif record.kind == "metrics":
+            self.logger.report_metrics(*record.args)
+        elif record.kind == "event":
+            self.logger.report_event(*record.args)
+        elif record.kind == "events":
+            self.logger.report_events(*record.args)
+        elif record.kind == "exception":
+            text, msg = record.args
+            self.logger.report_exception(Exception(text), msg)
+        elif record.kind == "start":
+            name, msg, args = record.args
+            self.logger.report_event(
+                "Process %s started: %s" % (name, msg), args)
+        elif record.kind == "end":
+            msg, exit_code = record.args
+            self.logger.report_event(
+                "Process ended: %s, exit code = %s" %
+                (msg, rh_logger.api.ExitCode(exit_code).name))
+
+    def save_offset(self, filename, offset, n_shipped):
+        '''Save the offset reached once the logger has sent the batch
+
+        :returns: False if the logger couldn't send everything, in which
+        case the batch will be shipped again
+        '''
+        if n_shipped == 0:
+            return True
+        if not self.logger.flush():
+            log.warning("The backend did not send everything from %s. "
+                        "It will be shipped again." % filename)
+            return False
+        self.n_shipped += n_shipped
+        self.checkpoint[filename] = offset
+        self.write_checkpoint()
+        return True
+
+    def ship(self):
+        '''Ship every segment once
+
+        :returns: the number of calls shipped
+        '''
+        n_shipped = self.n_shipped
+        for path in list_segments(self.directory):
+            filename = os.path.basename(path)
+            if self.checkpoint.get(filename) == -1:
+                continue
+            if self.ship_segment(path):
+                if self.keep:
+                    self.checkpoint[filename] = -1
+                else:
+                    os.remove(path)
+                    self.checkpoint.pop(filename, None)
+                self.write_checkpoint()
+        return self.n_shipped - n_shipped
+
+    def follow(self, interval):
+        '''Ship new records as they are written, until interrupted'''
+        try:
+            while True:
+                self.ship()
+                time.sleep(interval)
+        except KeyboardInterrupt:
+            self.ship()
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(
+        description="Replay an rh_logger spool into a logging backend")
+    parser.add_argument("directory", help="The spool directory")
+    parser.add_argument(
+        "--backend", action="append",
+        help="The backend to replay into. Give more than once for several "
+        "backends. Default is the logging-backend in the configuration.")
+    parser.add_argument("--name", default="rh-logger-ship",
+                        help="The process name to report to the backend")
+    parser.add_argument("--keep", action="store_true",
+                        help="Don't delete segments once they are shipped")
+    parser.add_argument("--stale", type=float,
+                        help="Treat open segments that haven't changed for "
+                        "this many seconds as finished")
+    parser.add_argument("--follow", action="store_true",
+                        help="Keep shipping new records until interrupted")
+    parser.add_argument("--interval", type=float, default=5.0,
+                        help="Seconds between checks for new records when "
+                        "following")
+    args = parser.parse_args(args)
+    if args.backend is not None:
+        rh_logger.api.set_logging_backend(
+            args.backend[0] if len(args.backend) == 1 else args.backend)
+    logger = rh_logger.api.LoggerProxy()
+    logger.start_process(args.name, "Shipping %s" % args.directory)
+    shipper = Shipper(args.directory, logger, keep=args.keep,
+                      stale=args.stale)
+    try:
+        if args.follow:
+            shipper.follow(args.interval)
+        else:
+            shipper.ship()
+    except Exception:
+        logger.report_exception()
+        logger.end_process("Failed after shipping %d calls" %
+                           shipper.n_shipped,
+                           rh_logger.api.ExitCode.internal_error)
+        raise
+    logger.end_process("Shipped %d calls" % shipper.n_shipped,
+                       rh_logger.api.ExitCode.success)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,310 @@
+'''spans.py - nested timing spans
+
+Use rh_logger.logger.span(name, context) as a context manager or a
+decorator, like logger.timer. Spans nest: each span gets an id and the id of
+its parent, which is the span open around it in the same thread. A span
+with no span around it is a child of the process's root span, which
+start_process opens and end_process closes.
+
+Start times and durations come from the monotonic perf_counter_ns clock.
+Finished spans are appended to columns of flat arrays, with names, contexts
+and threads stored once and referred to by number. The names and contexts
+are forgotten with each exported batch, so a process that uses a new
+context for every span doesn't keep them all. The buffer is exported
+through the logger's report_spans as a batch of :py:class: `SpanRecord`
+when "flush-size" spans are waiting, when "flush-interval" seconds have
+passed and at end_process. The default and Datadog backends get the batch
+as log lines or as one event. Carbon and the other backends get the
+durations of each span name as a TimeSeries named "span.<name>".
+
+Set "trace-file" to also write the spans in the Chrome trace-event format,
+for viewing the run's timeline in chrome://tracing or Perfetto:
+
+rh-logger:
+    spans:
+        # the number of finished spans buffered before they are exported
+        flush-size: 1000
+        # the longest time in seconds a finished span is buffered
+        flush-interval: 10
+        # the trace-event file
+        trace-file: trace.json
+'''
+
+import array
+import collections
+import functools
+import itertools
+import json
+import os
+import threading
+import time
+
+from rh_logger.aggregator import context_key, perf_counter_ns
+
+try:
+    from threading import get_ident
+except ImportError:
+    from thread import get_ident
+
+DEFAULT_FLUSH_SIZE = 1000
+DEFAULT_FLUSH_INTERVAL = 10.0
+
+'''A finished span
+
+name: the span's name
+context: the span's context
+span_id: the span's id
+parent_id: the id of the enclosing span, or 0 for the root span
+start: the wall-clock time the span started
+duration: the span's duration in seconds
+thread: a small number identifying the thread the span ran on
+'''
+SpanRecord = collections.namedtuple(
+    "SpanRecord", ["name", "context", "span_id", "parent_id", "start",
+                   "duration", "thread"])
+
+
+class Span(object):
+    '''Time a block of code or a function as a span
+
+    Use as a context manager:
+
+        with logger.span("Align tile", ["tile", 5]):
+            ...
+
+    or as a decorator:
+
+        @logger.span("Align tile")
+        def align_tile(...):
+            ...
+    '''
+
+    __slots__ = ["recorder", "name", "context", "span_id", "parent_id",
+                 "start"]
+
+    def __init__(self, recorder, name, context=None):
+        self.recorder = recorder
+        self.name = name
+        self.context = context
+
+    def __enter__(self):
+        recorder = self.recorder
+        stack = recorder.get_stack()
+        self.parent_id = stack[-1] if stack else recorder.root_id
+        self.span_id = next(recorder.ids)
+        stack.append(self.span_id)
+        self.start = perf_counter_ns()
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        end = perf_counter_ns()
+        stack = self.recorder.get_stack()
+        if stack and stack[-1] == self.span_id:
+            stack.pop()
+        elif self.span_id in stack:
+            stack.remove(self.span_id)
+        self.recorder.finish(self.name, self.context, self.span_id,
+                             self.parent_id, self.start, end)
+
+    def __call__(self, fn):
+        recorder, name, context = self.recorder, self.name, self.context
+
+        @functools.wraps(fn)
+        def spanned(*args, **kwargs):
+            with Span(recorder, name, context):
+                return fn(*args, **kwargs)
+        return spanned
+
+
+class SpanRecorder(object):
+    '''Buffers finished spans and exports them in batches
+
+    The "target" attribute is the logger that receives the batches through
+    report_spans. Spans are kept until a target or a trace file is set.
+    '''
+
+    def __init__(self, flush_size=DEFAULT_FLUSH_SIZE,
+                 flush_interval=DEFAULT_FLUSH_INTERVAL):
+        self.lock = threading.Lock()
+        self.trace_lock = threading.Lock()
+        self.local = threading.local()
+        self.target = None
+        self.ids = itertools.count(1)
+        self.root_id = 0
+        self.root = None
+        self.threads = {}
+        self.n_finished = 0
+        self.trace = None
+        self.n_traced = 0
+        #
+        # Add this to a perf_counter_ns time to get wall-clock nanoseconds
+        #
+        self.epoch_offset = time.time() * 1e9 - perf_counter_ns()
+        self.reset()
+        self.configure(flush_size, flush_interval)
+
+    def configure(self, flush_size=DEFAULT_FLUSH_SIZE,
+                  flush_interval=DEFAULT_FLUSH_INTERVAL, trace_file=None):
+        '''Set when batches are exported and where the trace is written
+
+        :param flush_size: export when this many spans are waiting
+        :param flush_interval: the longest time in seconds a span waits
+        :param trace_file: the path of the trace-event file or None
+        '''
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.next_flush = perf_counter_ns() + int(flush_interval * 1e9)
+        if trace_file is not None:
+            self.open_trace(trace_file)
+
+    def reset(self):
+        '''Start a new batch with no spans and no names or contexts'''
+        self.keys = {}
+        self.key_list = []
+        self.key_ids = array.array("I")
+        self.span_ids = array.array("L")
+        self.parent_ids = array.array("L")
+        self.thread_ids = array.array("I")
+        self.starts = array.array("d")
+        self.durations = array.array("d")
+
+    def get_stack(self):
+        '''The ids of the spans open in the calling thread'''
+        try:
+            return self.local.stack
+        except AttributeError:
+            stack = self.local.stack = []
+            return stack
+
+    def span(self, name, context=None):
+        '''Return a :py:class: `Span` for a block of code or a function'''
+        return Span(self, name, context)
+
+    def start_root(self, name):
+        '''Open the root span that spans with no parent belong to'''
+        self.root_id = next(self.ids)
+        self.root = (name, perf_counter_ns())
+        if self.trace is not None:
+            self.write_trace_events([{
+                "name": "process_name", "ph": "M", "pid": os.getpid(),
+                "args": {"name": name}}])
+
+    def end_root(self):
+        '''Close the root span and export everything
+
+        The root span is only reported if there were other spans or there is
+        a trace file, so processes that don't use spans report nothing.
+        '''
+        if self.root is not None:
+            name, start = self.root
+            self.root = None
+            if self.n_finished > 0 or self.trace is not None:
+                self.finish(name, None, self.root_id, 0, start,
+                            perf_counter_ns(), flush=False)
+        self.flush()
+        self.close_trace()
+
+    def finish(self, name, context, span_id, parent_id, start, end,
+               flush=True):
+        '''Buffer a finished span
+
+        :param start: the perf_counter_ns time the span started
+        :param end: the perf_counter_ns time the span ended
+        :param flush: False to never export from this call
+        '''
+        key = (name, context_key(context) if context is not None else None)
+        ident = get_ident()
+        #
+        # This is on the caller's path for every span, so the lock is
+        # taken by hand, which is cheaper than "with".
+        #
+        self.lock.acquire()
+        try:
+            try:
+                key_id = self.keys.get(key)
+            except TypeError:
+                key = (name, repr(context))
+                key_id = self.keys.get(key)
+            if key_id is None:
+                key_id = self.keys[key] = len(self.key_list)
+                self.key_list.append((name, context))
+            thread_id = self.threads.get(ident)
+            if thread_id is None:
+                thread_id = self.threads[ident] = len(self.threads) + 1
+            self.key_ids.append(key_id)
+            self.span_ids.append(span_id)
+            self.parent_ids.append(parent_id)
+            self.thread_ids.append(thread_id)
+            self.starts.append(start)
+            self.durations.append(end - start)
+            self.n_finished += 1
+            n_waiting = len(self.span_ids)
+        finally:
+            self.lock.release()
+        if flush and (n_waiting >= self.flush_size or end >= self.next_flush):
+            self.flush()
+
+    def flush(self):
+        '''Export the buffered spans'''
+        if self.target is None and self.trace is None:
+            return
+        with self.lock:
+            self.next_flush = perf_counter_ns() + \
+                int(self.flush_interval * 1e9)
+            if len(self.span_ids) == 0:
+                return
+            columns = (self.key_ids, self.span_ids, self.parent_ids,
+                       self.starts, self.durations, self.thread_ids)
+            key_list = self.key_list
+            self.reset()
+        offset = self.epoch_offset
+        spans = []
+        for key_id, span_id, parent_id, start, duration, thread_id in \
+                zip(*columns):
+            name, context = key_list[key_id]
+            spans.append(SpanRecord(
+                name, context, span_id, parent_id, (start + offset) * 1e-9,
+                duration * 1e-9, thread_id))
+        if self.trace is not None:
+            self.write_trace(spans)
+        if self.target is not None:
+            self.target.report_spans(spans)
+
+    def open_trace(self, path):
+        '''Start writing spans to a trace-event file'''
+        self.close_trace()
+        self.trace = open(path, "w")
+        self.trace.write("[")
+        self.n_traced = 0
+
+    def write_trace(self, spans):
+        '''Write spans as complete ("X") trace events'''
+        pid = os.getpid()
+        events = []
+        for span in spans:
+            args = dict(span_id=span.span_id, parent_id=span.parent_id)
+            if span.context is not None:
+                args["context"] = span.context
+            events.append({
+                "name": span.name, "cat": "span", "ph": "X",
+                "ts": span.start * 1e6, "dur": span.duration * 1e6,
+                "pid": pid, "tid": span.thread, "args": args})
+        self.write_trace_events(events)
+
+    def write_trace_events(self, events):
+        with self.trace_lock:
+            if self.trace is None:
+                return
+            for event in events:
+                if self.n_traced > 0:
+                    self.trace.write(",")
+                self.trace.write("\n" + json.dumps(event, default=repr))
+                self.n_traced += 1
+            self.trace.flush()
+
+    def close_trace(self):
+        with self.trace_lock:
+            if self.trace is not None:
+                self.trace.write("\n]\n")
+                self.trace.close()
+                self.trace = None
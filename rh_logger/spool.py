@@ -0,0 +1,443 @@
+'''spool.py - a crash-safe local spool of logging calls
+
+SpoolWriter appends binary records to memory-mapped segment files. Each
+segment is preallocated to the segment size and a new one is started when
+it is full. Records are written straight into the mapping, so they survive
+the process crashing as soon as the call returns. The segment's length
+and checksum are written after its payload, so a reader never sees part
+of a record.
+
+A segment starts with a 16-byte header: the magic number and a state byte
+that is OPEN while the segment is being written and CLOSED once the writer
+has finished with it. Each record is framed by its length and CRC-32. The
+payload starts with a one-byte record type:
+
+* STRING and OBJECT define a metric name or a pickled context that later
+  records in the same segment refer to by number (0 is None). Each segment
+  has its own definitions so it can be read on its own.
+* METRIC is a numeric metric: the time, name, context and value.
+* SERIES is a TimeSeries: the time, name, context, number of points and the
+  timestamp and value arrays.
+* METRIC_OBJECT and SERIES_OBJECT hold other metrics and time series,
+  pickled.
+* EVENTS is a batch of events from report_events: the time, context, log
+  level and the pickled title and event texts.
+* EVENT, EXCEPTION, START and END record the other logging calls.
+
+All numbers are little-endian. read_segment decodes a segment back into
+the calls that were made; see rh_logger.ship for replaying them.
+'''
+
+import array
+import collections
+import mmap
+import numbers
+import os
+import pickle
+import struct
+import sys
+import threading
+import time
+import zlib
+
+from rh_logger.aggregator import context_key
+
+MAGIC = b"RHSPOOL1"
+OPEN = 0
+CLOSED = 1
+SUFFIX = ".spool"
+
+DEFAULT_SEGMENT_SIZE = 64 * 1024 * 1024
+
+HEADER = struct.Struct("<8sB7x")
+FRAME = struct.Struct("<II")
+
+STRING = 1
+OBJECT = 2
+METRIC = 16
+METRIC_OBJECT = 17
+SERIES = 18
+SERIES_OBJECT = 19
+EVENT = 32
+EVENTS = 33
+EXCEPTION = 48
+START = 64
+END = 65
+
+_DEFINITION = struct.Struct("<BI")
+_METRIC = struct.Struct("<BdIId")
+_METRIC_OBJECT = struct.Struct("<BdII")
+_SERIES = struct.Struct("<BdIII")
+_EVENT = struct.Struct("<BdIi")
+_TIME = struct.Struct("<Bd")
+_END = struct.Struct("<Bdi")
+
+'''A logging call read from a spool
+
+kind: "metric", "metrics", "event", "events", "exception", "start" or "end"
+timestamp: when the call was made
+args: the arguments of the call
+offset: the offset in the segment just past the record
+'''
+SpoolRecord = collections.namedtuple(
+    "SpoolRecord", ["kind", "timestamp", "args", "offset"])
+
+
+def _dumps(obj):
+    '''Pickle an object or, if it can't be pickled, its repr'''
+    try:
+        return pickle.dumps(obj, 2)
+    except Exception:
+        return pickle.dumps(repr(obj), 2)
+
+
+def _encode(s):
+    if not isinstance(s, bytes):
+        s = s.encode("utf-8")
+    return s
+
+
+def _decode(b):
+    return b.decode("utf-8")
+
+
+def _array_bytes(a):
+    if sys.byteorder != "little":
+        a = array.array("d", a)
+        a.byteswap()
+    if hasattr(a, "tobytes"):
+        return a.tobytes()
+    return a.tostring()
+
+
+def _bytes_array(b):
+    a = array.array("d")
+    if hasattr(a, "frombytes"):
+        a.frombytes(b)
+    else:
+        a.fromstring(b)
+    if sys.byteorder != "little":
+        a.byteswap()
+    return a
+
+
+def segment_name(prefix, sequence):
+    return "%s-%06d%s" % (prefix, sequence, SUFFIX)
+
+
+class SpoolWriter(object):
+    '''Append logging calls to memory-mapped segment files
+
+    Calls made after close are dropped and counted in n_dropped.
+    '''
+
+    def __init__(self, directory, prefix,
+                 segment_size=DEFAULT_SEGMENT_SIZE):
+        '''Initialize the writer and create its first segment
+
+        :param directory: the directory for the segment files
+        :param prefix: the start of each segment's file name. It should be
+        unique to the process.
+        :param segment_size: the size of each segment in bytes
+        '''
+        if not os.path.isdir(directory):
+            try:
+                os.makedirs(directory)
+            except OSError:
+                if not os.path.isdir(directory):
+                    raise
+        self.directory = directory
+        self.prefix = prefix
+        self.segment_size = segment_size
+        self.lock = threading.Lock()
+        self.sequence = 0
+        self.mm = None
+        self.path = None
+        self.n_dropped = 0
+        self.open_segment(0)
+
+    def open_segment(self, needed):
+        '''Start a new segment with room for at least "needed" bytes'''
+        size = max(self.segment_size, HEADER.size + needed)
+        self.path = os.path.join(
+            self.directory, segment_name(self.prefix, self.sequence))
+        self.sequence += 1
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT | os.O_EXCL, 420)
+        try:
+            os.ftruncate(fd, size)
+            self.mm = mmap.mmap(fd, size)
+        finally:
+            os.close(fd)
+        HEADER.pack_into(self.mm, 0, MAGIC, OPEN)
+        self.size = size
+        self.offset = HEADER.size
+        self.strings = {}
+        self.objects = {}
+        self.next_id = 1
+
+    def close_segment(self):
+        '''Trim the segment to the records written and mark it CLOSED'''
+        self.mm.flush()
+        self.mm.close()
+        self.mm = None
+        with open(self.path, "r+b") as fd:
+            fd.truncate(self.offset)
+            fd.seek(len(MAGIC))
+            fd.write(struct.pack("<B", CLOSED))
+
+    def append(self, payloads):
+        '''Write records, all in the current segment
+
+        The caller must hold the lock and have checked there is room.
+        '''
+        mm = self.mm
+        offset = self.offset
+        for payload in payloads:
+            n = len(payload)
+            mm[offset + FRAME.size:offset + FRAME.size + n] = payload
+            FRAME.pack_into(mm, offset, n, zlib.crc32(payload) & 0xffffffff)
+            offset += FRAME.size + n
+        self.offset = offset
+
+    def define(self, table, key, record_type, data, definitions):
+        '''Return the number of a definition, adding it if it is new'''
+        try:
+            number = table.get(key)
+        except TypeError:
+            number = None
+            key = None
+        if number is None:
+            number = self.next_id
+            self.next_id += 1
+            definitions.append(
+                _DEFINITION.pack(record_type, number) + data())
+            if key is not None:
+                table[key] = number
+        return number
+
+    def write(self, name, context, make_payload):
+        '''Write a record that refers to a name and context
+
+        :param name: the metric name or None
+        :param context: the context or None
+        :param make_payload: a function of the name and context numbers that
+        returns the record's payload
+        '''
+        with self.lock:
+            if self.mm is None:
+                self.n_dropped += 1
+                return
+            while True:
+                definitions = []
+                if name is None:
+                    name_id = 0
+                else:
+                    name_id = self.define(
+                        self.strings, name, STRING,
+                        lambda: _encode(name), definitions)
+                if context is None:
+                    context_id = 0
+                else:
+                    context_id = self.define(
+                        self.objects, context_key(context), OBJECT,
+                        lambda: _dumps(context), definitions)
+                definitions.append(make_payload(name_id, context_id))
+                needed = sum([FRAME.size + len(_) for _ in definitions])
+                if self.offset + needed <= self.size:
+                    break
+                self.close_segment()
+                self.open_segment(needed)
+            self.append(definitions)
+
+    def write_metric(self, name, metric, context=None):
+        now = time.time()
+        if isinstance(metric, numbers.Real):
+            metric = float(metric)
+            with self.lock:
+                if self.mm is None:
+                    self.n_dropped += 1
+                    return
+                # Fast path for a name and context already in the segment
+                name_id = self.strings.get(name)
+                try:
+                    context_id = 0 if context is None else \
+                        self.objects.get(context_key(context))
+                except TypeError:
+                    context_id = None
+                offset = self.offset
+                end = offset + FRAME.size + _METRIC.size
+                if name_id is not None and context_id is not None and \
+                   end <= self.size:
+                    payload = _METRIC.pack(
+                        METRIC, now, name_id, context_id, metric)
+                    self.mm[offset + FRAME.size:end] = payload
+                    FRAME.pack_into(self.mm, offset, _METRIC.size,
+                                    zlib.crc32(payload) & 0xffffffff)
+                    self.offset = end
+                    return
+            self.write(name, context,
+                       lambda n, c: _METRIC.pack(METRIC, now, n, c, metric))
+        else:
+            self.write(name, context,
+                       lambda n, c: _METRIC_OBJECT.pack(
+                           METRIC_OBJECT, now, n, c) + _dumps(metric))
+
+    def write_metrics(self, name, time_series, context=None):
+        import rh_logger.api
+        now = time.time()
+        if type(time_series) is rh_logger.api.TimeSeries:
+            timestamps = _array_bytes(time_series.timestamps)
+            values = _array_bytes(time_series.values)
+            self.write(name, context,
+                       lambda n, c: _SERIES.pack(
+                           SERIES, now, n, c, len(time_series)) +
+                       timestamps + values)
+        else:
+            self.write(name, context,
+                       lambda n, c: _METRIC_OBJECT.pack(
+                           SERIES_OBJECT, now, n, c) + _dumps(time_series))
+
+    def write_event(self, event, context=None, log_level=None):
+        now = time.time()
+        level = -1 if log_level is None else log_level
+        self.write(None, context,
+                   lambda n, c: _EVENT.pack(EVENT, now, c, level) +
+                   _encode(event))
+
+    def write_events(self, events, context=None, log_level=None,
+                     title=None):
+        now = time.time()
+        level = -1 if log_level is None else log_level
+        payload = _dumps((title, list(events)))
+        self.write(None, context,
+                   lambda n, c: _EVENT.pack(EVENTS, now, c, level) + payload)
+
+    def write_exception(self, text, msg=None):
+        now = time.time()
+        self.write(None, None,
+                   lambda n, c: _TIME.pack(EXCEPTION, now) +
+                   _dumps((text, msg)))
+
+    def write_start(self, name, msg, args=None):
+        now = time.time()
+        self.write(None, None,
+                   lambda n, c: _TIME.pack(START, now) +
+                   _dumps((name, msg, args)))
+
+    def write_end(self, msg, exit_code):
+        now = time.time()
+        self.write(None, None,
+                   lambda n, c: _END.pack(END, now, exit_code) +
+                   _encode(msg))
+
+    def flush(self):
+        '''Ask the operating system to write the segment to disk'''
+        with self.lock:
+            if self.mm is not None:
+                self.mm.flush()
+
+    def close(self):
+        '''Close the current segment'''
+        with self.lock:
+            if self.mm is not None:
+                self.close_segment()
+
+
+def read_state(path):
+    '''Return a segment's state, OPEN or CLOSED, or None if it isn't one'''
+    with open(path, "rb") as fd:
+        header = fd.read(HEADER.size)
+    if len(header) < HEADER.size:
+        return None
+    magic, state = HEADER.unpack(header)
+    if magic != MAGIC:
+        return None
+    return state
+
+
+def read_segment(path, start=HEADER.size):
+    '''Decode the logging calls in a segment
+
+    The segment is read with ordinary file reads rather than mapped because
+    its writer may still be appending to it or trimming it. Reading stops
+    at the first record that isn't complete.
+
+    :param path: the path to the segment file
+    :param start: skip the calls in records before this offset. The
+    definitions before it are still read.
+    :returns: a generator of :py:class: `SpoolRecord`
+    '''
+    with open(path, "rb") as fd:
+        data = fd.read()
+    if len(data) < HEADER.size or data[:len(MAGIC)] != MAGIC:
+        return
+    strings = {0: None}
+    objects = {0: None}
+    offset = HEADER.size
+    while offset + FRAME.size <= len(data):
+        n, crc = FRAME.unpack_from(data, offset)
+        end = offset + FRAME.size + n
+        if n == 0 or end > len(data):
+            break
+        payload = data[offset + FRAME.size:end]
+        if zlib.crc32(payload) & 0xffffffff != crc:
+            break
+        record_type = struct.unpack_from("<B", data, offset + FRAME.size)[0]
+        offset += FRAME.size
+        record = None
+        if record_type == STRING:
+            number = _DEFINITION.unpack_from(data, offset)[1]
+            strings[number] = _decode(data[offset + _DEFINITION.size:end])
+        elif record_type == OBJECT:
+            number = _DEFINITION.unpack_from(data, offset)[1]
+            objects[number] = pickle.loads(data[offset + _DEFINITION.size:end])
+        elif end <= start:
+            pass
+        elif record_type == METRIC:
+            _, now, name, context, value = _METRIC.unpack_from(data, offset)
+            record = ("metric", now,
+                      (strings[name], value, objects[context]))
+        elif record_type in (METRIC_OBJECT, SERIES_OBJECT):
+            _, now, name, context = _METRIC_OBJECT.unpack_from(data, offset)
+            value = pickle.loads(data[offset + _METRIC_OBJECT.size:end])
+            record = ("metric" if record_type == METRIC_OBJECT else "metrics",
+                      now, (strings[name], value, objects[context]))
+        elif record_type == SERIES:
+            import rh_logger.api
+            _, now, name, context, count = _SERIES.unpack_from(data, offset)
+            middle = offset + _SERIES.size + count * 8
+            series = rh_logger.api.TimeSeries()
+            series.timestamps = _bytes_array(
+                data[offset + _SERIES.size:middle])
+            series.values = _bytes_array(data[middle:end])
+            record = ("metrics", now,
+                      (strings[name], series, objects[context]))
+        elif record_type == EVENT:
+            _, now, context, level = _EVENT.unpack_from(data, offset)
+            record = ("event", now,
+                      (_decode(data[offset + _EVENT.size:end]),
+                       objects[context], None if level == -1 else level))
+        elif record_type == EVENTS:
+            _, now, context, level = _EVENT.unpack_from(data, offset)
+            title, events = pickle.loads(data[offset + _EVENT.size:end])
+            record = ("events", now,
+                      (events, objects[context],
+                       None if level == -1 else level, title))
+        elif record_type in (EXCEPTION, START):
+            _, now = _TIME.unpack_from(data, offset)
+            record = ("exception" if record_type == EXCEPTION else "start",
+                      now, pickle.loads(data[offset + _TIME.size:end]))
+        elif record_type == END:
+            _, now, exit_code = _END.unpack_from(data, offset)
+            record = ("end", now,
+                      (_decode(data[offset + _END.size:end]), exit_code))
+        offset = end
+        if record is not None:
+            yield SpoolRecord(record[0], record[1], record[2], end)
+
+
+def list_segments(directory):
+    '''The paths of the segment files in a directory, in order'''
+    return [os.path.join(directory, filename)
+            for filename in sorted(os.listdir(directory))
+            if filename.endswith(SUFFIX)]
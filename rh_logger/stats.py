@@ -0,0 +1,229 @@
+'''stats.py - constant-memory summary statistics
+
+RunningStats keeps the count, sum, minimum, maximum, mean and variance of
+a stream of values. QuantileSketch estimates quantiles of a stream to within
+a relative accuracy using logarithmically-spaced buckets. Both can be merged
+with others of their kind, so summaries from different threads, processes
+or ranks can be combined.
+'''
+
+import bisect
+import collections
+import math
+
+
+class Summary(collections.namedtuple(
+        "Summary",
+        ["count", "total", "min", "max", "mean", "variance",
+         "p50", "p95", "p99", "start", "end"])):
+    '''A summary of a time series
+
+    start and end are the first and last timestamps of the series.
+    '''
+    __slots__ = ()
+
+    @property
+    def std(self):
+        return math.sqrt(self.variance)
+
+    def metrics(self):
+        '''The summary statistics as (suffix, value) pairs for reporting'''
+        return [("count", self.count),
+                ("sum", self.total),
+                ("min", self.min),
+                ("max", self.max),
+                ("mean", self.mean),
+                ("std", self.std),
+                ("p50", self.p50),
+                ("p95", self.p95),
+                ("p99", self.p99)]
+
+
+class RunningStats(object):
+    '''Count, sum, min, max, mean and variance of a stream of values
+
+    The mean and variance are computed with Welford's online algorithm.
+    '''
+
+    __slots__ = ["count", "total", "min", "max", "mean", "m2"]
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.min = float("inf")
+        self.max = float("-inf")
+        self.mean = 0.0
+        self.m2 = 0.0
+
+    def add(self, value):
+        self.count += 1
+        self.total += value
+        if value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+
+    def add_many(self, values):
+        '''Add a sequence of values
+
+        This is faster than calling add for each value because the sums,
+        minimum and maximum are computed by builtins.
+        '''
+        if len(values) == 0:
+            return
+        batch = RunningStats()
+        batch.count = len(values)
+        batch.total = float(sum(values))
+        batch.min = min(values)
+        batch.max = max(values)
+        batch.mean = batch.total / batch.count
+        mean = batch.mean
+        batch.m2 = sum([(v - mean) * (v - mean) for v in values])
+        self.merge(batch)
+
+    def merge(self, other):
+        '''Combine the statistics of another RunningStats into this one'''
+        if other.count == 0:
+            return
+        count = self.count + other.count
+        delta = other.mean - self.mean
+        self.mean += delta * other.count / count
+        self.m2 += other.m2 + delta * delta * self.count * other.count / count
+        self.count = count
+        self.total += other.total
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+    @property
+    def variance(self):
+        '''The population variance'''
+        if self.count == 0:
+            return 0.0
+        return self.m2 / self.count
+
+
+class QuantileSketch(object):
+    '''A mergeable sketch for estimating quantiles
+
+    Values are counted in buckets whose boundaries grow geometrically, so
+    that any quantile is estimated within relative_accuracy of a value
+    in the stream. If the number of buckets exceeds max_buckets, the
+    buckets closest to zero are collapsed together, which sacrifices the
+    accuracy of the smallest magnitudes first.
+    '''
+
+    __slots__ = ["relative_accuracy", "gamma", "log_gamma", "max_buckets",
+                 "positive", "negative", "zero_count", "count"]
+
+    '''Values with a smaller magnitude than this are counted as zero'''
+    MIN_VALUE = 1e-9
+
+    def __init__(self, relative_accuracy=0.01, max_buckets=2048):
+        self.relative_accuracy = relative_accuracy
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.log_gamma = math.log(self.gamma)
+        self.max_buckets = max_buckets
+        self.positive = {}
+        self.negative = {}
+        self.zero_count = 0
+        self.count = 0
+
+    def add(self, value):
+        if value > self.MIN_VALUE:
+            buckets = self.positive
+        elif value < -self.MIN_VALUE:
+            buckets = self.negative
+            value = -value
+        elif value == value:
+            self.zero_count += 1
+            self.count += 1
+            return
+        else:
+            # NaN
+            return
+        key = int(math.ceil(math.log(value) / self.log_gamma))
+        buckets[key] = buckets.get(key, 0) + 1
+        self.count += 1
+        if len(buckets) > self.max_buckets:
+            self._collapse(buckets)
+
+    def add_many(self, values):
+        '''Add a sequence of values
+
+        The values are sorted and counted a bucket at a time, so the cost
+        beyond the sort is proportional to the number of distinct buckets
+        rather than the number of values.
+        '''
+        values = sorted([v for v in values if v == v])
+        n = len(values)
+        if n == 0:
+            return
+        zero_start = bisect.bisect_left(values, -self.MIN_VALUE)
+        zero_end = bisect.bisect_right(values, self.MIN_VALUE)
+        self.zero_count += zero_end - zero_start
+        self.count += n
+        if zero_start > 0:
+            magnitudes = [-v for v in reversed(values[:zero_start])]
+            self._add_sorted(self.negative, magnitudes, 0, len(magnitudes))
+        self._add_sorted(self.positive, values, zero_end, n)
+
+    def _add_sorted(self, buckets, values, start, end):
+        '''Count sorted, positive values[start:end] into buckets'''
+        log_gamma = self.log_gamma
+        gamma = self.gamma
+        while start < end:
+            key = int(math.ceil(math.log(values[start]) / log_gamma))
+            stop = max(bisect.bisect_right(values, gamma ** key, start, end),
+                       start + 1)
+            buckets[key] = buckets.get(key, 0) + stop - start
+            start = stop
+        if len(buckets) > self.max_buckets:
+            self._collapse(buckets)
+
+    def _collapse(self, buckets):
+        keys = sorted(buckets)
+        n_extra = len(keys) - self.max_buckets
+        if n_extra <= 0:
+            return
+        buckets[keys[n_extra]] += sum([buckets.pop(k) for k in keys[:n_extra]])
+
+    def merge(self, other):
+        '''Add the counts of another sketch into this one'''
+        if other.gamma != self.gamma:
+            raise ValueError(
+                "Can't merge sketches with different relative accuracy")
+        for mine, theirs in ((self.positive, other.positive),
+                             (self.negative, other.negative)):
+            for key, count in theirs.items():
+                mine[key] = mine.get(key, 0) + count
+            self._collapse(mine)
+        self.zero_count += other.zero_count
+        self.count += other.count
+
+    def _value(self, key):
+        return 2 * self.gamma ** key / (self.gamma + 1)
+
+    def quantile(self, q):
+        '''Estimate the q'th quantile, e.g. q=.5 for the median
+
+        :returns: the estimate or None if no values have been added
+        '''
+        if self.count == 0:
+            return None
+        rank = q * (self.count - 1)
+        n = 0
+        for key in sorted(self.negative, reverse=True):
+            n += self.negative[key]
+            if n > rank:
+                return -self._value(key)
+        n += self.zero_count
+        if n > rank:
+            return 0.0
+        for key in sorted(self.positive):
+            n += self.positive[key]
+            if n > rank:
+                return self._value(key)
+        return self._value(max(self.positive))
@@ -0,0 +1,366 @@
+'''testing.py - local stand-ins for the services that backends talk to
+
+These let the tests and benchmarks exercise the network backends offline.
+Each stand-in runs in a daemon thread, records what it receives and counts
+requests and bytes so that both correctness and throughput can be checked.
+'''
+
+import json
+import pickle
+import socket
+import struct
+import threading
+import time
+
+try:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn, TCPServer, BaseRequestHandler
+    from urlparse import urlparse, parse_qs
+except ImportError:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn, TCPServer, BaseRequestHandler
+    from urllib.parse import urlparse, parse_qs
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class _DatadogHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # The headers and body are written separately: without this, each
+    # response waits for the client's delayed ACK
+    disable_nagle_algorithm = True
+
+    def do_POST(self):
+        server = self.server.fake
+        length = int(self.headers.get("Content-Length", 0))
+        data = self.rfile.read(length)
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        with server.lock:
+            server.n_requests += 1
+            server.n_bytes += length
+            server.api_keys.update(query.get("api_key", []))
+            if server.status == 200:
+                body = json.loads(data.decode("utf-8"))
+                if url.path.endswith("/api/v1/series"):
+                    server.series.extend(body["series"])
+                elif url.path.endswith("/api/v1/events"):
+                    server.events.append(body)
+            status = server.status
+        response = b'{"status": "ok"}'
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(response)))
+        self.end_headers()
+        self.wfile.write(response)
+
+    def log_message(self, *args):
+        pass
+
+
+class FakeDatadogServer(object):
+    '''A stand-in for the Datadog HTTP API
+
+    Accepts posts to /api/v1/series and /api/v1/events and records the
+    decoded series and events. Set "status" to an HTTP error code to
+    make the server reject requests.
+
+    Use as a context manager or call start() and stop().
+    '''
+
+    def __init__(self, host="127.0.0.1", port=0):
+        self.lock = threading.Lock()
+        self.series = []
+        self.events = []
+        self.api_keys = set()
+        self.n_requests = 0
+        self.n_bytes = 0
+        self.status = 200
+        self.server = _ThreadingHTTPServer((host, port), _DatadogHandler)
+        self.server.fake = self
+        self.thread = None
+
+    @property
+    def url(self):
+        '''The URL to use as the api-host of the Datadog backend'''
+        host, port = self.server.server_address[:2]
+        return "http://%s:%d" % (host, port)
+
+    def points(self, metric):
+        '''All (timestamp, value) points received for a metric'''
+        with self.lock:
+            return [tuple(point) for series in self.series
+                    if series["metric"] == metric
+                    for point in series["points"]]
+
+    def start(self):
+        self.thread = threading.Thread(
+            target=self.server.serve_forever,
+            name="FakeDatadogServerThread")
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+
+class _ThreadingTCPServer(ThreadingMixIn, TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class _CarbonHandler(BaseRequestHandler):
+
+    def handle(self):
+        sink = self.server.sink
+        with sink.lock:
+            sink.connections.append(self.request)
+            sink.n_connections += 1
+        data = b""
+        try:
+            while True:
+                sink.running.wait()
+                chunk = self.request.recv(65536)
+                if not chunk:
+                    break
+                with sink.lock:
+                    sink.n_bytes += len(chunk)
+                data += chunk
+                if sink.protocol == "pickle":
+                    data = sink.add_pickles(data)
+                else:
+                    lines = data.split(b"\n")
+                    data = lines.pop()
+                    sink.add_lines(lines)
+        except (socket.error, IOError, OSError):
+            pass
+        finally:
+            with sink.lock:
+                if self.request in sink.connections:
+                    sink.connections.remove(self.request)
+
+
+class CarbonSink(object):
+    '''A stand-in for a Carbon server
+
+    Speaks the plaintext protocol or, if protocol is "pickle", the pickle
+    protocol. Records the (name, value, timestamp) of each metric received. Call
+    stall() to stop reading from the connections, which eventually blocks
+    the sender, resume() to start reading again and disconnect() to close
+    all current connections.
+
+    Use as a context manager or call start() and stop().
+    '''
+
+    def __init__(self, host="127.0.0.1", port=0, protocol="plaintext"):
+        self.protocol = protocol
+        self.lock = threading.Lock()
+        self.condition = threading.Condition(self.lock)
+        self.metrics = []
+        self.connections = []
+        self.n_connections = 0
+        self.n_bytes = 0
+        self.running = threading.Event()
+        self.running.set()
+        self.server = _ThreadingTCPServer((host, port), _CarbonHandler)
+        self.server.sink = self
+        self.thread = None
+
+    @property
+    def address(self):
+        '''The host and port to use in the carbon configuration'''
+        return self.server.server_address[:2]
+
+    def add_lines(self, lines):
+        metrics = []
+        for line in lines:
+            name, value, timestamp = line.decode("utf-8").split()
+            metrics.append((name, float(value), float(timestamp)))
+        with self.condition:
+            self.metrics.extend(metrics)
+            self.condition.notify_all()
+
+    def add_pickles(self, data):
+        '''Add the metrics in complete pickles and return the remainder'''
+        metrics = []
+        while len(data) >= 4:
+            length = struct.unpack("!L", data[:4])[0]
+            if len(data) < length + 4:
+                break
+            for name, (timestamp, value) in pickle.loads(data[4:length + 4]):
+                metrics.append((name, float(value), float(timestamp)))
+            data = data[length + 4:]
+        with self.condition:
+            self.metrics.extend(metrics)
+            self.condition.notify_all()
+        return data
+
+    def names(self):
+        '''The names of the metrics received, in order'''
+        with self.lock:
+            return [_[0] for _ in self.metrics]
+
+    def wait_for(self, predicate, timeout=10):
+        '''Wait until predicate(metrics) is true
+
+        :returns: the predicate's final value
+        '''
+        with self.condition:
+            deadline = time.time() + timeout
+            while not predicate(self.metrics):
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                self.condition.wait(remaining)
+            return predicate(self.metrics)
+
+    def stall(self):
+        self.running.clear()
+
+    def resume(self):
+        self.running.set()
+
+    def disconnect(self):
+        with self.lock:
+            connections = list(self.connections)
+        for connection in connections:
+            try:
+                connection.shutdown(socket.SHUT_RDWR)
+            except (socket.error, IOError, OSError):
+                pass
+
+    def start(self):
+        self.thread = threading.Thread(
+            target=self.server.serve_forever,
+            name="CarbonSinkThread")
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.resume()
+        self.disconnect()
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+
+class DogStatsdListener(object):
+    '''A stand-in for the DogStatsD agent
+
+    Listens on UDP and records each metric line as a (name, value, type,
+    tags) tuple and each event as a dictionary with title, text,
+    alert_type and tags.
+
+    Use as a context manager or call start() and stop().
+    '''
+
+    def __init__(self, host="127.0.0.1", port=0):
+        self.lock = threading.Lock()
+        self.condition = threading.Condition(self.lock)
+        self.metrics = []
+        self.events = []
+        self.n_packets = 0
+        self.n_bytes = 0
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket.bind((host, port))
+        self.socket.settimeout(.1)
+        self.stopping = False
+        self.thread = None
+
+    @property
+    def address(self):
+        '''The host and port to use as dogstatsd-host and dogstatsd-port'''
+        return self.socket.getsockname()[:2]
+
+    def parse(self, data):
+        metrics = []
+        events = []
+        for line in data.decode("utf-8").split("\n"):
+            fields = line.split("|")
+            tags = []
+            if fields[-1].startswith("#"):
+                tags = fields.pop()[1:].split(",")
+            if line.startswith("_e{"):
+                title, text = fields[0][fields[0].index(":") + 1:], fields[1]
+                event = dict(title=title, text=text, tags=tags)
+                for field in fields[2:]:
+                    if field.startswith("t:"):
+                        event["alert_type"] = field[2:]
+                    elif field.startswith("d:"):
+                        event["date_happened"] = int(field[2:])
+                events.append(event)
+            else:
+                name, value = fields[0].rsplit(":", 1)
+                metrics.append((name, float(value), fields[1], tags))
+        with self.condition:
+            self.n_packets += 1
+            self.n_bytes += len(data)
+            self.metrics.extend(metrics)
+            self.events.extend(events)
+            self.condition.notify_all()
+
+    def run(self):
+        while not self.stopping:
+            try:
+                data = self.socket.recv(65536)
+            except socket.timeout:
+                continue
+            except (socket.error, IOError, OSError):
+                break
+            self.parse(data)
+
+    def values(self, name):
+        '''The values received for a metric, in order'''
+        with self.lock:
+            return [_[1] for _ in self.metrics if _[0] == name]
+
+    def wait_for(self, predicate, timeout=10):
+        '''Wait until predicate(listener) is true
+
+        :returns: the predicate's final value
+        '''
+        with self.condition:
+            deadline = time.time() + timeout
+            while not predicate(self):
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                self.condition.wait(remaining)
+            return predicate(self)
+
+    def start(self):
+        self.thread = threading.Thread(
+            target=self.run, name="DogStatsdListenerThread")
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.stopping = True
+        self.thread.join()
+        self.socket.close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
@@ -0,0 +1,72 @@
+'''timer.py - timing blocks of code and functions
+
+Use rh_logger.logger.timer(name) as a context manager or a decorator. The
+durations, in seconds, are added to a per-name distribution in process and
+reported through report_metrics when the aggregator's flush interval has
+elapsed and at end_process.
+'''
+
+import functools
+
+from rh_logger.aggregator import perf_counter_ns
+
+
+class Timer(object):
+    '''Time a block of code or a function
+
+    Use as a context manager:
+
+        with logger.timer("Align tile"):
+            ...
+
+    or as a decorator:
+
+        @logger.timer("Align tile")
+        def align_tile(...):
+            ...
+    '''
+
+    __slots__ = ["aggregator", "name", "context", "start"]
+
+    def __init__(self, aggregator, name, context=None):
+        self.aggregator = aggregator
+        self.name = name
+        self.context = context
+        self.start = None
+
+    def __enter__(self):
+        self.start = perf_counter_ns()
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        end = perf_counter_ns()
+        self.aggregator.histogram(self.name, (end - self.start) * 1e-9,
+                                  self.context, end)
+
+    def __call__(self, fn):
+        aggregator, name, context = self.aggregator, self.name, self.context
+
+        @functools.wraps(fn)
+        def timed(*args, **kwargs):
+            if not aggregator.enabled:
+                return fn(*args, **kwargs)
+            with Timer(aggregator, name, context):
+                return fn(*args, **kwargs)
+        return timed
+
+
+class NullTimer(object):
+    '''A timer that does nothing, for when timing is disabled'''
+
+    __slots__ = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        pass
+
+    def __call__(self, fn):
+        return fn
+
+NULL_TIMER = NullTimer()
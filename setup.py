@@ -6,7 +6,12 @@ setuptools.setup(
         "rh_logger.backend": [
             "default = rh_logger.backends.backend_python_logging:get_logger",
             "datadog = rh_logger.backends.backend_datadog_logging:get_logger",
-            "carbon = rh_logger.backends.backend_carbon_logging:get_logger"
+            "carbon = rh_logger.backends.backend_carbon_logging:get_logger",
+            "spool = rh_logger.backends.backend_spool_logging:get_logger",
+            "columnar = rh_logger.backends.backend_columnar_logging:get_logger"
+        ],
+        "console_scripts": [
+            "rh-logger-ship = rh_logger.ship:main"
         ]
     },
     install_requires=["enum34>=1.0.4",
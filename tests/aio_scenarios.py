@@ -0,0 +1,109 @@
+'''Coroutines for test_aio, kept apart because Python 2 can't parse them'''
+
+import asyncio
+import logging
+
+import rh_logger.aio
+from rh_logger.api import ExitCode, TimeSeries, AggregateTimeSeries
+
+
+async def carbon(host, port):
+    logger = rh_logger.aio.AsyncCarbonLogger(
+        "myapp", dict(host=host, port=port))
+    await logger.start_process("myapp", "Starting")
+    for i in range(100):
+        logger.report_metric_nowait("tiles done", i)
+    series = TimeSeries()
+    series.report_metrics([1, 2, 3], [10, 11, 12])
+    await logger.report_metrics("sizes", series)
+    aggregate = AggregateTimeSeries()
+    aggregate.report_metrics([1, 2, 3])
+    await logger.report_metrics("times", aggregate)
+    await logger.flush()
+    n_sent = logger.transport.n_sent
+    await logger.report_metric("last", 1)
+    await logger.end_process("Done", ExitCode.success)
+    return n_sent
+
+
+async def carbon_backpressure(host, port):
+    logger = rh_logger.aio.AsyncCarbonLogger(
+        "myapp", dict(host=host, port=port, **{"max-queue": 10}))
+    await logger.report_metric("first", 0)
+    await logger.flush()
+    for i in range(1000):
+        await logger.report_metric("value", i)
+    await logger.end_process("Done", ExitCode.success)
+    return logger.transport.n_dropped
+
+
+async def carbon_unreachable(port):
+    logger = rh_logger.aio.AsyncCarbonLogger(
+        "myapp", {"host": "127.0.0.1", "port": port, "max-queue": 10,
+                  "reconnect-min": .01, "reconnect-max": .01})
+    for i in range(100):
+        await logger.report_metric("value", i)
+    await asyncio.wait_for(logger.transport.close(timeout=.2), 5)
+    return logger.transport
+
+
+async def carbon_unreachable_flush(port):
+    logger = rh_logger.aio.AsyncCarbonLogger(
+        "myapp", {"host": "127.0.0.1", "port": port,
+                  "reconnect-min": .01, "reconnect-max": .01})
+    await logger.report_metric("value", 1)
+    sent = await asyncio.wait_for(logger.transport.flush(timeout=.2), 5)
+    await logger.transport.close(timeout=0)
+    return sent
+
+
+async def datadog(url):
+    logger = rh_logger.aio.AsyncDatadogLogger("myapp", {
+        "api-key": "api-key", "api-host": url, "flush-interval": 60,
+        "myapp": {"app-key": "app-key"}})
+    await logger.start_process("myapp", "Starting")
+    for i in range(10):
+        logger.report_metric_nowait("score", i, ["tile", 1])
+    series = TimeSeries()
+    series.report_metrics([1, 2, 3], [10, 11, 12])
+    await logger.report_metrics("sizes", series)
+    await logger.report_event("Bad tile", ["tile", 2], logging.WARNING)
+    try:
+        raise ValueError("oops")
+    except ValueError:
+        await logger.report_exception()
+    await logger.end_process("Done", ExitCode.success)
+    return logger.transport
+
+
+async def backend(name):
+    logger = rh_logger.aio.get_logger(name)
+    await logger.start_process(name, "Starting")
+    await logger.report_metric("score", 1)
+    logger.report_event_nowait("Hello")
+    await logger.end_process("Done", ExitCode.success)
+    return logger
+
+
+async def backend_time_series(name):
+    logger = rh_logger.aio.get_logger(name)
+    await logger.start_process(name, "Starting")
+    time_series = TimeSeries()
+    time_series.report_metric(1)
+    time_series.report_metric(2)
+    logger.report_metrics_nowait("sizes", time_series)
+    time_series.report_metric(3)
+    await logger.end_process("Done", ExitCode.success)
+
+
+async def datadog_close_during_flush(url):
+    transport = rh_logger.aio.AsyncDatadogTransport(
+        "api-key", "app-key", api_host=url, flush_interval=60)
+    for i in range(5):
+        transport.send_metric("score", [(1000 + i, i)])
+    transport.wakeup.set()
+    # wait until the task has taken the points from the buffer
+    while transport.n_pending > 0:
+        await asyncio.sleep(0)
+    await transport.close()
+    return transport
@@ -0,0 +1,42 @@
+'''An MPI job for test_mpi.py: run with "mpiexec -n 4 python <this file>"
+
+Each rank reports the values rank * 10 + 0..9 for "foo" and rank 3 also
+reports 1000 for "foo". Rank 0 prints the combined metrics as JSON.
+'''
+
+from mpi4py import MPI
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
+
+from rh_logger.mpi import MetricReducer
+
+
+def report(merged, outliers):
+    result = dict(
+        [(name, dict(count=stats.count, total=stats.total, min=stats.min,
+                     max=stats.max))
+         for name, stats in merged.items()])
+    result["outliers"] = dict(
+        [(name, [rank for rank, mean in ranks])
+         for name, ranks in outliers.items()])
+    print(json.dumps(result))
+    sys.stdout.flush()
+
+
+def main():
+    rank = MPI.COMM_WORLD.Get_rank()
+    interval = float(sys.argv[1]) if len(sys.argv) > 1 else None
+    reducer = MetricReducer(MPI.COMM_WORLD, report, interval=interval,
+                            outlier_sigma=1.5)
+    for i in range(10):
+        reducer.add("foo", rank * 10 + i)
+    if rank == 3:
+        reducer.add("foo", 1000)
+    reducer.close()
+
+if __name__ == "__main__":
+    main()
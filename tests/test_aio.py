@@ -0,0 +1,133 @@
+'''Test the asyncio loggers against local stand-ins'''
+
+from rh_logger.testing import CarbonSink, FakeDatadogServer
+import socket
+import sys
+import unittest
+
+if sys.version_info >= (3, 7):
+    import asyncio
+    from tests import aio_scenarios
+    from tests.test_fanout import RecordingLogger
+    import rh_logger.api
+    import rh_logger.discovery
+else:
+    aio_scenarios = None
+
+backends = []
+
+
+def get_logger(name, config):
+    backends.append(RecordingLogger())
+    return backends[-1]
+
+
+@unittest.skipIf(aio_scenarios is None, "asyncio needs Python 3.7")
+class TestAsyncCarbon(unittest.TestCase):
+
+    def test_metrics(self):
+        with CarbonSink() as sink:
+            n_sent = asyncio.run(aio_scenarios.carbon(*sink.address))
+            self.assertTrue(sink.wait_for(
+                lambda metrics: "myapp.last" in [_[0] for _ in metrics]))
+            names = sink.names()
+        # 100 points, one series and 9 summary statistics
+        self.assertEqual(n_sent, 110)
+        self.assertEqual(names.count("myapp.tiles_done"), 100)
+        self.assertEqual(names.count("myapp.sizes"), 3)
+        self.assertIn("myapp.times.p99", names)
+
+    def test_backpressure(self):
+        with CarbonSink() as sink:
+            n_dropped = asyncio.run(
+                aio_scenarios.carbon_backpressure(*sink.address))
+            self.assertTrue(sink.wait_for(lambda metrics: len(metrics) == 1001))
+        self.assertEqual(n_dropped, 0)
+
+    def test_unreachable(self):
+        s = socket.socket()
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+        s.close()
+        transport = asyncio.run(aio_scenarios.carbon_unreachable(port))
+        self.assertEqual(len(transport.queue), 10)
+        self.assertEqual(transport.n_dropped, 90)
+
+    def test_flush_unreachable(self):
+        s = socket.socket()
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+        s.close()
+        sent = asyncio.run(aio_scenarios.carbon_unreachable_flush(port))
+        self.assertFalse(sent)
+
+
+@unittest.skipIf(aio_scenarios is None, "asyncio needs Python 3.7")
+class TestAsyncDatadog(unittest.TestCase):
+
+    def test_batches(self):
+        with FakeDatadogServer() as server:
+            transport = asyncio.run(aio_scenarios.datadog(server.url))
+            self.assertEqual(len(server.points("score")), 10)
+            self.assertEqual(server.points("sizes"),
+                             [(10, 1), (11, 2), (12, 3)])
+            self.assertEqual(server.points("exception")[0][1], 1)
+            titles = [_["title"] for _ in server.events]
+            self.assertEqual(titles, ["myapp starting", "Bad tile",
+                                      "Exception report", "myapp exiting"])
+            self.assertIn("ValueError: oops", server.events[2]["text"])
+            self.assertEqual(server.events[1]["alert_type"], "warning")
+            self.assertEqual(server.api_keys, set(["api-key"]))
+        self.assertEqual(transport.n_dropped, 0)
+        self.assertEqual(transport.n_requests, 1 + len(titles))
+
+    def test_close_during_flush(self):
+        with FakeDatadogServer() as server:
+            transport = asyncio.run(
+                aio_scenarios.datadog_close_during_flush(server.url))
+            self.assertEqual(len(server.points("score")), 5)
+        self.assertEqual(transport.n_points_sent, 5)
+        self.assertEqual(transport.n_dropped, 0)
+
+
+@unittest.skipIf(aio_scenarios is None, "asyncio needs Python 3.7")
+class TestAsyncBackend(unittest.TestCase):
+
+    def setUp(self):
+        self.config_root = rh_logger.api.logging_config_root
+        rh_logger.discovery.register_backend(
+            "recording", "tests.test_aio:get_logger")
+        rh_logger.api.logging_config_root = {
+            "logging-backend": "recording", "recording": {}}
+        del backends[:]
+
+    def tearDown(self):
+        rh_logger.api.logging_config_root = self.config_root
+        rh_logger.discovery._registered_backends.pop("recording")
+
+    def test_executor(self):
+        asyncio.run(aio_scenarios.backend("recording"))
+        self.assertEqual(backends[0].calls, [
+            ("start_process", "Starting"),
+            ("report_metric", "score", 1),
+            ("report_event", "Hello"),
+            ("end_process", "Done")])
+
+    def test_fanout(self):
+        rh_logger.api.logging_config_root["logging-backend"] = [
+            "recording", "recording"]
+        asyncio.run(aio_scenarios.backend(None))
+        self.assertEqual(len(backends), 2)
+        for backend in backends:
+            self.assertEqual(backend.calls, [
+                ("start_process", "Starting"),
+                ("report_metric", "score", 1),
+                ("report_event", "Hello"),
+                ("end_process", "Done")])
+
+    def test_time_series_is_copied(self):
+        asyncio.run(aio_scenarios.backend_time_series("recording"))
+        self.assertIn(("report_metrics", "sizes", [1, 2]), backends[0].calls)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,46 @@
+'''Test the Carbon backend against a local stand-in'''
+
+from rh_logger import AggregateTimeSeries, ExitCode, TimeSeries
+from rh_logger.backends.backend_carbon_logging import CarbonLogger
+from rh_logger.testing import CarbonSink
+import unittest
+
+
+class TestCarbonLogger(unittest.TestCase):
+
+    def run_logger(self, protocol):
+        with CarbonSink(protocol=protocol) as sink:
+            host, port = sink.address
+            logger = CarbonLogger("myapp", dict(host=host, port=port,
+                                                protocol=protocol))
+            logger.start_process("myapp", "Hello")
+            logger.report_metric("Execution time", 1.5)
+            ts = TimeSeries()
+            ts.report_metrics([1, 2, 3], [10, 11, 12])
+            logger.report_metrics("Tile time", ts)
+            ts.report_metric(4)
+            aggregate = AggregateTimeSeries()
+            aggregate.report_metrics([1, 2, 3])
+            logger.report_metrics("Summary", aggregate)
+            logger.end_process("Goodbye", ExitCode.success)
+            sink.wait_for(lambda metrics: len(metrics) >= 13)
+            return sink.metrics
+
+    def check(self, metrics):
+        self.assertEqual(metrics[0][:2], ("myapp.Execution_time", 1.5))
+        self.assertEqual(metrics[1:4], [("myapp.Tile_time", 1, 10),
+                                        ("myapp.Tile_time", 2, 11),
+                                        ("myapp.Tile_time", 3, 12)])
+        summary = dict([_[:2] for _ in metrics[4:]])
+        self.assertEqual(summary["myapp.Summary.count"], 3)
+        self.assertEqual(summary["myapp.Summary.sum"], 6)
+        self.assertEqual(summary["myapp.Summary.max"], 3)
+
+    def test_plaintext(self):
+        self.check(self.run_logger("plaintext"))
+
+    def test_pickle(self):
+        self.check(self.run_logger("pickle"))
+
+if __name__ == "__main__":
+    unittest.main()
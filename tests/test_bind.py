@@ -0,0 +1,128 @@
+'''Test loggers bound to a context'''
+
+from rh_logger.api import ExitCode, Logger, TimeSeries
+from rh_logger.backends.backend_python_logging import BLPLogger
+from rh_logger.fanout import FanoutLogger
+from rh_logger.testing import FakeDatadogServer
+import logging
+import unittest
+
+try:
+    from rh_logger.backends.backend_datadog_logging import DatadogLogger
+except ImportError:
+    DatadogLogger = None
+
+
+class RecordingLogger(Logger):
+    '''Records the contexts it is called with'''
+
+    def __init__(self):
+        self.calls = []
+
+    def start_process(self, name, msg, args=None):
+        pass
+
+    def end_process(self, msg, exit_code):
+        pass
+
+    def report_metric(self, name, metric, context=None):
+        self.calls.append(("report_metric", name, metric, context))
+
+    def report_metrics(self, name, time_series, context=None):
+        self.calls.append(("report_metrics", name, len(time_series), context))
+
+    def report_event(self, event, context=None, log_level=None):
+        self.calls.append(("report_event", event, context, log_level))
+
+
+class RecordingHandler(logging.Handler):
+
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.messages = []
+
+    def emit(self, record):
+        self.messages.append(record.getMessage())
+
+
+class TestBind(unittest.TestCase):
+
+    def test_default(self):
+        logger = RecordingLogger()
+        bound = logger.bind(["tile", 3])
+        self.assertEqual(bound.context, ["tile", 3])
+        bound.report_metric("score", .5)
+        series = TimeSeries()
+        series.report_metrics([1, 2, 3])
+        bound.report_metrics("sizes", series)
+        bound.report_event("done", logging.WARNING)
+        self.assertEqual(logger.calls, [
+            ("report_metric", "score", .5, ["tile", 3]),
+            ("report_metrics", "sizes", 3, ["tile", 3]),
+            ("report_event", "done", ["tile", 3], logging.WARNING)])
+
+    def test_slots(self):
+        bound = RecordingLogger().bind(None)
+        self.assertRaises(AttributeError, setattr, bound, "other", 1)
+
+    def test_fanout(self):
+        a, b = RecordingLogger(), RecordingLogger()
+        fanout = FanoutLogger([("a", a), ("b", b)])
+        bound = fanout.bind("section 1")
+        bound.report_metric("score", 1)
+        bound.report_event("done")
+        fanout.end_process("bye", ExitCode.success)
+        for logger in a, b:
+            self.assertEqual(logger.calls, [
+                ("report_metric", "score", 1, "section 1"),
+                ("report_event", "done", "section 1", None)])
+
+
+class TestBLPLoggerBind(unittest.TestCase):
+
+    def setUp(self):
+        self.handler = RecordingHandler()
+        self.logger = logging.getLogger(self.id())
+        self.logger.addHandler(self.handler)
+
+    def tearDown(self):
+        self.logger.removeHandler(self.handler)
+
+    def test_same_messages(self):
+        logger = BLPLogger(self.id(), {})
+        series = TimeSeries()
+        series.report_metrics([1, 2, 3], [0, 1, 2])
+        for context in (["tile", 3], None):
+            bound = logger.bind(context)
+            logger.report_metric("score", .5, context)
+            bound.report_metric("score", .5)
+            logger.report_metrics("sizes", series, context)
+            bound.report_metrics("sizes", series)
+            logger.report_event("done", context)
+            bound.report_event("done")
+        messages = self.handler.messages
+        self.assertEqual(len(messages), 12)
+        self.assertEqual(messages[0::2], messages[1::2])
+        self.assertEqual(messages[4], "done (['tile', 3])")
+
+
+@unittest.skipIf(DatadogLogger is None, "datadog is not installed")
+class TestDatadogLoggerBind(unittest.TestCase):
+
+    def test_tags(self):
+        with FakeDatadogServer() as server:
+            logger = DatadogLogger("test", {
+                "api-key": "key", "api-host": server.url,
+                "test": {"app-key": "app"}})
+            bound = logger.bind(["tile", 3])
+            bound.report_metric("score", .5)
+            bound.report_event("done", logging.ERROR)
+            logger.end_process("bye", ExitCode.success)
+            series = [_ for _ in server.series if _["metric"] == "score"]
+            self.assertEqual(series[0]["tags"], ["test", "tile", 3])
+            event = [_ for _ in server.events if _["title"] == "done"][0]
+            self.assertEqual(event["tags"], ["test", "tile", 3])
+            self.assertEqual(event["alert_type"], "error")
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,316 @@
+'''Test the Carbon sender against a local TCP stand-in'''
+
+from rh_logger.backends.carbon_transport import CarbonSender, BLOCK, \
+     DROP_NEWEST, DROP_OLDEST, PICKLE, ConsistentHashRing, \
+     ShardedCarbonSender, parse_destination, serialize_plaintext
+from rh_logger.backends.backend_carbon_logging import CarbonLogger
+from rh_logger.testing import CarbonSink
+import array
+import hashlib
+import socket
+import threading
+import time
+import unittest
+
+
+def unused_port():
+    s = socket.socket()
+    s.bind(("127.0.0.1", 0))
+    port = s.getsockname()[1]
+    s.close()
+    return port
+
+
+def line(name, value=1):
+    return "%s %f %f\n" % (name, value, 1000)
+
+
+class TestCarbonSender(unittest.TestCase):
+
+    def setUp(self):
+        self.sink = CarbonSink().start()
+        self.senders = []
+
+    def tearDown(self):
+        for sender in self.senders:
+            sender.close_timeout = 0
+            sender.close()
+        self.sink.stop()
+
+    def make_sender(self, address=None, **kwargs):
+        host, port = address or self.sink.address
+        kwargs.setdefault("reconnect_min", .01)
+        kwargs.setdefault("reconnect_max", .05)
+        sender = CarbonSender(host, port, **kwargs)
+        self.senders.append(sender)
+        return sender
+
+    def test_send(self):
+        sender = self.make_sender()
+        for i in range(1000):
+            sender.put(line("foo.bar", i))
+        sender.close()
+        self.sink.wait_for(lambda metrics: len(metrics) >= 1000)
+        self.assertEqual(len(self.sink.metrics), 1000)
+        self.assertEqual([_[1] for _ in self.sink.metrics], list(range(1000)))
+        self.assertEqual(self.sink.metrics[0], ("foo.bar", 0, 1000))
+
+    def check_overflow(self, overflow):
+        sender = self.make_sender(("127.0.0.1", unused_port()),
+                                  max_queue=10, overflow=overflow,
+                                  prefix="myapp")
+        for i in range(20):
+            sender.put(line("foo", i))
+        self.assertEqual(sender.n_dropped, 10)
+        values = [float(_.split()[1]) for _ in sender.buffer]
+        sender.address = self.sink.address
+        sender.close_timeout = 5
+        sender.close()
+        self.sink.wait_for(lambda metrics: len(metrics) >= 12)
+        self.assertEqual([_[1] for _ in self.sink.metrics
+                          if _[0] == "foo"], values)
+        self.assertIn(("myapp.carbon.dropped", 10),
+                      [_[:2] for _ in self.sink.metrics])
+        return values
+
+    def test_drop_oldest(self):
+        self.assertEqual(self.check_overflow(DROP_OLDEST), list(range(10, 20)))
+
+    def test_drop_newest(self):
+        self.assertEqual(self.check_overflow(DROP_NEWEST), list(range(10)))
+
+    def test_block(self):
+        sender = self.make_sender(("127.0.0.1", unused_port()),
+                                  max_queue=10, overflow=BLOCK)
+        for i in range(10):
+            sender.put(line("foo", i))
+        thread = threading.Thread(target=sender.put, args=(line("foo", 10),))
+        thread.start()
+        thread.join(.1)
+        self.assertTrue(thread.is_alive())
+        sender.address = self.sink.address
+        thread.join(5)
+        self.assertFalse(thread.is_alive())
+        sender.close()
+        self.sink.wait_for(lambda metrics: len(metrics) >= 11)
+        self.assertEqual(len(self.sink.metrics), 11)
+        self.assertEqual(sender.n_dropped, 0)
+
+    def test_reconnect(self):
+        sender = self.make_sender()
+        sender.put(line("before"))
+        self.assertTrue(self.sink.wait_for(lambda metrics: len(metrics) == 1))
+        self.sink.disconnect()
+        deadline = time.time() + 10
+        while self.sink.n_connections < 2 and time.time() < deadline:
+            sender.put(line("during"))
+            time.sleep(.01)
+        sender.put(line("after"))
+        self.assertTrue(self.sink.wait_for(
+            lambda metrics: "after" in [_[0] for _ in metrics]))
+        self.assertGreaterEqual(sender.n_reconnects, 1)
+
+    def test_stall(self):
+        sender = self.make_sender(max_queue=100, overflow=DROP_NEWEST)
+        self.sink.stall()
+        big = line("x" * 60000)
+        for _ in range(1000):
+            sender.put(big)
+        self.assertGreater(sender.n_dropped, 0)
+        self.sink.resume()
+        deadline = time.time() + 10
+        while len(sender.buffer) > 0 and time.time() < deadline:
+            time.sleep(.01)
+        sender.put(line("after"))
+        self.assertTrue(self.sink.wait_for(
+            lambda metrics: "after" in [_[0] for _ in metrics]))
+
+    def test_flush(self):
+        sender = self.make_sender()
+        for i in range(100):
+            sender.put(line("foo", i))
+        self.assertTrue(sender.flush())
+        self.assertEqual(len(sender.buffer), 0)
+        self.assertEqual(sender.n_sending, 0)
+        self.assertTrue(self.sink.wait_for(lambda metrics: len(metrics) == 100))
+        down = self.make_sender(("127.0.0.1", unused_port()))
+        down.put(line("foo"))
+        self.assertFalse(down.flush(.1))
+
+    def test_gives_up(self):
+        sender = self.make_sender(("127.0.0.1", unused_port()),
+                                  close_timeout=.1)
+        sender.put(line("foo"))
+        sender.close()
+        self.assertEqual(sender.n_dropped, 1)
+
+    def test_pickle(self):
+        sink = CarbonSink(protocol=PICKLE).start()
+        try:
+            sender = self.make_sender(sink.address, protocol=PICKLE)
+            sender.put(("foo", 1, 1000))
+            sender.put(("bar", array.array("d", range(1000)),
+                        array.array("d", range(1000, 2000))))
+            sender.close()
+            sink.wait_for(lambda metrics: len(metrics) >= 1001)
+            self.assertEqual(sink.metrics[0], ("foo", 1, 1000))
+            self.assertEqual(sink.metrics[1:],
+                             [("bar", i, i + 1000) for i in range(1000)])
+        finally:
+            sink.stop()
+
+    def test_serialize_plaintext(self):
+        data = serialize_plaintext(
+            [("foo", 1, 2),
+             ("bar", array.array("d", [3, 4]), array.array("d", [5, 6])),
+             ("bad", "not a number", 7),
+             "baz 8 9\n"])
+        self.assertEqual(data.decode().splitlines(),
+                         ["foo 1.000000 2.000000",
+                          "bar 3.000000 5.000000",
+                          "bar 4.000000 6.000000",
+                          "baz 8 9"])
+
+    def test_bad_policy(self):
+        self.assertRaises(ValueError, CarbonSender, "127.0.0.1", 2003,
+                          overflow="explode")
+        self.assertRaises(ValueError, CarbonSender, "127.0.0.1", 2003,
+                          protocol="carrier pigeon")
+
+
+class TestConsistentHashRing(unittest.TestCase):
+
+    def test_positions(self):
+        # carbon-relay's placement: the first 4 hex digits of the MD5 of
+        # "<str(node)>:<replica>", bumped past positions already taken
+        node = ("10.0.0.1", "a")
+        ring = ConsistentHashRing([node], replica_count=3)
+        expected = sorted([int(hashlib.md5(
+            ("%s:%d" % (str(node), i)).encode()).hexdigest()[:4], 16)
+            for i in range(3)])
+        self.assertEqual(ring.ring, [(_, node) for _ in expected])
+
+    def test_get_node(self):
+        nodes = [("10.0.0.%d" % i, None) for i in range(1, 4)]
+        ring = ConsistentHashRing(nodes)
+        self.assertEqual(len(ring.ring), 300)
+        for name in ["foo.bar", "foo.baz", "myapp.carbon.dropped"]:
+            position = ring.compute_ring_position(name)
+            following = [_ for _ in ring.ring if _[0] >= position]
+            expected = (following or ring.ring)[0][1]
+            self.assertEqual(ring.get_node(name), expected)
+            preference = ring.get_nodes(name)
+            self.assertEqual(preference[0], expected)
+            self.assertEqual(sorted(preference), sorted(nodes))
+
+    def test_stable(self):
+        nodes = [("10.0.0.%d" % i, None) for i in range(1, 5)]
+        names = ["metric.%d" % i for i in range(1000)]
+        ring = ConsistentHashRing(nodes)
+        before = dict([(_, ring.get_node(_)) for _ in names])
+        ring.remove_node(nodes[-1])
+        moved = [_ for _ in names if ring.get_node(_) != before[_]]
+        self.assertEqual(set([before[_] for _ in moved]), set([nodes[-1]]))
+
+    def test_parse_destination(self):
+        self.assertEqual(parse_destination("carbon"),
+                         ("carbon", 2003, None))
+        self.assertEqual(parse_destination("carbon:2004", 2003),
+                         ("carbon", 2004, None))
+        self.assertEqual(parse_destination("carbon:2104:b"),
+                         ("carbon", 2104, "b"))
+        self.assertEqual(parse_destination(
+            dict(host="carbon", instance="c")), ("carbon", 2003, "c"))
+        self.assertRaises(ValueError, parse_destination, "a:1:b:c")
+
+
+class TestShardedCarbonSender(unittest.TestCase):
+
+    def setUp(self):
+        self.sinks = [CarbonSink().start() for _ in range(3)]
+        self.senders = []
+
+    def tearDown(self):
+        for sender in self.senders:
+            for _ in sender.senders.values():
+                _.close_timeout = 0
+            sender.close()
+        for sink in self.sinks:
+            sink.stop()
+
+    def make_sender(self, destinations, **kwargs):
+        kwargs.setdefault("reconnect_min", .01)
+        kwargs.setdefault("reconnect_max", .05)
+        sender = ShardedCarbonSender(destinations, **kwargs)
+        self.senders.append(sender)
+        return sender
+
+    def test_distribution(self):
+        destinations = [sink.address + (str(i), )
+                        for i, sink in enumerate(self.sinks)]
+        sender = self.make_sender(destinations)
+        names = ["metric.%d" % i for i in range(300)]
+        for name in names:
+            sender.put(line(name))
+            sender.put((name, 2, 1000))
+        sender.close()
+        for sink, (host, port, instance) in zip(self.sinks, destinations):
+            expected = set([_ for _ in names
+                            if sender.ring.get_node(_) == (host, instance)])
+            sink.wait_for(lambda metrics: len(metrics) >= 2 * len(expected))
+            self.assertEqual(set(sink.names()), expected)
+            # a roughly even spread
+            self.assertGreater(len(expected), 50)
+
+    def test_failover(self):
+        dead = ("127.0.0.1", unused_port(), "dead")
+        destinations = [dead, self.sinks[0].address + ("live", )]
+        sender = self.make_sender(destinations, close_timeout=.1)
+        failed = sender.senders[("127.0.0.1", "dead")]
+        deadline = time.time() + 10
+        while not failed.failed and time.time() < deadline:
+            time.sleep(.01)
+        self.assertTrue(failed.failed)
+        names = ["metric.%d" % i for i in range(100)]
+        for name in names:
+            sender.put(line(name))
+        self.assertTrue(self.sinks[0].wait_for(
+            lambda metrics: len(metrics) >= 100))
+        self.assertEqual(set(self.sinks[0].names()), set(names))
+        self.assertEqual(len(failed.buffer), 0)
+
+    def test_counters(self):
+        destinations = [self.sinks[0].address + ("a", ),
+                        self.sinks[1].address + ("b", )]
+        sender = self.make_sender(destinations, prefix="myapp")
+        prefixes = sorted([_.counter_prefix
+                           for _ in sender.senders.values()])
+        self.assertEqual(prefixes, sorted([
+            "myapp.carbon.127_0_0_1_%d_a" % self.sinks[0].address[1],
+            "myapp.carbon.127_0_0_1_%d_b" % self.sinks[1].address[1]]))
+        self.assertEqual(sender.n_dropped, 0)
+
+    def test_duplicate(self):
+        self.assertRaises(ValueError, ShardedCarbonSender,
+                          [self.sinks[0].address + (None, ),
+                           self.sinks[1].address + (None, )])
+        self.assertRaises(ValueError, ShardedCarbonSender, [])
+
+    def test_logger(self):
+        logger = CarbonLogger("myapp", {
+            "destinations": ["%s:%d:%d" % (sink.address + (i, ))
+                             for i, sink in enumerate(self.sinks)],
+            "reconnect-min": .01})
+        self.assertIsInstance(logger.sender, ShardedCarbonSender)
+        for i in range(100):
+            logger.report_metric("metric %d" % i, i)
+        logger.sender.close()
+        names = set()
+        for sink in self.sinks:
+            sink.wait_for(lambda metrics: len(metrics) > 0)
+            names.update(sink.names())
+        self.assertEqual(names, set(["myapp.metric_%d" % i
+                                     for i in range(100)]))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,219 @@
+'''Test collecting the logging of forked children'''
+
+from rh_logger.api import ExitCode, Logger, LoggerProxy, AggregateTimeSeries
+from rh_logger.collector import ForkCollector, SharedRing, METRIC, EVENT, \
+     ChildException
+import logging
+import multiprocessing
+import os
+import rh_logger.api
+import rh_logger.discovery
+import unittest
+
+
+class RecordingLogger(Logger):
+
+    def __init__(self):
+        self.calls = []
+
+    def start_process(self, name, msg, args=None):
+        self.calls.append(("start_process", name))
+
+    def end_process(self, msg, exit_code):
+        self.calls.append(("end_process", msg))
+
+    def report_metric(self, name, metric, context=None):
+        self.calls.append(("report_metric", name, metric, context))
+
+    def report_metrics(self, name, time_series, context=None):
+        self.calls.append(("report_metrics", name,
+                           list(time_series.values), context))
+
+    def report_count(self, name, count, context=None, timestamp=None):
+        self.calls.append(("report_count", name, count, context))
+
+    def report_event(self, event, context=None, log_level=None):
+        self.calls.append(("report_event", event, context, log_level))
+
+    def report_exception(self, exception=None, msg=None):
+        self.calls.append(("report_exception", exception, msg))
+
+
+def run_in_child(fn):
+    '''Fork, call fn in the child and wait for the child to exit'''
+    pid = os.fork()
+    if pid == 0:
+        try:
+            fn()
+        finally:
+            os._exit(0)
+    os.waitpid(pid, 0)
+
+
+class TestSharedRing(unittest.TestCase):
+
+    def test_round_trip(self):
+        ring = SharedRing(capacity=4, record_size=64)
+        self.assertTrue(ring.write(METRIC, None, 1.5, 2.5, (b"foo", b"[1]")))
+        self.assertTrue(ring.write(EVENT, logging.ERROR, 2, 0, (b"x" * 100,)))
+        records = ring.read()
+        self.assertEqual(len(records), 2)
+        self.assertEqual(records[0].kind, METRIC)
+        self.assertEqual(records[0].timestamp, 1.5)
+        self.assertEqual(records[0].value, 2.5)
+        self.assertEqual(records[0].fields[:2], [b"foo", b"[1]"])
+        self.assertIsNone(records[0].log_level)
+        self.assertEqual(records[1].log_level, logging.ERROR)
+        self.assertEqual(records[1].fields[0], b"x" * (64 - 24))
+        self.assertEqual(ring.read(), [])
+
+    def test_full(self):
+        ring = SharedRing(capacity=2, record_size=32)
+        for i in range(5):
+            ring.write(METRIC, None, i, i, (b"foo", ))
+        self.assertEqual(ring.n_dropped, 3)
+        self.assertEqual([_.value for _ in ring.read()], [0, 1])
+        ring.write(METRIC, None, 5, 5, (b"foo", ))
+        self.assertEqual([_.value for _ in ring.read()], [5])
+
+    def test_lock_timeout(self):
+        ring = SharedRing(capacity=4, record_size=32, lock_timeout=.05)
+        ring.write(METRIC, None, 1, 1, (b"foo", ))
+        ring.lock.acquire()
+        # a writer gives up rather than waiting forever
+        self.assertFalse(ring.write(METRIC, None, 2, 2, (b"foo", )))
+        self.assertEqual(ring.n_lock_timeouts, 1)
+        # the reader breaks the lock
+        self.assertEqual([_.value for _ in ring.read()], [1])
+        self.assertTrue(ring.write(METRIC, None, 3, 3, (b"foo", )))
+        self.assertEqual([_.value for _ in ring.read()], [3])
+
+    @unittest.skipUnless(hasattr(os, "fork"), "fork is not available")
+    def test_child_killed_holding_lock(self):
+        ring = SharedRing(capacity=4, record_size=32, lock_timeout=.5)
+        ring.write(METRIC, None, 1, 1, (b"foo", ))
+        run_in_child(ring.lock.acquire)
+        self.assertEqual([_.value for _ in ring.read()], [1])
+        self.assertTrue(ring.write(METRIC, None, 2, 2, (b"foo", )))
+        self.assertEqual([_.value for _ in ring.read()], [2])
+
+
+@unittest.skipUnless(hasattr(os, "fork"), "fork is not available")
+class TestForkCollector(unittest.TestCase):
+
+    def setUp(self):
+        self.backend = RecordingLogger()
+        self.collector = ForkCollector(self.backend, interval=60)
+
+    def test_parent(self):
+        self.collector.start_process("test", "hello")
+        self.collector.report_metric("x", 1, ["tile", 1])
+        self.collector.end_process("bye", ExitCode.success)
+        self.assertEqual(self.backend.calls, [
+            ("start_process", "test"),
+            ("report_metric", "x", 1, ["tile", 1]),
+            ("end_process", "bye")])
+
+    def test_children(self):
+        collector = self.collector
+
+        def child():
+            for i in range(10):
+                collector.report_metric("x", i, ["tile", 1])
+            collector.report_metric("y", "text")
+            collector.report_count("n", 12)
+            series = AggregateTimeSeries()
+            series.report_metrics([1, 2, 3])
+            collector.report_metrics("agg", series)
+            collector.report_event("done", "section", logging.WARNING)
+            try:
+                raise ValueError("bad")
+            except ValueError:
+                collector.report_exception(msg="oops")
+            collector.end_process("child", ExitCode.success)
+
+        for _ in range(3):
+            run_in_child(child)
+        collector.end_process("bye", ExitCode.success)
+        calls = self.backend.calls
+        self.assertEqual(calls[-1], ("end_process", "bye"))
+        series = [_ for _ in calls if _[:2] == ("report_metrics", "x")]
+        self.assertEqual(series, [("report_metrics", "x",
+                                   list(range(10)) * 3, ["tile", 1])])
+        self.assertEqual(
+            len([_ for _ in calls if _ == ("report_metric", "y", "text",
+                                           None)]), 3)
+        self.assertIn(("report_count", "n", 12, None), calls)
+        self.assertIn(("report_metrics", "agg.count", [3, 3, 3], None),
+                      calls)
+        self.assertIn(("report_event", "done", "section", logging.WARNING),
+                      calls)
+        exceptions = [_ for _ in calls if _[0] == "report_exception"]
+        self.assertEqual(len(exceptions), 3)
+        self.assertIsInstance(exceptions[0][1], ChildException)
+        self.assertIn("ValueError: bad", str(exceptions[0][1]))
+        self.assertEqual(exceptions[0][2], "oops")
+        self.assertEqual(len([_ for _ in calls if _[0] == "end_process"]), 1)
+
+    def test_bound(self):
+        collector = self.collector
+        bound = collector.bind(["tile", 2])
+        run_in_child(lambda: bound.report_event("child"))
+        bound.report_event("parent")
+        collector.end_process("bye", ExitCode.success)
+        self.assertEqual(self.backend.calls[:2], [
+            ("report_event", "parent", ["tile", 2], None),
+            ("report_event", "child", ["tile", 2], None)])
+
+
+backends = []
+
+
+def get_logger(name, config):
+    backends.append(RecordingLogger())
+    return backends[-1]
+
+
+def work(i):
+    rh_logger.logger.report_metric("square", i * i)
+
+
+@unittest.skipUnless(hasattr(os, "fork"), "fork is not available")
+class TestProxyForkCollector(unittest.TestCase):
+
+    def setUp(self):
+        self.config_root = rh_logger.api.logging_config_root
+        rh_logger.discovery.register_backend(
+            "recording", "tests.test_collector:get_logger")
+        rh_logger.api.logging_config_root = {
+            "logging-backend": "recording", "fork-collector": True,
+            "recording": {}}
+        self.proxy = rh_logger.logger = LoggerProxy()
+        del backends[:]
+
+    def tearDown(self):
+        rh_logger.api.logging_config_root = self.config_root
+        rh_logger.discovery._registered_backends.pop("recording")
+        rh_logger.logger = rh_logger.api.logger
+
+    def test_pool(self):
+        self.proxy.start_process("test", "hello")
+        self.assertIsInstance(self.proxy.logger, ForkCollector)
+        if hasattr(multiprocessing, "get_context"):
+            pool = multiprocessing.get_context("fork").Pool(2)
+        else:
+            pool = multiprocessing.Pool(2)
+        pool.map(work, range(10))
+        pool.close()
+        pool.join()
+        self.proxy.end_process("bye", ExitCode.success)
+        values = []
+        for call in backends[0].calls:
+            if call[0] == "report_metrics":
+                values.extend(call[2])
+            elif call[0] == "report_metric":
+                values.append(call[2])
+        self.assertEqual(sorted(values), [i * i for i in range(10)])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,116 @@
+'''Test the columnar metrics format and backend'''
+
+from rh_logger.api import AggregateTimeSeries, ExitCode, TimeSeries
+from rh_logger.backends.backend_columnar_logging import ColumnarLogger
+from rh_logger.columnar import ColumnarWriter, ColumnarReader, \
+     TRAILER, list_files
+import os
+import rh_logger.columnar
+import shutil
+import tempfile
+import unittest
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+@unittest.skipIf(np is None, "NumPy is not installed")
+class TestColumnar(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "test.rhcol")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write(self, chunk_size=10):
+        writer = ColumnarWriter(self.path, chunk_size=chunk_size)
+        for i in range(100):
+            writer.add("x", i, 1000 + i, ["tile", i % 3])
+        writer.add_many("y", [1, 2, 3], [10, 11, 12], {"mfov": 1})
+        writer.add("y", 4, 13)
+        return writer
+
+    def test_read(self):
+        self.write().close()
+        with ColumnarReader(self.path) as reader:
+            self.assertTrue(reader.complete)
+            self.assertEqual(reader.metrics(), ["x", "y"])
+            timestamps, values = reader.read("x")
+            np.testing.assert_array_equal(values, np.arange(100))
+            np.testing.assert_array_equal(timestamps, 1000 + np.arange(100))
+            timestamps, values = reader.read("x", ["tile", 1])
+            np.testing.assert_array_equal(values, np.arange(1, 100, 3))
+            timestamps, values = reader.read("x", start=1050, end=1060)
+            np.testing.assert_array_equal(values, np.arange(50, 60))
+            timestamps, values = reader.read("y", any_context=False)
+            np.testing.assert_array_equal(values, [4])
+            timestamps, values = reader.read("z")
+            self.assertEqual(len(values), 0)
+
+    def test_read_by_context(self):
+        self.write().close()
+        with ColumnarReader(self.path) as reader:
+            by_context = reader.read_by_context("y")
+            self.assertEqual([_[0] for _ in by_context], [{"mfov": 1}, None])
+            np.testing.assert_array_equal(by_context[0][2], [1, 2, 3])
+            np.testing.assert_array_equal(by_context[0][1], [10, 11, 12])
+
+    def test_unfinished_file(self):
+        writer = self.write()
+        writer.flush()
+        with ColumnarReader(self.path) as reader:
+            self.assertFalse(reader.complete)
+            timestamps, values = reader.read("x", ["tile", 2])
+            np.testing.assert_array_equal(values, np.arange(2, 100, 3))
+            timestamps, values = reader.read("y")
+            np.testing.assert_array_equal(values, [1, 2, 3, 4])
+        writer.close()
+
+    def test_context_numbers_are_bounded(self):
+        max_context_numbers = rh_logger.columnar.MAX_CONTEXT_NUMBERS
+        rh_logger.columnar.MAX_CONTEXT_NUMBERS = 4
+        try:
+            writer = ColumnarWriter(self.path, chunk_size=7)
+            for i in range(60):
+                writer.add("x", i, 1000 + i, ["tile", i % 6])
+                self.assertLessEqual(len(writer.context_numbers), 4)
+            writer.close()
+        finally:
+            rh_logger.columnar.MAX_CONTEXT_NUMBERS = max_context_numbers
+        with ColumnarReader(self.path) as reader:
+            self.assertGreater(len(reader.contexts), 6)
+            timestamps, values = reader.read("x", ["tile", 1])
+            np.testing.assert_array_equal(values, np.arange(1, 60, 6))
+            self.assertEqual([_[0] for _ in reader.read_by_context("x")],
+                             [["tile", i] for i in range(6)])
+
+    def test_one_chunk_is_not_copied(self):
+        self.write(chunk_size=1000).close()
+        with ColumnarReader(self.path) as reader:
+            timestamps, values = reader.read("x")
+            self.assertFalse(values.flags.writeable)
+
+    def test_backend(self):
+        logger = ColumnarLogger("test", dict(directory=self.directory))
+        logger.report_metric("x", 1.5, ["tile", 1])
+        series = TimeSeries()
+        series.report_metrics([1, 2, 3], [10, 11, 12])
+        logger.report_metrics("series", series)
+        aggregate = AggregateTimeSeries()
+        aggregate.report_metrics([4, 5, 6])
+        logger.report_metrics("aggregate", aggregate)
+        logger.end_process("bye", ExitCode.success)
+        path, = list_files(self.directory)
+        with ColumnarReader(path) as reader:
+            np.testing.assert_array_equal(reader.read("x")[1], [1.5])
+            np.testing.assert_array_equal(reader.read("series")[0],
+                                          [10, 11, 12])
+            np.testing.assert_array_equal(reader.read("aggregate.count")[1],
+                                          [3])
+
+if __name__ == "__main__":
+    unittest.main()
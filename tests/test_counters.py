@@ -0,0 +1,228 @@
+'''Test counters, gauges and histograms and the DogStatsD transport'''
+
+from rh_logger.aggregator import MetricAggregator, perf_counter_ns
+from rh_logger.api import LoggerProxy, AggregateTimeSeries
+from rh_logger.backends.dogstatsd_transport import DogStatsdTransport
+from rh_logger.testing import DogStatsdListener
+import time
+import unittest
+
+try:
+    import datadog
+except ImportError:
+    datadog = None
+
+
+class RecordingLogger(object):
+    '''Records report_count, report_metric and report_metrics calls'''
+
+    def __init__(self):
+        self.reports = []
+        self.timestamps = []
+
+    def report_count(self, name, count, context=None, timestamp=None):
+        self.reports.append(("count", name, count, context))
+        self.timestamps.append(timestamp)
+
+    def report_metrics(self, name, time_series, context=None):
+        if isinstance(time_series, AggregateTimeSeries):
+            self.reports.append(("histogram", name, time_series.summary(),
+                                 context))
+            self.timestamps.append(time_series.end)
+        else:
+            assert len(time_series) == 1
+            self.reports.append(("gauge", name, time_series.values[0],
+                                 context))
+            self.timestamps.append(time_series.timestamps[0])
+
+
+class TestAggregation(unittest.TestCase):
+
+    def setUp(self):
+        self.proxy = LoggerProxy()
+        self.target = RecordingLogger()
+        self.proxy.aggregator.target = self.target
+
+    def test_increment(self):
+        for i in range(100):
+            self.proxy.increment("tiles", context=["section", i % 2])
+        self.proxy.increment("bytes", 1000)
+        self.proxy.increment("bytes", 24)
+        self.assertEqual(self.target.reports, [])
+        self.proxy.aggregator.flush()
+        counts = dict([((name, tuple(context or ())), value)
+                       for kind, name, value, context
+                       in self.target.reports])
+        self.assertEqual(counts, {("tiles", ("section", 0)): 50,
+                                  ("tiles", ("section", 1)): 50,
+                                  ("bytes", ()): 1024})
+        self.proxy.aggregator.flush()
+        self.assertEqual(len(self.target.reports), 3)
+
+    def test_gauge(self):
+        for i in range(10):
+            self.proxy.gauge("depth", i)
+        self.proxy.aggregator.flush()
+        self.assertEqual(self.target.reports, [("gauge", "depth", 9, None)])
+
+    def test_histogram(self):
+        for i in range(1, 101):
+            self.proxy.histogram("size", i, "tile")
+        self.proxy.aggregator.flush()
+        kind, name, summary, context = self.target.reports[0]
+        self.assertEqual((kind, name, context), ("histogram", "size", "tile"))
+        self.assertEqual(summary.count, 100)
+        self.assertEqual(summary.max, 100)
+
+    def test_flush_window(self):
+        self.proxy.aggregator.set_flush_interval(0)
+        self.proxy.increment("tiles")
+        self.proxy.gauge("depth", 3)
+        self.assertEqual(self.target.reports,
+                         [("count", "tiles", 1, None),
+                          ("gauge", "depth", 3, None)])
+
+    def end_window(self, seconds_ago):
+        '''Make the current window look as if it ended a while ago'''
+        aggregator = self.proxy.aggregator
+        aggregator.next_flush = perf_counter_ns() - 1
+        aggregator.window_end = time.time() - seconds_ago
+        return aggregator.window_end
+
+    def test_late_value(self):
+        self.proxy.increment("x", 1)
+        self.proxy.gauge("depth", 1)
+        self.proxy.histogram("size", 1)
+        window_end = self.end_window(5)
+        self.proxy.increment("x", 100)
+        self.proxy.gauge("depth", 2)
+        self.proxy.histogram("size", 2)
+        self.assertEqual(sorted(self.target.reports[:2]),
+                         [("count", "x", 1, None),
+                          ("gauge", "depth", 1, None)])
+        self.assertEqual(self.target.reports[2][2].max, 1)
+        self.assertEqual(self.target.timestamps, [window_end] * 3)
+        self.proxy.aggregator.flush()
+        self.assertEqual(sorted(self.target.reports[3:5]),
+                         [("count", "x", 100, None),
+                          ("gauge", "depth", 2, None)])
+        self.assertEqual(self.target.reports[5][2].max, 2)
+        self.assertGreater(min(self.target.timestamps[3:]), window_end)
+
+    def test_late_timer(self):
+        with self.proxy.timer("block"):
+            pass
+        window_end = self.end_window(5)
+        with self.proxy.timer("block"):
+            pass
+        self.assertEqual(len(self.target.reports), 1)
+        self.assertEqual(self.target.reports[0][2].count, 1)
+        self.assertEqual(self.target.timestamps, [window_end])
+
+    def test_aligned_window(self):
+        aggregator = MetricAggregator(60)
+        remaining = aggregator.next_flush - perf_counter_ns()
+        self.assertGreater(remaining, 0)
+        self.assertLessEqual(remaining, 60 * 1e9)
+
+
+class TestDogStatsdTransport(unittest.TestCase):
+
+    def setUp(self):
+        self.listener = DogStatsdListener().start()
+        host, port = self.listener.address
+        self.transport = DogStatsdTransport(host, port)
+
+    def tearDown(self):
+        self.transport.close()
+        self.listener.stop()
+
+    def test_metrics(self):
+        self.transport.send_metric("foo", [(0, 1), (1, 2.5)], "host",
+                                   ["a", "b|c"])
+        self.transport.send_metric("bar:baz", [(0, 3)], None, None, "count")
+        self.assertTrue(self.listener.wait_for(lambda _: len(_.metrics) == 3))
+        self.assertEqual(self.listener.metrics, [
+            ("foo", 1.0, "g", ["a", "b_c", "host:host"]),
+            ("foo", 2.5, "g", ["a", "b_c", "host:host"]),
+            ("bar_baz", 3.0, "c", [])])
+        self.assertEqual(self.listener.n_packets, 2)
+
+    def test_packets(self):
+        self.transport.send_metric("foo", [(i, i) for i in range(1000)])
+        self.assertTrue(self.listener.wait_for(
+            lambda _: len(_.metrics) == 1000))
+        self.assertEqual(self.listener.values("foo"),
+                         [float(_) for _ in range(1000)])
+        self.assertGreater(self.transport.n_packets, 1)
+        self.assertEqual(self.transport.n_points_sent, 1000)
+
+    def test_event(self):
+        self.transport.send_event("Hello", "big\nworld", "warning", ["a"])
+        self.assertTrue(self.listener.wait_for(lambda _: len(_.events) == 1))
+        event = self.listener.events[0]
+        self.assertEqual(event["title"], "Hello")
+        self.assertEqual(event["text"], "big\\nworld")
+        self.assertEqual(event["alert_type"], "warning")
+        self.assertEqual(event["tags"], ["a"])
+
+
+@unittest.skipIf(datadog is None, "datadog is not installed")
+class TestDatadogDogStatsd(unittest.TestCase):
+
+    def test_logger(self):
+        from rh_logger.backends.backend_datadog_logging import DatadogLogger
+        from rh_logger.api import ExitCode
+        with DogStatsdListener() as listener:
+            host, port = listener.address
+            logger = DatadogLogger("myapp", {
+                "transport": "dogstatsd", "dogstatsd-host": host,
+                "dogstatsd-port": port})
+            logger.start_process("myapp", "Starting")
+            logger.report_count("tiles", 12, ["section", 3])
+            logger.report_metric("depth", 4)
+            logger.end_process("Done", ExitCode.success)
+            self.assertTrue(listener.wait_for(
+                lambda _: len(_.metrics) == 2 and len(_.events) == 2))
+            self.assertIn(("tiles", 12.0, "c",
+                           ["myapp", "section", "3", "host:myapp"]),
+                          listener.metrics)
+            self.assertIn(("depth", 4.0, "g", ["myapp", "host:myapp"]),
+                          listener.metrics)
+            self.assertEqual(
+                [_["alert_type"] for _ in listener.events],
+                ["info", "success"])
+
+    def check_series(self, config, metric_type):
+        from rh_logger.backends.backend_datadog_logging import DatadogLogger
+        from rh_logger.api import TimeSeries
+        with DogStatsdListener() as listener:
+            host, port = listener.address
+            config = dict(config, **{
+                "transport": "dogstatsd", "dogstatsd-host": host,
+                "dogstatsd-port": port})
+            logger = DatadogLogger("myapp", config)
+            series = TimeSeries()
+            series.report_metrics([1, 2, 3], [10, 11, 12])
+            logger.report_metrics("latency", series)
+            self.assertTrue(listener.wait_for(lambda _: len(_.metrics) == 3))
+            self.assertEqual([_[:3] for _ in listener.metrics], [
+                ("latency", 1.0, metric_type),
+                ("latency", 2.0, metric_type),
+                ("latency", 3.0, metric_type)])
+            logger.transport.close()
+
+    def test_series(self):
+        # every point counts, rather than the last one of a gauge
+        self.check_series({}, "d")
+
+    def test_series_histogram(self):
+        self.check_series({"dogstatsd-series-type": "histogram"}, "h")
+
+    def test_series_type_unknown(self):
+        from rh_logger.backends.backend_datadog_logging import DatadogLogger
+        self.assertRaises(ValueError, DatadogLogger, "myapp", {
+            "transport": "dogstatsd", "dogstatsd-series-type": "gauge"})
+
+if __name__ == "__main__":
+    unittest.main()
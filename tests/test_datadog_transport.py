@@ -0,0 +1,105 @@
+'''Test the batching Datadog transport against a local stand-in'''
+
+from rh_logger.api import TimeSeries
+from rh_logger.backends.datadog_transport import DatadogTransport
+from rh_logger.testing import FakeDatadogServer
+import time
+import unittest
+
+try:
+    from rh_logger.backends.backend_datadog_logging import DatadogLogger
+except ImportError:
+    DatadogLogger = None
+
+
+class TestDatadogTransport(unittest.TestCase):
+
+    def setUp(self):
+        self.server = FakeDatadogServer().start()
+
+    def tearDown(self):
+        self.server.stop()
+
+    def make_transport(self, **kwargs):
+        kwargs.setdefault("flush_interval", 60)
+        return DatadogTransport("my-api-key", "my-app-key",
+                                api_host=self.server.url, **kwargs)
+
+    def test_merge_series(self):
+        transport = self.make_transport()
+        for i in range(100):
+            transport.send_metric("foo", [(i, i * 2)], "host", ["a", "b"])
+            transport.send_metric("foo", [(i, i * 3)], "host", ["a", "c"])
+            transport.send_metric("bar", [(i, i)], "host", ["a", "b"])
+        transport.close()
+        self.assertEqual(self.server.n_requests, 1)
+        self.assertEqual(len(self.server.series), 3)
+        for series in self.server.series:
+            self.assertEqual(len(series["points"]), 100)
+            self.assertEqual(series["host"], "host")
+        foo_b = [_ for _ in self.server.series
+                 if _["metric"] == "foo" and _["tags"] == ["a", "b"]][0]
+        self.assertEqual([tuple(_) for _ in foo_b["points"]],
+                         [(i, i * 2) for i in range(100)])
+        self.assertEqual(self.server.api_keys, set(["my-api-key"]))
+        self.assertEqual(transport.n_points_sent, 300)
+
+    def test_events(self):
+        transport = self.make_transport()
+        transport.send_event("Hello", "world", "warning", ["a"])
+        transport.send_event("Goodbye", "world", "success", ["b"])
+        transport.close()
+        self.assertEqual([_["title"] for _ in self.server.events],
+                         ["Hello", "Goodbye"])
+        self.assertEqual(self.server.events[0]["alert_type"], "warning")
+        self.assertEqual(self.server.events[1]["tags"], ["b"])
+
+    def test_flush_on_size(self):
+        transport = self.make_transport(flush_size=10)
+        for i in range(10):
+            transport.send_metric("foo", [(i, i)])
+        for _ in range(100):
+            if len(self.server.points("foo")) == 10:
+                break
+            time.sleep(.05)
+        self.assertEqual(len(self.server.points("foo")), 10)
+        transport.close()
+
+    def test_flush_on_interval(self):
+        transport = self.make_transport(flush_interval=.05)
+        transport.send_metric("foo", [(1, 1)])
+        for _ in range(100):
+            if len(self.server.points("foo")) == 1:
+                break
+            time.sleep(.05)
+        self.assertEqual(self.server.points("foo"), [(1, 1)])
+        transport.close()
+
+    def test_rejected(self):
+        self.server.status = 500
+        transport = self.make_transport()
+        transport.send_metric("foo", [(1, 1), (2, 2)])
+        transport.close()
+        self.assertEqual(transport.n_points_sent, 0)
+        self.assertEqual(transport.n_dropped, 2)
+
+    def test_iterable_points(self):
+        transport = self.make_transport()
+        transport.send_metric("foo", zip([1, 2], [3, 4]))
+        transport.close()
+        self.assertEqual(self.server.points("foo"), [(1, 3), (2, 4)])
+
+    @unittest.skipIf(DatadogLogger is None, "datadog is not installed")
+    def test_time_series(self):
+        logger = DatadogLogger("test", {
+            "api-key": "key", "api-host": self.server.url,
+            "test": {"app-key": "app"}})
+        series = TimeSeries()
+        series.report_metrics([1, 2, 3], [10, 11, 12])
+        logger.report_metrics("sizes", series)
+        logger.transport.close()
+        self.assertEqual(self.server.points("sizes"),
+                         [(10, 1), (11, 2), (12, 3)])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,72 @@
+'''Test finding backends through the cached entry point map'''
+
+import json
+import os
+import os.path
+import rh_logger.discovery as discovery
+import shutil
+import tempfile
+import unittest
+
+
+class TestDiscovery(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.cache_path = os.path.join(self.directory, "entry_points.json")
+        self.old_cache = os.environ.get("RH_LOGGER_CACHE")
+        os.environ["RH_LOGGER_CACHE"] = self.cache_path
+        discovery._entry_point_map = None
+
+    def tearDown(self):
+        if self.old_cache is None:
+            del os.environ["RH_LOGGER_CACHE"]
+        else:
+            os.environ["RH_LOGGER_CACHE"] = self.old_cache
+        discovery._entry_point_map = None
+        shutil.rmtree(self.directory)
+
+    def test_write_cache(self):
+        entry_points = discovery.get_entry_point_map()
+        with open(self.cache_path) as fd:
+            cache = json.load(fd)
+        self.assertEqual(cache["entry_points"], entry_points)
+        self.assertEqual(cache["key"],
+                         json.loads(json.dumps(
+                             discovery.get_environment_key())))
+
+    def test_read_cache(self):
+        with open(self.cache_path, "w") as fd:
+            json.dump(dict(key=discovery.get_environment_key(),
+                           entry_points=dict(foo=["os.path:join"])), fd)
+        self.assertEqual(discovery.get_entry_point_map(),
+                         dict(foo=["os.path:join"]))
+        self.assertEqual(discovery.find_backends("foo"), [os.path.join])
+
+    def test_stale_cache(self):
+        with open(self.cache_path, "w") as fd:
+            json.dump(dict(key=["something else"],
+                           entry_points=dict(foo=["os.path:join"])), fd)
+        self.assertNotIn("foo", discovery.get_entry_point_map())
+
+    def test_no_cache(self):
+        os.environ["RH_LOGGER_CACHE"] = ""
+        discovery.get_entry_point_map()
+        self.assertFalse(os.path.exists(self.cache_path))
+
+    def test_load_entry_point(self):
+        self.assertIs(discovery.load_entry_point("os.path:join"),
+                      os.path.join)
+        self.assertIs(discovery.load_entry_point("os:path.join"),
+                      os.path.join)
+
+    def test_register_backend(self):
+        discovery.register_backend("joiner", "os.path:join")
+        try:
+            self.assertEqual(discovery.find_backends("joiner"),
+                             [os.path.join])
+        finally:
+            del discovery._registered_backends["joiner"]
+
+if __name__ == "__main__":
+    unittest.main()
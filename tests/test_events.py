@@ -0,0 +1,212 @@
+'''Test reporting several events at once'''
+
+from rh_logger.api import ExitCode, Logger, LoggerProxy
+from rh_logger.backends.backend_python_logging import BLPLogger
+from rh_logger.backends.backend_spool_logging import SpoolLogger
+from rh_logger.collector import ForkCollector
+from rh_logger.fanout import FanoutLogger
+from rh_logger.ship import Shipper
+from rh_logger.spool import list_segments, read_segment
+from rh_logger.testing import FakeDatadogServer
+import logging
+import os
+import rh_logger.api
+import rh_logger.discovery
+import shutil
+import tempfile
+import unittest
+
+try:
+    from rh_logger.backends.backend_datadog_logging import DatadogLogger, \
+         format_event_lines
+except ImportError:
+    DatadogLogger = None
+
+
+class RecordingLogger(Logger):
+
+    def __init__(self):
+        self.calls = []
+
+    def start_process(self, name, msg, args=None):
+        pass
+
+    def end_process(self, msg, exit_code):
+        pass
+
+    def report_event(self, event, context=None, log_level=None):
+        self.calls.append(("report_event", event, context, log_level))
+
+
+class BatchLogger(RecordingLogger):
+
+    def report_events(self, events, context=None, log_level=None,
+                      title=None):
+        self.calls.append(("report_events", list(events), context,
+                           log_level, title))
+
+
+class RecordingHandler(logging.Handler):
+
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.messages = []
+
+    def emit(self, record):
+        self.messages.append(record.getMessage())
+
+
+def get_logger(name, config):
+    return BLPLogger(name, {})
+
+
+class TestReportEvents(unittest.TestCase):
+
+    def test_default(self):
+        logger = RecordingLogger()
+        logger.report_events(["a", "b"], ["tile", 1], logging.WARNING,
+                             title="Batch")
+        self.assertEqual(logger.calls, [
+            ("report_event", "Batch", ["tile", 1], logging.WARNING),
+            ("report_event", "a", ["tile", 1], logging.WARNING),
+            ("report_event", "b", ["tile", 1], logging.WARNING)])
+
+    def test_fanout(self):
+        a, b = BatchLogger(), BatchLogger()
+        fanout = FanoutLogger([("a", a), ("b", b)])
+        fanout.report_events(iter(["x", "y"]), "section", title="T")
+        fanout.end_process("bye", ExitCode.success)
+        for logger in a, b:
+            self.assertEqual(logger.calls, [
+                ("report_events", ["x", "y"], "section", None, "T")])
+
+
+class TestBLPLoggerEvents(unittest.TestCase):
+
+    def setUp(self):
+        self.handler = RecordingHandler()
+        self.logger = logging.getLogger(self.id())
+        self.logger.addHandler(self.handler)
+
+    def tearDown(self):
+        self.logger.removeHandler(self.handler)
+
+    def test_one_record(self):
+        logger = BLPLogger(self.id(), {})
+        logger.report_events(["a: 1", "b: 2"], title="Settings")
+        logger.report_events(["c"], ["tile", 1])
+        self.assertEqual(self.handler.messages, [
+            "Settings\n    a: 1\n    b: 2",
+            "1 events (['tile', 1])\n    c"])
+
+    def test_rate_limit(self):
+        logger = BLPLogger(self.id(), {"event-rate-limit": {
+            "rate": .001, "burst": 1, "window": 60}})
+        for _ in range(3):
+            logger.report_events(["a", "b"], title="Settings")
+        self.assertEqual(len(self.handler.messages), 1)
+
+
+@unittest.skipIf(DatadogLogger is None, "datadog is not installed")
+class TestDatadogLoggerEvents(unittest.TestCase):
+
+    def test_one_event(self):
+        with FakeDatadogServer() as server:
+            logger = DatadogLogger("test", {
+                "api-key": "key", "api-host": server.url,
+                "test": {"app-key": "app"}})
+            logger.report_events(["PID: 1", "HOME: /root"], ["tile", 2],
+                                 logging.WARNING, title="Environment")
+            logger.end_process("bye", ExitCode.success)
+            events = [_ for _ in server.events if "exiting" not in _["title"]]
+            self.assertEqual(len(events), 1)
+            event = events[0]
+            self.assertEqual(event["title"], "Environment")
+            self.assertEqual(event["alert_type"], "warning")
+            self.assertEqual(event["tags"], ["test", "tile", 2])
+            self.assertIn("PID: 1\nHOME: /root", event["text"])
+
+    def test_truncate(self):
+        text = format_event_lines(["x" * 100] * 100)
+        self.assertLessEqual(len(text), 4000)
+        self.assertTrue(text.startswith("%%% \n```\n"))
+        self.assertTrue(text.endswith("\n```\n %%%"))
+        self.assertIn("more", text)
+        self.assertEqual(format_event_lines(["```"]).count("```"), 2)
+
+
+class TestSpoolEvents(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_round_trip(self):
+        logger = SpoolLogger("test", dict(directory=self.directory))
+        logger.report_events(["a", "b"], {"mfov": 5}, 30, "Title")
+        records = [record for path in list_segments(self.directory)
+                   for record in read_segment(path)]
+        self.assertEqual(records[0].kind, "events")
+        self.assertEqual(records[0].args,
+                         (["a", "b"], {"mfov": 5}, 30, "Title"))
+        target = BatchLogger()
+        Shipper(self.directory, target).ship()
+        self.assertEqual(target.calls, [
+            ("report_events", ["a", "b"], {"mfov": 5}, 30, "Title")])
+
+
+@unittest.skipUnless(hasattr(os, "fork"), "fork is not available")
+class TestForkCollectorEvents(unittest.TestCase):
+
+    def test_child(self):
+        backend = BatchLogger()
+        collector = ForkCollector(backend, interval=60)
+        pid = os.fork()
+        if pid == 0:
+            try:
+                collector.report_events(["a", "b", "c"], ["tile", 1],
+                                        logging.ERROR, "Child")
+                collector.report_events(["d"])
+            finally:
+                os._exit(0)
+        os.waitpid(pid, 0)
+        collector.report_events(["e"], title="Parent")
+        collector.end_process("bye", ExitCode.success)
+        self.assertEqual(backend.calls, [
+            ("report_events", ["e"], None, None, "Parent"),
+            ("report_events", ["a", "b", "c"], ["tile", 1], logging.ERROR,
+             "Child"),
+            ("report_events", ["d"], None, None, None)])
+
+
+class TestLogEnv(unittest.TestCase):
+
+    def setUp(self):
+        self.config_root = rh_logger.api.logging_config_root
+        rh_logger.discovery.register_backend(
+            "events", "tests.test_events:get_logger")
+        rh_logger.api.logging_config_root = {"logging-backend": "events"}
+        self.handler = RecordingHandler()
+        self.logger = logging.getLogger(self.id())
+        self.logger.addHandler(self.handler)
+
+    def tearDown(self):
+        rh_logger.api.logging_config_root = self.config_root
+        rh_logger.discovery._registered_backends.pop("events")
+        self.logger.removeHandler(self.handler)
+
+    def test_one_record(self):
+        proxy = LoggerProxy()
+        proxy.start_process(self.id(), "hello", log_env=True)
+        proxy.end_process("bye", ExitCode.success)
+        records = [_ for _ in self.handler.messages
+                   if _.startswith("Environment")]
+        self.assertEqual(len(records), 1)
+        lines = records[0].split("\n")
+        self.assertEqual(lines[1], "    PID: %d" % os.getpid())
+        self.assertEqual(len(lines), len(os.environ) + 2)
+
+if __name__ == "__main__":
+    unittest.main()
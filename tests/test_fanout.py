@@ -0,0 +1,217 @@
+'''Test sending calls to several backends'''
+
+from rh_logger.api import ExitCode, LoggerProxy, TimeSeries
+from rh_logger.backends.backend_python_logging import BLPLogger
+from rh_logger.fanout import FanoutLogger
+import logging
+import rh_logger.api
+import rh_logger.discovery
+import threading
+import time
+import unittest
+
+
+class RecordingLogger(object):
+    '''Records calls and waits for its gate to be open before each one'''
+
+    def __init__(self, name=None, config=None):
+        self.calls = []
+        self.gate = threading.Event()
+        self.gate.set()
+        self.done = threading.Event()
+
+    def record(self, *args):
+        self.gate.wait()
+        self.calls.append(args)
+
+    def start_process(self, name, msg, args=None):
+        self.record("start_process", msg)
+
+    def end_process(self, msg, exit_code):
+        self.record("end_process", msg)
+        self.done.set()
+
+    def report_metric(self, name, metric, subcontext=None):
+        self.record("report_metric", name, metric)
+
+    def report_metrics(self, name, time_series, context=None):
+        self.record("report_metrics", name, list(time_series.values))
+
+    def report_event(self, event, context=None, log_level=None):
+        self.record("report_event", event)
+
+    def flush(self):
+        self.record("flush")
+        return True
+
+    def report_exception(self, exception=None, msg=None):
+        self.record("report_exception", exception)
+
+
+class FailingLogger(RecordingLogger):
+
+    def report_metric(self, name, metric, subcontext=None):
+        raise IOError("Service unavailable")
+
+
+class RecordingHandler(logging.Handler):
+
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+
+class TestFanoutLogger(unittest.TestCase):
+
+    def test_all_backends_get_calls(self):
+        a, b = RecordingLogger(), RecordingLogger()
+        fanout = FanoutLogger([("a", a), ("b", b)])
+        fanout.start_process("test", "hello")
+        fanout.report_metric("x", 1)
+        fanout.end_process("bye", ExitCode.success)
+        for logger in a, b:
+            self.assertEqual(logger.calls, [
+                ("start_process", "hello"),
+                ("report_metric", "x", 1),
+                ("end_process", "bye")])
+        stats = fanout.get_backend_stats()
+        self.assertEqual(sorted(stats), ["a", "b"])
+        self.assertEqual(stats["a"].calls, 3)
+        self.assertEqual(stats["a"].depth, 0)
+        self.assertEqual(stats["a"].dropped, 0)
+
+    def test_slow_backend_is_isolated(self):
+        slow, fast = RecordingLogger(), RecordingLogger()
+        slow.gate.clear()
+        fanout = FanoutLogger([("slow", slow), ("fast", fast)], max_queue=5,
+                              close_timeout=.1)
+        for i in range(3):
+            fanout.report_metric("x", i)
+        deadline = time.time() + 10
+        while len(fast.calls) < 3 and time.time() < deadline:
+            time.sleep(.01)
+        self.assertEqual(len(fast.calls), 3)
+        self.assertEqual(len(slow.calls), 0)
+        start = time.time()
+        for i in range(20):
+            fanout.report_metric("x", i)
+        self.assertLess(time.time() - start, 1)
+        self.assertGreater(fanout.get_backend_stats()["slow"].dropped, 0)
+        fanout.end_process("bye", ExitCode.success)
+        self.assertTrue(fast.done.wait(10))
+        slow.gate.set()
+
+    def test_close_timeout(self):
+        stuck = RecordingLogger()
+        stuck.gate.clear()
+        fanout = FanoutLogger([("stuck", stuck)], close_timeout=.1)
+        fanout.report_metric("x", 1)
+        start = time.time()
+        fanout.end_process("bye", ExitCode.success)
+        self.assertLess(time.time() - start, 5)
+        stuck.gate.set()
+
+    def test_flush(self):
+        a, b = RecordingLogger(), RecordingLogger()
+        fanout = FanoutLogger([("a", a), ("b", b)], close_timeout=.1)
+        fanout.report_metric("x", 1)
+        self.assertTrue(fanout.flush())
+        self.assertEqual(a.calls, [("report_metric", "x", 1), ("flush", )])
+        b.gate.clear()
+        self.assertFalse(fanout.flush())
+        b.gate.set()
+        fanout.end_process("bye", ExitCode.success)
+
+    def test_failing_backend(self):
+        failing, ok = FailingLogger(), RecordingLogger()
+        fanout = FanoutLogger([("failing", failing), ("ok", ok)])
+        fanout.report_metric("x", 1)
+        fanout.end_process("bye", ExitCode.success)
+        self.assertEqual(fanout.get_backend_stats()["failing"].errors, 1)
+        self.assertEqual(ok.calls[0], ("report_metric", "x", 1))
+
+    def test_exception_is_captured_on_caller_thread(self):
+        logger = RecordingLogger()
+        fanout = FanoutLogger([("a", logger)])
+        try:
+            raise ValueError("oops")
+        except ValueError:
+            fanout.report_exception()
+        fanout.end_process("bye", ExitCode.success)
+        exception = logger.calls[0][1]
+        self.assertIsInstance(exception, ValueError)
+        self.assertIsNotNone(getattr(exception, "__traceback__", None))
+
+    def test_exception_traceback_is_logged(self):
+        handler = RecordingHandler()
+        logging.getLogger(self.id()).addHandler(handler)
+        try:
+            fanout = FanoutLogger([("blp", BLPLogger(self.id(), {}))])
+            try:
+                raise ValueError("oops")
+            except ValueError:
+                fanout.report_exception()
+            fanout.end_process("bye", ExitCode.success)
+        finally:
+            logging.getLogger(self.id()).removeHandler(handler)
+        records = [_ for _ in handler.records if _.exc_info]
+        self.assertEqual(len(records), 1)
+        self.assertIs(records[0].exc_info[0], ValueError)
+        self.assertIsNotNone(records[0].exc_info[2])
+
+    def test_time_series_is_copied(self):
+        logger = RecordingLogger()
+        logger.gate.clear()
+        fanout = FanoutLogger([("a", logger)])
+        time_series = TimeSeries()
+        time_series.report_metric(1)
+        fanout.report_metrics("x", time_series)
+        time_series.report_metric(2)
+        time_series.values[0] = 5
+        logger.gate.set()
+        fanout.end_process("bye", ExitCode.success)
+        self.assertEqual(logger.calls[0], ("report_metrics", "x", [1.0]))
+
+
+backends = {}
+
+
+def get_logger(name, config):
+    backends[config["id"]] = logger = RecordingLogger()
+    return logger
+
+
+class TestProxyFanout(unittest.TestCase):
+
+    def setUp(self):
+        self.entry_point_map = rh_logger.discovery._entry_point_map
+        self.config_root = rh_logger.api.logging_config_root
+        rh_logger.discovery._entry_point_map = {
+            "a": ["tests.test_fanout:get_logger"],
+            "b": ["tests.test_fanout:get_logger"]}
+        rh_logger.api.logging_config_root = {
+            "logging-backend": ["a", "b"],
+            "a": {"id": "a"}, "b": {"id": "b"}}
+        backends.clear()
+
+    def tearDown(self):
+        rh_logger.discovery._entry_point_map = self.entry_point_map
+        rh_logger.api.logging_config_root = self.config_root
+
+    def test_list_of_backends(self):
+        proxy = LoggerProxy()
+        proxy.start_process("test", "hello")
+        self.assertIsInstance(proxy.logger, FanoutLogger)
+        proxy.report_event("frobbed")
+        proxy.end_process("bye", ExitCode.success)
+        for name in "a", "b":
+            self.assertEqual(backends[name].calls, [
+                ("start_process", "hello"),
+                ("report_event", "frobbed"),
+                ("end_process", "bye")])
+
+if __name__ == "__main__":
+    unittest.main()
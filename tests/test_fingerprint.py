@@ -0,0 +1,245 @@
+'''Test exception fingerprinting'''
+
+from rh_logger.api import ExitCode, Logger, LoggerProxy
+from rh_logger.backends.backend_python_logging import BLPLogger
+from rh_logger.fingerprint import ExceptionFingerprinter, exception_key, \
+     fingerprint, get_exception_info
+from rh_logger.testing import FakeDatadogServer
+import logging
+import rh_logger.api
+import rh_logger.discovery
+import sys
+import unittest
+
+try:
+    from rh_logger.backends.backend_datadog_logging import DatadogLogger
+except ImportError:
+    DatadogLogger = None
+
+
+class RecordingLogger(Logger):
+
+    def __init__(self):
+        self.exceptions = []
+        self.counts = []
+
+    def start_process(self, name, msg, args=None):
+        pass
+
+    def end_process(self, msg, exit_code):
+        pass
+
+    def report_count(self, name, count, context=None, timestamp=None):
+        self.counts.append((name, count, context))
+
+    def report_exception(self, exception=None, msg=None):
+        if exception is None:
+            exception = sys.exc_info()[1]
+        self.exceptions.append((exception, msg))
+
+
+class RecordingHandler(logging.Handler):
+
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+
+backends = []
+
+
+def get_logger(name, config):
+    backends.append(RecordingLogger())
+    return backends[-1]
+
+
+def fail(value):
+    raise ValueError(value)
+
+
+def fail_elsewhere(value):
+    raise ValueError(value)
+
+
+def catch(fn, value):
+    '''Return the exception info of fn(value)'''
+    try:
+        fn(value)
+    except ValueError:
+        return sys.exc_info()
+
+
+def current_fingerprint():
+    '''The fingerprint of the exception being handled'''
+    exc_type, _, tb = sys.exc_info()
+    return fingerprint(exc_type, tb)
+
+
+class TestFingerprint(unittest.TestCase):
+
+    def test_same_place(self):
+        fingerprints = set()
+        for i in range(3):
+            exc_type, exception, tb = catch(fail, i)
+            fingerprints.add(fingerprint(exc_type, tb))
+        self.assertEqual(len(fingerprints), 1)
+        self.assertEqual(len(fingerprints.pop()), 12)
+
+    def test_different_place(self):
+        exc_type, _, tb = catch(fail, 1)
+        exc_type2, _, tb2 = catch(fail_elsewhere, 1)
+        self.assertNotEqual(fingerprint(exc_type, tb),
+                            fingerprint(exc_type2, tb2))
+        self.assertNotEqual(fingerprint(ValueError, tb),
+                            fingerprint(KeyError, tb))
+
+    def test_key(self):
+        exc_type, _, tb = catch(fail, 1)
+        key_type, frames, message = exception_key(exc_type, tb)
+        self.assertIs(key_type, ValueError)
+        self.assertEqual([_[1] for _ in frames], ["catch", "fail"])
+        self.assertEqual(frames[-1][0], fail.__code__.co_filename)
+        self.assertEqual(frames[-1][2], fail.__code__.co_firstlineno + 1)
+        self.assertIsNone(message)
+        self.assertEqual(exception_key(ValueError, None, ValueError("x")),
+                         (ValueError, (), "x"))
+
+    def test_no_traceback(self):
+        # exceptions that were never raised are told apart by message
+        self.assertNotEqual(
+            fingerprint(Exception, None, Exception("disk full")),
+            fingerprint(Exception, None, Exception("bad tile 7")))
+        self.assertEqual(
+            fingerprint(Exception, None, Exception("disk full")),
+            fingerprint(Exception, None, Exception("disk full")))
+
+    def test_get_exception_info(self):
+        self.assertEqual(get_exception_info(), (None, None, None))
+        exc_type, exception, tb = catch(fail, 1)
+        try:
+            raise exception
+        except ValueError:
+            self.assertIs(get_exception_info()[1], exception)
+        error = KeyError()
+        self.assertEqual(get_exception_info(error)[:2], (KeyError, error))
+
+
+class TestExceptionFingerprinter(unittest.TestCase):
+
+    def test_window(self):
+        now = [1000.0]
+        fingerprinter = ExceptionFingerprinter(window=60,
+                                               clock=lambda: now[0])
+        exc_type, _, tb = catch(fail, 1)
+        fp, first = fingerprinter.check(exc_type, tb)
+        self.assertTrue(first)
+        self.assertEqual(fp, fingerprint(exc_type, tb))
+        now[0] += 59
+        self.assertEqual(fingerprinter.check(exc_type, tb), (fp, False))
+        exc_type2, _, tb2 = catch(fail_elsewhere, 1)
+        self.assertTrue(fingerprinter.check(exc_type2, tb2)[1])
+        now[0] += 1
+        self.assertEqual(fingerprinter.check(exc_type, tb), (fp, True))
+        self.assertEqual(fingerprinter.check(exc_type, tb), (fp, False))
+
+    def test_no_window(self):
+        fingerprinter = ExceptionFingerprinter(window=0)
+        exc_type, _, tb = catch(fail, 1)
+        for _ in range(3):
+            self.assertTrue(fingerprinter.check(exc_type, tb)[1])
+
+
+class TestProxy(unittest.TestCase):
+
+    def setUp(self):
+        self.config_root = rh_logger.api.logging_config_root
+        rh_logger.discovery.register_backend(
+            "recording", "tests.test_fingerprint:get_logger")
+        del backends[:]
+
+    def tearDown(self):
+        rh_logger.api.logging_config_root = self.config_root
+        rh_logger.discovery._registered_backends.pop("recording")
+
+    def run_process(self, config):
+        rh_logger.api.logging_config_root = dict(
+            config, **{"logging-backend": "recording"})
+        proxy = LoggerProxy()
+        proxy.start_process("test", "hello")
+        for i in range(5):
+            try:
+                fail(i)
+            except ValueError:
+                self.fingerprint = current_fingerprint()
+                proxy.report_exception()
+        proxy.report_exception(KeyError("no traceback"))
+        proxy.report_exception(KeyError("no traceback"))
+        proxy.report_exception(Exception("disk full"))
+        proxy.report_exception(Exception("bad tile 7"))
+        proxy.end_process("bye", ExitCode.success)
+        return backends[0]
+
+    def test_repeats(self):
+        backend = self.run_process({})
+        self.assertEqual([str(_[0]) for _ in backend.exceptions],
+                         ["0", "'no traceback'", "disk full", "bad tile 7"])
+        self.assertEqual(sorted(backend.counts), sorted([
+            ("exception.repeats." + self.fingerprint, 4, "ValueError"),
+            ("exception.repeats." + fingerprint(
+                KeyError, None, KeyError("no traceback")), 1, "KeyError")]))
+
+    def test_window_off(self):
+        backend = self.run_process({"exception-window": 0})
+        self.assertEqual(len(backend.exceptions), 9)
+        self.assertEqual(backend.counts, [])
+
+
+class TestBackends(unittest.TestCase):
+
+    def test_python_logging(self):
+        handler = RecordingHandler()
+        logging.getLogger(self.id()).addHandler(handler)
+        try:
+            logger = BLPLogger(self.id(), {})
+            exc_type, exception, tb = catch(fail, 1)
+            try:
+                raise exception
+            except ValueError:
+                fp = current_fingerprint()
+                logger.report_exception()
+            logger.report_exception(KeyError("key"), "message")
+        finally:
+            logging.getLogger(self.id()).removeHandler(handler)
+        self.assertEqual(handler.records[0].getMessage(),
+                         "1 (fingerprint %s)" % fp)
+        self.assertIsNotNone(handler.records[0].exc_info)
+        self.assertEqual(handler.records[1].getMessage(),
+                         "message (fingerprint %s)" % fingerprint(
+                             KeyError, None, KeyError("key")))
+
+    @unittest.skipIf(DatadogLogger is None, "datadog is not installed")
+    def test_datadog(self):
+        with FakeDatadogServer() as server:
+            logger = DatadogLogger("test", {
+                "api-key": "key", "api-host": server.url,
+                "test": {"app-key": "app"}})
+            exc_type, exception, tb = catch(fail, 1)
+            try:
+                raise exception
+            except ValueError:
+                fp = current_fingerprint()
+                logger.report_exception()
+            logger.end_process("bye", ExitCode.success)
+            events = [_ for _ in server.events
+                      if _["title"] == "Exception report"]
+            self.assertEqual(len(events), 1)
+            self.assertIn("fingerprint:" + fp, events[0]["tags"])
+            self.assertIn("Traceback", events[0]["text"])
+            # Repeats are counted by the proxy, not once per report
+            self.assertEqual(server.points("exception"), [])
+
+if __name__ == "__main__":
+    unittest.main()
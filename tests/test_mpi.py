@@ -0,0 +1,228 @@
+'''Test combining metrics across MPI ranks'''
+
+from rh_logger.api import ExitCode, TimeSeries
+from rh_logger.backends import backend_python_logging
+from rh_logger.backends.backend_carbon_logging import CarbonLogger
+from rh_logger.mpi import MetricReducer, pack_stats, reduce_payloads, \
+     environment_rank_detector
+import rh_logger.mpi
+from rh_logger.stats import RunningStats
+import json
+import os
+import subprocess
+import sys
+import unittest
+
+try:
+    import mpi4py
+except ImportError:
+    mpi4py = None
+
+
+def make_stats(values):
+    stats = RunningStats()
+    stats.add_many(values)
+    return stats
+
+
+class SerialComm(object):
+    '''Stands in for a communicator with one rank'''
+
+    def Dup(self):
+        return self
+
+    def Get_rank(self):
+        return 0
+
+    def gather(self, obj, root=0):
+        return [obj]
+
+    def bcast(self, obj, root=0):
+        return obj
+
+    def Free(self):
+        pass
+
+
+class TestReducePayloads(unittest.TestCase):
+
+    def test_merge(self):
+        payloads = [dict(foo=pack_stats(make_stats([1, 2, 3]))),
+                    dict(foo=pack_stats(make_stats([4, 5])),
+                         bar=pack_stats(make_stats([10])))]
+        merged, outliers = reduce_payloads(payloads)
+        self.assertEqual(merged["foo"].count, 5)
+        self.assertEqual(merged["foo"].total, 15)
+        self.assertEqual(merged["foo"].min, 1)
+        self.assertEqual(merged["foo"].max, 5)
+        self.assertAlmostEqual(merged["foo"].mean, 3)
+        self.assertEqual(merged["bar"].count, 1)
+        self.assertEqual(outliers, {})
+
+    def test_outliers(self):
+        payloads = [dict(foo=pack_stats(make_stats([1]))) for _ in range(20)]
+        payloads[7] = dict(foo=pack_stats(make_stats([100])))
+        merged, outliers = reduce_payloads(payloads)
+        self.assertEqual(outliers, dict(foo=[(7, 100)]))
+
+
+class TestMetricReducer(unittest.TestCase):
+
+    def test_serial(self):
+        reports = []
+        reducer = MetricReducer(SerialComm(),
+                                lambda *args: reports.append(args))
+        reducer.add("foo", 1)
+        reducer.add_many("foo", [2, 3])
+        reducer.merge("bar", make_stats([4, 5]))
+        reducer.close()
+        self.assertEqual(len(reports), 1)
+        merged, outliers = reports[0]
+        self.assertEqual(merged["foo"].total, 6)
+        self.assertEqual(merged["bar"].count, 2)
+
+
+class TestBLPLogger(unittest.TestCase):
+    '''The default logger on rank 0 of 2, gathering only its own metrics'''
+
+    def setUp(self):
+        self.detectors = list(rh_logger.mpi._rank_detectors)
+        rh_logger.mpi.register_rank_detector(lambda: (0, 2))
+        self.get_comm = backend_python_logging.get_comm
+        self.comms = []
+        backend_python_logging.get_comm = self.make_comm
+
+    def tearDown(self):
+        backend_python_logging.get_comm = self.get_comm
+        rh_logger.mpi._rank_detectors[:] = self.detectors
+        rh_logger.mpi._rank_and_size = None
+
+    def make_comm(self):
+        self.comms.append(SerialComm())
+        return self.comms[-1]
+
+    def test_lazy(self):
+        logger = backend_python_logging.BLPLogger(self.id(), {})
+        self.assertEqual(len(self.comms), 0)
+        reports = []
+        logger.report_reduced_metrics = lambda *args: reports.append(args)
+        logger.report_metric("foo", 1)
+        logger.report_metric("foo", 2, "tile 1")
+        series = TimeSeries()
+        series.report_metrics([3, 4])
+        logger.report_metrics("foo", series, "tile 1")
+        self.assertEqual(len(self.comms), 1)
+        logger.end_process("bye", ExitCode.success)
+        merged = reports[0][0]
+        self.assertEqual(sorted(merged), ["foo", "foo (tile 1)"])
+        self.assertEqual(merged["foo"].total, 1)
+        self.assertEqual(merged["foo (tile 1)"].total, 9)
+
+    def test_end_process_without_metrics(self):
+        # end_process is collective, so it reduces even with no metrics
+        logger = backend_python_logging.BLPLogger(self.id(), {})
+        logger.end_process("bye", ExitCode.success)
+        self.assertEqual(len(self.comms), 1)
+
+    def test_subclass(self):
+        logger = CarbonLogger(self.id(), {"port": 1})
+        logger.report_metric("foo", 1)
+        logger.end_process("bye", ExitCode.success)
+        self.assertEqual(len(self.comms), 0)
+
+
+class TestRankDetection(unittest.TestCase):
+
+    def setUp(self):
+        self.old_environ = dict(os.environ)
+        for rank_variable, size_variable in \
+                rh_logger.mpi.RANK_ENVIRONMENT_VARIABLES + \
+                rh_logger.mpi.TASK_ENVIRONMENT_VARIABLES:
+            os.environ.pop(rank_variable, None)
+            os.environ.pop(size_variable, None)
+        os.environ.pop(rh_logger.mpi.MPI_ENVIRONMENT_VARIABLE, None)
+
+    def tearDown(self):
+        os.environ.clear()
+        os.environ.update(self.old_environ)
+
+    def test_no_environment(self):
+        self.assertIsNone(environment_rank_detector())
+
+    def test_open_mpi(self):
+        os.environ["OMPI_COMM_WORLD_RANK"] = "3"
+        os.environ["OMPI_COMM_WORLD_SIZE"] = "512"
+        self.assertEqual(environment_rank_detector(), (3, 512))
+
+    def test_slurm(self):
+        os.environ["SLURM_PROCID"] = "2"
+        os.environ["SLURM_NTASKS"] = "4"
+        os.environ["RH_LOGGER_MPI"] = "1"
+        self.assertEqual(environment_rank_detector(), (2, 4))
+
+    def test_slurm_without_mpi(self):
+        # srun -n 4 of a serial program: every task is rank 0 of 1
+        os.environ["SLURM_PROCID"] = "1"
+        os.environ["SLURM_NTASKS"] = "4"
+        detectors = list(rh_logger.mpi._rank_detectors)
+        module = sys.modules.pop("mpi4py", None)
+        try:
+            self.assertIsNone(environment_rank_detector())
+            rh_logger.mpi._rank_detectors[:] = [environment_rank_detector]
+            rh_logger.mpi._rank_and_size = None
+            self.assertEqual(rh_logger.mpi.get_rank_and_size(), (0, 1))
+        finally:
+            if module is not None:
+                sys.modules["mpi4py"] = module
+            rh_logger.mpi._rank_detectors[:] = detectors
+            rh_logger.mpi._rank_and_size = None
+
+    def test_slurm_with_open_mpi(self):
+        os.environ["SLURM_PROCID"] = "1"
+        os.environ["SLURM_NTASKS"] = "4"
+        os.environ["OMPI_COMM_WORLD_RANK"] = "1"
+        os.environ["OMPI_COMM_WORLD_SIZE"] = "4"
+        self.assertEqual(environment_rank_detector(), (1, 4))
+
+    def test_register(self):
+        detectors = list(rh_logger.mpi._rank_detectors)
+        try:
+            rh_logger.mpi.register_rank_detector(lambda: (5, 6))
+            self.assertEqual(rh_logger.mpi.get_rank_and_size(), (5, 6))
+        finally:
+            rh_logger.mpi._rank_detectors[:] = detectors
+            rh_logger.mpi._rank_and_size = None
+
+
+@unittest.skipIf(mpi4py is None, "mpi4py is not installed")
+class TestMPIJob(unittest.TestCase):
+
+    def run_job(self, *args):
+        script = os.path.join(os.path.dirname(__file__), "mpi_reduce_job.py")
+        try:
+            output = subprocess.check_output(
+                ["mpiexec", "-n", "4", sys.executable, script] +
+                list(args))
+        except OSError:
+            self.skipTest("mpiexec is not available")
+        return [json.loads(line) for line in output.decode().splitlines()
+                if line.startswith("{")]
+
+    def check(self, results):
+        self.assertEqual(sum([_["foo"]["count"] for _ in results]), 41)
+        self.assertEqual(sum([_["foo"]["total"] for _ in results]),
+                         sum(range(40)) + 1000)
+        self.assertEqual(min([_["foo"]["min"] for _ in results]), 0)
+        self.assertEqual(max([_["foo"]["max"] for _ in results]), 1000)
+
+    def test_end_process(self):
+        results = self.run_job()
+        self.assertEqual(len(results), 1)
+        self.check(results)
+        self.assertEqual(results[0]["outliers"], dict(foo=[3]))
+
+    def test_interval(self):
+        self.check(self.run_job(".05"))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,129 @@
+'''Test the sampling profiler'''
+
+from rh_logger.api import ExitCode, LoggerProxy
+from rh_logger.profiler import SamplingProfiler, make_profiler
+import os
+import rh_logger.api
+import rh_logger.discovery
+import shutil
+import tempfile
+import time
+import unittest
+
+
+class RecordingLogger(object):
+
+    def __init__(self):
+        self.metrics = []
+
+    def start_process(self, name, msg, args=None):
+        pass
+
+    def end_process(self, msg, exit_code):
+        pass
+
+    def report_metric(self, name, metric, context=None):
+        self.metrics.append((name, metric))
+
+    def report_metrics(self, name, time_series, context=None):
+        self.metrics.extend([(name, _) for _ in time_series.values])
+
+
+def get_logger(name, config):
+    return RecordingLogger()
+
+
+def busy(duration):
+    end = time.time() + duration
+    while time.time() < end:
+        pass
+
+
+def outer(duration):
+    busy(duration)
+
+
+class TestSamplingProfiler(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.output = os.path.join(self.directory, "profile.collapsed")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_hot_function(self):
+        logger = RecordingLogger()
+        profiler = SamplingProfiler(logger, interval=.001, top=100,
+                                    max_overhead=.5, output=self.output)
+        profiler.start()
+        outer(.3)
+        profiler.stop()
+        self.assertGreater(profiler.n_samples, 10)
+        metrics = dict(logger.metrics)
+        self.assertGreater(metrics["profile.cumulative.test_profiler.outer"],
+                           50)
+        self.assertIn("profile.self.test_profiler.busy", metrics)
+        self.assertNotIn("profile.self.test_profiler.outer", metrics)
+        self.assertIn("profile.overhead", metrics)
+        with open(self.output) as fd:
+            lines = fd.read().splitlines()
+        hot = [_ for _ in lines if ";outer (" in _ and ";busy (" in _]
+        self.assertGreater(len(hot), 0)
+        stack, count = hot[0].rsplit(" ", 1)
+        self.assertGreater(int(count), 0)
+        self.assertTrue(stack.split(";")[-1].startswith("busy ("))
+
+    def test_overhead_bound(self):
+        profiler = SamplingProfiler(interval=.0001, max_overhead=.001)
+        profiler.start()
+        busy(.3)
+        profiler.stop()
+        self.assertGreater(profiler.interval, .0001)
+
+    def test_all_threads(self):
+        profiler = SamplingProfiler(interval=.001, threads="all")
+        profiler.start()
+        busy(.1)
+        profiler.stop()
+        self.assertIn("test_profiler.busy",
+                      [_.label for _ in profiler.functions.values()])
+
+    def test_config(self):
+        profiler = make_profiler(None, "my app", {"interval": .5, "top": 3})
+        self.assertEqual(profiler.interval, .5)
+        self.assertEqual(profiler.top, 3)
+        self.assertEqual(profiler.output,
+                         "my_app-%d.collapsed" % os.getpid())
+        self.assertRaises(ValueError, SamplingProfiler, threads="some")
+
+
+class TestProxyProfile(unittest.TestCase):
+
+    def setUp(self):
+        self.config_root = rh_logger.api.logging_config_root
+        self.directory = tempfile.mkdtemp()
+        rh_logger.discovery.register_backend(
+            "recording", "tests.test_profiler:get_logger")
+        rh_logger.api.logging_config_root = {
+            "logging-backend": "recording",
+            "profile": {"output": os.path.join(self.directory, "p"),
+                        "interval": .001}}
+
+    def tearDown(self):
+        rh_logger.api.logging_config_root = self.config_root
+        rh_logger.discovery._registered_backends.pop("recording")
+        shutil.rmtree(self.directory)
+
+    def test_start_process(self):
+        proxy = LoggerProxy()
+        proxy.start_process("test", "hello", profile=True)
+        busy(.05)
+        profiler = proxy.profiler
+        proxy.end_process("bye", ExitCode.success)
+        self.assertIsNone(proxy.profiler)
+        self.assertGreater(profiler.n_samples, 0)
+        self.assertTrue(os.path.exists(os.path.join(self.directory, "p")))
+
+if __name__ == "__main__":
+    unittest.main()
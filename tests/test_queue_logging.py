@@ -0,0 +1,129 @@
+'''Test writing log records from a background thread'''
+
+from rh_logger.backends.backend_python_logging import BLPLogger
+from rh_logger.api import ExitCode
+from rh_logger.queue_logging import BackgroundLogWriter
+import logging
+import threading
+import unittest
+
+
+class RecordingHandler(logging.Handler):
+    '''Records formatted messages and the threads that wrote them'''
+
+    def __init__(self, level=logging.NOTSET):
+        logging.Handler.__init__(self, level)
+        self.messages = []
+        self.threads = set()
+        self.gate = threading.Event()
+        self.gate.set()
+
+    def emit(self, record):
+        self.gate.wait()
+        self.messages.append(self.format(record))
+        self.threads.add(threading.current_thread().name)
+
+
+class Unprintable(object):
+    '''Counts how often it is formatted'''
+    n_formatted = 0
+
+    def __repr__(self):
+        Unprintable.n_formatted += 1
+        return "Unprintable()"
+
+
+class TestBackgroundLogWriter(unittest.TestCase):
+
+    def setUp(self):
+        self.logger = logging.getLogger(self.id())
+        self.logger.propagate = False
+        self.logger.setLevel(logging.DEBUG)
+        self.handler = RecordingHandler()
+        self.logger.addHandler(self.handler)
+
+    def tearDown(self):
+        self.logger.removeHandler(self.handler)
+
+    def test_writes_on_thread(self):
+        writer = BackgroundLogWriter(self.logger)
+        self.assertIn(writer.handler, self.logger.handlers)
+        self.assertNotIn(self.handler, self.logger.handlers)
+        for i in range(100):
+            self.logger.info("message %d", i)
+        writer.stop()
+        self.assertEqual(self.handler.messages,
+                         ["message %d" % i for i in range(100)])
+        self.assertEqual(self.handler.threads,
+                         set(["BackgroundLogWriterThread"]))
+        self.assertIn(self.handler, self.logger.handlers)
+        self.assertNotIn(writer.handler, self.logger.handlers)
+
+    def test_does_not_wait_for_handler(self):
+        self.handler.gate.clear()
+        writer = BackgroundLogWriter(self.logger)
+        self.logger.info("stalled")
+        self.assertEqual(self.handler.messages, [])
+        self.handler.gate.set()
+        writer.stop()
+        self.assertEqual(self.handler.messages, ["stalled"])
+
+    def test_handler_level(self):
+        self.handler.setLevel(logging.WARNING)
+        writer = BackgroundLogWriter(self.logger)
+        self.logger.info("info")
+        self.logger.warning("warning")
+        writer.stop()
+        self.assertEqual(self.handler.messages, ["warning"])
+
+    def test_drop_when_full(self):
+        self.handler.gate.clear()
+        writer = BackgroundLogWriter(self.logger, queue_size=2)
+        for i in range(10):
+            self.logger.info("message %d", i)
+        self.assertGreaterEqual(writer.n_dropped, 7)
+        self.handler.gate.set()
+        writer.stop()
+        self.assertEqual(len(self.handler.messages) + writer.n_dropped, 10)
+
+
+class TestAsynchronousBLPLogger(unittest.TestCase):
+
+    def setUp(self):
+        self.root_handlers = logging.root.handlers[:]
+        self.root_level = logging.root.level
+        self.handler = RecordingHandler()
+        logging.root.handlers = [self.handler]
+        logging.root.setLevel(logging.INFO)
+
+    def tearDown(self):
+        logging.root.handlers = self.root_handlers
+        logging.root.setLevel(self.root_level)
+
+    def test_end_process_flushes(self):
+        logger = BLPLogger("test", {"asynchronous": True})
+        self.assertIsNotNone(logger.writer)
+        logger.start_process("test", "starting")
+        logger.report_metric("x", 5)
+        logger.report_event("frobbed", context=[1, 2])
+        logger.end_process("done", ExitCode.success)
+        self.assertEqual(self.handler.messages, [
+            "Starting process: starting",
+            "Metric x=5",
+            "frobbed ([1, 2])",
+            "Ending process: done, exit code = success"])
+        self.assertEqual(self.handler.threads,
+                         set(["BackgroundLogWriterThread"]))
+        self.assertEqual(logging.root.handlers, [self.handler])
+
+    def test_filtered_messages_are_not_formatted(self):
+        logger = BLPLogger("test", {})
+        Unprintable.n_formatted = 0
+        logger.report_event("quiet", context=Unprintable(),
+                            log_level=logging.DEBUG)
+        self.assertEqual(Unprintable.n_formatted, 0)
+        logger.report_event("loud", context=Unprintable())
+        self.assertEqual(Unprintable.n_formatted, 1)
+
+if __name__ == "__main__":
+    unittest.main()
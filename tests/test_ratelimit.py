@@ -0,0 +1,192 @@
+'''Test rate limiting and coalescing of repeated events'''
+
+from rh_logger.api import ExitCode
+from rh_logger.backends.backend_python_logging import BLPLogger
+from rh_logger.ratelimit import EventLimiter, make_event_limiter
+from rh_logger.testing import FakeDatadogServer
+import logging
+import threading
+import time
+import unittest
+
+try:
+    from rh_logger.backends.backend_datadog_logging import DatadogLogger
+except ImportError:
+    DatadogLogger = None
+
+
+class FakeClock(object):
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class RecordingHandler(logging.Handler):
+
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.records = []
+
+    def emit(self, record):
+        self.records.append((record.levelno, record.getMessage()))
+
+
+class TestEventLimiter(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.limiter = EventLimiter(rate=1, burst=3, window=10,
+                                    clock=self.clock)
+
+    def test_burst(self):
+        self.assertEqual([self.limiter.allow("e") for _ in range(5)],
+                         [True, True, True, False, False])
+        self.assertTrue(self.limiter.allow("other"))
+        self.assertTrue(self.limiter.allow("e", log_level=logging.ERROR))
+
+    def test_refill(self):
+        for _ in range(4):
+            self.limiter.allow("e")
+        self.clock.now += 1
+        self.assertTrue(self.limiter.allow("e"))
+        self.assertFalse(self.limiter.allow("e"))
+
+    def test_coalesce(self):
+        for i in range(10):
+            self.limiter.allow("e", ["tile", i])
+            self.clock.now += .1
+        self.assertEqual(self.limiter.pop_due(), [])
+        self.clock.now += 10
+        coalesced, = self.limiter.pop_due()
+        self.assertEqual(coalesced.event, "e")
+        self.assertEqual(coalesced.count, 7)
+        self.assertEqual(coalesced.context, ["tile", 3])
+        self.assertAlmostEqual(coalesced.first, 1000.3)
+        self.assertAlmostEqual(coalesced.last, 1000.9)
+        self.assertEqual(self.limiter.pop_due(force=True), [])
+
+    def test_force(self):
+        for _ in range(5):
+            self.limiter.allow("e")
+        coalesced, = self.limiter.pop_due(force=True)
+        self.assertEqual(coalesced.count, 2)
+
+    def test_timer(self):
+        reported = []
+        done = threading.Event()
+
+        def report(summaries):
+            reported.extend(summaries)
+            done.set()
+
+        limiter = EventLimiter(rate=.001, burst=1, window=.05, report=report)
+        self.assertTrue(limiter.allow("x"))
+        self.assertFalse(limiter.allow("x", "ctx"))
+        self.assertFalse(limiter.allow("x"))
+        # no more events arrive, but the summary is reported
+        self.assertTrue(done.wait(10))
+        self.assertEqual([(_.event, _.context, _.count) for _ in reported],
+                         [("x", "ctx", 2)])
+        self.assertIsNone(limiter.timer)
+        limiter.close()
+
+    def test_close_before_timer(self):
+        reported = []
+        limiter = EventLimiter(rate=.001, burst=1, window=10,
+                               clock=self.clock, report=reported.extend)
+        limiter.allow("x")
+        limiter.allow("x")
+        self.clock.now += 10
+        # close gets in between the timer firing and the report
+        limiter.close()
+        limiter.on_timer()
+        self.assertEqual(reported, [])
+        coalesced, = limiter.pop_due(force=True)
+        self.assertEqual(coalesced.count, 1)
+
+    def test_close_during_report(self):
+        reported = []
+        started = threading.Event()
+        release = threading.Event()
+
+        def report(summaries):
+            started.set()
+            release.wait(10)
+            reported.extend(summaries)
+
+        limiter = EventLimiter(rate=.001, burst=1, window=.01, report=report)
+        limiter.allow("x")
+        limiter.allow("x")
+        self.assertTrue(started.wait(10))
+        closer = threading.Thread(target=limiter.close)
+        closer.start()
+        release.set()
+        closer.join(10)
+        self.assertFalse(closer.is_alive())
+        self.assertEqual([_.count for _ in reported], [1])
+        self.assertEqual(limiter.pop_due(force=True), [])
+
+    def test_config(self):
+        self.assertIsNone(make_event_limiter({}))
+        limiter = make_event_limiter({"event-rate-limit": {"burst": 2}})
+        self.assertEqual(limiter.burst, 2)
+
+
+class TestBLPLoggerRateLimit(unittest.TestCase):
+
+    def setUp(self):
+        self.handler = RecordingHandler()
+        self.logger = logging.getLogger("test_ratelimit")
+        self.logger.addHandler(self.handler)
+
+    def tearDown(self):
+        self.logger.removeHandler(self.handler)
+
+    def test_storm(self):
+        logger = BLPLogger("test_ratelimit", {
+            "event-rate-limit": {"rate": .001, "burst": 2, "window": 60}})
+        for i in range(1000):
+            logger.report_event("Bad section", ["tile", i], logging.ERROR)
+        logger.end_process("bye", ExitCode.success)
+        messages = [_ for _ in self.handler.records
+                    if _[1].startswith("Bad section")]
+        self.assertEqual(len(messages), 3)
+        level, message = messages[-1]
+        self.assertEqual(level, logging.ERROR)
+        self.assertIn("998 more occurrences", message)
+
+    def test_summary_without_more_events(self):
+        logger = BLPLogger("test_ratelimit", {
+            "event-rate-limit": {"rate": .001, "burst": 1, "window": .05}})
+        for i in range(3):
+            logger.report_event("Bad section", ["tile", i], logging.ERROR)
+        deadline = time.time() + 10
+        while len(self.handler.records) < 2 and time.time() < deadline:
+            time.sleep(.01)
+        self.assertIn("2 more occurrences", self.handler.records[-1][1])
+        logger.end_process("bye", ExitCode.success)
+
+
+@unittest.skipIf(DatadogLogger is None, "datadog is not installed")
+class TestDatadogLoggerRateLimit(unittest.TestCase):
+
+    def test_storm(self):
+        with FakeDatadogServer() as server:
+            logger = DatadogLogger("test", {
+                "api-key": "key", "api-host": server.url,
+                "test": {"app-key": "app"},
+                "event-rate-limit": {"rate": .001, "burst": 1}})
+            for i in range(100):
+                logger.report_event("Bad section", ["tile", i], logging.ERROR)
+            logger.end_process("bye", ExitCode.success)
+            events = [_ for _ in server.events
+                      if _["title"] == "Bad section"]
+            self.assertEqual(len(events), 2)
+            self.assertIn("99 more occurrences", events[1]["text"])
+            self.assertIn("coalesced", events[1]["tags"])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,126 @@
+'''Test the /proc resource sampler'''
+
+from rh_logger.api import ExitCode, LoggerProxy
+from rh_logger.resources import ResourceSampler, make_resource_sampler
+import os
+import rh_logger.api
+import rh_logger.discovery
+import shutil
+import tempfile
+import time
+import unittest
+
+
+class RecordingLogger(object):
+
+    def __init__(self):
+        self.series = {}
+
+    def start_process(self, name, msg, args=None):
+        pass
+
+    def end_process(self, msg, exit_code):
+        pass
+
+    def report_metrics(self, name, time_series, context=None):
+        self.series.setdefault(name, []).extend(time_series.values)
+
+
+def get_logger(name, config):
+    return RecordingLogger()
+
+
+def busy(duration):
+    end = time.time() + duration
+    while time.time() < end:
+        pass
+
+
+@unittest.skipUnless(os.path.exists("/proc/self/stat"), "no /proc")
+class TestResourceSampler(unittest.TestCase):
+
+    def test_read(self):
+        sampler = ResourceSampler(RecordingLogger())
+        self.assertTrue(sampler.open())
+        try:
+            reading = sampler.read()
+        finally:
+            sampler.close()
+        self.assertGreater(reading["rss"], 0)
+        self.assertGreaterEqual(reading["rss_peak"], reading["rss"] // 2)
+        self.assertGreater(reading["vsize"], reading["rss"])
+        self.assertGreaterEqual(reading["threads"], 1)
+        self.assertIn("ctx_switches_voluntary", reading)
+
+    def test_sample(self):
+        logger = RecordingLogger()
+        sampler = ResourceSampler(logger, interval=.01, flush_interval=60)
+        self.assertTrue(sampler.start())
+        busy(.2)
+        data = [b"x" * 1000000 for _ in range(10)]
+        time.sleep(.05)
+        sampler.stop()
+        del data
+        self.assertGreater(sampler.n_samples, 5)
+        series = logger.series
+        self.assertEqual(len(series["resources.rss"]),
+                         sampler.n_samples + 1)
+        self.assertEqual(len(series["resources.cpu_user"]),
+                         sampler.n_samples)
+        self.assertGreater(max(series["resources.cpu_user"]), 10)
+        self.assertGreater(max(series["resources.rss"]),
+                           min(series["resources.rss"]))
+        self.assertIsNone(sampler.stat_fd)
+
+    def test_periodic_flush(self):
+        logger = RecordingLogger()
+        sampler = ResourceSampler(logger, interval=.01, flush_interval=.02)
+        sampler.start()
+        time.sleep(.2)
+        n_flushed = len(logger.series.get("resources.rss", []))
+        sampler.stop()
+        self.assertGreater(n_flushed, 0)
+
+    def test_no_proc(self):
+        directory = tempfile.mkdtemp()
+        try:
+            sampler = ResourceSampler(RecordingLogger(), proc=directory)
+            self.assertFalse(sampler.start())
+            sampler.stop()
+        finally:
+            shutil.rmtree(directory)
+
+    def test_config(self):
+        sampler = make_resource_sampler(None, {"interval": .1,
+                                               "flush-interval": 5})
+        self.assertEqual(sampler.interval, .1)
+        self.assertEqual(sampler.flush_interval, 5)
+        self.assertEqual(make_resource_sampler(None, True).interval, 1.0)
+
+
+@unittest.skipUnless(os.path.exists("/proc/self/stat"), "no /proc")
+class TestProxyResources(unittest.TestCase):
+
+    def setUp(self):
+        self.config_root = rh_logger.api.logging_config_root
+        rh_logger.discovery.register_backend(
+            "recording", "tests.test_resources:get_logger")
+        rh_logger.api.logging_config_root = {
+            "logging-backend": "recording",
+            "resources": {"interval": .01}}
+
+    def tearDown(self):
+        rh_logger.api.logging_config_root = self.config_root
+        rh_logger.discovery._registered_backends.pop("recording")
+
+    def test_start_process(self):
+        proxy = LoggerProxy()
+        proxy.start_process("test", "hello")
+        self.assertIsNotNone(proxy.resource_sampler)
+        time.sleep(.05)
+        proxy.end_process("bye", ExitCode.success)
+        self.assertIsNone(proxy.resource_sampler)
+        self.assertIn("resources.rss", proxy.logger.series)
+
+if __name__ == "__main__":
+    unittest.main()
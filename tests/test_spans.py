@@ -0,0 +1,254 @@
+'''Test nested timing spans'''
+
+from rh_logger.api import ExitCode, Logger, LoggerProxy
+from rh_logger.backends.backend_python_logging import BLPLogger
+from rh_logger.spans import SpanRecord, SpanRecorder
+from rh_logger.testing import FakeDatadogServer
+import json
+import logging
+import os
+import rh_logger.api
+import rh_logger.discovery
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+try:
+    from rh_logger.backends.backend_datadog_logging import DatadogLogger
+except ImportError:
+    DatadogLogger = None
+
+
+class RecordingLogger(Logger):
+
+    def __init__(self):
+        self.spans = []
+        self.metrics = []
+
+    def start_process(self, name, msg, args=None):
+        pass
+
+    def end_process(self, msg, exit_code):
+        pass
+
+    def report_metrics(self, name, time_series, context=None):
+        self.metrics.append((name, list(time_series.values), context))
+
+    def report_spans(self, spans):
+        self.spans.append(list(spans))
+
+
+class RecordingHandler(logging.Handler):
+
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.messages = []
+
+    def emit(self, record):
+        self.messages.append(record.getMessage())
+
+
+backends = []
+
+
+def get_logger(name, config):
+    backends.append(RecordingLogger())
+    return backends[-1]
+
+
+def make_span(name, span_id, parent_id, duration, context=None):
+    return SpanRecord(name, context, span_id, parent_id, time.time(),
+                      duration, 1)
+
+
+class TestSpanRecorder(unittest.TestCase):
+
+    def setUp(self):
+        self.target = RecordingLogger()
+        self.recorder = SpanRecorder(flush_size=1000, flush_interval=60)
+        self.recorder.target = self.target
+
+    def test_nesting(self):
+        recorder = self.recorder
+        recorder.start_root("process")
+        with recorder.span("outer", ["tile", 1]) as outer:
+            with recorder.span("inner") as inner:
+                time.sleep(.01)
+            with recorder.span("inner") as inner2:
+                pass
+        thread = threading.Thread(target=lambda: recorder.span("other")
+                                  .__enter__().__exit__(None, None, None))
+        thread.start()
+        thread.join()
+        recorder.end_root()
+        spans = dict([(_.span_id, _) for _ in self.target.spans[0]])
+        root = recorder.root_id
+        self.assertEqual(spans[root].parent_id, 0)
+        self.assertEqual(spans[root].name, "process")
+        self.assertEqual(spans[outer.span_id].parent_id, root)
+        self.assertEqual(spans[outer.span_id].context, ["tile", 1])
+        self.assertEqual(spans[inner.span_id].parent_id, outer.span_id)
+        self.assertEqual(spans[inner2.span_id].parent_id, outer.span_id)
+        other = [_ for _ in spans.values() if _.name == "other"][0]
+        self.assertEqual(other.parent_id, root)
+        self.assertNotEqual(other.thread, spans[outer.span_id].thread)
+        self.assertGreaterEqual(spans[inner.span_id].duration, .01)
+        self.assertGreaterEqual(spans[outer.span_id].duration,
+                                spans[inner.span_id].duration)
+        self.assertLessEqual(spans[outer.span_id].start,
+                             spans[inner.span_id].start)
+        self.assertLess(abs(spans[root].start - time.time()), 60)
+
+    def test_decorator(self):
+        recorder = self.recorder
+
+        @recorder.span("work")
+        def work(x):
+            return x * 2
+
+        self.assertEqual(work(2), 4)
+        self.assertEqual(work(3), 6)
+        recorder.flush()
+        spans = self.target.spans[0]
+        self.assertEqual([_.name for _ in spans], ["work", "work"])
+        self.assertNotEqual(spans[0].span_id, spans[1].span_id)
+
+    def test_flush_size(self):
+        self.recorder.configure(flush_size=10, flush_interval=60)
+        for _ in range(25):
+            with self.recorder.span("x"):
+                pass
+        self.assertEqual([len(_) for _ in self.target.spans], [10, 10])
+        self.recorder.flush()
+        self.assertEqual(len(self.target.spans[-1]), 5)
+
+    def test_keys_are_forgotten(self):
+        self.recorder.configure(flush_size=10, flush_interval=60)
+        for i in range(25):
+            with self.recorder.span("x", ["tile", i]):
+                pass
+        self.assertEqual(len(self.recorder.keys), 5)
+        self.assertEqual(len(self.recorder.key_list), 5)
+        self.recorder.flush()
+        self.assertEqual(self.recorder.keys, {})
+        self.assertEqual(
+            [_.context for batch in self.target.spans for _ in batch],
+            [["tile", i] for i in range(25)])
+
+    def test_no_target(self):
+        recorder = SpanRecorder(flush_size=1)
+        with recorder.span("x"):
+            pass
+        recorder.target = self.target
+        recorder.flush()
+        self.assertEqual(len(self.target.spans[0]), 1)
+
+    def test_trace_file(self):
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, "trace.json")
+            recorder = SpanRecorder()
+            recorder.configure(flush_size=2, trace_file=path)
+            recorder.start_root("process")
+            for i in range(3):
+                with recorder.span("step", {"i": i}):
+                    pass
+            recorder.end_root()
+            with open(path) as fd:
+                events = json.load(fd)
+        finally:
+            shutil.rmtree(directory)
+        self.assertEqual(events[0]["ph"], "M")
+        self.assertEqual(events[0]["args"]["name"], "process")
+        complete = [_ for _ in events if _["ph"] == "X"]
+        self.assertEqual([_["name"] for _ in complete],
+                         ["step", "step", "step", "process"])
+        self.assertEqual(complete[2]["args"]["context"], {"i": 2})
+        self.assertEqual(complete[0]["args"]["parent_id"],
+                         complete[3]["args"]["span_id"])
+        self.assertGreaterEqual(complete[0]["ts"], complete[3]["ts"])
+
+
+class TestBackends(unittest.TestCase):
+
+    def test_default(self):
+        logger = RecordingLogger()
+        Logger.report_spans(logger, [
+            make_span("a", 1, 0, .5), make_span("a", 2, 1, .25),
+            make_span("a", 3, 1, .125, ["tile", 1])])
+        self.assertEqual(sorted(logger.metrics, key=str), sorted([
+            ("span.a", [.5, .25], None),
+            ("span.a", [.125], ["tile", 1])], key=str))
+
+    def test_python_logging(self):
+        handler = RecordingHandler()
+        logging.getLogger(self.id()).addHandler(handler)
+        try:
+            logger = BLPLogger(self.id(), {})
+            logger.report_spans([make_span("a", 2, 1, .5, ["tile", 1])])
+        finally:
+            logging.getLogger(self.id()).removeHandler(handler)
+        self.assertEqual(len(handler.messages), 1)
+        self.assertTrue(handler.messages[0].startswith(
+            "Span a: id = 2, parent = 1, start = "))
+        self.assertTrue(handler.messages[0].endswith(
+            "duration = 0.500000, thread = 1 (['tile', 1])"))
+
+    @unittest.skipIf(DatadogLogger is None, "datadog is not installed")
+    def test_datadog(self):
+        with FakeDatadogServer() as server:
+            logger = DatadogLogger("test", {
+                "api-key": "key", "api-host": server.url,
+                "test": {"app-key": "app"}})
+            logger.report_spans([make_span("a", 2, 1, .5),
+                                 make_span("b", 3, 1, .25)])
+            logger.end_process("bye", ExitCode.success)
+            events = [_ for _ in server.events if _["title"] == "2 spans"]
+            self.assertEqual(len(events), 1)
+            self.assertIn("a: id = 2, parent = 1", events[0]["text"])
+            self.assertEqual(server.points("span.b")[0][1], .25)
+
+
+class TestProxySpans(unittest.TestCase):
+
+    def setUp(self):
+        self.config_root = rh_logger.api.logging_config_root
+        rh_logger.discovery.register_backend(
+            "recording", "tests.test_spans:get_logger")
+        rh_logger.api.logging_config_root = {
+            "logging-backend": "recording",
+            "spans": {"flush-size": 2}}
+        del backends[:]
+
+    def tearDown(self):
+        rh_logger.api.logging_config_root = self.config_root
+        rh_logger.discovery._registered_backends.pop("recording")
+
+    def test_process(self):
+        proxy = LoggerProxy()
+        proxy.start_process("test", "hello")
+        for i in range(3):
+            with proxy.span("stage", ["stage", i]):
+                with proxy.span("step"):
+                    pass
+        proxy.end_process("bye", ExitCode.success)
+        spans = [span for batch in backends[0].spans for span in batch]
+        self.assertEqual(len(spans), 7)
+        root = [_ for _ in spans if _.name == "test"][0]
+        stages = [_ for _ in spans if _.name == "stage"]
+        self.assertEqual(set([_.parent_id for _ in stages]),
+                         set([root.span_id]))
+        steps = [_ for _ in spans if _.name == "step"]
+        self.assertEqual([_.parent_id for _ in steps],
+                         [_.span_id for _ in stages])
+
+    def test_unused(self):
+        proxy = LoggerProxy()
+        proxy.start_process("test", "hello")
+        proxy.end_process("bye", ExitCode.success)
+        self.assertEqual(backends[0].spans, [])
+
+if __name__ == "__main__":
+    unittest.main()
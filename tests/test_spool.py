@@ -0,0 +1,210 @@
+'''Test the spool backend and the shipper'''
+
+from rh_logger.api import ExitCode, TimeSeries, AggregateTimeSeries
+from rh_logger.backends.backend_spool_logging import SpoolLogger
+from rh_logger.ship import Shipper, CHECKPOINT_FILENAME
+from rh_logger.spool import CLOSED, OPEN, SpoolWriter, list_segments, \
+     read_segment, read_state
+import os
+import shutil
+import tempfile
+import unittest
+
+
+class RecordingLogger(object):
+
+    def __init__(self):
+        self.calls = []
+        self.flushes = []
+        self.flush_result = True
+
+    def flush(self):
+        # the number of calls sent when the logger was flushed
+        self.flushes.append(len(self.calls))
+        return self.flush_result
+
+    def report_metric(self, name, metric, subcontext=None):
+        self.calls.append(("report_metric", name, metric, subcontext))
+
+    def report_metrics(self, name, time_series, context=None):
+        self.calls.append(("report_metrics", name, time_series, context))
+
+    def report_event(self, event, context=None, log_level=None):
+        self.calls.append(("report_event", event, context, log_level))
+
+    def report_exception(self, exception=None, msg=None):
+        self.calls.append(("report_exception", str(exception), msg))
+
+
+class TestSpool(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def read_all(self):
+        return [record for path in list_segments(self.directory)
+                for record in read_segment(path)]
+
+    def test_round_trip(self):
+        logger = SpoolLogger("test", dict(directory=self.directory))
+        logger.start_process("test", "hello", ["arg"])
+        logger.report_metric("x", 1.5, ["tile", 1])
+        logger.report_metric("label", "big")
+        series = TimeSeries()
+        series.report_metrics([1, 2, 3], [10, 11, 12])
+        logger.report_metrics("series", series)
+        aggregate = AggregateTimeSeries()
+        aggregate.report_metrics([4, 5, 6])
+        logger.report_metrics("aggregate", aggregate, "ctx")
+        logger.report_event("frobbed", {"mfov": 5}, 30)
+        logger.report_exception(ValueError("oops"), "message")
+        logger.end_process("bye", ExitCode.io_error)
+        records = self.read_all()
+        self.assertEqual([_.kind for _ in records], [
+            "start", "metric", "metric", "metrics", "metrics", "event",
+            "exception", "end"])
+        self.assertEqual(records[0].args, ("test", "hello", ["arg"]))
+        self.assertEqual(records[1].args, ("x", 1.5, ["tile", 1]))
+        self.assertEqual(records[2].args, ("label", "big", None))
+        name, series, context = records[3].args
+        self.assertEqual(list(series.timestamps), [10, 11, 12])
+        self.assertEqual(list(series.values), [1, 2, 3])
+        name, aggregate, context = records[4].args
+        self.assertEqual(aggregate.summary().count, 3)
+        self.assertEqual(context, "ctx")
+        self.assertEqual(records[5].args, ("frobbed", {"mfov": 5}, 30))
+        self.assertEqual(records[6].args, ("ValueError: oops", "message"))
+        self.assertEqual(records[7].args, ("bye", ExitCode.io_error.value))
+        path, = list_segments(self.directory)
+        self.assertEqual(read_state(path), CLOSED)
+
+    def test_rotation(self):
+        writer = SpoolWriter(self.directory, "test", segment_size=1024)
+        for i in range(1000):
+            writer.write_metric("metric %d" % (i % 7), i, ["tile", i % 3])
+        self.assertEqual(read_state(writer.path), OPEN)
+        writer.close()
+        paths = list_segments(self.directory)
+        self.assertGreater(len(paths), 10)
+        self.assertTrue(all([read_state(_) == CLOSED for _ in paths]))
+        records = self.read_all()
+        self.assertEqual([_.args for _ in records],
+                         [("metric %d" % (i % 7), i, ["tile", i % 3])
+                          for i in range(1000)])
+
+    def test_write_after_close(self):
+        writer = SpoolWriter(self.directory, "test")
+        writer.write_metric("x", 1)
+        writer.close()
+        writer.write_metric("x", 2)
+        writer.write_metric("y", 3)
+        series = TimeSeries()
+        series.report_metrics([1, 2])
+        writer.write_metrics("series", series)
+        writer.write_event("late")
+        self.assertEqual(writer.n_dropped, 4)
+        self.assertEqual([_.args for _ in self.read_all()],
+                         [("x", 1, None)])
+
+    def test_read_while_open(self):
+        writer = SpoolWriter(self.directory, "test")
+        writer.write_metric("x", 1)
+        writer.write_metric("x", 2)
+        records = list(read_segment(writer.path))
+        self.assertEqual([_.args[1] for _ in records], [1, 2])
+        writer.write_metric("x", 3)
+        records = list(read_segment(writer.path, records[-1].offset))
+        self.assertEqual([_.args[1] for _ in records], [3])
+        writer.close()
+
+    def test_torn_record(self):
+        writer = SpoolWriter(self.directory, "test")
+        writer.write_event("complete")
+        offset = writer.offset
+        writer.write_event("torn")
+        writer.mm[offset + 10] ^= 0xff
+        records = list(read_segment(writer.path))
+        self.assertEqual([_.args[0] for _ in records], ["complete"])
+        writer.close()
+
+
+class TestShipper(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_ship(self):
+        logger = SpoolLogger("test", dict(directory=self.directory))
+        logger.start_process("test", "hello")
+        for i in range(10):
+            logger.report_metric("x", i, ["tile", i % 2])
+        logger.report_event("frobbed")
+        logger.report_metric("x", 10, ["tile", 0])
+        target = RecordingLogger()
+        shipper = Shipper(self.directory, target)
+        self.assertEqual(shipper.ship(), 13)
+        self.assertEqual(target.calls[0][0], "report_event")
+        self.assertIn("hello", target.calls[0][1])
+        metrics = dict([(tuple(_[3]), _[2]) for _ in target.calls[1:3]])
+        self.assertEqual(list(metrics[("tile", 0)].values), [0, 2, 4, 6, 8])
+        self.assertEqual(list(metrics[("tile", 1)].values), [1, 3, 5, 7, 9])
+        self.assertEqual(target.calls[3][:2], ("report_event", "frobbed"))
+        self.assertEqual(list(target.calls[4][2].values), [10])
+        # Nothing new: nothing shipped, the open segment is kept
+        self.assertEqual(shipper.ship(), 0)
+        self.assertEqual(len(list_segments(self.directory)), 1)
+        # A restarted shipper resumes from the checkpoint
+        logger.end_process("bye", ExitCode.success)
+        target = RecordingLogger()
+        shipper = Shipper(self.directory, target)
+        self.assertEqual(shipper.ship(), 1)
+        self.assertEqual(len(target.calls), 1)
+        self.assertIn("exit code = success", target.calls[0][1])
+        self.assertEqual(list_segments(self.directory), [])
+        self.assertEqual(shipper.checkpoint, {})
+
+    def test_keep(self):
+        logger = SpoolLogger("test", dict(directory=self.directory))
+        logger.report_metric("x", 1)
+        logger.end_process("bye", ExitCode.success)
+        target = RecordingLogger()
+        self.assertEqual(Shipper(self.directory, target, keep=True).ship(), 2)
+        self.assertEqual(len(list_segments(self.directory)), 1)
+        self.assertEqual(Shipper(self.directory, target, keep=True).ship(), 0)
+        self.assertTrue(os.path.exists(
+            os.path.join(self.directory, CHECKPOINT_FILENAME)))
+
+    def test_flush_before_checkpoint(self):
+        logger = SpoolLogger("test", dict(directory=self.directory))
+        for i in range(5):
+            logger.report_event("event %d" % i)
+        target = RecordingLogger()
+        shipper = Shipper(self.directory, target, batch_size=2)
+        self.assertEqual(shipper.ship(), 5)
+        self.assertEqual(target.flushes, [2, 4, 5])
+
+    def test_failed_flush(self):
+        logger = SpoolLogger("test", dict(directory=self.directory))
+        logger.report_event("frobbed")
+        logger.end_process("bye", ExitCode.success)
+        target = RecordingLogger()
+        target.flush_result = False
+        shipper = Shipper(self.directory, target)
+        self.assertEqual(shipper.ship(), 0)
+        self.assertEqual(len(list_segments(self.directory)), 1)
+        self.assertEqual(shipper.checkpoint, {})
+        # the next pass ships the batch again
+        target.flush_result = True
+        self.assertEqual(shipper.ship(), 2)
+        self.assertEqual([_[1] for _ in target.calls[::2]],
+                         ["frobbed", "frobbed"])
+        self.assertEqual(list_segments(self.directory), [])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,118 @@
+'''Test the constant-memory statistics and AggregateTimeSeries'''
+
+from rh_logger import AggregateTimeSeries, TimeSeries
+from rh_logger.stats import QuantileSketch, RunningStats
+import random
+import unittest
+
+
+class TestRunningStats(unittest.TestCase):
+
+    def test_stats(self):
+        values = [random.gauss(10, 3) for _ in range(1000)]
+        stats = RunningStats()
+        for value in values:
+            stats.add(value)
+        mean = sum(values) / len(values)
+        variance = sum([(v - mean) ** 2 for v in values]) / len(values)
+        self.assertEqual(stats.count, 1000)
+        self.assertAlmostEqual(stats.total, sum(values))
+        self.assertAlmostEqual(stats.mean, mean)
+        self.assertAlmostEqual(stats.variance, variance)
+        self.assertEqual(stats.min, min(values))
+        self.assertEqual(stats.max, max(values))
+
+    def test_merge(self):
+        values = [random.uniform(-5, 5) for _ in range(1000)]
+        whole, first, second = RunningStats(), RunningStats(), RunningStats()
+        for i, value in enumerate(values):
+            whole.add(value)
+            (first if i < 300 else second).add(value)
+        first.merge(second)
+        self.assertEqual(first.count, whole.count)
+        self.assertAlmostEqual(first.mean, whole.mean)
+        self.assertAlmostEqual(first.variance, whole.variance)
+        self.assertEqual(first.min, whole.min)
+        self.assertEqual(first.max, whole.max)
+
+
+class TestQuantileSketch(unittest.TestCase):
+
+    def check(self, sketch, values):
+        ordered = sorted(values)
+        for q in (.01, .5, .95, .99):
+            expected = ordered[int(q * (len(ordered) - 1))]
+            self.assertLessEqual(
+                abs(sketch.quantile(q) - expected),
+                abs(expected) * sketch.relative_accuracy * 1.01)
+
+    def test_quantiles(self):
+        values = [random.lognormvariate(0, 2) for _ in range(10000)]
+        sketch = QuantileSketch()
+        for value in values:
+            sketch.add(value)
+        self.check(sketch, values)
+
+    def test_negative(self):
+        values = list(range(-500, 500))
+        sketch = QuantileSketch()
+        for value in values:
+            sketch.add(value)
+        self.check(sketch, values)
+
+    def test_merge(self):
+        values = [random.expovariate(1) for _ in range(10000)]
+        first, second = QuantileSketch(), QuantileSketch()
+        for i, value in enumerate(values):
+            (first if i % 2 else second).add(value)
+        first.merge(second)
+        self.assertEqual(first.count, len(values))
+        self.check(first, values)
+
+    def test_bounded(self):
+        sketch = QuantileSketch(max_buckets=100)
+        for i in range(100000):
+            sketch.add(1.001 ** i)
+        self.assertLessEqual(len(sketch.positive), 100)
+        self.assertEqual(sketch.count, 100000)
+
+    def test_empty(self):
+        self.assertIsNone(QuantileSketch().quantile(.5))
+
+
+class TestAggregateTimeSeries(unittest.TestCase):
+
+    def test_summary(self):
+        ts = AggregateTimeSeries()
+        raw = TimeSeries()
+        for i in range(1, 1001):
+            ts.report_metric(i)
+            raw.report_metric(i)
+        ts.report_metrics([0, 1001], [0, 1e10])
+        raw.report_metrics([0, 1001])
+        summary = ts.summary()
+        raw_summary = raw.summary()
+        self.assertEqual(len(ts), 1002)
+        self.assertEqual(summary.count, raw_summary.count)
+        self.assertEqual(summary.total, raw_summary.total)
+        self.assertEqual(summary.min, 0)
+        self.assertEqual(summary.max, 1001)
+        self.assertAlmostEqual(summary.mean, raw_summary.mean)
+        self.assertAlmostEqual(summary.variance, raw_summary.variance)
+        self.assertAlmostEqual(summary.p50, raw_summary.p50, delta=10)
+        self.assertAlmostEqual(summary.p99, raw_summary.p99, delta=20)
+        self.assertEqual(summary.start, 0)
+        self.assertEqual(summary.end, 1e10)
+
+    def test_merge(self):
+        first, second = AggregateTimeSeries(), AggregateTimeSeries()
+        first.report_metrics([1, 2, 3])
+        second.report_metrics([4, 5])
+        first.merge(second)
+        summary = first.summary()
+        self.assertEqual(summary.count, 5)
+        self.assertEqual(summary.total, 15)
+        self.assertEqual(summary.max, 5)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,60 @@
+'''Test the TimeSeries class'''
+
+from rh_logger import TimeSeries
+import array
+import unittest
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+class TestTimeSeries(unittest.TestCase):
+
+    def test_report_metric(self):
+        ts = TimeSeries()
+        ts.report_metric(1)
+        ts.report_metric(2.5)
+        self.assertEqual(len(ts), 2)
+        self.assertEqual(list(ts.values), [1, 2.5])
+        self.assertEqual(len(ts.timestamps), 2)
+        self.assertLessEqual(ts.timestamps[0], ts.timestamps[1])
+        self.assertEqual([v for t, v in ts.timestamps_and_metrics], [1, 2.5])
+
+    def test_slots(self):
+        ts = TimeSeries()
+        self.assertRaises(AttributeError, setattr, ts, "foo", 1)
+
+    def test_report_metrics(self):
+        ts = TimeSeries()
+        ts.report_metric(0)
+        ts.report_metrics([1, 2, 3])
+        ts.report_metrics(array.array("d", [4, 5]), [10, 11])
+        self.assertEqual(list(ts.values), [0, 1, 2, 3, 4, 5])
+        self.assertEqual(list(ts.timestamps[-2:]), [10, 11])
+
+    def test_mismatched_timestamps(self):
+        ts = TimeSeries()
+        ts.report_metrics([1, 2])
+        self.assertRaises(ValueError, ts.report_metrics, [3, 4], [1])
+        self.assertEqual(list(ts.values), [1, 2])
+        self.assertEqual(len(ts.timestamps), 2)
+
+    @unittest.skipIf(np is None, "NumPy is not installed")
+    def test_numpy(self):
+        ts = TimeSeries()
+        ts.report_metrics(np.arange(5), np.arange(5, 10, dtype=np.float32))
+        ts.report_metrics(np.ones((2, 2)))
+        t, v = ts.as_numpy()
+        np.testing.assert_array_equal(v, [0, 1, 2, 3, 4, 1, 1, 1, 1])
+        np.testing.assert_array_equal(t[:5], [5, 6, 7, 8, 9])
+        # the arrays are copies, so the series can still grow
+        v[0] = 100
+        self.assertEqual(ts.values[0], 0)
+        ts.report_metric(2)
+        ts.report_metrics([3, 4])
+        self.assertEqual(len(ts), 12)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,91 @@
+'''Test timers and the metric aggregator'''
+
+from rh_logger.aggregator import MetricAggregator
+from rh_logger.api import LoggerProxy
+from rh_logger.timer import NULL_TIMER
+import time
+import unittest
+
+
+class RecordingLogger(object):
+    '''Records report_metrics calls'''
+
+    def __init__(self):
+        self.reports = []
+
+    def report_metrics(self, name, time_series, context=None):
+        self.reports.append((name, time_series.summary(), context))
+
+
+class TestTimer(unittest.TestCase):
+
+    def setUp(self):
+        self.proxy = LoggerProxy()
+        self.target = RecordingLogger()
+        self.proxy.aggregator.target = self.target
+
+    def test_context_manager(self):
+        for _ in range(10):
+            with self.proxy.timer("sleep", ["tile", 1]):
+                time.sleep(.001)
+        with self.proxy.timer("sleep", ["tile", 2]):
+            pass
+        self.proxy.aggregator.flush()
+        self.assertEqual(len(self.target.reports), 2)
+        reports = dict([(tuple(context), summary)
+                        for name, summary, context in self.target.reports])
+        self.assertEqual(reports[("tile", 1)].count, 10)
+        self.assertGreaterEqual(reports[("tile", 1)].min, .001)
+        self.assertLess(reports[("tile", 1)].max, 1)
+        self.assertEqual(reports[("tile", 2)].count, 1)
+
+    def test_decorator(self):
+        @self.proxy.timer("fn")
+        def fn(x):
+            return x + 1
+
+        self.assertEqual([fn(i) for i in range(5)], [1, 2, 3, 4, 5])
+        self.assertEqual(fn.__name__, "fn")
+        self.proxy.aggregator.flush()
+        name, summary, context = self.target.reports[0]
+        self.assertEqual(name, "fn")
+        self.assertEqual(summary.count, 5)
+        self.assertIsNone(context)
+
+    def test_exception(self):
+        try:
+            with self.proxy.timer("fail"):
+                raise ValueError()
+        except ValueError:
+            pass
+        self.proxy.aggregator.flush()
+        self.assertEqual(self.target.reports[0][1].count, 1)
+
+    def test_periodic_flush(self):
+        self.proxy.aggregator.set_flush_interval(0)
+        with self.proxy.timer("foo"):
+            pass
+        self.assertEqual(len(self.target.reports), 1)
+
+    def test_no_target(self):
+        aggregator = MetricAggregator()
+        aggregator.histogram("foo", 1)
+        aggregator.flush()
+        aggregator.target = self.target
+        aggregator.flush()
+        self.assertEqual(self.target.reports[0][1].count, 1)
+
+    def test_disabled(self):
+        self.proxy.enable_timers(False)
+        self.assertIs(self.proxy.timer("foo"), NULL_TIMER)
+        with self.proxy.timer("foo"):
+            pass
+
+        def fn():
+            return 1
+        self.assertIs(self.proxy.timer("foo")(fn), fn)
+        self.proxy.aggregator.flush()
+        self.assertEqual(self.target.reports, [])
+
+if __name__ == "__main__":
+    unittest.main()